@@ -0,0 +1,187 @@
+"""
+История резервных копий конфига: сжатые блобы по хэшу содержимого и индекс версий
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from stunnel_config import atomic_write
+from switch_coordinator import FileLock
+
+
+class BackupEntry:
+    """Версия конфига в индексе"""
+
+    __slots__ = ('timestamp', 'hash', 'upstream', 'size', 'source')
+
+    def __init__(self, timestamp, hash, upstream=None, size=0, source=None):
+        self.timestamp = timestamp
+        self.hash = hash
+        self.upstream = upstream
+        self.size = size
+        self.source = source
+
+    def to_dict(self):
+        """Словарь для индекса и JSON-вывода"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Запись индекса -> BackupEntry"""
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def __repr__(self):
+        return (f"BackupEntry({self.timestamp}, {self.hash[:12]}, upstream={self.upstream!r}, "
+                f"size={self.size})")
+
+
+class BackupStore:
+    """Хранилище резервных копий конфига
+
+    Содержимое сохраняется один раз: blobs/<sha256>.gz. Каждое сохранение добавляет запись
+    в index.json (время, хэш, апстрим); одинаковые версии разделяют один блоб. Сверх
+    max_entries и старше max_age_days записи удаляются, блобы без ссылок - тоже.
+
+    GUI и CLI могут работать с одним каталогом одновременно, поэтому индекс не кэшируется:
+    изменения делаются под межпроцессной блокировкой index.lock по свежему файлу.
+    pinned - функция, возвращающая хэши, блобы которых очистка не удаляет (копия смены,
+    прерванной сбоем: в индекс она могла не попасть, а нужна для восстановления).
+    """
+
+    def __init__(self, directory, max_entries=50, max_age_days=90, pinned=None):
+        self.directory = Path(directory)
+        self.blob_dir = self.directory / "blobs"
+        self.index_path = self.directory / "index.json"
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.pinned = pinned
+        # Сохраненные с commit=False записи и их содержимое - до записи индекса
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.directory / "index.lock")
+
+    def _load_index(self):
+        """Прочитать индекс с диска"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        return [BackupEntry.from_dict(item) for item in data.get('entries', [])]
+
+    def _write_index(self, entries):
+        """Атомарно записать индекс"""
+        data = {'entries': [entry.to_dict() for entry in entries]}
+        atomic_write(self.index_path, json.dumps(data, ensure_ascii=False, indent=1))
+
+    def blob_path(self, digest):
+        """Путь к сжатому блобу"""
+        return self.blob_dir / f"{digest}.gz"
+
+    def _write_blob(self, digest, data):
+        """Записать блоб, если его нет; вернуть True, если он записан"""
+        import gzip
+
+        blob = self.blob_path(digest)
+        if blob.exists():
+            return False
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        # mtime=0 - одинаковое содержимое дает одинаковый блоб
+        atomic_write(blob, gzip.compress(data, compresslevel=6, mtime=0))
+        return True
+
+    def save(self, data, upstream=None, source=None, commit=True):
+        """Сохранить версию конфига; вернуть (запись, записан ли новый блоб)
+
+        Если блоб с таким содержимым уже есть, файл не пишется - добавляется только
+        запись в индекс. С commit=False индекс записывается позже вызовом commit():
+        так смена сервера не ждет записи индекса, пока служба остановлена.
+        """
+        import hashlib
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            created = self._write_blob(digest, data)
+            entry = BackupEntry(
+                timestamp=datetime.now().isoformat(timespec='seconds'),
+                hash=digest,
+                upstream=upstream,
+                size=len(data),
+                source=os.path.abspath(source) if source else None,
+            )
+            self._pending.append((entry, data))
+            if commit:
+                self._commit()
+        return entry, created
+
+    def commit(self):
+        """Записать индекс, если есть несохраненные записи"""
+        with self._lock:
+            if self._pending:
+                self._commit()
+
+    def _commit(self):
+        """Под блокировкой: перечитать индекс, добавить записи, применить лимиты, записать"""
+        with self._file_lock:
+            entries = self._load_index()
+            for entry, data in self._pending:
+                # Блоб мог удалить другой процесс по своему лимиту, пока запись ждала commit()
+                self._write_blob(entry.hash, data)
+                entries.append(entry)
+            self._pending = []
+            self._write_index(self._apply_retention(entries))
+
+    def _apply_retention(self, entries):
+        """Записи в пределах лимитов; блобы, на которые больше нет ссылок, удаляются"""
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat(timespec='seconds')
+        # Последняя запись сохраняется всегда - иначе откатываться будет не к чему
+        kept = [entry for entry in entries[:-1] if entry.timestamp >= cutoff] + entries[-1:]
+        kept = kept[-self.max_entries:]
+        if len(kept) == len(entries):
+            return entries
+
+        removed = {entry.hash for entry in entries} - {entry.hash for entry in kept}
+        if self.pinned is not None:
+            removed -= set(self.pinned())
+        for digest in removed:
+            try:
+                self.blob_path(digest).unlink()
+            except OSError:
+                pass
+        return kept
+
+    def history(self, source=None):
+        """Версии от новой к старой (опционально - только для конфига source)"""
+        with self._lock:
+            entries = self._load_index() + [entry for entry, _ in self._pending]
+        if source is not None:
+            source = os.path.abspath(source)
+            entries = [entry for entry in entries if entry.source in (None, source)]
+        return entries[::-1]
+
+    def get(self, version, source=None):
+        """Запись по номеру версии: 1 - последняя сохраненная"""
+        entries = self.history(source)
+        if not 1 <= version <= len(entries):
+            raise KeyError(f"Версия {version} не найдена (доступно: {len(entries)})")
+        return entries[version - 1]
+
+    def read(self, digest):
+        """Содержимое версии с проверкой хэша"""
+        import gzip
+        import hashlib
+
+        with open(self.blob_path(digest), 'rb') as f:
+            data = gzip.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Резервная копия {digest[:12]} повреждена")
+        return data
+
+    def restore(self, entry, path):
+        """Атомарно заменить файл path содержимым версии entry"""
+        atomic_write(path, self.read(entry.hash))
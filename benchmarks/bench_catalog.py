@@ -0,0 +1,159 @@
+"""
+Бенчмарк каталога серверов: загрузка файла, построение индекса и фильтр по мере ввода
+
+Ввод запроса моделируется посимвольно, как в поле dropdown: после каждого символа
+CatalogFilter.update() и подписи строк для видимой части списка (MAX_VISIBLE). Время
+одного нажатия сравнивается с кадром 60 Гц (16.7 мс) и с прежним способом - проход по
+всем записям с построением подписей для каждой.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_catalog --entries 10000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from server_catalog import ServerCatalog, ServerEntry, load_catalog
+
+
+FRAME_MS = 1000 / 60
+MAX_VISIBLE = 200
+CITIES = ["Москва", "Казань", "Новосибирск", "Екатеринбург", "Самара", "Омск", "Пермь", "Уфа"]
+ROLES = ["основной", "резервный", "тестовый контур", "промышленный контур"]
+
+
+def make_entries(count):
+    """count записей со разными подсетями, городами и тегами"""
+    entries = []
+    for i in range(count):
+        entries.append({
+            'ip': f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+            'label': f"{CITIES[i % len(CITIES)]} {ROLES[i // 7 % len(ROLES)]} узел {i}",
+            'tags': ["prod" if i % 3 else "test", f"dc{i % 12}"],
+            'port': 443 if i % 10 else 8443,
+        })
+    return entries
+
+
+def write_toml(path, entries):
+    """Тот же каталог в TOML"""
+    lines = []
+    for item in entries:
+        tags = ", ".join(f'"{tag}"' for tag in item['tags'])
+        lines += ["[[servers]]", f'ip = "{item["ip"]}"', f'label = "{item["label"]}"',
+                  f"tags = [{tags}]", f"port = {item['port']}", ""]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+
+
+def server_label(entry):
+    """Строка dropdown (как StunnelGUI._server_label)"""
+    return f"{entry.ip} - {entry.label}"
+
+
+def keystrokes(queries):
+    """Все префиксы запросов: 'каз' -> 'к', 'ка', 'каз'"""
+    for query in queries:
+        for end in range(1, len(query) + 1):
+            yield query[:end]
+
+
+def indexed_filter(catalog, sequence):
+    """Время нажатий (мс): CatalogFilter + подписи видимых строк"""
+    times = []
+    results = []
+    catalog_filter = catalog.filter()
+    for query in sequence:
+        start = time.perf_counter()
+        entries = catalog_filter.update(query, limit=MAX_VISIBLE)
+        values = [server_label(entry) for entry in entries]
+        times.append((time.perf_counter() - start) * 1000)
+        results.append((catalog_filter.count, values))
+    return times, results
+
+
+def linear_filter(catalog, sequence):
+    """Прежний способ: подписи всех записей и поиск подстроки в каждой"""
+    times = []
+    results = []
+    for query in sequence:
+        start = time.perf_counter()
+        words = query.lower().split()
+        labels = [(server_label(entry), entry) for entry in catalog]
+        matched = [label for label, entry in labels
+                   if all(any(key.startswith(word) for key in entry.keys) for word in words)]
+        times.append((time.perf_counter() - start) * 1000)
+        results.append((len(matched), matched[:MAX_VISIBLE]))
+    return times, results
+
+
+def summary(times):
+    """p50 / p99 / максимум, мс"""
+    ordered = sorted(times)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return statistics.median(ordered), p99, ordered[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5, help="повторов последовательности ввода")
+    args = parser.parse_args(argv)
+
+    entries = make_entries(args.entries)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "servers.json")
+        toml_path = os.path.join(tmp, "servers.toml")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'servers': entries}, f, ensure_ascii=False)
+        write_toml(toml_path, entries)
+
+        print(f"Записей: {args.entries}")
+        for path in (json_path, toml_path):
+            start = time.perf_counter()
+            catalog = load_catalog(path)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"  загрузка {os.path.basename(path):<14}{elapsed:>9.1f} мс (с индексом)")
+
+    start = time.perf_counter()
+    ServerCatalog(ServerEntry(item['ip'], item['label'], item['tags'], item['port'])
+                  for item in entries)
+    print(f"  построение индекса       {(time.perf_counter() - start) * 1000:>9.1f} мс")
+
+    # Набор как в поле ввода: IP по цифрам, подпись по словам, исправление опечатки
+    queries = ["10.0.12.7", "каз", "казань рез", "dc7 prod москва", "узел 99", "10.0.1 омск",
+               "екатеринбург промышленный узел 1234", "xyz"]
+    sequence = list(keystrokes(queries)) * args.rounds
+    # Исправление: возврат к более короткому запросу сбрасывает уточнение
+    sequence += ["казань ре", "казань р", "казань", "москва"] * args.rounds
+
+    indexed, indexed_results = indexed_filter(catalog, sequence)
+    linear, linear_results = linear_filter(catalog, sequence)
+    if [count for count, _ in indexed_results] != [count for count, _ in linear_results]:
+        print("ОШИБКА: число совпадений индекса и полного прохода различается", file=sys.stderr)
+        failed = True
+    elif [values for _, values in indexed_results] != [values for _, values in linear_results]:
+        print("ОШИБКА: видимые строки индекса и полного прохода различаются", file=sys.stderr)
+        failed = True
+
+    print(f"\nНажатий: {len(sequence)}, кадр {FRAME_MS:.1f} мс")
+    print(f"{'способ':<24}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}{'> кадра':>9}")
+    for name, times in (("индекс + фильтр", indexed), ("полный проход", linear)):
+        p50, p99, worst = summary(times)
+        over = sum(1 for ms in times if ms > FRAME_MS)
+        print(f"{name:<24}{p50:>10.3f}{p99:>10.3f}{worst:>10.3f}{over:>9}")
+
+    p50, p99, worst = summary(indexed)
+    if p99 > FRAME_MS:
+        print(f"ОШИБКА: p99 нажатия {p99:.2f} мс превышает кадр {FRAME_MS:.1f} мс", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
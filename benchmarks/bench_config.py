@@ -0,0 +1,101 @@
+"""
+Бенчмарк чтения и записи конфига stunnel: прежний построчный разбор против StunnelConfig
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_config --sections 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import stunnel_config
+from stunnel_config import load_config, save_config
+
+
+def make_config(sections):
+    """Конфиг с глобальными опциями и sections секциями служб"""
+    lines = ["; generated for benchmark", "debug = 5", "output = stunnel.log", ""]
+    for i in range(sections):
+        lines += [
+            f"[service{i}]",
+            "client = yes",
+            f"accept = 127.0.0.1:{10000 + i}",
+            "; upstream",
+            "connect=195.209.130.9:443",
+            "",
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_current_server(path):
+    """Прежний get_current_server: чтение файла до первой строки connect="""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('connect='):
+                return line.split('=', 1)[1].split(':')[0].strip()
+    return None
+
+
+def legacy_rewrite(path, new_ip):
+    """Прежний change_server: readlines, замена всех connect= и запись open('w')"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    new_lines = [f'connect={new_ip}:443\n' if line.strip().startswith('connect=') else line
+                 for line in lines]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(new_lines)
+
+
+def new_rewrite(path, new_ip):
+    """Разбор из кэша, замена и атомарная запись"""
+    config, _ = load_config(path).with_option('connect', f"{new_ip}:443")
+    save_config(path, config)
+
+
+def timeit(func, repeat):
+    """Среднее время вызова в миллисекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(sections, repeat):
+    """Замеры для конфига заданного размера"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stunnel.conf")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(make_config(sections))
+
+        def cold_load():
+            stunnel_config.invalidate(path)
+            load_config(path)
+
+        ips = iter(f"10.0.{i // 256}.{i % 256}" for i in range(10 ** 6))
+        return {
+            'legacy read (first connect=)': timeit(lambda: legacy_current_server(path), repeat),
+            'parse (cold)': timeit(cold_load, repeat),
+            'load_config (cached)': timeit(lambda: load_config(path).first('connect'), repeat),
+            'legacy rewrite': timeit(lambda: legacy_rewrite(path, next(ips)), repeat),
+            'with_option + atomic save': timeit(lambda: new_rewrite(path, next(ips)), repeat),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sections', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for sections in args.sections:
+        print(f"\nСекций: {sections}")
+        for name, ms in bench(sections, args.repeat).items():
+            print(f"  {name:<30}{ms:>10.3f} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Проверка ожидания соединений перед остановкой службы (connection_drain.py) на локальных сокетах
+
+Порт accept stunnel заменяет слушающий сокет, клиенты туннеля - удерживаемые соединения.
+Сценарии:
+- подсчет по таблице сокетов ОС совпадает с числом открытых соединений (клиентские концы
+  и закрытые соединения не считаются), стоимость одного подсчета;
+- клиенты постепенно отключаются: ожидание заканчивается вскоре после последнего;
+- часть клиентов не отключается: ожидание прерывается по сроку, разорванные посчитаны;
+- порог: ожидание до threshold оставшихся соединений;
+- смена сервера способом restart на фейковой службе: фаза drain до остановки, разорванные
+  соединения в last_drain; способ reload службу не останавливает и соединения не ждет.
+
+Запуск из корня репозитория (Linux - /proc/net/tcp, Windows - GetExtendedTcpTable):
+    python -m benchmarks.bench_drain --connections 1000
+"""
+import argparse
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import StandInUpstreams
+from connection_drain import ConnectionDrain, count_established
+from load_test import raise_fd_limit
+from service_control import FakeServiceController
+from stunnel_manager import StunnelManager
+
+
+class AcceptPort:
+    """Слушающий сокет, который принимает и держит соединения (как stunnel на порту accept)
+
+    Каждому соединению сразу отправляется байт - проверка апстрима после перезагрузки
+    конфига (check_upstream) считает туннель рабочим. upstream - функция, возвращающая адрес
+    апстрима или None: на каждое соединение открывается соединение с ним, как у stunnel.
+    """
+
+    def __init__(self, upstream=None):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(4096)
+        self.port = self.sock.getsockname()[1]
+        self.accepted = []
+        self.upstream = upstream
+        self.upstream_connections = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            address = self.upstream() if self.upstream else None
+            if address is not None:
+                self.upstream_connections.append(socket.create_connection(address))
+            self.accepted.append(conn)
+            conn.sendall(b"+")
+
+    def connect(self, count):
+        """Открыть count клиентских соединений и дождаться, пока все будут приняты"""
+        expected = len(self.accepted) + count
+        clients = [socket.create_connection(('127.0.0.1', self.port)) for _ in range(count)]
+        while len(self.accepted) < expected:
+            time.sleep(0.01)
+        return clients
+
+    def close(self):
+        self.sock.close()
+        for conn in self.accepted + self.upstream_connections:
+            conn.close()
+
+
+def close_gradually(clients, duration):
+    """Закрыть клиентов равномерно за duration секунд (в фоновом потоке)"""
+    def run():
+        pause = duration / max(1, len(clients))
+        for client in clients:
+            client.close()
+            time.sleep(pause)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def check_count(args):
+    """Подсчет совпадает с числом соединений; закрытые клиенты не считаются"""
+    problems = []
+    accept = AcceptPort()
+    clients = accept.connect(args.connections)
+    times = []
+    for _ in range(20):
+        start = time.perf_counter()
+        counts = count_established([accept.port])
+        times.append((time.perf_counter() - start) * 1000)
+    if counts[accept.port] != args.connections:
+        problems.append(f"подсчет: {counts[accept.port]} из {args.connections}")
+    for client in clients[:10]:
+        client.close()
+    time.sleep(0.05)
+    after = count_established([accept.port])[accept.port]
+    if after != args.connections - 10:
+        problems.append(f"после закрытия 10 клиентов: {after}, ожидалось {args.connections - 10}")
+    print(f"Подсчет {args.connections} соединений: {counts[accept.port]}, после закрытия 10 - "
+          f"{after}; один подсчет p50 {statistics.median(times):.2f} мс, макс {max(times):.2f} мс")
+    for client in clients[10:]:
+        client.close()
+    accept.close()
+    return problems
+
+
+def check_drain(args):
+    """Клиенты отключаются за 1 с: ожидание заканчивается вскоре после последнего"""
+    accept = AcceptPort()
+    clients = accept.connect(200)
+    updates = []
+    drain = ConnectionDrain([accept.port], timeout=5.0, interval=0.05,
+                            on_progress=lambda count, initial, left: updates.append(count))
+    closer = close_gradually(clients, 1.0)
+    result = drain.wait()
+    closer.join()
+    accept.close()
+    problems = []
+    if result.timed_out or result.cut or not 0.9 <= result.elapsed <= 1.5:
+        problems.append(f"ожидание: {result!r}")
+    if updates != sorted(updates, reverse=True) or len(updates) < 10:
+        problems.append(f"ожидание: {len(updates)} обновлений прогресса, не по убыванию")
+    print(f"Клиенты отключаются за 1 с: {result.summary()}, обновлений прогресса {len(updates)}")
+    return problems
+
+
+def check_deadline(args):
+    """10 клиентов не отключаются: ожидание прерывается через 0.5 с, разорвано 10"""
+    accept = AcceptPort()
+    clients = accept.connect(30)
+    closer = close_gradually(clients[:20], 0.2)
+    result = ConnectionDrain([accept.port], timeout=0.5, interval=0.05).wait()
+    closer.join()
+    threshold = ConnectionDrain([accept.port], timeout=2.0, threshold=5, interval=0.05)
+    closer = close_gradually(clients[20:25], 0.3)
+    partial = threshold.wait()
+    closer.join()
+    for client in clients[25:]:
+        client.close()
+    accept.close()
+    problems = []
+    if not result.timed_out or result.cut != 10 or not 0.5 <= result.elapsed < 0.7:
+        problems.append(f"срок: {result!r}")
+    if partial.timed_out or partial.cut != 5:
+        problems.append(f"порог 5: {partial!r}")
+    print(f"Клиенты не отключаются: {result.summary()}; до порога 5: {partial.summary()}")
+    return problems
+
+
+def check_switch(args, tmp):
+    """Смена restart ждет соединения и сообщает разорванные; reload - без ожидания"""
+    upstreams = StandInUpstreams(StunnelManager.SERVERS)
+    config_path = Path(tmp) / "stunnel.conf"
+    service = FakeServiceController(running=False, upstream=upstreams.follow(str(config_path)))
+    accept = AcceptPort(upstream=lambda: service.upstream_address)
+    config_path.write_text(f"[giis]\nclient=yes\naccept=127.0.0.1:{accept.port}\n"
+                           f"connect=195.209.130.9:443\n", encoding='utf-8')
+    service.start()
+    manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+    manager.config_file_path = str(config_path)
+    manager.upstream_addresses = upstreams.addresses
+    manager.settings.update(drain_timeout=0.5)
+    clients = accept.connect(8)
+    # 3 клиента отключаются во время ожидания, 5 - остаются до остановки
+    close_gradually(clients[:3], 0.3)
+    problems = []
+    try:
+        manager.change_server('195.209.130.45', strategy='restart')
+        restart = manager.last_drain
+        timings = dict(manager.last_switch_timings)
+        manager.change_server('195.209.130.9', strategy='reload')
+        reload = manager.last_drain
+        strategy = manager.last_switch_strategy
+    finally:
+        manager.close()
+        for client in clients:
+            client.close()
+        accept.close()
+        upstreams.close()
+    if restart is None or not 5 < restart.initial <= 8 or restart.cut != 5:
+        problems.append(f"restart: {restart!r}")
+    if list(timings)[:2] != ['drain', 'stop'] or timings['drain'] < 0.5:
+        problems.append(f"restart: фазы {timings}")
+    if reload is not None or strategy != 'reload':
+        problems.append(f"reload ({strategy}): ожидание соединений {reload!r}")
+    print(f"Смена restart: {restart.summary() if restart else '-'}, "
+          f"drain {timings.get('drain', 0) * 1000:.0f} мс; reload - без ожидания")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if count_established([0]) is None:
+        print("Подсчет соединений на этой ОС не поддерживается")
+        return 0
+    limit = raise_fd_limit(args.connections * 2 + 256)
+    if limit is not None and limit < args.connections * 2 + 64:
+        args.connections = (limit - 64) // 2
+        print(f"Лимит открытых файлов {limit}: соединений {args.connections}")
+
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in (check_count, check_drain, check_deadline):
+            problems += check(args)
+        problems += check_switch(args, tmp)
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
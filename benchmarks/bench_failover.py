@@ -0,0 +1,272 @@
+"""
+Бенчмарк автопереключения: время от отказа апстрима до переключения монитором
+
+Апстримы подменяются слушающими сокетами на loopback, которые можно включать и выключать.
+Отдельно проверяется, что неудачные попытки переключения (служба не останавливается)
+не повторяются на каждой проверке: их ограничивают пауза и лимит переключений в час,
+и что при каталоге из сотни недоступных серверов кандидаты проверяются одновременно
+и их число ограничено (max_candidates), а не N x recovery_threshold x probe_timeout.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_failover --cycles 10 --interval 0.05 --failures 3
+"""
+import argparse
+import json
+import queue
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import SAMPLE_CONFIG, follow_config, free_port, hold_connection
+from health_monitor import HealthMonitor
+from latency_probe import percentile
+from service_control import FakeServiceController
+from stunnel_manager import StunnelManager
+
+
+class StandInUpstream:
+    """Апстрим-заглушка на loopback: up() начинает принимать соединения, down() - перестает"""
+
+    def __init__(self):
+        self.port = free_port()
+        self._socket = None
+        self._thread = None
+
+    def up(self):
+        """Начать слушать порт"""
+        if self._socket is not None:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', self.port))
+        sock.listen(128)
+        self._socket = sock
+        self._thread = threading.Thread(target=self._accept, args=(sock,), daemon=True)
+        self._thread.start()
+
+    def _accept(self, sock):
+        """Принимать соединения и держать их до закрытия другой стороной"""
+        while True:
+            try:
+                connection, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=hold_connection, args=(connection,), daemon=True).start()
+
+    def down(self):
+        """Перестать слушать порт (соединения получают отказ)"""
+        if self._socket is None:
+            return
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._thread.join()
+        self._socket = None
+
+
+def run(cycles, interval, failures, recovery):
+    """Выполнить cycles отказов активного апстрима, вернуть список времен до переключения, с"""
+    servers = list(StunnelManager.SERVERS)
+    upstreams = {ip: StandInUpstream() for ip in servers}
+    for upstream in upstreams.values():
+        upstream.up()
+    events = queue.SimpleQueue()
+    samples = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        accept_port = free_port()
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=accept_port),
+                               encoding='utf-8')
+        addresses = {f"{ip}:{StunnelManager.SERVER_PORT}": ('127.0.0.1', upstream.port)
+                     for ip, upstream in upstreams.items()}
+        service = FakeServiceController(listen=('127.0.0.1', accept_port),
+                                        upstream=follow_config(str(config_path), addresses))
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+        manager.upstream_addresses = addresses
+        monitor = HealthMonitor(
+            manager, interval=interval, failure_threshold=failures, recovery_threshold=recovery,
+            cooldown=0.0, max_failovers_per_hour=cycles, probe_timeout=0.5,
+            targets={ip: ('127.0.0.1', upstream.port) for ip, upstream in upstreams.items()},
+            on_event=events.put,
+        )
+        monitor.start()
+
+        for _ in range(cycles):
+            active = manager.get_current_server()
+            start = time.perf_counter()
+            upstreams[active].down()
+            while True:
+                event = events.get(timeout=30)
+                if event['event'] == 'switched':
+                    if manager.last_switch_strategy != 'reload':
+                        raise RuntimeError(f"Смена {manager.last_switch_strategy} вместо reload")
+                    break
+                if event['event'] == 'failover_failed':
+                    raise RuntimeError(f"Переключение не удалось: {event['error']}")
+            samples.append(time.perf_counter() - start)
+            upstreams[active].up()
+
+        monitor.stop()
+        manager.close()
+        service.stop()
+
+    for upstream in upstreams.values():
+        upstream.down()
+    return samples
+
+
+def check_failed_failover(failures, checks=20):
+    """Служба не останавливается: неудачные попытки ограничены паузой и лимитом в час"""
+    servers = list(StunnelManager.SERVERS)
+    upstreams = {ip: StandInUpstream() for ip in servers}
+    for ip, upstream in upstreams.items():
+        if ip != servers[0]:
+            upstream.up()
+    now = [0.0]
+    events = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=free_port()),
+                               encoding='utf-8')
+        service = FakeServiceController()
+        service.fail_stop = True
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+        # Способ restart: служба останавливается до записи конфига, сервер остается прежним
+        manager.settings.update(switch_strategy='restart')
+        monitor = HealthMonitor(
+            manager, failure_threshold=failures, recovery_threshold=1, cooldown=60.0,
+            max_failovers_per_hour=2, probe_timeout=0.5,
+            targets={ip: ('127.0.0.1', upstream.port) for ip, upstream in upstreams.items()},
+            on_event=lambda event: events.append(event['event']), clock=lambda: now[0],
+        )
+        # checks проверок в пределах паузы, затем столько же после паузы и после второй паузы
+        for _ in range(3):
+            for _ in range(checks):
+                monitor.check_once()
+                now[0] += 1.0
+            now[0] += 60.0
+        manager.close()
+
+    for upstream in upstreams.values():
+        upstream.down()
+    attempts = events.count('failover_failed')
+    print(f"Служба не останавливается: {len(events)} событий, попыток переключения {attempts} "
+          f"(остановок службы {service.stop_calls}), заблокировано {events.count('failover_blocked')}")
+    if attempts != 2 or service.stop_calls != 2:
+        return [f"неудачных попыток {attempts}, остановок службы {service.stop_calls}, ожидалось 2"]
+    return []
+
+
+class BlackHole:
+    """Порт, на котором соединение не устанавливается до таймаута: очередь accept заполнена"""
+
+    def __init__(self):
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(0)
+        self.address = self._socket.getsockname()
+        self._pending = []
+        for _ in range(4):
+            sock = socket.socket()
+            sock.setblocking(False)
+            sock.connect_ex(self.address)
+            self._pending.append(sock)
+
+    def close(self):
+        for sock in self._pending + [self._socket]:
+            sock.close()
+
+
+def check_candidates(count=100, max_candidates=8, probe_timeout=0.3, recovery=2):
+    """Недоступные кандидаты отвечают только таймаутом: выбор занимает ~recovery x timeout"""
+    servers = [f"10.0.{n // 250}.{n % 250 + 1}" for n in range(count)]
+    healthy = StandInUpstream()
+    healthy.up()
+    hole = BlackHole()
+    events = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=free_port()),
+                               encoding='utf-8')
+        manager = StunnelManager(service=FakeServiceController(), app_dir=Path(tmp) / "app",
+                                 console=None)
+        manager.config_file_path = str(config_path)
+        (manager.config_dir / "servers.json").write_text(
+            json.dumps({'servers': [{'ip': ip} for ip in servers]}), encoding='utf-8')
+        # Исправен последний сервер каталога; у него и у соседа есть история задержки
+        manager.latency_store.record(servers[-1], 5.0)
+        manager.latency_store.record(servers[-2], 50.0)
+        targets = {ip: hole.address for ip in servers}
+        targets[servers[-1]] = ('127.0.0.1', healthy.port)
+        monitor = HealthMonitor(
+            manager, recovery_threshold=recovery, probe_timeout=probe_timeout,
+            max_candidates=max_candidates, targets=targets,
+            on_event=lambda event: events.append(event),
+        )
+        start = time.perf_counter()
+        candidate = monitor._pick_candidate(servers[0])
+        elapsed = time.perf_counter() - start
+        manager.close()
+
+    hole.close()
+    healthy.down()
+    rejected = sum(1 for event in events if event['event'] == 'candidate_rejected')
+    print(f"Каталог {count} серверов, кандидатов не больше {max_candidates}: выбран {candidate} "
+          f"за {elapsed * 1000:.0f} мс, отклонено {rejected}")
+    problems = []
+    if candidate != servers[-1]:
+        problems.append(f"кандидаты: выбран {candidate}, ожидался {servers[-1]}")
+    if rejected > max_candidates - 1:
+        problems.append(f"кандидаты: проверено {rejected + 1}, больше {max_candidates}")
+    if elapsed > (recovery + 1) * probe_timeout:
+        problems.append(f"кандидаты: выбор занял {elapsed:.2f} с - проверки последовательные")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.05, help="период проверки, с")
+    parser.add_argument('--failures', type=int, default=3)
+    parser.add_argument('--recovery', type=int, default=2)
+    parser.add_argument('--json', metavar='FILE', help="сохранить сводку в JSON")
+    args = parser.parse_args(argv)
+
+    samples = run(args.cycles, args.interval, args.failures, args.recovery)
+    summary = {
+        'mean': statistics.fmean(samples) * 1000,
+        'median': statistics.median(samples) * 1000,
+        'p95': percentile(samples, 95) * 1000,
+        'max': max(samples) * 1000,
+    }
+    print(f"Переключений: {len(samples)}, интервал {args.interval} с, порог {args.failures}")
+    print("До переключения: " + ", ".join(f"{k} {v:.1f} мс" for k, v in summary.items()))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            'cycles': args.cycles,
+            'interval': args.interval,
+            'failures': args.failures,
+            'recovery': args.recovery,
+            'failover_ms': summary,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    problems = check_failed_failover(args.failures) + check_candidates()
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Проверка и бенчмарк раскатки смены сервера по инвентарю (fleet.py) на фейковой службе
+
+Каталог с N конфигами-фикстурами и инвентарь JSON (backend fake). Сценарии:
+- все цели исправны: все переключены, время пулом из W потоков против одного потока;
+- неудача на канареечной цели: раскатка остановлена, остальные конфиги не тронуты;
+- неудач больше порога: переключенные цели откачены к исходному серверу;
+- зависшая служба: цель получает итог timeout, раскатка не ждет ее дольше таймаута.
+"Сломанная" цель - конфиг с accept= на порту, который никто не слушает (туннель не готов).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_fleet --targets 40 --workers 8
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fleet import (FAILED, ROLLBACK_FAILED, ROLLED_BACK, SKIPPED, SWITCHED, TIMEOUT, FleetRunner,
+                   load_inventory)
+from stunnel_config import load_config
+from stunnel_manager import StunnelManager
+
+
+GOOD_CONFIG = "[giis]\nclient=yes\nconnect={ip}:443\n"
+# Порт 1 никто не слушает: после запуска службы туннель не готов
+BROKEN_CONFIG = "[giis]\nclient=yes\naccept=127.0.0.1:1\nconnect={ip}:443\n"
+
+
+def make_fleet(directory, count, ip, broken=(), hung=(), start_delay=0.05):
+    """Конфиги ws000..wsNNN и inventory.json; broken/hung - номера сломанных и зависших целей"""
+    directory = Path(directory)
+    directory.mkdir(parents=True)
+    targets = []
+    for i in range(count):
+        name = f"ws{i:03d}"
+        template = BROKEN_CONFIG if i in broken else GOOD_CONFIG
+        (directory / f"{name}.conf").write_text(template.format(ip=ip), encoding='utf-8')
+        options = {'stop_delay': 0.01, 'start_delay': 30.0 if i in hung else start_delay}
+        targets.append({'name': name, 'config': f"{name}.conf", 'options': options})
+    inventory = {'defaults': {'backend': 'fake', 'settings': {'switch_strategy': 'restart'}},
+                 'targets': targets}
+    path = directory / "inventory.json"
+    path.write_text(json.dumps(inventory, indent=1), encoding='utf-8')
+    return path
+
+
+def servers(directory):
+    """{цель: сервер из connect=} по конфигам каталога"""
+    return {path.stem: load_config(path).first('connect').split(':')[0]
+            for path in sorted(Path(directory).glob("*.conf"))}
+
+
+def run(inventory, state_dir, ip, **options):
+    """Раскатка по инвентарю; вернуть FleetReport"""
+    runner = FleetRunner(load_inventory(inventory), state_dir, **options)
+    return runner.run(ip)
+
+
+def check_all_good(tmp, args, old, new):
+    """Все цели исправны: пул быстрее одного потока, все конфиги на новом сервере"""
+    problems = []
+    elapsed = {}
+    for workers in (1, args.workers):
+        directory = Path(tmp) / f"good_{workers}"
+        inventory = make_fleet(directory, args.targets, old, start_delay=args.start_delay)
+        start = time.perf_counter()
+        report = run(inventory, directory / "state", new, workers=workers, timeout=args.timeout)
+        elapsed[workers] = time.perf_counter() - start
+        if not report.ok or report.counts() != {SWITCHED: args.targets}:
+            problems.append(f"исправные цели, {workers} потоков: {report.counts()}")
+        if set(servers(directory).values()) != {new}:
+            problems.append(f"исправные цели, {workers} потоков: не все конфиги на {new}")
+        if workers == args.workers:
+            print("\n".join(report.table()[-2:]))
+    print(f"Исправные цели ({args.targets}): 1 поток {elapsed[1]:.2f} с, "
+          f"{args.workers} потоков {elapsed[args.workers]:.2f} с "
+          f"(x{elapsed[1] / elapsed[args.workers]:.1f})")
+    return problems
+
+
+def check_canary(tmp, args, old, new):
+    """Канарейка сломана: раскатка останавливается, остальные цели не запускаются"""
+    directory = Path(tmp) / "canary"
+    inventory = make_fleet(directory, args.targets, old, broken={0})
+    report = run(inventory, directory / "state", new, workers=args.workers, timeout=args.timeout,
+                 canary=2)
+    problems = []
+    counts = report.counts()
+    if report.aborted is None:
+        problems.append("канарейка: раскатка не остановлена")
+    if counts.get(SKIPPED) != args.targets - 1:
+        problems.append(f"канарейка: пропущено {counts.get(SKIPPED)}, ожидалось {args.targets - 1}")
+    if set(servers(directory).values()) != {old}:
+        problems.append("канарейка: конфиги изменены")
+    print(f"Сломанная канарейка: {counts}, {report.aborted}")
+    return problems
+
+
+def check_threshold(tmp, args, old, new):
+    """Неудач больше порога: все переключенные цели возвращены на исходный сервер"""
+    directory = Path(tmp) / "threshold"
+    broken = set(range(3, args.targets, max(args.targets // 4, 1)))
+    inventory = make_fleet(directory, args.targets, old, broken=broken)
+    report = run(inventory, directory / "state", new, workers=args.workers, timeout=args.timeout,
+                 max_failure_rate=0.05)
+    problems = []
+    counts = report.counts()
+    if report.aborted is None:
+        problems.append("порог: раскатка не остановлена")
+    if counts.get(SWITCHED):
+        problems.append(f"порог: {counts[SWITCHED]} целей остались переключенными")
+    if not counts.get(ROLLED_BACK):
+        problems.append("порог: нет откаченных целей")
+    unrestored = {name: ip for name, ip in servers(directory).items() if ip != old}
+    if unrestored:
+        problems.append(f"порог: конфиги не откачены: {unrestored}")
+    # Сломанные цели откатываются, но их туннель так и не готов
+    bad = [r.name for r in report.results if r.outcome in (FAILED, ROLLBACK_FAILED)]
+    print(f"Порог неудач: {counts}, сломанные: {len(bad)}, конфиги на исходном сервере: "
+          f"{len(servers(directory)) - len(unrestored)} из {args.targets}")
+    return problems
+
+
+def check_timeout(tmp, args, old, new):
+    """Служба цели не запускается вовремя: итог timeout без ожидания сверх таймаута"""
+    directory = Path(tmp) / "timeout"
+    inventory = make_fleet(directory, 4, old, hung={1})
+    start = time.perf_counter()
+    report = run(inventory, directory / "state", new, workers=4, timeout=1.0,
+                 max_failure_rate=1.0)
+    elapsed = time.perf_counter() - start
+    problems = []
+    outcome = report.results[1].outcome
+    if outcome != TIMEOUT:
+        problems.append(f"таймаут: итог зависшей цели {outcome}")
+    # Таймаут цели + ожидание зависшей смены перед выходом
+    if elapsed > 2.5:
+        problems.append(f"таймаут: раскатка заняла {elapsed:.1f} с")
+    print(f"Зависшая служба: {report.counts()} за {elapsed:.1f} с")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--targets', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--start-delay', type=float, default=0.05, help="запуск фейковой службы, с")
+    parser.add_argument('--timeout', type=float, default=10.0, help="таймаут цели, с")
+    args = parser.parse_args(argv)
+
+    old, new = list(StunnelManager.SERVERS)[:2]
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in (check_all_good, check_canary, check_threshold, check_timeout):
+            problems += check(tmp, args, old, new)
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
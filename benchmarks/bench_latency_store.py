@@ -0,0 +1,159 @@
+"""
+Бенчмарк истории задержки (latency_store.py): добавление замеров и стоимость сводок
+
+Во временный каталог записываются миллионы замеров по нескольким серверам за 30 дней
+(логнормальная задержка, часть замеров - неудачные). Проверяется:
+- скорость добавления замеров;
+- сводка за час/сутки после повторного открытия (как при запуске GUI) читает только
+  слоты агрегатов: время не зависит от длины истории (сравнение с историей в 30 раз
+  короче при той же частоте замеров) и укладывается в бюджет;
+- p50/p95 сводки совпадают с точными перцентилями замеров из кольцевого буфера
+  с точностью корзины гистограммы, число замеров и доступность - точно.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_latency_store --samples 2000000 --servers 10
+"""
+import argparse
+import math
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from latency_probe import percentile
+from latency_store import (HISTOGRAM_RATIO, HOUR_SLOTS, MINUTE_SLOTS, SLOT_WORDS, LatencyStore,
+                           WINDOWS)
+
+
+DAYS = 30
+FAILURE_RATE = 0.02
+SUMMARY_BUDGET_MS = 5.0
+# Оценка корзины отличается от значения не больше чем в sqrt(ratio) раз
+TOLERANCE = math.sqrt(HISTOGRAM_RATIO) - 1 + 1e-9
+
+
+def fill(directory, samples, servers, now, days=DAYS, seed=3):
+    """Записать samples замеров по servers серверам за days дней; вернуть (серверы, мс)"""
+    rng = random.Random(seed)
+    store = LatencyStore(directory)
+    names = [f"10.0.0.{number}" for number in range(1, servers + 1)]
+    per_server = samples // servers
+    step = days * 86400 / per_server
+    medians = {name: rng.uniform(10, 120) for name in names}
+    start = time.perf_counter()
+    for name in names:
+        series = store.series(name, create=True)
+        mu = math.log(medians[name])
+        moment = now - days * 86400
+        for _ in range(per_server):
+            moment += step
+            if rng.random() < FAILURE_RATE:
+                series.append(None, moment)
+            else:
+                series.append(rng.lognormvariate(mu, 0.5), moment)
+    elapsed = (time.perf_counter() - start) * 1000
+    store.close()
+    return names, elapsed
+
+
+def timed_summaries(directory, names, now, repeat):
+    """Время сводок: первое открытие файлов и повторные вызовы (мс)"""
+    store = LatencyStore(directory)
+    start = time.perf_counter()
+    summaries = store.summaries(names, now)
+    cold = (time.perf_counter() - start) * 1000
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        store.summaries(names, now)
+        warm.append((time.perf_counter() - start) * 1000)
+    return store, summaries, cold, statistics.median(warm)
+
+
+def window_start(window, now):
+    """Начало окна сводки - как в LatencySeries.summary"""
+    now = int(now)
+    if window == 'hour':
+        return now - now % 60 - (MINUTE_SLOTS - 1) * 60
+    return now - now % 3600 - (HOUR_SLOTS - 1) * 3600
+
+
+def check_accuracy(store, names, summaries, now):
+    """Сводки против точных перцентилей замеров кольцевого буфера"""
+    problems = []
+    worst = 0.0
+    for name in names:
+        series = store.series(name)
+        for window in WINDOWS:
+            since = window_start(window, now)
+            samples = series.samples(since=since)
+            if series.samples()[0][0] >= since:
+                problems.append(f"{name}: кольцевой буфер не покрывает окно {window}")
+                continue
+            values = [value for _, value in samples if value is not None]
+            summary = summaries[name][window]
+            if summary.samples != len(samples) or summary.failures != len(samples) - len(values):
+                problems.append(f"{name} {window}: замеров {summary.samples}/{summary.failures}, "
+                                f"в буфере {len(samples)}/{len(samples) - len(values)}")
+                continue
+            for pct, estimate in ((50, summary.p50), (95, summary.p95)):
+                exact = percentile(values, pct)
+                error = abs(estimate - exact) / exact
+                worst = max(worst, error)
+                if error > TOLERANCE:
+                    problems.append(f"{name} {window}: p{pct} {estimate:.1f} мс, точно {exact:.1f} мс")
+    return problems, worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=2_000_000, help="всего замеров")
+    parser.add_argument('--servers', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=50, help="повторов сводки")
+    args = parser.parse_args(argv)
+
+    now = time.time()
+    problems = []
+    results = {}
+    # Та же частота замеров, история в DAYS раз короче: слоты агрегатов заполнены так же
+    for samples, days in ((args.samples, DAYS), (args.samples // DAYS, 1)):
+        with tempfile.TemporaryDirectory() as tmp:
+            names, append_ms = fill(tmp, samples, args.servers, now, days)
+            store, summaries, cold, warm = timed_summaries(tmp, names, now, args.repeat)
+            if samples == args.samples:
+                print(f"Добавление {samples} замеров по {args.servers} серверам: "
+                      f"{append_ms / 1000:.1f} с ({samples / (append_ms / 1000):,.0f} замеров/с, "
+                      f"{append_ms * 1000 / samples:.2f} мкс на замер)")
+                series = store.series(names[0])
+                print(f"Файл сервера: {series.path.stat().st_size / 1024:.0f} КБ "
+                      f"(кольцевой буфер {series.capacity} замеров, всего добавлено {series.count})")
+                found, worst = check_accuracy(store, names, summaries, now)
+                problems += found
+                print(f"Сводки против точных перцентилей: наибольшее отклонение {worst:.1%} "
+                      f"(допустимо {TOLERANCE:.1%})")
+                for name in names[:3]:
+                    print(f"  {name}: " + ", ".join(s.text() for s in summaries[name].values()))
+            results[samples] = (cold, warm)
+            store.close()
+
+    read_bytes = (MINUTE_SLOTS + HOUR_SLOTS) * SLOT_WORDS * 4
+    print(f"\n{'замеров':>10}{'открытие + сводки, мс':>24}{'повторно, мс':>14}{'на сервер, мс':>15}")
+    for samples, (cold, warm) in results.items():
+        print(f"{samples:>10}{cold:>24.2f}{warm:>14.3f}{warm / args.servers:>15.3f}")
+    print(f"Сводка сервера читает {read_bytes / 1024:.1f} КБ слотов при любой длине истории")
+
+    (big_cold, big_warm), (small_cold, small_warm) = results.values()
+    if big_warm > small_warm * 3 + 0.5:
+        problems.append(f"сводка зависит от длины истории: {big_warm:.2f} мс против {small_warm:.2f} мс")
+    if big_cold / args.servers > SUMMARY_BUDGET_MS:
+        problems.append(f"сводка сервера при запуске {big_cold / args.servers:.2f} мс > "
+                        f"{SUMMARY_BUDGET_MS} мс")
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Проверка нагрузочного теста (load_test.py) на локальной замене туннеля
+
+Замена сервера ГИИС - TLS HTTP-сервер с keep-alive (задержка ответа и доля 503 задаются),
+замена stunnel - встроенный ForwardProxy: порт accept без TLS -> сервер по TLS. Сценарии:
+- тысячи соединений из одного процесса к порту без TLS (как accept stunnel) и сотни через
+  туннель: число ответов и гистограмма сходятся со счетчиками сервера, ошибок нет, все
+  соединения одновременно открыты на сервере;
+- режим echo напрямую к TLS эхо-серверу;
+- ошибки обнаруживаются: закрытый порт и каждый N-й ответ 503;
+- сравнение серверов через change_server (фейковая служба): порядок по p50 совпадает
+  с заданными задержками, исходный сервер восстановлен.
+Сертификаты создаются командой openssl во временном каталоге.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_loadtest --connections 5000 --duration 3
+"""
+import argparse
+import asyncio
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from benchmarks.bench_proxy import CLIENT_CONTEXT, TlsEchoServer, make_certificate
+from forward_proxy import ForwardProxy
+from load_test import LoadGenerator, compare_servers, comparison_table, raise_fd_limit
+from service_control import FakeServiceController
+from stunnel_manager import StunnelManager
+
+
+class HttpStandIn:
+    """HTTP-сервер с keep-alive в отдельном потоке: задержка ответа, каждый fail_every-й - 503
+
+    Без cert - без TLS, как порт accept stunnel.
+    """
+
+    def __init__(self, cert=None, key=None, delay=0.0, fail_every=0):
+        self.context = None
+        if cert:
+            self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.context.load_cert_chain(cert, key)
+        self.delay = delay
+        self.fail_every = fail_every
+        self.responses = 0
+        self.failures = 0
+        self.active = 0
+        self.peak = 0
+        self.address = None
+        self._ready = threading.Event()
+        self._loop = None
+        self._stop = None
+        threading.Thread(target=asyncio.run, args=(self._main(),), daemon=True).start()
+        self._ready.wait()
+
+    async def _serve(self, reader, writer):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                self.responses += 1
+                if self.fail_every and self.responses % self.fail_every == 0:
+                    self.failures += 1
+                    status, body = "503 Service Unavailable", b"busy\n"
+                else:
+                    status, body = "200 OK", b"ok\n"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode('ascii') + body)
+                await writer.drain()
+        except (OSError, ssl.SSLError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._serve, '127.0.0.1', 0, ssl=self.context,
+                                            backlog=4096)
+        self.address = server.sockets[0].getsockname()[:2]
+        self._ready.set()
+        await self._stop.wait()
+        server.close()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+
+def tunnel(upstream):
+    """"stunnel" на свободном порту: без TLS на входе, TLS к upstream"""
+    proxy = ForwardProxy(('127.0.0.1', 0), upstream, ssl_context=CLIENT_CONTEXT, pool_size=0)
+    proxy.start()
+    return proxy
+
+
+def dead_port():
+    """Порт, который никто не слушает"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def check_counts(name, result, server, connections):
+    """Счетчики генератора сходятся со счетчиками сервера, гистограмма согласована"""
+    problems = []
+    latency = result.latency
+    if result.errors:
+        problems.append(f"{name}: ошибки {result.error_kinds}")
+    # Ответ мог быть отправлен сервером, но не дочитан к концу теста
+    if not 0 <= server.responses - result.requests <= connections:
+        problems.append(f"{name}: ответов сервера {server.responses}, учтено {result.requests}")
+    if latency.count != result.requests or sum(latency.counts) != latency.count:
+        problems.append(f"{name}: {latency.count} замеров на {result.requests} запросов")
+    quantiles = [latency.quantile(q) for q in (0.5, 0.9, 0.99, 0.999)]
+    if None in quantiles or quantiles != sorted(quantiles) or quantiles[-1] > latency.max:
+        problems.append(f"{name}: квантили не упорядочены: {quantiles}")
+    if server.peak < connections * 0.95:
+        problems.append(f"{name}: одновременно открыто {server.peak} из {connections} соединений")
+    print(f"{name}, {connections} соединений: {result.summary()}, одновременно на сервере "
+          f"{server.peak}, подключение p99 {result.connect.quantile(0.99) * 1000:.1f} мс")
+    return problems
+
+
+def check_many_connections(cert, key, args):
+    """Тысячи соединений из одного процесса к порту без TLS (как accept stunnel)"""
+    server = HttpStandIn()
+    try:
+        result = LoadGenerator(*server.address, connections=args.connections,
+                               duration=args.duration, ramp_up=args.ramp_up,
+                               timeout=10.0).run()
+    finally:
+        server.close()
+    return check_counts("Порт без TLS", result, server, args.connections)
+
+
+def check_tunnel(cert, key, args):
+    """Через "stunnel" (ForwardProxy) к TLS-серверу: рукопожатия делят процесс с генератором"""
+    server = HttpStandIn(cert, key)
+    proxy = tunnel(server.address)
+    try:
+        result = LoadGenerator(*proxy.address, connections=args.tunnel_connections,
+                               duration=args.duration, ramp_up=args.ramp_up,
+                               timeout=10.0).run()
+    finally:
+        proxy.stop()
+        server.close()
+    return check_counts("Через туннель", result, server, args.tunnel_connections)
+
+
+def check_echo(cert, key, args):
+    """Режим echo напрямую к TLS эхо-серверу"""
+    server = TlsEchoServer(cert, key)
+    try:
+        result = LoadGenerator(*server.address, connections=200, duration=1.0, mode='echo',
+                               payload=512, ramp_up=0.2, ssl_context=CLIENT_CONTEXT,
+                               server_hostname='localhost').run()
+    finally:
+        server.close()
+    problems = []
+    if result.errors or not result.requests:
+        problems.append(f"echo: {result.requests} запросов, ошибки {result.error_kinds}")
+    if result.bytes != result.requests * 512:
+        problems.append(f"echo: получено {result.bytes} байт на {result.requests} запросов")
+    print(f"Echo по TLS, 200 соединений: {result.summary()}")
+    return problems
+
+
+def check_errors(cert, key, args):
+    """Ошибки учитываются: закрытый порт и каждый 10-й ответ 503"""
+    problems = []
+    result = LoadGenerator('127.0.0.1', dead_port(), connections=20, duration=0.5,
+                           ramp_up=0).run()
+    if result.requests or result.error_rate != 1.0:
+        problems.append(f"закрытый порт: {result.requests} запросов, ошибок {result.error_rate:.0%}")
+    print(f"Закрытый порт: ошибок {result.errors} ({result.error_kinds})")
+
+    server = HttpStandIn(cert, key, fail_every=10)
+    proxy = tunnel(server.address)
+    try:
+        result = LoadGenerator(*proxy.address, connections=50, duration=1.0, ramp_up=0.1).run()
+    finally:
+        proxy.stop()
+        server.close()
+    if not 0.09 <= result.error_rate <= 0.11 or result.statuses.get(503) != result.errors:
+        problems.append(f"503: доля ошибок {result.error_rate:.3f}, статусы {result.statuses}")
+    print(f"Каждый 10-й ответ 503: ошибок {result.error_rate:.1%}, статусы {result.statuses}")
+    return problems
+
+
+def check_compare(cert, key, args, tmp):
+    """Сравнение серверов через change_server: порядок по задержке, исходный сервер восстановлен"""
+    ips = list(StunnelManager.SERVERS)[:3]
+    delays = dict(zip(ips, (0.06, 0.0, 0.03)))
+    servers = {ip: HttpStandIn(cert, key, delay=delay) for ip, delay in delays.items()}
+    proxy = tunnel(servers[ips[0]].address)
+    addresses = {f"{ip}:443": server.address for ip, server in servers.items()}
+    config_path = Path(tmp) / "stunnel.conf"
+    config_path.write_text(f"[giis]\nclient=yes\naccept=127.0.0.1:{proxy.address[1]}\n"
+                           f"connect={ips[0]}:443\n", encoding='utf-8')
+
+    def follow_config():
+        """Прокси-замена stunnel переходит на connect= конфига при запуске и перезагрузке"""
+        address = addresses[manager.get_tunnel_section().get('connect')]
+        proxy.switch(*address)
+        return address
+
+    service = FakeServiceController(running=False, upstream=follow_config)
+    manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+    manager.config_file_path = str(config_path)
+    manager.upstream_addresses = addresses
+    service.start()
+    strategies = set()
+    manager.tracer.add_hook(lambda span: strategies.add(span.attributes.get('strategy')))
+    try:
+        results = compare_servers(manager, ips, strategy='reload', connections=50,
+                                  duration=1.0, ramp_up=0.2)
+        current = manager.get_current_server()
+    finally:
+        proxy.stop()
+        for server in servers.values():
+            server.close()
+        manager.close()
+    print("\n".join(comparison_table(results)))
+    problems = []
+    ranked = [r.server for r in sorted(results, key=lambda r: r.latency.quantile(0.5))]
+    expected = sorted(ips, key=delays.get)
+    if ranked != expected:
+        problems.append(f"сравнение: порядок {ranked}, ожидался {expected}")
+    if any(r.errors for r in results):
+        problems.append(f"сравнение: ошибки {[r.error_kinds for r in results]}")
+    if current != ips[0]:
+        problems.append(f"сравнение: после теста сервер {current}, ожидался {ips[0]}")
+    if strategies - {None} != {'reload'}:
+        problems.append(f"сравнение: способы смены {strategies - {None}}, ожидался reload")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--tunnel-connections', type=int, default=500,
+                        help="соединений через прокси с TLS к серверу")
+    parser.add_argument('--duration', type=float, default=3.0, help="длительность, с")
+    parser.add_argument('--ramp-up', type=float, default=1.0, help="открытие соединений, с")
+    args = parser.parse_args(argv)
+
+    # Генератор, прокси и сервер в одном процессе: по три дескриптора на соединение
+    limit = raise_fd_limit(args.connections * 4 + 256)
+    if limit is not None and limit < args.connections * 4:
+        print(f"Лимит открытых файлов {limit}: соединений не больше {limit // 4}")
+        args.connections = limit // 4
+
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        for check in (check_many_connections, check_tunnel, check_echo, check_errors):
+            problems += check(cert, key, args)
+        problems += check_compare(cert, key, args, tmp)
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Бенчмарк записи лога: открытие/запись/закрытие на каждое сообщение против LogWriter
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_log --messages 5000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from log_writer import LogWriter
+
+
+MESSAGE = "[2025-10-02 12:00:00] Строка connect заменена на: connect=195.209.130.9:443"
+
+
+def bench_open_per_call(directory, messages):
+    """Прежняя схема StunnelManager.log: open/append/close на каждую строку"""
+    path = Path(directory) / "per_call.log"
+    start = time.perf_counter()
+    for _ in range(messages):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(MESSAGE + '\n')
+    return time.perf_counter() - start, 0.0
+
+
+def bench_log_writer(directory, messages):
+    """LogWriter: постановка в очередь, запись фоновым потоком пакетами"""
+    writer = LogWriter(Path(directory), prefix="writer")
+    start = time.perf_counter()
+    for _ in range(messages):
+        writer.write(MESSAGE)
+    enqueue = time.perf_counter() - start
+    writer.flush()
+    total = time.perf_counter() - start
+    writer.close()
+    return enqueue, total - enqueue
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            'open/write/close': bench_open_per_call(tmp, args.messages),
+            'LogWriter': bench_log_writer(tmp, args.messages),
+        }
+
+    print(f"{'схема':<18}{'на вызов, мкс':>16}{'досылка, мс':>14}")
+    for name, (per_call_total, drain) in results.items():
+        print(f"{name:<18}{per_call_total / args.messages * 1e6:>16.2f}{drain * 1000:>14.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Бенчмарк индекса логов: построение, повторное открытие, поиск по истории и дочитывание
+
+Во временном каталоге создаются файлы stunnel_manager_*.log по 5 МБ (как после ротации
+LogWriter) за 60 дней: смены серверов, замеры, ошибки запуска службы. Поиск по индексу
+сравнивается с полным проходом по всем файлам (прежний способ - открыть и читать),
+результаты обоих способов должны совпадать. Дочитывание текущего лога - refresh() после
+дописывания строк; окно виртуального списка - 50 строк из произвольного места истории.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_logindex --megabytes 200
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from log_index import TIME_LENGTH, TOKEN_PATTERN, LogIndex, parse_period, query_terms
+from stunnel_manager import StunnelManager
+
+
+FILE_BYTES = 5 * 1024 * 1024
+WINDOW_ROWS = 50
+SEARCH_BUDGET_MS = 50
+
+
+def session_lines(rng, servers):
+    """Сообщения одного события: смена сервера (иногда неудачная) или замер"""
+    old, new = rng.sample(servers, 2)
+    kind = rng.random()
+    if kind < 0.5:
+        lines = ["=" * 50, "Изменение сервера", f"Старый сервер: {old}",
+                 f"Новый сервер: {new} (промышленный контур)", "Способ: reload", "=" * 50,
+                 "Создание резервной копии...", f"Резервная копия создана: версия {rng.getrandbits(48):012x}",
+                 "Изменение конфигурации...", f"Строка connect заменена на: connect={new}:443 (1 шт.)"]
+        if rng.random() < 0.03:
+            lines += ["Остановка службы Stunnel (win32)...", "ОШИБКА: Не удалось запустить службу!",
+                      "Вывод: служба не отвечает", "Восстановление из резервной копии..."]
+        else:
+            lines += ["Команда перезагрузки конфигурации принята",
+                      f"Туннель готов через {rng.randint(20, 900)} мс", "УСПЕШНО: Сервер изменен!"]
+        return lines
+    lines = [f"Замер задержки до серверов (3 попыток, таймаут 2.0 с)..."]
+    lines += [f"  {ip}: tcp {rng.uniform(5, 80):.1f} мс, tls {rng.uniform(20, 200):.1f} мс"
+              for ip in servers]
+    if kind > 0.97:
+        lines.append(f"ОШИБКА: Порт 127.0.0.1:1501 не принимает соединения: timed out")
+    return lines
+
+
+def make_logs(directory, megabytes, days=60, seed=7):
+    """Файлы лога общим объемом megabytes за последние days дней; вернуть число строк"""
+    rng = random.Random(seed)
+    servers = list(StunnelManager.SERVERS)
+    count = max(1, megabytes * 1024 * 1024 // FILE_BYTES)
+    # Время идет пропорционально объему: последняя строка - около текущего момента
+    step = days * 86400 / (count * FILE_BYTES)
+    moment = time.time() - days * 86400
+    lines_written = 0
+    for number in range(count):
+        name = datetime.fromtimestamp(moment).strftime("%Y-%m-%d_%H-%M-%S")
+        path = Path(directory) / f"stunnel_manager_{name}_{number}.log"
+        written = 0
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            while written < FILE_BYTES:
+                stamp = datetime.fromtimestamp(moment).strftime("%Y-%m-%d %H:%M:%S")
+                block = "".join(f"[{stamp}] {line}\n" for line in session_lines(rng, servers))
+                f.write(block)
+                size = len(block.encode('utf-8'))
+                written += size
+                lines_written += block.count("\n")
+                moment += step * size
+    return lines_written
+
+
+def linear_search(directory, queries):
+    """Прежний способ: прочитать все файлы и проверить каждую строку
+
+    Все запросы проверяются за одно чтение; queries - [(слова, since)], результат -
+    список найденных строк для каждого запроса.
+    """
+    found = [[] for _ in queries]
+    parsed = {}
+    for path in sorted(Path(directory).glob("stunnel_manager_*.log")):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.rstrip("\n")
+                stamped = line[:1] == "[" and line[20:21] == "]"
+                moment = None
+                if stamped:
+                    moment = parsed.get(line[1:20])
+                    if moment is None:
+                        moment = parsed[line[1:20]] = datetime.strptime(
+                            line[1:20], "%Y-%m-%d %H:%M:%S").timestamp()
+                tokens = TOKEN_PATTERN.findall(line[TIME_LENGTH if stamped else 0:].lower())
+                for number, (terms, since) in enumerate(queries):
+                    if since is not None and (moment is None or moment < since):
+                        continue
+                    if all(any(token.startswith(term) for token in tokens) for term in terms):
+                        found[number].append(line)
+    return found
+
+
+def timed(fn, *args, **kwargs):
+    """(результат, миллисекунды)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megabytes', type=int, default=200, help="объем истории логов")
+    parser.add_argument('--repeat', type=int, default=20, help="повторов каждого запроса")
+    parser.add_argument('--skip-linear', action='store_true', help="без сравнения с полным проходом")
+    args = parser.parse_args(argv)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        lines, elapsed = timed(make_logs, tmp, args.megabytes)
+        print(f"История: {args.megabytes} МБ, {lines} строк (создана за {elapsed / 1000:.1f} с)")
+
+        index = LogIndex(tmp)
+        _, build_ms = timed(index.refresh)
+        stats = index.stats()
+        print(f"Построение индекса: {build_ms / 1000:.1f} с "
+              f"({stats['log_bytes'] / 1e6 / (build_ms / 1000):.0f} МБ/с), индекс "
+              f"{stats['index_bytes'] / 1e6:.1f} МБ ({stats['index_bytes'] / stats['log_bytes']:.0%} логов)")
+        if stats['lines'] != lines:
+            print(f"ОШИБКА: в индексе {stats['lines']} строк из {lines}", file=sys.stderr)
+            failed = True
+        index.close()
+
+        # Повторное открытие: индексы читаются через mmap, логи не читаются
+        index = LogIndex(tmp)
+        _, open_ms = timed(index.refresh)
+        print(f"Открытие готового индекса: {open_ms:.1f} мс")
+
+        queries = [
+            ("ошибка запуст", "30d"),
+            ("ошибка", None),
+            (list(StunnelManager.SERVERS)[1], "7d"),
+            ("изменение сервера", "1d"),
+            ("восстановление резерв", None),
+            ("", "2h"),
+        ]
+        since = {period: parse_period(period) if period else None for _, period in queries}
+        expected = None
+        if not args.skip_linear:
+            expected, linear_ms = timed(linear_search, tmp, [(query_terms(query), since[period])
+                                                             for query, period in queries])
+            print(f"Полный проход по всем файлам (все запросы за одно чтение): {linear_ms / 1000:.1f} с")
+        print(f"\n{'запрос':<34}{'строк':>8}{'первый, мс':>12}{'p50, мс':>10}{'макс, мс':>10}")
+        slowest = 0.0
+        for number, (query, period) in enumerate(queries):
+            result, first_ms = timed(index.search, query, since=since[period])
+            times = [timed(index.search, query, since=since[period])[1] for _ in range(args.repeat)]
+            slowest = max(slowest, statistics.median(times))
+            if expected is not None:
+                lines = expected[number]
+                if len(lines) != len(result) or [line.text for line in result] != lines:
+                    print(f"ОШИБКА: '{query}' - индекс {len(result)} строк, проход {len(lines)}",
+                          file=sys.stderr)
+                    failed = True
+            label = f"{query or '(все строки)'}" + (f" за {period}" if period else "")
+            print(f"{label:<34}{len(result):>8}{first_ms:>12.2f}{statistics.median(times):>10.2f}"
+                  f"{max(times):>10.2f}")
+        if slowest > SEARCH_BUDGET_MS:
+            print(f"ОШИБКА: p50 поиска {slowest:.1f} мс больше {SEARCH_BUDGET_MS} мс", file=sys.stderr)
+            failed = True
+
+        # Окно виртуального списка: 50 строк из произвольного места всей истории
+        everything = index.search()
+        rng = random.Random(1)
+        windows = []
+        for _ in range(200):
+            first = rng.randrange(max(1, len(everything) - WINDOW_ROWS))
+            start = time.perf_counter()
+            rows = [everything[i].text for i in range(first, first + WINDOW_ROWS)]
+            windows.append((time.perf_counter() - start) * 1000)
+        print(f"\nОкно {WINDOW_ROWS} строк из {len(everything)}: p50 "
+              f"{statistics.median(windows):.3f} мс, макс {max(windows):.3f} мс")
+
+        # Дочитывание текущего лога: читаются только дописанные байты
+        live = sorted(Path(tmp).glob("stunnel_manager_*.log"))[-1]
+        index.live = lambda: live
+        tails = []
+        for _ in range(20):
+            stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with open(live, 'a', encoding='utf-8') as f:
+                f.write("".join(f"[{stamp}] Текущий сервер: 195.209.130.9\n" for _ in range(100)))
+            added, tail_ms = timed(index.refresh)
+            tails.append(tail_ms)
+            if added != 100:
+                print(f"ОШИБКА: дочитано {added} строк из 100", file=sys.stderr)
+                failed = True
+        print(f"Дочитывание 100 новых строк: p50 {statistics.median(tails):.2f} мс, "
+              f"макс {max(tails):.2f} мс (против {build_ms:.0f} мс полного построения)")
+        index.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Проверка замера задержки: LatencyProber на локальном TLS-сервере с известной задержкой
+рукопожатия, цели в формах {имя: host} и {имя: (host, port)}
+
+Имя цели не разрешается (домен .invalid): если замер подключается к имени, а не к host,
+сервер недоступен. Задержка рукопожатия должна попасть в замер TLS.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_probe --delay 0.1 --samples 3
+"""
+import argparse
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_proxy import make_certificate
+from latency_probe import LatencyProber
+
+
+# Запас сверху на планирование потоков и само рукопожатие
+MARGIN = 0.5
+
+
+class DelayedTlsServer:
+    """TLS-сервер, который начинает рукопожатие через delay секунд после подключения"""
+
+    def __init__(self, cert, key, delay):
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.context.load_cert_chain(cert, key)
+        self.delay = delay
+        self.connections = 0
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(64)
+        self.address = self._socket.getsockname()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handshake, args=(connection,), daemon=True).start()
+
+    def _handshake(self, connection):
+        time.sleep(self.delay)
+        try:
+            with self.context.wrap_socket(connection, server_side=True) as tls:
+                while tls.recv(1024):
+                    pass
+        except (OSError, ssl.SSLError):
+            connection.close()
+
+    def close(self):
+        self._socket.close()
+
+
+def check(results, host, delay):
+    """Список найденных проблем по результатам замера"""
+    problems = []
+    for name, result in results.items():
+        if result.host != host:
+            problems.append(f"{name}: замерялся {result.host}, а не {host}")
+        if not result.reachable:
+            problems.append(f"{name}: сервер недоступен ({'; '.join(result.errors)})")
+            continue
+        if not result.tls_ok:
+            problems.append(f"{name}: рукопожатие не прошло ({'; '.join(result.errors)})")
+            continue
+        low, high = min(result.tls_samples), max(result.tls_samples)
+        if low < delay or high > delay + MARGIN:
+            problems.append(f"{name}: TLS {low * 1000:.0f}-{high * 1000:.0f} мс "
+                            f"вне {delay * 1000:.0f}-{(delay + MARGIN) * 1000:.0f} мс")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--delay', type=float, default=0.1, help="задержка рукопожатия, с")
+    parser.add_argument('--samples', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        server = DelayedTlsServer(cert, key, args.delay)
+        host, port = server.address
+        prober = LatencyProber(samples=args.samples, timeout=args.delay + 2.0, port=port)
+        targets = {
+            'delayed.invalid': host,
+            'tuple.invalid': (host, port),
+        }
+        results = prober.run(targets)
+        server.close()
+
+    print(f"Задержка рукопожатия сервера: {args.delay * 1000:.0f} мс, замеров: {args.samples}")
+    print(f"{'цель':<18}{'host':<16}{'TCP мс':>9}{'TLS мс':>9}")
+    for name, result in results.items():
+        tcp, tls = result.stats('tcp'), result.stats('tls')
+        print(f"{name:<18}{result.host:<16}"
+              f"{tcp['median'] if tcp else float('nan'):>9.1f}"
+              f"{tls['median'] if tls else float('nan'):>9.1f}")
+
+    problems = check(results, host, args.delay)
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Бенчмарк встроенного прокси: соединения/с, МБ/с и добавленная задержка (p50/p99)
+относительно прямого TLS-соединения с локальным эхо-сервером, а также время смены апстрима
+и передача половинного закрытия (клиент закрывает запись и ждет ответа)
+
+Сертификат эхо-сервера создается командой openssl во временном каталоге.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_proxy --requests 2000 --duration 3 --pool 8
+"""
+import argparse
+import asyncio
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from forward_proxy import ForwardProxy
+from latency_probe import percentile
+
+
+MESSAGE = b"x" * 64
+
+
+def make_certificate(directory):
+    """Самоподписанный сертификат для localhost: (cert, key)"""
+    cert, key = Path(directory) / "echo.crt", Path(directory) / "echo.key"
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+         '-nodes', '-subj', '/CN=localhost', '-days', '1', '-keyout', str(key), '-out', str(cert)],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+class TlsEchoServer:
+    """TLS эхо-сервер в отдельном потоке со своим циклом asyncio"""
+
+    def __init__(self, cert, key):
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.context.load_cert_chain(cert, key)
+        self.connections = 0
+        self.address = None
+        self._ready = threading.Event()
+        self._loop = None
+        self._stop = None
+        threading.Thread(target=asyncio.run, args=(self._main(),), daemon=True).start()
+        self._ready.wait()
+
+    async def _echo(self, reader, writer):
+        self.connections += 1
+        try:
+            while data := await reader.read(64 * 1024):
+                writer.write(data)
+                await writer.drain()
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._echo, '127.0.0.1', 0, ssl=self.context,
+                                            backlog=512)
+        self.address = server.sockets[0].getsockname()[:2]
+        self._ready.set()
+        await self._stop.wait()
+        server.close()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+
+def client_context():
+    """Клиентский контекст для прямых соединений (без проверки сертификата)"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+# Контекст создается один раз: загрузка системных сертификатов дороже рукопожатия
+CLIENT_CONTEXT = client_context()
+
+
+async def open_stream(address, tls):
+    """Соединение с прокси (без TLS) или напрямую с эхо-сервером (TLS)"""
+    return await asyncio.open_connection(*address, ssl=CLIENT_CONTEXT if tls else None)
+
+
+async def measure_latency(address, tls, requests):
+    """RTT запрос/ответ по одному установленному соединению, секунды"""
+    reader, writer = await open_stream(address, tls)
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        writer.write(MESSAGE)
+        await reader.readexactly(len(MESSAGE))
+        samples.append(time.perf_counter() - start)
+    writer.close()
+    return samples
+
+
+async def measure_connections(address, tls, duration, concurrency):
+    """Соединений в секунду: подключение, запрос, ответ, закрытие"""
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            reader, writer = await open_stream(address, tls)
+            writer.write(MESSAGE)
+            await reader.readexactly(len(MESSAGE))
+            writer.close()
+            done += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done / (time.perf_counter() - start)
+
+
+async def measure_throughput(address, tls, megabytes, streams):
+    """МБ/с эха: каждый поток отправляет megabytes и читает их обратно"""
+    chunk = b"y" * (64 * 1024)
+    total = megabytes * 1024 * 1024
+
+    async def stream():
+        reader, writer = await open_stream(address, tls)
+
+        async def send():
+            sent = 0
+            while sent < total:
+                writer.write(chunk)
+                await writer.drain()
+                sent += len(chunk)
+
+        async def receive():
+            received = 0
+            while received < total:
+                data = await reader.read(256 * 1024)
+                if not data:
+                    raise ConnectionError("соединение закрыто до получения всех данных")
+                received += len(data)
+
+        await asyncio.gather(send(), receive())
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(stream() for _ in range(streams)))
+    return megabytes * streams / (time.perf_counter() - start)
+
+
+async def check_drain(proxy, first, second):
+    """Открытое соединение дорабатывает на прежнем апстриме, новые идут на новый"""
+    reader, writer = await open_stream(proxy.address, False)
+    writer.write(MESSAGE)
+    await reader.readexactly(len(MESSAGE))
+    before = second.connections
+    proxy.switch(*second.address)
+    await asyncio.sleep(0.2)
+    writer.write(MESSAGE)
+    await reader.readexactly(len(MESSAGE))  # старое соединение работает
+    writer.close()
+    new_reader, new_writer = await open_stream(proxy.address, False)
+    new_writer.write(MESSAGE)
+    await new_reader.readexactly(len(MESSAGE))
+    new_writer.close()
+    proxy.switch(*first.address)
+    return second.connections > before
+
+
+class ReplyAfterEof:
+    """Сервер без TLS: читает запрос до EOF клиента, затем отвечает размером и закрывает"""
+
+    def __init__(self):
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+        self.address = self._socket.getsockname()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            with connection:
+                received = 0
+                while chunk := connection.recv(64 * 1024):
+                    received += len(chunk)
+                connection.sendall(f"received {received}".encode())
+
+    def close(self):
+        self._socket.close()
+
+
+def check_half_close():
+    """Клиент закрывает запись (shutdown SHUT_WR) - ответ апстрима все равно доходит"""
+    server = ReplyAfterEof()
+    proxy = ForwardProxy(('127.0.0.1', 0), server.address, tls=False, pool_size=0)
+    proxy.start()
+    reply = b""
+    try:
+        with socket.create_connection(proxy.address, timeout=2.0) as sock:
+            sock.sendall(MESSAGE)
+            sock.shutdown(socket.SHUT_WR)
+            while chunk := sock.recv(1024):
+                reply += chunk
+    except OSError:
+        pass
+    finally:
+        proxy.stop()
+        server.close()
+    return reply == f"received {len(MESSAGE)}".encode()
+
+
+def swap_time(proxy, first, second, count):
+    """Медиана времени switch() в микросекундах"""
+    samples = []
+    for i in range(count):
+        target = second if i % 2 == 0 else first
+        start = time.perf_counter()
+        proxy.switch(*target.address)
+        samples.append(time.perf_counter() - start)
+    if count % 2:
+        proxy.switch(*first.address)
+    return statistics.median(samples) * 1e6
+
+
+async def run_all(proxy, echo, args):
+    """Все замеры: напрямую и через прокси"""
+    direct, via = echo.address, proxy.address
+    results = {}
+    for name, address, tls in (('direct', direct, True), ('proxy', via, False)):
+        latency = await measure_latency(address, tls, args.requests)
+        results[name] = {
+            'p50_ms': statistics.median(latency) * 1000,
+            'p99_ms': percentile(latency, 99) * 1000,
+            'conn_per_s': await measure_connections(address, tls, args.duration, args.concurrency),
+            'mb_per_s': await measure_throughput(address, tls, args.megabytes, args.streams),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help="запросов для замера задержки")
+    parser.add_argument('--duration', type=float, default=3.0, help="длительность замера соединений, с")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--megabytes', type=int, default=32, help="МБ на поток для пропускной способности")
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--pool', type=int, default=8, help="размер пула прокси")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        first, second = TlsEchoServer(cert, key), TlsEchoServer(cert, key)
+        proxy = ForwardProxy(('127.0.0.1', 0), first.address, pool_size=args.pool)
+        proxy.start()
+        time.sleep(0.2)  # заполнение пула
+
+        results = asyncio.run(run_all(proxy, first, args))
+        drained = asyncio.run(check_drain(proxy, first, second))
+        half_closed = check_half_close()
+        swap_us = swap_time(proxy, first, second, 1000)
+        stats = proxy.stats()
+        proxy.stop()
+        first.close()
+        second.close()
+
+    print(f"{'':<8}{'p50 мс':>9}{'p99 мс':>9}{'соед/с':>10}{'МБ/с':>9}")
+    for name, row in results.items():
+        print(f"{name:<8}{row['p50_ms']:>9.3f}{row['p99_ms']:>9.3f}"
+              f"{row['conn_per_s']:>10.0f}{row['mb_per_s']:>9.1f}")
+    print(f"Добавленная задержка: p50 {results['proxy']['p50_ms'] - results['direct']['p50_ms']:.3f} мс, "
+          f"p99 {results['proxy']['p99_ms'] - results['direct']['p99_ms']:.3f} мс")
+    print(f"Пул: попаданий {stats['pool_hits']}, промахов {stats['pool_misses']}; "
+          f"ошибок {stats['errors']}")
+    print(f"Смена апстрима: {swap_us:.1f} мкс (медиана)")
+    if not drained:
+        print("ОШИБКА: после смены апстрима новое соединение не попало на новый сервер",
+              file=sys.stderr)
+        return 1
+    print("Открытое соединение доработало на прежнем апстриме, новое - на новом")
+    if not half_closed:
+        print("ОШИБКА: после закрытия записи клиентом ответ апстрима не дошел", file=sys.stderr)
+        return 1
+    print("Половинное закрытие: ответ апстрима дошел после EOF клиента")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
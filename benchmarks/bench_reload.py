@@ -0,0 +1,228 @@
+"""
+Бенчмарк способов смены сервера: перезагрузка конфига (SIGHUP) против остановки и запуска
+
+Служба - stunnel-подобный процесс (benchmarks/fake_stunnel.py), апстримы - loopback-заглушки,
+отвечающие своим именем. Клиенты держат постоянные соединения через туннель и непрерывно
+шлют запросы; за N переключений каждым способом считаются разорванные соединения,
+неудачные запросы и длительность смены. После каждой смены новое соединение должно
+попасть на новый апстрим. Ожидание соединений перед остановкой отключено (drain_timeout=0),
+время подсчета соединений показано отдельной колонкой. Третий прогон - служба игнорирует
+SIGHUP: проверка апстрима после перезагрузки должна это заметить и перезапустить службу.
+
+Только Linux/macOS (SIGHUP). Запуск из корня репозитория:
+    python -m benchmarks.bench_reload --cycles 10 --clients 8
+"""
+import argparse
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import SAMPLE_CONFIG, free_port
+from latency_probe import percentile
+from readiness import wait_for_port
+from service_control import ProcessServiceController
+from stunnel_manager import StunnelManager
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class NamedUpstream:
+    """Заглушка апстрима: на каждую строку отвечает '<имя> <строка>'"""
+
+    def __init__(self, name):
+        self.name = name.encode()
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(128)
+        self.address = self._socket.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        """Принимать соединения"""
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        """Отвечать на строки до закрытия соединения"""
+        with connection:
+            stream = connection.makefile('rb')
+            try:
+                for line in stream:
+                    connection.sendall(self.name + b' ' + line)
+            except OSError:
+                pass
+
+    def close(self):
+        """Перестать принимать соединения"""
+        self._socket.close()
+
+
+class Client(threading.Thread):
+    """Постоянное соединение через туннель с запросами каждые interval секунд"""
+
+    def __init__(self, address, interval):
+        super().__init__(daemon=True)
+        self.address = address
+        self.interval = interval
+        self.requests = 0
+        self.failed = 0
+        self.dropped = 0
+        self._stop = threading.Event()
+
+    def _connect(self):
+        """Подключиться (повторять, пока туннель недоступен)"""
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection(self.address, timeout=1.0)
+                return sock, sock.makefile('rb')
+            except OSError:
+                self.failed += 1
+                time.sleep(self.interval)
+        return None, None
+
+    def run(self):
+        sock, stream = self._connect()
+        while not self._stop.is_set() and sock is not None:
+            try:
+                sock.sendall(b"ping\n")
+                if not stream.readline():
+                    raise ConnectionError("соединение закрыто")
+                self.requests += 1
+            except OSError:
+                # Соединение разорвано - клиент переподключается
+                self.dropped += 1
+                self.failed += 1
+                sock.close()
+                sock, stream = self._connect()
+                continue
+            time.sleep(self.interval)
+        if sock is not None:
+            sock.close()
+
+    def stop(self):
+        self._stop.set()
+        self.join()
+
+
+def current_upstream(address):
+    """Имя апстрима, на который попадает новое соединение через туннель"""
+    with socket.create_connection(address, timeout=2.0) as sock:
+        sock.sendall(b"who\n")
+        return sock.makefile('rb').readline().split(b' ', 1)[0].decode()
+
+
+def run_strategy(strategy, cycles, clients, interval, ignore_sighup=False):
+    """cycles переключений способом strategy; вернуть сводку"""
+    servers = list(StunnelManager.SERVERS)
+    upstreams = {ip: NamedUpstream(ip) for ip in servers}
+    port = free_port()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=port), encoding='utf-8')
+        command = [sys.executable, '-m', 'benchmarks.fake_stunnel', str(config_path)]
+        for ip, upstream in upstreams.items():
+            command += ['--map', f"{ip}:{StunnelManager.SERVER_PORT}="
+                                 f"{upstream.address[0]}:{upstream.address[1]}"]
+        if ignore_sighup:
+            command.append('--ignore-sighup')
+        service = ProcessServiceController(command=command, cwd=REPO_ROOT)
+        service.start()
+        if not wait_for_port('127.0.0.1', port, timeout=10).ready:
+            raise RuntimeError("stunnel-подобный процесс не запустился")
+
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+        # Клиенты держат соединения постоянно: ожидание их завершения перед остановкой
+        # (drain_timeout) заняло бы весь срок и сделало способы несравнимыми
+        manager.settings.update(drain_timeout=0, upstream_verify_timeout=0.5)
+        # Проверка апстрима ищет соединения службы с заглушками, а не с адресами серверов
+        manager.upstream_addresses = {f"{ip}:{StunnelManager.SERVER_PORT}": upstream.address
+                                      for ip, upstream in upstreams.items()}
+
+        workers = [Client(('127.0.0.1', port), interval) for _ in range(clients)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.2)
+
+        durations = []
+        drains = []
+        strategies = []
+        stale = 0
+        for i in range(cycles):
+            target = servers[(i + 1) % len(servers)]
+            start = time.perf_counter()
+            manager.change_server(target, strategy=strategy)
+            durations.append(time.perf_counter() - start)
+            strategies.append(manager.last_switch_strategy)
+            drains.append(manager.last_switch_timings.get('drain', 0.0))
+            if current_upstream(('127.0.0.1', port)) != target:
+                stale += 1
+            time.sleep(0.1)
+
+        for worker in workers:
+            worker.stop()
+        manager.close()
+        service.stop()
+        for upstream in upstreams.values():
+            upstream.close()
+
+    return {
+        'strategy': strategy,
+        'used': sorted(set(strategies)),
+        'median_ms': statistics.median(durations) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'drain_ms': statistics.median(drains) * 1000,
+        'requests': sum(worker.requests for worker in workers),
+        'dropped': sum(worker.dropped for worker in workers),
+        'failed': sum(worker.failed for worker in workers),
+        'stale': stale,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=8, help="постоянных соединений")
+    parser.add_argument('--interval', type=float, default=0.01, help="пауза между запросами, с")
+    args = parser.parse_args(argv)
+
+    if not hasattr(signal, 'SIGHUP'):
+        print("Бенчмарк требует SIGHUP (Linux/macOS)", file=sys.stderr)
+        return 2
+
+    print(f"{'способ':<10}{'смена med':>11}{'p95':>9}{'drain':>9}{'запросов':>10}{'разрывов':>10}"
+          f"{'ошибок':>8}{'старый апстрим':>16}")
+    failed = False
+    # (строка таблицы, способ, служба игнорирует SIGHUP, ожидаемый итог смены)
+    runs = (('restart', 'restart', False, 'restart'),
+            ('reload', 'reload', False, 'reload'),
+            ('no-sighup', 'reload', True, 'restart-fallback'))
+    for label, strategy, ignore_sighup, expected in runs:
+        row = run_strategy(strategy, args.cycles, args.clients, args.interval, ignore_sighup)
+        print(f"{label:<10}{row['median_ms']:>9.1f}мс{row['p95_ms']:>7.1f}мс"
+              f"{row['drain_ms']:>7.1f}мс"
+              f"{row['requests']:>10}{row['dropped']:>10}{row['failed']:>8}{row['stale']:>16}")
+        if row['used'] != [expected]:
+            print(f"ОШИБКА: {label}: использовано {row['used']}, ожидалось {expected}",
+                  file=sys.stderr)
+            failed = True
+        if row['stale']:
+            print(f"ОШИБКА: {label}: новые соединения шли на старый апстрим", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
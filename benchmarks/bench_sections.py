@@ -0,0 +1,142 @@
+"""
+Бенчмарк пакетной смены серверов секций: K изменений в конфиге с N секциями
+
+Сравниваются K вызовов change_server(ip, section=...) (K перезапусков службы) и один
+change_servers({секция: ip, ...}) (один перезапуск). После каждого способа проверяется,
+что измененные секции указывают на новые серверы, а остальные не тронуты. Отдельно -
+стоимость правки конфига: K вызовов with_option(section=...) против одного with_options.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_sections --sections 1000 --changes 20 --stop-delay 0.05 --start-delay 0.2
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import free_port
+from service_control import FakeServiceController
+from stunnel_config import StunnelConfig, load_config
+from stunnel_manager import StunnelManager
+
+
+def make_config(sections, port, servers):
+    """Конфиг с sections секциями; порт accept первой секции - port (его слушает служба)"""
+    lines = ["; multi-service config for benchmark", "client=yes", ""]
+    for i in range(sections):
+        lines += [f"[svc{i}]", f"accept=127.0.0.1:{port if i == 0 else 20000 + i}",
+                  f"connect={servers[i % len(servers)]}:{443 if i % 2 else 8443}", ""]
+    return "\n".join(lines)
+
+
+def pick_changes(sections, count, servers, seed=1):
+    """count случайных секций с новым (отличным от текущего) сервером"""
+    rng = random.Random(seed)
+    names = rng.sample(range(sections), count)
+    return {f"svc{i}": servers[(i + 1) % len(servers)] for i in names}
+
+
+def check_config(path, text, changes):
+    """Измененные секции - на новых серверах (порт сохранен), прочие - без изменений"""
+    original = StunnelConfig(text)
+    current = load_config(path)
+    errors = []
+    for section in original.services:
+        before = section.get('connect')
+        after = current.section(section.name).get('connect')
+        if section.name in changes:
+            expected = f"{changes[section.name]}:{before.rsplit(':', 1)[1]}"
+            if after != expected:
+                errors.append(f"[{section.name}] {after}, ожидалось {expected}")
+        elif after != before:
+            errors.append(f"[{section.name}] изменена без запроса: {before} -> {after}")
+    return errors
+
+
+def run(mode, args, servers, changes):
+    """Применить changes способом mode; вернуть (секунды, остановок, запусков, ошибки)"""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        text = make_config(args.sections, port, servers)
+        config_path.write_text(text, encoding='utf-8')
+        service = FakeServiceController(stop_delay=args.stop_delay, start_delay=args.start_delay,
+                                        listen=('127.0.0.1', port))
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+
+        start = time.perf_counter()
+        if mode == 'batch':
+            manager.change_servers(changes, strategy='restart')
+        else:
+            for name, ip in changes.items():
+                manager.change_server(ip, strategy='restart', section=name)
+        elapsed = time.perf_counter() - start
+
+        errors = check_config(config_path, text, changes)
+        stops, starts = service.stop_calls, service.start_calls
+        manager.close()
+        service.stop()
+    return elapsed, stops, starts, errors
+
+
+def edit_cost(args, servers, changes, repeat=20):
+    """Медиана времени правки конфига в памяти: (K with_option, один with_options), мс"""
+    config = StunnelConfig(make_config(args.sections, 1501, servers))
+    values = {name: f"{ip}:443" for name, ip in changes.items()}
+    single, batch = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        edited = config
+        for name, value in values.items():
+            edited, _ = edited.with_option('connect', value, section=name)
+        single.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batched, _ = config.with_options('connect', values)
+        batch.append(time.perf_counter() - start)
+        if batched.render() != edited.render():
+            raise AssertionError("with_options и серия with_option дали разные конфиги")
+    return statistics.median(single) * 1000, statistics.median(batch) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sections', type=int, default=1000)
+    parser.add_argument('--changes', type=int, default=20, help="изменяемых секций (K)")
+    parser.add_argument('--stop-delay', type=float, default=0.05)
+    parser.add_argument('--start-delay', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    servers = list(StunnelManager.SERVERS)
+    changes = pick_changes(args.sections, args.changes, servers)
+    print(f"Секций: {args.sections}, изменений: {len(changes)}, "
+          f"остановка {args.stop_delay} с, запуск {args.start_delay} с")
+
+    failed = False
+    rows = {}
+    for mode in ('single', 'batch'):
+        elapsed, stops, starts, errors = run(mode, args, servers, changes)
+        rows[mode] = elapsed
+        title = "по одной" if mode == 'single' else "пакетом"
+        print(f"{title:<10} {elapsed * 1000:>9.0f} мс, остановок службы: {stops}, запусков: {starts}")
+        for error in errors[:10]:
+            print(f"ОШИБКА: {title}: {error}", file=sys.stderr)
+        failed = failed or bool(errors)
+        expected = 1 if mode == 'batch' else len(changes)
+        if stops != expected or starts != expected:
+            print(f"ОШИБКА: {title}: ожидалось перезапусков {expected}", file=sys.stderr)
+            failed = True
+    print(f"Ускорение: x{rows['single'] / rows['batch']:.1f}")
+
+    single_ms, batch_ms = edit_cost(args, servers, changes)
+    print(f"Правка конфига в памяти: {len(changes)} x with_option {single_ms:.2f} мс, "
+          f"with_options {batch_ms:.2f} мс")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
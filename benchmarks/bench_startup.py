@@ -0,0 +1,95 @@
+"""
+Бенчмарк запуска CLI: время импорта по `python -X importtime` и контроль тяжелых модулей
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup --budget-ms 50
+
+Код завершения 1, если CLI загрузил запрещенный модуль или превысил бюджет времени импорта.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Модули, которые CLI не должен загружать при старте
+FORBIDDEN = ('tkinter', '_tkinter', 'asyncio', 'ssl', 'giis_srv_selector', 'latency_probe')
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _env():
+    """Окружение дочернего процесса: с записью .pyc, чтобы не мерить компиляцию"""
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def import_profile(module):
+    """Разобрать вывод -X importtime: {модуль: (self мкс, cumulative мкс)}"""
+    # Прогревочный запуск: компиляция .pyc и дисковый кэш не должны попасть в замер
+    subprocess.run([sys.executable, '-c', f'import {module}'], cwd=ROOT, env=_env(),
+                   capture_output=True)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, env=_env()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    profile = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            profile[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return profile
+
+
+def wall_time(args, repeat):
+    """Медианное время запуска процесса с аргументами args, мс"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, env=_env(), capture_output=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='cli')
+    parser.add_argument('--budget-ms', type=float, default=50.0,
+                        help="допустимое суммарное время импорта модуля CLI")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    profile = import_profile(args.module)
+    total_ms = profile[args.module][1] / 1000
+
+    print(f"Импорт {args.module}: {total_ms:.1f} мс (бюджет {args.budget_ms:.0f} мс)")
+    print(f"Самые дорогие модули (self, мс):")
+    for name, (self_us, _) in sorted(profile.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {name:<30}{self_us / 1000:>8.2f}")
+
+    baseline = wall_time(['-c', 'pass'], args.repeat)
+    startup = wall_time(['-c', f'import {args.module}'], args.repeat)
+    print(f"Запуск интерпретатора: {baseline:.1f} мс, с импортом {args.module}: {startup:.1f} мс")
+
+    failed = False
+    loaded = [name for name in FORBIDDEN if name in profile]
+    if loaded:
+        print(f"ОШИБКА: при старте загружены модули: {', '.join(loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"ОШИБКА: время импорта превышает бюджет")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Бенчмарк смены сервера: N циклов change_server на фейковой службе с замером фаз
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_switch --cycles 50 --stop-delay 0.05 --start-delay 0.2
+    python -m benchmarks.bench_switch --strategy reload --reload-delay 0.05
+"""
+import argparse
+import json
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from latency_probe import percentile
+from service_control import FakeServiceController
+from stunnel_config import invalidate, load_config
+from stunnel_manager import StunnelManager
+
+
+PHASES = ('stop', 'backup', 'rewrite', 'start', 'ready')
+RELOAD_PHASES = ('backup', 'rewrite', 'reload', 'verify')
+
+SAMPLE_CONFIG = """; stunnel config for benchmark
+[giis]
+client=yes
+accept=127.0.0.1:{port}
+connect={ip}:443
+"""
+
+
+def free_port():
+    """Свободный TCP порт на loopback"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def hold_connection(connection):
+    """Держать принятое соединение, пока другая сторона его не закроет"""
+    with connection:
+        try:
+            while connection.recv(1024):
+                pass
+        except OSError:
+            pass
+
+
+def follow_config(config_path, addresses):
+    """Функция: адрес из addresses для текущего connect= туннельной секции конфига"""
+    def upstream():
+        invalidate(config_path)
+        for section in load_config(config_path).services:
+            if section.get('accept') and section.get('connect'):
+                return addresses.get(section.get('connect'))
+        return None
+    return upstream
+
+
+class StandInUpstreams:
+    """Слушатели на loopback вместо серверов - чтобы проверка апстрима после reload работала
+
+    addresses - {значение connect=: (host, port)} для manager.upstream_addresses,
+    follow(config_path) - upstream для FakeServiceController (connect= туннельной секции).
+    """
+
+    def __init__(self, servers, port=443):
+        self._sockets = []
+        self.addresses = {}
+        for ip in servers:
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(64)
+            self._sockets.append(sock)
+            self.addresses[f"{ip}:{port}"] = sock.getsockname()
+            threading.Thread(target=self._accept, args=(sock,), daemon=True).start()
+
+    def _accept(self, sock):
+        while True:
+            try:
+                connection, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=hold_connection, args=(connection,), daemon=True).start()
+
+    def follow(self, config_path):
+        """upstream для FakeServiceController: слушатель для connect= из config_path"""
+        return follow_config(config_path, self.addresses)
+
+    def close(self):
+        for sock in self._sockets:
+            sock.close()
+
+
+def run(cycles, stop_delay, start_delay, ready_delay=0.0, strategy='restart', reload_delay=0.0):
+    """Выполнить cycles переключений, вернуть {фаза: [секунды]}"""
+    servers = list(StunnelManager.SERVERS)
+    phases = RELOAD_PHASES if strategy == 'reload' else PHASES
+    timings = {phase: [] for phase in phases + ('total',)}
+    port = free_port()
+
+    upstreams = StandInUpstreams(servers)
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=port), encoding='utf-8')
+        # Фейковая служба слушает порт accept и соединяется с "сервером", как настоящий stunnel
+        service = FakeServiceController(stop_delay=stop_delay, start_delay=start_delay,
+                                        listen=('127.0.0.1', port), ready_delay=ready_delay,
+                                        reload_delay=reload_delay,
+                                        upstream=upstreams.follow(str(config_path)))
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+        manager.upstream_addresses = upstreams.addresses
+        # Фейковая служба перечитывает конфиг синхронно - пауза не нужна
+        manager.settings['reload_settle'] = 0
+
+        for i in range(cycles):
+            target = servers[(i + 1) % len(servers)]
+            start = time.perf_counter()
+            manager.change_server(target, strategy=strategy)
+            timings['total'].append(time.perf_counter() - start)
+            if manager.last_switch_strategy != strategy:
+                raise RuntimeError(f"цикл {i}: {manager.last_switch_strategy} вместо {strategy}")
+            for phase in phases:
+                timings[phase].append(manager.last_switch_timings[phase])
+        manager.close()
+        service.stop()
+    upstreams.close()
+
+    return timings
+
+
+def summarize(timings):
+    """Сводка по фазам в миллисекундах"""
+    return {
+        phase: {
+            'mean': statistics.fmean(samples) * 1000,
+            'median': statistics.median(samples) * 1000,
+            'p95': percentile(samples, 95) * 1000,
+            'max': max(samples) * 1000,
+        }
+        for phase, samples in timings.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--stop-delay', type=float, default=0.0)
+    parser.add_argument('--start-delay', type=float, default=0.0)
+    parser.add_argument('--ready-delay', type=float, default=0.0,
+                        help="задержка между запуском службы и открытием порта accept")
+    parser.add_argument('--reload-delay', type=float, default=0.0)
+    parser.add_argument('--strategy', choices=StunnelManager.SWITCH_STRATEGIES, default='restart')
+    parser.add_argument('--json', metavar='FILE', help="сохранить сводку в JSON")
+    args = parser.parse_args(argv)
+
+    summary = summarize(run(args.cycles, args.stop_delay, args.start_delay, args.ready_delay,
+                            args.strategy, args.reload_delay))
+
+    print(f"{'фаза':<10}{'mean':>10}{'median':>10}{'p95':>10}{'max':>10}  (мс)")
+    for phase, row in summary.items():
+        values = ''.join(f"{row[k]:>10.2f}" for k in ('mean', 'median', 'p95', 'max'))
+        print(f"{phase:<10}{values}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            'cycles': args.cycles,
+            'stop_delay': args.stop_delay,
+            'start_delay': args.start_delay,
+            'ready_delay': args.ready_delay,
+            'reload_delay': args.reload_delay,
+            'strategy': args.strategy,
+            'phases_ms': summary,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
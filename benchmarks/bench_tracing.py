@@ -0,0 +1,170 @@
+"""
+Проверка трассировки смены сервера: спаны фаз через хуки, JSONL и снимок метрик Prometheus
+
+Выполняется N переключений на фейковой службе и одно неудачное (служба не запускается).
+Спаны собираются хуком tracer.add_hook и проверяются: у каждой смены есть корневой спан
+switch с фазами stop, backup, rewrite, start, ready, у stop/start - код возврата, у
+неудачной смены - outcome=error. Затем проверяются JSONL-журнал и файл .prom, а также
+общее состояние метрик двух трассировщиков одного каталога (как у GUI и CLI).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_tracing --cycles 20
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import PHASES, SAMPLE_CONFIG, free_port
+from service_control import FakeServiceController
+from stunnel_manager import StunnelManager
+from tracing import Tracer
+
+
+def check_trace(spans, expect_error=False):
+    """Проверить спаны одной смены; вернуть список ошибок"""
+    errors = []
+    roots = [span for span in spans if span.parent_id is None]
+    if len(roots) != 1 or roots[0].name != 'switch':
+        return [f"ожидался один корневой спан switch, получено: {roots}"]
+    root = roots[0]
+    children = {span.name: span for span in spans if span.parent_id == root.span_id}
+
+    if expect_error:
+        if root.status != 'error' or root.attributes.get('outcome', root.status) != 'error':
+            errors.append(f"неудачная смена не помечена ошибкой: {root}")
+        start = children.get('start')
+        if start is None or start.attributes.get('ok') is not False:
+            errors.append("у фазы start нет признака ошибки запуска")
+        return errors
+
+    if root.status != 'ok':
+        errors.append(f"смена завершилась с ошибкой: {root.attributes.get('error')}")
+    for phase in PHASES:
+        if phase not in children:
+            errors.append(f"нет спана фазы {phase}")
+    for phase in ('stop', 'start'):
+        attributes = children.get(phase).attributes if phase in children else {}
+        if 'returncode' not in attributes:
+            errors.append(f"у фазы {phase} нет кода возврата")
+    if 'previous' not in root.attributes or 'target' not in root.attributes:
+        errors.append("у корневого спана нет previous/target")
+    return errors
+
+
+def run(cycles):
+    """Переключения с хуком; вернуть (ошибки, спаны, путь к JSONL, текст .prom)"""
+    servers = list(StunnelManager.SERVERS)
+    port = free_port()
+    spans = []
+    errors = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "stunnel.conf"
+        config_path.write_text(SAMPLE_CONFIG.format(ip=servers[0], port=port), encoding='utf-8')
+        service = FakeServiceController(listen=('127.0.0.1', port))
+        manager = StunnelManager(service=service, app_dir=Path(tmp) / "app", console=None)
+        manager.config_file_path = str(config_path)
+        manager.tracer.add_hook(spans.append)
+
+        for i in range(cycles):
+            spans.clear()
+            manager.change_server(servers[(i + 1) % len(servers)], strategy='restart')
+            errors += [f"смена {i + 1}: {e}" for e in check_trace(spans)]
+
+        spans.clear()
+        service.fail_start = True
+        try:
+            manager.change_server(servers[(cycles + 1) % len(servers)], strategy='restart')
+        except Exception:
+            pass
+        else:
+            errors.append("смена с незапускающейся службой не завершилась ошибкой")
+        service.fail_start = False
+        errors += [f"неудачная смена: {e}" for e in check_trace(spans, expect_error=True)]
+
+        manager.close()
+        service.stop()
+
+        trace_files = sorted(Path(manager.config_dir).glob("switch_trace_*.jsonl"))
+        records = []
+        for path in trace_files:
+            with open(path, 'r', encoding='utf-8') as f:
+                records += [json.loads(line) for line in f if line.strip()]
+        roots = [record for record in records if record['parent_id'] is None]
+        if len(roots) != cycles + 1:
+            errors.append(f"в JSONL {len(roots)} корневых спанов вместо {cycles + 1}")
+
+        metrics = manager.tracer.metrics_path.read_text(encoding='utf-8')
+        expected = [
+            f'giis_switch_operations_total{{operation="switch",outcome="ok"}} {cycles}',
+            'giis_switch_operations_total{operation="switch",outcome="error"} 1',
+            'giis_switch_phase_seconds_count{phase="ready"}',
+        ]
+        for line in expected:
+            if line not in metrics:
+                errors.append(f"в снимке метрик нет строки: {line}")
+
+    return errors, len(records), metrics
+
+
+def check_shared_state(rounds=5):
+    """Два трассировщика на одном каталоге (GUI и CLI): счетчики не затирают друг друга"""
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics_path = Path(tmp) / "metrics.prom"
+        tracers = [Tracer(tmp, metrics_path=metrics_path) for _ in range(2)]
+        for _ in range(rounds):
+            for tracer in tracers:
+                with tracer.span('switch', outcome='ok'):
+                    with tracer.span('stop'):
+                        pass
+        metrics = metrics_path.read_text(encoding='utf-8')
+        for tracer in tracers:
+            tracer.close()
+    expected = [
+        f'giis_switch_operations_total{{operation="switch",outcome="ok"}} {rounds * 2}',
+        f'giis_switch_phase_seconds_count{{phase="stop"}} {rounds * 2}',
+    ]
+    return [f"общее состояние метрик: нет строки {line}" for line in expected
+            if line not in metrics]
+
+
+def span_overhead(samples):
+    """Стоимость пустого спана без записи на диск, микросекунды"""
+    tracer = Tracer()
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        with tracer.span('switch'):
+            with tracer.span('stop'):
+                pass
+        durations.append((time.perf_counter() - start) / 2)
+    return statistics.median(durations) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--show-metrics', action='store_true', help="вывести снимок .prom")
+    args = parser.parse_args(argv)
+
+    errors, records, metrics = run(args.cycles)
+    errors += check_shared_state()
+    print(f"Смен: {args.cycles} + 1 неудачная, записей JSONL: {records}")
+    print(f"Накладные расходы спана: {span_overhead(10000):.1f} мкс")
+    if args.show_metrics:
+        print(metrics)
+
+    if errors:
+        for error in errors:
+            print(f"ОШИБКА: {error}", file=sys.stderr)
+        return 1
+    print("Трассировка в порядке")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Бенчмарк наблюдения за конфигом: серии быстрых перезаписей должны давать по одному обновлению
+
+Каждая серия - burst атомарных перезаписей файла подряд; обновления "UI" (вызовы on_change)
+собираются в очередь, как root.after в GUI. Проверяется, что на серию приходится не больше
+одного обновления и что последнее обновление видит итоговое содержимое файла.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_watcher --bursts 5 --burst-size 50 --backend poll
+"""
+import argparse
+import queue
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from config_watcher import ConfigWatcher
+from stunnel_config import atomic_write, load_config
+
+
+def run(bursts, burst_size, backend, debounce, poll_interval):
+    """Вернуть (сырые события, обновления на серию, задержки от последней записи до обновления)"""
+    updates = queue.SimpleQueue()
+    per_burst = []
+    latencies = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "stunnel.conf"
+        atomic_write(path, "[giis]\nconnect=10.0.0.0:443\n")
+
+        def on_change(changed_path):
+            # Чтение файла - в потоке наблюдателя, в "UI" уходит уже готовое значение
+            updates.put((time.perf_counter(), load_config(changed_path).first('connect')))
+
+        watcher = ConfigWatcher(path, on_change, debounce=debounce,
+                                poll_interval=poll_interval, backend=backend)
+        watcher.start()
+        updates.get(timeout=5)  # начальное состояние
+
+        for burst in range(bursts):
+            for i in range(burst_size):
+                atomic_write(path, f"[giis]\nconnect=10.0.{burst}.{i}:443\n")
+            last_write = time.perf_counter()
+            expected = f"10.0.{burst}.{burst_size - 1}:443"
+
+            received = []
+            deadline = time.monotonic() + debounce + poll_interval + 2
+            while time.monotonic() < deadline:
+                try:
+                    received.append(updates.get(timeout=0.05))
+                except queue.Empty:
+                    if received and received[-1][1] == expected:
+                        break
+            if not received or received[-1][1] != expected:
+                raise RuntimeError(f"Серия {burst}: итоговое состояние не получено")
+            per_burst.append(len(received))
+            latencies.append(received[-1][0] - last_write)
+
+        source = watcher.source_name
+        watcher.stop()
+    return source, watcher.raw_events, per_burst, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--burst-size', type=int, default=50, help="перезаписей в серии")
+    parser.add_argument('--backend', choices=ConfigWatcher.BACKENDS,
+                        help="механизм уведомлений (по умолчанию - по платформе)")
+    parser.add_argument('--debounce', type=float, default=0.2)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    source, raw_events, per_burst, latencies = run(
+        args.bursts, args.burst_size, args.backend, args.debounce, args.poll_interval)
+
+    print(f"Механизм: {source}, перезаписей: {args.bursts * args.burst_size}, "
+          f"сырых событий: {raw_events}")
+    print(f"Обновлений UI по сериям: {per_burst}")
+    print(f"От последней записи до обновления: median {statistics.median(latencies) * 1000:.0f} мс, "
+          f"max {max(latencies) * 1000:.0f} мс")
+
+    if max(per_burst) > 1:
+        print("ОШИБКА: серия перезаписей дала больше одного обновления", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+stunnel-подобный процесс для бенчмарков на Linux: слушает accept= из конфига и пересылает
+соединения на connect=. По SIGHUP перечитывает конфиг, как stunnel: новые соединения идут
+на новый connect=, открытые сохраняются. SIGKILL (stop службы) разрывает все соединения.
+С --ignore-sighup сигнал игнорируется - как служба, не перечитавшая конфиг.
+
+Запуск из корня репозитория:
+    python -m benchmarks.fake_stunnel stunnel.conf --map 195.209.130.9:443=127.0.0.1:5001
+"""
+import argparse
+import signal
+import socket
+import sys
+import threading
+
+from readiness import parse_endpoint
+from stunnel_config import invalidate, load_config
+
+
+class FakeStunnel:
+    """Пересылка accept -> connect с перечитыванием конфига по SIGHUP"""
+
+    def __init__(self, config_path, mapping, ignore_sighup=False):
+        self.config_path = config_path
+        self.mapping = mapping
+        self.ignore_sighup = ignore_sighup
+        self.upstream = None
+        self.reloads = 0
+        self._reload_requested = False
+
+    def load(self):
+        """Прочитать accept и connect первой секции с обоими параметрами"""
+        invalidate(self.config_path)
+        config = load_config(self.config_path)
+        for section in config.services:
+            accept, connect = section.get('accept'), section.get('connect')
+            if accept and connect:
+                # Адреса серверов из конфига подменяются на локальные заглушки
+                self.upstream = self.mapping.get(connect, parse_endpoint(connect))
+                return parse_endpoint(accept)
+        raise SystemExit(f"В {self.config_path} нет секции с accept= и connect=")
+
+    def _on_sighup(self, signum, frame):
+        """Обработчик SIGHUP: конфиг перечитывается в основном цикле"""
+        self._reload_requested = True
+
+    def serve(self):
+        """Основной цикл: прием соединений и перечитывание конфига"""
+        accept = self.load()
+        signal.signal(signal.SIGHUP, signal.SIG_IGN if self.ignore_sighup else self._on_sighup)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(accept)
+        listener.listen(128)
+        listener.settimeout(0.05)
+        while True:
+            if self._reload_requested:
+                self._reload_requested = False
+                self.load()
+                self.reloads += 1
+            try:
+                client, _ = listener.accept()
+            except TimeoutError:
+                continue
+            except InterruptedError:
+                continue
+            threading.Thread(target=self._relay, args=(client, self.upstream),
+                             daemon=True).start()
+
+    def _relay(self, client, upstream):
+        """Соединиться с апстримом и пересылать данные в обе стороны"""
+        try:
+            server = socket.create_connection(upstream, timeout=2.0)
+        except OSError:
+            client.close()
+            return
+        server.settimeout(None)
+        threading.Thread(target=_pump, args=(server, client), daemon=True).start()
+        _pump(client, server)
+
+
+def _pump(source, target):
+    """Копировать данные source -> target до закрытия"""
+    try:
+        while True:
+            data = source.recv(64 * 1024)
+            if not data:
+                break
+            target.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for sock in (source, target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+def parse_mapping(items):
+    """--map 'ip:port=host:port' -> {'ip:port': (host, port)}"""
+    mapping = {}
+    for item in items:
+        source, target = item.split('=', 1)
+        mapping[source] = parse_endpoint(target)
+    return mapping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config')
+    parser.add_argument('--map', action='append', default=[], metavar='CONNECT=HOST:PORT',
+                        help="подмена адреса connect= на локальный")
+    parser.add_argument('--ignore-sighup', action='store_true',
+                        help="не перечитывать конфиг по SIGHUP")
+    args = parser.parse_args(argv)
+
+    FakeStunnel(args.config, parse_mapping(args.map), args.ignore_sighup).serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
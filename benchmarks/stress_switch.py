@@ -0,0 +1,350 @@
+"""
+Стресс-тест очереди смены сервера: P процессов по T потоков шлют запросы на случайные серверы
+
+Все процессы работают с одним AppData и одним конфигом на фейковой службе. Корневые спаны
+switch собираются хуком трассировщика и проверяются: смены разных процессов не пересекаются
+во времени, запросов больше, чем реальных смен (объединение), итоговый сервер - последний
+запрошенный, журнал не остался в состоянии 'in_progress'. Затем проверяется восстановление:
+дочерний процесс завершается посреди смены (служба остановлена, конфиг испорчен), новый
+менеджер должен запустить службу и восстановить конфиг из резервной копии (если копия
+прерванной смены повреждена - из истории), а очистка истории не должна удалять копию,
+на которую ссылается прерванная смена. Смена, упавшая
+после записи конфига (служба не запустилась, туннель не готов), должна вернуть запросу ошибку
+и восстановить прежний конфиг; если копию восстановить не удалось - все равно ошибку, хотя
+текущий сервер в конфиге уже совпадает с целью.
+
+Запуск из корня репозитория:
+    python -m benchmarks.stress_switch --processes 4 --threads 8 --requests 20
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.bench_switch import free_port
+from backup_store import BackupStore
+from service_control import FakeServiceController, ServiceResult
+from stunnel_manager import StunnelManager
+from switch_coordinator import SwitchCoordinator
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Без accept= проверка готовности пропускается: фейковые службы процессов не делят порт
+STRESS_CONFIG = """; stunnel config for stress test
+[giis]
+client=yes
+connect={ip}:443
+"""
+
+
+def create_manager(workdir, service):
+    """Менеджер с общими для всех процессов AppData и конфигом"""
+    manager = StunnelManager(service=service, app_dir=Path(workdir) / "app", console=None)
+    manager.config_file_path = str(Path(workdir) / "stunnel.conf")
+    return manager
+
+
+def run_worker(args):
+    """Дочерний процесс: threads потоков по requests запросов; отчет - в файл"""
+    service = FakeServiceController(stop_delay=args.stop_delay, start_delay=args.start_delay)
+    manager = create_manager(args.workdir, service)
+    coordinator = SwitchCoordinator(manager, coalesce_window=args.window)
+    servers = list(StunnelManager.SERVERS)
+    spans = []
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def on_span(span):
+        if span.name == 'switch':
+            with lock:
+                spans.append([span.start, span.start + span.duration,
+                              span.attributes.get('outcome', span.status),
+                              span.attributes.get('target')])
+
+    def requester(seed):
+        rng = random.Random(seed)
+        for _ in range(args.requests):
+            time.sleep(rng.uniform(0, args.pause))
+            try:
+                result = coordinator.request(rng.choice(servers), strategy='restart',
+                                             timeout=60)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                results.append(result.superseded)
+
+    manager.tracer.add_hook(on_span)
+    threads = [threading.Thread(target=requester, args=(os.getpid() * 1000 + i,))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    coordinator.close()
+    manager.close()
+
+    report = {
+        'pid': os.getpid(),
+        'requests': coordinator.requests,
+        'switches': coordinator.switches,
+        'superseded': sum(results),
+        'errors': errors,
+        'spans': spans,
+        'stop_calls': service.stop_calls,
+    }
+    path = Path(args.workdir) / f"worker_{os.getpid()}.json"
+    path.write_text(json.dumps(report), encoding='utf-8')
+    return 0
+
+
+class CrashingService(FakeServiceController):
+    """Служба, при запуске которой процесс аварийно завершается (после остановки)"""
+
+    def __init__(self, corrupt_config=None):
+        super().__init__()
+        self.corrupt_config = corrupt_config
+
+    def start(self):
+        if self.corrupt_config:
+            # Конфиг, испорченный вне программы до сбоя: без строки connect=
+            Path(self.corrupt_config).write_text("; damaged\n", encoding='utf-8')
+        os._exit(3)
+        return ServiceResult(False, 1)
+
+
+def run_crash_child(args):
+    """Дочерний процесс: смена сервера, прерванная на запуске службы"""
+    manager = create_manager(args.workdir, None)
+    corrupt = manager.config_file_path if args.corrupt else None
+    manager.service = CrashingService(corrupt)
+    target = [ip for ip in StunnelManager.SERVERS if ip != manager.get_current_server()][0]
+    manager.change_server(target, strategy='restart')
+    return 1  # сюда процесс дойти не должен
+
+
+def spawn(workdir, *options):
+    """Запустить этот модуль в дочернем процессе"""
+    command = [sys.executable, '-m', 'benchmarks.stress_switch', '--workdir', str(workdir)]
+    return subprocess.Popen(command + [str(option) for option in options], cwd=REPO_ROOT)
+
+
+def check_overlaps(spans):
+    """Пары пересекающихся во времени смен (допуск - 1 мс)"""
+    ordered = sorted(spans)
+    return [(a, b) for a, b in zip(ordered, ordered[1:]) if b[0] < a[1] - 0.001]
+
+
+def run_stress(args, workdir):
+    """Стресс-тест; вернуть список ошибок"""
+    servers = list(StunnelManager.SERVERS)
+    Path(workdir).mkdir()
+    config = Path(workdir) / "stunnel.conf"
+    config.write_text(STRESS_CONFIG.format(ip=servers[0]), encoding='utf-8')
+
+    start = time.perf_counter()
+    processes = [spawn(workdir, '--worker', '--threads', args.threads, '--requests', args.requests,
+                       '--stop-delay', args.stop_delay, '--start-delay', args.start_delay,
+                       '--window', args.window, '--pause', args.pause)
+                 for _ in range(args.processes)]
+    codes = [process.wait() for process in processes]
+    elapsed = time.perf_counter() - start
+
+    problems = [f"процесс завершился с кодом {code}" for code in codes if code]
+    reports = [json.loads(path.read_text(encoding='utf-8'))
+               for path in Path(workdir).glob("worker_*.json")]
+    spans = [span for report in reports for span in report['spans']]
+    real = [span for span in spans if span[2] != 'noop']
+    requests = sum(report['requests'] for report in reports)
+    superseded = sum(report['superseded'] for report in reports)
+    stops = sum(report['stop_calls'] for report in reports)
+
+    for report in reports:
+        problems += [f"PID {report['pid']}: {error}" for error in report['errors']]
+    for a, b in check_overlaps(spans):
+        problems.append(f"смены пересекаются: {a} и {b}")
+    if len(real) != stops:
+        problems.append(f"остановок службы {stops}, а смен {len(real)}")
+
+    manager = create_manager(workdir, FakeServiceController())
+    final = manager.get_current_server()
+    last_request = json.loads((manager.config_dir / "switch_request.json").read_text(encoding='utf-8'))
+    journal = manager.journal.read()
+    if final != last_request['target']:
+        problems.append(f"итоговый сервер {final}, последний запрос - {last_request['target']}")
+    if journal.get('state') == 'in_progress':
+        problems.append("журнал остался в состоянии in_progress")
+    if journal.get('applied_seq') != last_request['seq']:
+        problems.append("последний запрос не отмечен примененным")
+    manager.close()
+
+    print(f"Процессов: {args.processes}, потоков: {args.threads}, запросов: {requests} "
+          f"за {elapsed:.2f} с")
+    print(f"Смен сервера: {len(real)} (без изменений: {len(spans) - len(real)}), "
+          f"объединение: {requests / max(len(real), 1):.1f} запросов на смену, "
+          f"заменено более новыми: {superseded}")
+    print(f"Итоговый сервер: {final}, журнал: {journal.get('state')}")
+    return problems
+
+
+def run_crash(workdir, corrupt, broken_backup=False):
+    """Сбой посреди смены и восстановление новым процессом; вернуть список ошибок
+
+    broken_backup - копия прерванной смены повреждена: конфиг восстанавливается из истории.
+    """
+    servers = list(StunnelManager.SERVERS)
+    Path(workdir).mkdir()
+    Path(workdir, "stunnel.conf").write_text(STRESS_CONFIG.format(ip=servers[0]), encoding='utf-8')
+    if broken_backup:
+        # Удачная смена до сбоя - в истории есть версия, к которой можно вернуться
+        manager = create_manager(workdir, FakeServiceController())
+        manager.change_server(servers[1], strategy='restart')
+        manager.close()
+    options = ['--crash-child'] + (['--corrupt'] if corrupt else [])
+    code = spawn(workdir, *options).wait()
+    problems = [] if code == 3 else [f"дочерний процесс завершился с кодом {code}, ожидался 3"]
+
+    # Служба осталась остановленной
+    service = FakeServiceController(running=False)
+    manager = create_manager(workdir, service)
+    if broken_backup:
+        digest = manager.journal.interrupted()['backup']
+        manager.backup_store.blob_path(digest).write_bytes(b"broken")
+    # ОС освобождает блокировку умершего процесса
+    if not manager.process_lock.acquire(timeout=2):
+        manager.close()
+        return problems + ["блокировка не освобождена после сбоя процесса"]
+    manager.process_lock.release()
+
+    if manager.interrupted_switch() is None:
+        problems.append("прерванная смена не обнаружена")
+    entry = manager.recover_interrupted_switch()
+    if entry is None:
+        problems.append("recover_interrupted_switch не вернул запись")
+    if not service.running:
+        problems.append("служба не запущена после восстановления")
+    if manager.journal.read().get('state') != 'recovered':
+        problems.append(f"состояние журнала: {manager.journal.read().get('state')}")
+    current = manager.get_current_server()
+    if current not in servers:
+        problems.append(f"конфиг не восстановлен: сервер {current}")
+    if manager.recover_interrupted_switch() is not None:
+        problems.append("повторное восстановление не должно ничего делать")
+    manager.close()
+
+    print(f"Сбой {'с порчей конфига' if corrupt else 'после остановки службы'}"
+          f"{' и копии' if broken_backup else ''}: восстановлено, сервер {current}")
+    return problems
+
+
+def run_pinned_backup(workdir):
+    """Очистка истории не удаляет блоб копии, на которую ссылается прерванная смена"""
+    manager = create_manager(workdir, FakeServiceController())
+    store = BackupStore(manager.backup_store.directory, max_entries=2,
+                        pinned=manager._pinned_backups)
+    pinned, _ = store.save(b"[giis]\nconnect=195.209.130.9:443\n")
+    # Процесс упал посреди смены: журнал ссылается на копию, индекс ее больше не удержит
+    manager.journal.begin('switch', '195.209.130.45', '195.209.130.9')
+    manager.journal.record(backup=pinned.hash)
+    for n in range(3):
+        store.save(f"[giis]\nconnect=10.0.0.{n + 1}:443\n")
+    kept = store.blob_path(pinned.hash).exists()
+    manager.journal.finish('error')
+    manager.close()
+    print(f"Очистка истории при прерванной смене: копия смены {'сохранена' if kept else 'удалена'}")
+    return [] if kept else ["очистка истории удалила копию прерванной смены"]
+
+
+def run_failure(workdir):
+    """Смена падает после записи конфига: запрос - ошибка, конфиг восстановлен из копии"""
+    servers = list(StunnelManager.SERVERS)
+    problems = []
+    accept_port = free_port()
+    ready_config = STRESS_CONFIG.replace("client=yes\n",
+                                         f"client=yes\naccept=127.0.0.1:{accept_port}\n")
+    # (сценарий, конфиг, служба, служба не запускается, восстановление копии ломается)
+    cases = (
+        ("служба не запускается", STRESS_CONFIG, FakeServiceController(), True, False),
+        # Порт accept откроется только через 5 с - туннель не готов за ready_timeout
+        ("туннель не готов", ready_config,
+         FakeServiceController(listen=('127.0.0.1', accept_port), ready_delay=5.0), False, False),
+        ("копия не восстанавливается", STRESS_CONFIG, FakeServiceController(), True, True),
+    )
+    for number, (name, config, service, fail_start, broken_restore) in enumerate(cases):
+        directory = Path(workdir) / str(number)
+        directory.mkdir(parents=True)
+        Path(directory, "stunnel.conf").write_text(config.format(ip=servers[0]), encoding='utf-8')
+        service.fail_start = fail_start
+        manager = create_manager(directory, service)
+        manager.settings.update(ready_timeout=0.3)
+        if broken_restore:
+            def restore(entry, target):
+                raise OSError("копия недоступна")
+            manager.backup_store.restore = restore
+        coordinator = SwitchCoordinator(manager, coalesce_window=0.01)
+        try:
+            result = coordinator.request(servers[1], strategy='restart', timeout=30)
+            problems.append(f"{name}: смена вернула {result!r}")
+        except Exception as e:
+            print(f"Ошибка после записи конфига ({name}): запрос завершился исключением ({e})")
+        finally:
+            current = manager.get_current_server()
+            coordinator.close()
+            manager.close()
+        # Без копии конфиг остается переписанным, но запрос все равно получает ошибку
+        expected = servers[1] if broken_restore else servers[0]
+        if current != expected:
+            problems.append(f"{name}: сервер в конфиге {current}, ожидался {expected}")
+        if name == "туннель не готов" and (not service.running or service.stop_calls != 2):
+            problems.append(f"{name}: служба не перезапущена с прежним конфигом "
+                            f"(остановок {service.stop_calls}, запущена {service.running})")
+        service.stop()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help="потоков в каждом процессе")
+    parser.add_argument('--requests', type=int, default=20, help="запросов на поток")
+    parser.add_argument('--stop-delay', type=float, default=0.02)
+    parser.add_argument('--start-delay', type=float, default=0.05)
+    parser.add_argument('--window', type=float, default=0.05, help="окно объединения, с")
+    parser.add_argument('--pause', type=float, default=0.02, help="макс. пауза между запросами, с")
+    # Служебные режимы дочерних процессов
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--crash-child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--corrupt', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(args)
+    if args.crash_child:
+        return run_crash_child(args)
+
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        problems += run_stress(args, Path(tmp) / "stress")
+        for corrupt in (False, True):
+            problems += run_crash(Path(tmp) / f"crash_{int(corrupt)}", corrupt)
+        problems += run_crash(Path(tmp) / "crash_backup", True, broken_backup=True)
+        problems += run_pinned_backup(Path(tmp) / "pinned")
+        problems += run_failure(Path(tmp) / "failure")
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,736 @@
+"""
+GIIS Server Selector - консольный интерфейс (без tkinter)
+
+Примеры:
+    python main.py status
+    python main.py list --json
+    python main.py switch 195.209.130.45
+    python main.py --drain-timeout 30 switch 195.209.130.45 --strategy restart
+    python main.py sections
+    python main.py apply giis=195.209.130.45 reports=195.209.130.19
+    python main.py probe --samples 5
+    python main.py latency
+    python main.py monitor --interval 30 --failures 3
+    python main.py history
+    python main.py rollback 1
+    python main.py proxy --replace-service
+    python main.py fleet inventory.json 195.209.130.45 --canary 1 --workers 8
+    python main.py loadtest --connections 1000 --duration 30 --compare
+    python main.py logs ошибка запуск --since 30d
+    python main.py gui
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from stunnel_manager import StunnelManager, is_admin
+
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_NO_CONFIG = 3
+EXIT_NOT_ADMIN = 4
+EXIT_UNREACHABLE = 5
+
+
+class CliError(Exception):
+    """Ошибка команды с кодом завершения"""
+
+    def __init__(self, message, exit_code=EXIT_ERROR):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def _emit(args, data, text_lines):
+    """Вывести результат в JSON или текстом"""
+    if args.json:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+    else:
+        for line in text_lines:
+            print(line)
+
+
+def _report_error(args, error):
+    """Вывести ошибку в JSON (stdout) или текстом (stderr)"""
+    if args.json:
+        print(json.dumps({'ok': False, 'error': str(error)}, ensure_ascii=False))
+    else:
+        print(f"Ошибка: {error}", file=sys.stderr)
+
+
+def _create_manager(args):
+    """StunnelManager с учетом переопределений из командной строки"""
+    service = None
+    if args.service_backend:
+        from service_control import create_service_controller
+        service = create_service_controller(args.service_backend, StunnelManager.SERVICE_NAME)
+
+    # Лог в консоль только с -v и только в stderr, чтобы не портить вывод команды
+    manager = StunnelManager(service=service, console=sys.stderr if args.verbose else None)
+    if args.config:
+        manager.config_file_path = args.config
+    if args.drain_timeout is not None:
+        # Только для этого запуска - в settings.json не сохраняется
+        manager.settings['drain_timeout'] = args.drain_timeout
+    return manager
+
+
+def _require_config(manager):
+    """Проверить, что конфиг указан и существует"""
+    if not manager.config_file_path or not os.path.exists(manager.config_file_path):
+        raise CliError("Файл конфигурации не указан или не существует", EXIT_NO_CONFIG)
+
+
+def _recover_interrupted(manager):
+    """Довести до конца смену, прерванную сбоем предыдущего запуска"""
+    entry = manager.recover_interrupted_switch()
+    if entry is not None:
+        # В stderr, чтобы не портить JSON-вывод команды
+        print(f"Восстановлена прерванная операция: {entry.get('operation')} -> "
+              f"{entry.get('target') or '?'} (PID {entry.get('pid')}, {entry.get('started')})",
+              file=sys.stderr)
+    return entry
+
+
+def _drain_report(manager, data, lines):
+    """Добавить к выводу итог ожидания соединений перед остановкой службы"""
+    drain = manager.last_drain
+    data['drain'] = drain.to_dict() if drain is not None else None
+    if drain is not None and drain.initial:
+        lines.append(f"Соединения: {drain.summary()}")
+
+
+def cmd_status(args, manager):
+    """Текущий сервер и настройки"""
+    _require_config(manager)
+    current_ip = manager.get_current_server()
+    data = {
+        'ok': True,
+        'config_path': manager.config_file_path,
+        'current_server': current_ip,
+        'description': manager.catalog.label(current_ip, None) if current_ip else None,
+        'service_backend': manager.service.name,
+        'log_file': str(manager.log_file),
+        'interrupted_switch': manager.interrupted_switch(),
+    }
+    lines = [
+        f"Конфиг:  {data['config_path']}",
+        f"Сервер:  {current_ip or 'не определен'}"
+        + (f" ({data['description']})" if data['description'] else ""),
+        f"Служба:  {manager.SERVICE_NAME} ({data['service_backend']})",
+    ]
+    interrupted = data['interrupted_switch']
+    if interrupted:
+        lines.append(f"Прервана: {interrupted.get('operation')} -> {interrupted.get('target') or '?'} "
+                     f"({interrupted.get('started')}); будет восстановлена при следующей смене")
+    _emit(args, data, lines)
+    return EXIT_OK
+
+
+def cmd_list(args, manager):
+    """Список серверов каталога (--filter - только подходящие под запрос)"""
+    current_ip = manager.get_current_server()
+    catalog = manager.catalog
+    entries = catalog.search(args.filter) if args.filter else list(catalog)
+    servers = [
+        dict(entry.to_dict(), description=entry.label, current=entry.ip == current_ip)
+        for entry in entries
+    ]
+    lines = [
+        f"{'*' if s['current'] else ' '} {s['ip']:<16} {s['description']}"
+        + (f" [{', '.join(s['tags'])}]" if s['tags'] else "")
+        + (f" (порт {s['port']})" if s['port'] != manager.SERVER_PORT else "")
+        for s in servers
+    ] or [f"Нет серверов по запросу: {args.filter}"]
+    _emit(args, {'ok': True, 'total': len(catalog), 'servers': servers}, lines)
+    return EXIT_OK
+
+
+def cmd_switch(args, manager):
+    """Сменить сервер"""
+    _require_config(manager)
+    if args.ip not in manager.catalog and not args.force:
+        raise CliError(f"Сервер {args.ip} нет в каталоге (используйте --force)", EXIT_USAGE)
+    if sys.platform == 'win32' and manager.service.name != 'fake' and not is_admin():
+        raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+
+    if args.section:
+        args.changes = [f"{args.section}={args.ip}"]
+        return cmd_apply(args, manager)
+
+    from switch_coordinator import SwitchCoordinator
+
+    _recover_interrupted(manager)
+    previous_ip = manager.get_current_server()
+    # Запрос идет через общую очередь: если одновременно сервер меняет другой процесс,
+    # применяется последний запрос, а не оба по очереди
+    coordinator = SwitchCoordinator(manager, coalesce_window=0)
+    try:
+        result = coordinator.request(args.ip, strategy=args.strategy)
+    except Exception as e:
+        raise CliError(f"Не удалось изменить сервер: {e}")
+    finally:
+        coordinator.close()
+
+    timings = {phase: round(seconds * 1000, 2)
+               for phase, seconds in manager.last_switch_timings.items()}
+    data = {
+        'ok': True,
+        'previous_server': previous_ip,
+        'current_server': result.applied,
+        'changed': previous_ip != result.applied,
+        'superseded': result.superseded,
+        'strategy': manager.last_switch_strategy,
+        'timings_ms': timings,
+        'ready_ms': (round(manager.last_ready_time * 1000, 2)
+                     if manager.last_ready_time is not None else None),
+    }
+    if result.superseded:
+        lines = [f"Запрос {args.ip} заменен более новым, сервер: {result.applied}"]
+    elif not data['changed']:
+        lines = [f"Сервер {args.ip} уже установлен"]
+    else:
+        lines = [
+            f"Сервер изменен: {previous_ip or 'не определен'} -> {args.ip} "
+            f"({manager.last_switch_strategy})",
+            "Фазы: " + ", ".join(f"{phase} {ms} мс" for phase, ms in timings.items()),
+        ]
+    _drain_report(manager, data, lines)
+    _emit(args, data, lines)
+    return EXIT_OK
+
+
+def cmd_sections(args, manager):
+    """Секции конфига с адресами accept и connect"""
+    _require_config(manager)
+    sections = [section.to_dict() for section in manager.list_sections()]
+    catalog = manager.catalog
+    lines = [f"[{s['name']}] {s['accept'] or '-'} -> {s['connect'] or '-'}"
+             + (f" ({catalog.label(s['server'])})" if s['server'] in catalog else "")
+             for s in sections] or ["В конфиге нет секций"]
+    _emit(args, {'ok': True, 'sections': sections}, lines)
+    return EXIT_OK
+
+
+def _parse_changes(items):
+    """['секция=IP', ...] -> {секция: IP}"""
+    changes = {}
+    for item in items:
+        name, separator, target = item.rpartition('=')
+        if not separator or not name.strip() or not target.strip():
+            raise CliError(f"Ожидается СЕКЦИЯ=IP, получено: {item}", EXIT_USAGE)
+        changes[name.strip()] = target.strip()
+    return changes
+
+
+def cmd_apply(args, manager):
+    """Сменить серверы нескольких секций одной операцией (одна перезагрузка службы)"""
+    _require_config(manager)
+    changes = _parse_changes(args.changes)
+    for target in changes.values():
+        if target.split(':')[0] not in manager.catalog and not args.force:
+            raise CliError(f"Сервер {target} нет в каталоге (используйте --force)", EXIT_USAGE)
+    if sys.platform == 'win32' and manager.service.name != 'fake' and not is_admin():
+        raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+
+    _recover_interrupted(manager)
+    known = {section.name for section in manager.list_sections()}
+    for name in changes:
+        if name not in known:
+            raise CliError(f"Секция [{name}] не найдена в конфиге", EXIT_USAGE)
+    try:
+        applied = manager.change_servers(changes, strategy=args.strategy)
+    except Exception as e:
+        raise CliError(f"Не удалось изменить серверы: {e}")
+
+    timings = {phase: round(seconds * 1000, 2)
+               for phase, seconds in manager.last_switch_timings.items()}
+    data = {
+        'ok': True,
+        'changed': applied,
+        'unchanged': sorted(set(changes) - set(applied)),
+        'strategy': manager.last_switch_strategy if applied else None,
+        'timings_ms': timings if applied else {},
+    }
+    if not applied:
+        lines = ["Серверы секций уже установлены"]
+    else:
+        lines = [f"[{name}] -> {value}" for name, value in applied.items()]
+        lines.append(f"Изменено секций: {len(applied)} ({manager.last_switch_strategy}), "
+                     "фазы: " + ", ".join(f"{phase} {ms} мс" for phase, ms in timings.items()))
+    _drain_report(manager, data, lines)
+    _emit(args, data, lines)
+    return EXIT_OK
+
+
+def cmd_probe(args, manager):
+    """Замер задержки до серверов"""
+    from latency_probe import fastest
+
+    results = manager.probe_servers(samples=args.samples, timeout=args.timeout)
+    best_ip = fastest(results)
+    data = {
+        'ok': best_ip is not None,
+        'fastest': best_ip,
+        'results': [result.to_dict() for result in results.values()],
+    }
+    lines = [f"{ip:<16} {result.summary()}" for ip, result in results.items()]
+    lines.append(f"Самый быстрый: {best_ip or 'нет доступных серверов'}")
+    _emit(args, data, lines)
+    return EXIT_OK if best_ip else EXIT_UNREACHABLE
+
+
+def cmd_latency(args, manager):
+    """Сводка истории задержки за час и сутки (без замера)"""
+    summaries = manager.latency_summaries()
+    servers = [
+        dict(ip=ip, **{window: summary.to_dict() for window, summary in windows.items()})
+        for ip, windows in summaries.items()
+    ]
+    lines = [f"{ip:<16} {windows['hour'].text():<28} {windows['day'].text()}"
+             for ip, windows in summaries.items()] or ["История задержки пуста (нет замеров)"]
+    _emit(args, {'ok': True, 'servers': servers}, lines)
+    return EXIT_OK
+
+
+def cmd_history(args, manager):
+    """История резервных копий конфига"""
+    entries = manager.backup_history()
+    versions = [dict(entry.to_dict(), version=number)
+                for number, entry in enumerate(entries, start=1)]
+    lines = [f"{v['version']:>3}  {v['timestamp']}  {v['hash'][:12]}  {v['upstream'] or '-'}"
+             for v in versions] or ["История резервных копий пуста"]
+    _emit(args, {'ok': True, 'versions': versions}, lines)
+    return EXIT_OK
+
+
+def cmd_rollback(args, manager):
+    """Откатить конфиг к версии из истории"""
+    _require_config(manager)
+    if sys.platform == 'win32' and manager.service.name != 'fake' and not is_admin():
+        raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+    try:
+        manager.backup_store.get(args.version, source=manager.config_file_path)
+    except KeyError as e:
+        raise CliError(e.args[0], EXIT_USAGE)
+
+    _recover_interrupted(manager)
+    try:
+        entry = manager.rollback(args.version)
+    except Exception as e:
+        raise CliError(f"Не удалось откатить конфиг: {e}")
+
+    current_ip = manager.get_current_server()
+    data = {
+        'ok': True,
+        'version': args.version,
+        'hash': entry.hash,
+        'timestamp': entry.timestamp,
+        'current_server': current_ip,
+        'timings_ms': {phase: round(seconds * 1000, 2)
+                       for phase, seconds in manager.last_switch_timings.items()},
+    }
+    lines = [
+        f"Конфиг откачен к версии {args.version} ({entry.timestamp}, {entry.hash[:12]})",
+        f"Сервер: {current_ip or 'не определен'}",
+    ]
+    _drain_report(manager, data, lines)
+    _emit(args, data, lines)
+    return EXIT_OK
+
+
+def _print_event(args, event):
+    """Вывести событие монитора строкой JSON или текстом"""
+    if args.json:
+        print(json.dumps(event, ensure_ascii=False, default=str), flush=True)
+    else:
+        details = ", ".join(f"{key}={value}" for key, value in event.items() if key != 'event')
+        print(f"{time.strftime('%H:%M:%S')} {event['event']}: {details}", flush=True)
+
+
+def cmd_monitor(args, manager):
+    """Мониторинг текущего сервера с автоматическим переключением (до Ctrl+C)"""
+    from health_monitor import HealthMonitor
+
+    _require_config(manager)
+    if sys.platform == 'win32' and manager.service.name != 'fake' and not is_admin():
+        raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+
+    options = dict(manager.settings.get('monitor', {}))
+    overrides = {
+        'interval': args.interval,
+        'failure_threshold': args.failures,
+        'recovery_threshold': args.recovery,
+        'latency_budget_ms': args.budget_ms,
+        'cooldown': args.cooldown,
+        'max_failovers_per_hour': args.max_per_hour,
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    if args.tls:
+        options['tls'] = True
+    _recover_interrupted(manager)
+    monitor = HealthMonitor(manager, on_event=lambda event: _print_event(args, event), **options)
+
+    if args.once:
+        event = monitor.check_once()
+        return EXIT_OK if event['event'] in ('healthy', 'switched') else EXIT_UNREACHABLE
+
+    monitor.start()
+    try:
+        while monitor.running:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.stop()
+    return EXIT_OK
+
+
+def cmd_proxy(args, manager):
+    """Встроенный прокси вместо stunnel: порт accept -> сервер из connect= по TLS (до Ctrl+C)"""
+    from config_watcher import ConfigWatcher
+    from forward_proxy import ForwardProxy, ssl_context_for_section
+    from readiness import parse_endpoint
+
+    _require_config(manager)
+    section = manager.get_tunnel_section()
+    if section is None:
+        raise CliError("В конфиге нет секции с accept= и connect=", EXIT_NO_CONFIG)
+    listen = parse_endpoint(args.listen or section.get('accept'))
+    config_upstream = parse_endpoint(section.get('connect'))
+    upstream = (args.upstream, config_upstream[1]) if args.upstream else config_upstream
+    try:
+        ssl_context = ssl_context_for_section(section)
+    except (OSError, ValueError) as e:
+        raise CliError(f"Не удалось подготовить TLS по параметрам конфига: {e}")
+
+    if args.replace_service and not manager.stop_service():
+        raise CliError("Не удалось остановить службу stunnel")
+    proxy = ForwardProxy(listen, upstream, ssl_context=ssl_context, pool_size=args.pool,
+                         log=manager.log)
+    try:
+        proxy.start()
+    except OSError as e:
+        if args.replace_service:
+            manager.start_service()
+        raise CliError(f"Не удалось открыть порт {listen[0]}:{listen[1]}: {e} "
+                       f"(порт занят службой stunnel? см. --replace-service)")
+    _print_event(args, {'event': 'started', 'listen': f"{listen[0]}:{listen[1]}",
+                        'upstream': f"{upstream[0]}:{upstream[1]}", 'pool': args.pool})
+
+    def on_config_change(path):
+        # Сервер меняется правкой connect= в конфиге (GUI, switch, текстовый редактор)
+        nonlocal config_upstream
+        section = manager.get_tunnel_section()
+        if section is None:
+            return
+        endpoint = parse_endpoint(section.get('connect'))
+        if endpoint == config_upstream:
+            return
+        config_upstream = endpoint
+        started = time.perf_counter()
+        proxy.switch(*endpoint)
+        _print_event(args, {'event': 'switched', 'upstream': f"{endpoint[0]}:{endpoint[1]}",
+                            'swap_us': round((time.perf_counter() - started) * 1e6, 1)})
+
+    watcher = ConfigWatcher(manager.config_file_path, on_config_change, log=manager.log)
+    watcher.start()
+    try:
+        while proxy.running:
+            time.sleep(args.stats_interval)
+            _print_event(args, dict(event='stats', **proxy.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        proxy.stop()
+        if args.replace_service:
+            manager.start_service()
+    return EXIT_OK
+
+
+def cmd_fleet(args, manager):
+    """Смена сервера на всех конфигах инвентаря (пул потоков, канарейки, откат по порогу)"""
+    from fleet import FleetRunner, load_inventory
+
+    if args.ip not in manager.catalog and not args.force:
+        raise CliError(f"Сервер {args.ip} нет в каталоге (используйте --force)", EXIT_USAGE)
+    try:
+        targets = load_inventory(args.inventory)
+    except (OSError, ValueError) as e:
+        raise CliError(f"Не удалось прочитать инвентарь {args.inventory}: {e}", EXIT_USAGE)
+    if not targets:
+        raise CliError(f"В инвентаре {args.inventory} нет целей", EXIT_USAGE)
+    if not 0 <= args.max_failure_rate <= 1:
+        raise CliError("--max-failure-rate - доля от 0 до 1", EXIT_USAGE)
+    backends = {args.service_backend} if args.service_backend else {t.backend for t in targets}
+    if sys.platform == 'win32' and backends != {'fake'} and not is_admin():
+        raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+
+    def on_result(result):
+        # Ход раскатки - в stderr, чтобы не портить JSON и итоговую таблицу
+        if not args.json:
+            print(f"  {result.name}: {result.outcome}"
+                  + (f" ({result.error})" if result.error else ""), file=sys.stderr)
+
+    runner = FleetRunner(
+        targets, state_dir=args.state_dir or manager.config_dir / "fleet",
+        workers=args.workers, timeout=args.timeout, canary=args.canary,
+        max_failure_rate=args.max_failure_rate, strategy=args.strategy,
+        backend=args.service_backend, on_result=on_result, log=manager.log,
+    )
+    report = runner.run(args.ip)
+    _emit(args, report.to_dict(), report.table())
+    return EXIT_OK if report.ok else EXIT_ERROR
+
+
+def cmd_loadtest(args, manager):
+    """Нагрузка через порт accept туннеля: текущий сервер или сравнение серверов каталога"""
+    from load_test import LoadGenerator, accept_ssl_context, compare_servers, comparison_table
+    from readiness import parse_endpoint
+
+    if args.connections < 1 or args.duration <= 0:
+        raise CliError("--connections и --duration должны быть больше нуля", EXIT_USAGE)
+    options = dict(connections=args.connections, duration=args.duration, mode=args.mode,
+                   path=args.path, payload=args.payload, timeout=args.timeout,
+                   ramp_up=args.ramp_up)
+
+    def on_result(result):
+        # Ход сравнения - в stderr, чтобы не портить JSON и итоговую таблицу
+        if not args.json:
+            print(f"  {result.server}: {result.summary()}", file=sys.stderr)
+
+    if args.compare or args.servers:
+        _require_config(manager)
+        servers = args.servers or manager.catalog.ips()
+        unknown = [ip for ip in servers if ip not in manager.catalog]
+        if unknown and not args.force:
+            raise CliError(f"Серверов нет в каталоге: {', '.join(unknown)} (используйте --force)",
+                           EXIT_USAGE)
+        if sys.platform == 'win32' and manager.service.name != 'fake' and not is_admin():
+            raise CliError("Требуются права администратора", EXIT_NOT_ADMIN)
+        _recover_interrupted(manager)
+        try:
+            results = compare_servers(manager, servers, strategy=args.strategy,
+                                      on_result=on_result, **options)
+        except ValueError as e:
+            raise CliError(str(e), EXIT_NO_CONFIG)
+    else:
+        if args.target:
+            host, port = parse_endpoint(args.target)
+            client = True
+            server = f"{host}:{port}"
+        else:
+            _require_config(manager)
+            endpoint = manager.get_accept_endpoint()
+            if endpoint is None:
+                raise CliError("В конфиге нет секции с accept= и connect=", EXIT_NO_CONFIG)
+            host, port, client = endpoint
+            server = manager.get_current_server()
+        if not client:
+            options['ssl_context'] = accept_ssl_context()
+        results = [LoadGenerator(host, port, **options).run(server=server)]
+
+    data = {
+        'ok': all(result.requests and result.error_rate <= args.max_error_rate
+                  for result in results),
+        'results': [result.to_dict() for result in results],
+    }
+    _emit(args, data, comparison_table(results))
+    return EXIT_OK if data['ok'] else EXIT_ERROR
+
+
+def cmd_logs(args, manager):
+    """Поиск по истории логов через индекс (AppData\\log_index)"""
+    from log_index import parse_period
+
+    try:
+        since = parse_period(args.since) if args.since else None
+        until = parse_period(args.until) if args.until else None
+    except ValueError as e:
+        raise CliError(str(e), EXIT_USAGE)
+    index = manager.log_index
+    # Первый запуск индексирует всю историю, следующие - только новые файлы и строки
+    start = time.perf_counter()
+    index.refresh()
+    index_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    selection = index.search(" ".join(args.query), since=since, until=until,
+                             paths=[manager.log_file] if args.current else None)
+    search_ms = (time.perf_counter() - start) * 1000
+    shown = [selection[i] for i in range(max(0, len(selection) - args.limit), len(selection))]
+
+    data = {
+        'ok': True,
+        'total': len(selection),
+        'index_ms': round(index_ms, 1),
+        'search_ms': round(search_ms, 2),
+        'lines': [line.to_dict() for line in shown],
+    }
+    lines = [line.text for line in shown]
+    lines.append(f"Найдено строк: {len(selection)}" +
+                 (f" (показаны последние {len(shown)})" if len(shown) < len(selection) else "") +
+                 f", поиск {search_ms:.1f} мс")
+    _emit(args, data, lines)
+    return EXIT_OK
+
+
+def cmd_gui(args):
+    """Запустить графический интерфейс (tkinter загружается только здесь)"""
+    import giis_srv_selector
+
+    giis_srv_selector.main()
+    return EXIT_OK
+
+
+def build_parser():
+    """Парсер аргументов командной строки"""
+    parser = argparse.ArgumentParser(
+        prog="giis-srv-selector",
+        description="Управление сервером stunnel для ГИИС"
+    )
+    parser.add_argument('--json', action='store_true', help="вывод в формате JSON")
+    parser.add_argument('-v', '--verbose', action='store_true', help="дублировать лог в stderr")
+    parser.add_argument('--config', help="путь к stunnel.conf (вместо сохраненного)")
+    parser.add_argument('--service-backend', choices=['subprocess', 'win32', 'fake'],
+                        help="реализация управления службой")
+    parser.add_argument('--drain-timeout', type=float, metavar='S',
+                        help="ждать завершения соединений перед остановкой службы, с "
+                             "(0 - только подсчет)")
+    sub = parser.add_subparsers(dest='command')
+
+    sub.add_parser('status', help="текущий сервер").set_defaults(func=cmd_status)
+    server_list = sub.add_parser('list', help="список серверов каталога")
+    server_list.add_argument('--filter', metavar='ЗАПРОС',
+                             help="начало IP, слова подписи или тега (несколько слов - все сразу)")
+    server_list.set_defaults(func=cmd_list)
+
+    switch = sub.add_parser('switch', help="сменить сервер")
+    switch.add_argument('ip')
+    switch.add_argument('--force', action='store_true', help="разрешить IP не из каталога")
+    switch.add_argument('--strategy', choices=StunnelManager.SWITCH_STRATEGIES,
+                        help="reload - перечитать конфиг без разрыва соединений (при неудаче - "
+                             "перезапуск), restart - остановка и запуск службы")
+    switch.add_argument('--section', help="изменить только секцию [SECTION]")
+    switch.set_defaults(func=cmd_switch)
+
+    sub.add_parser('sections', help="секции конфига (accept -> connect)").set_defaults(func=cmd_sections)
+
+    apply = sub.add_parser('apply', help="сменить серверы нескольких секций одной операцией")
+    apply.add_argument('changes', nargs='+', metavar='СЕКЦИЯ=IP',
+                       help="IP или IP:порт (без порта сохраняется текущий)")
+    apply.add_argument('--force', action='store_true', help="разрешить IP не из каталога")
+    apply.add_argument('--strategy', choices=StunnelManager.SWITCH_STRATEGIES)
+    apply.set_defaults(func=cmd_apply)
+
+    probe = sub.add_parser('probe', help="замер задержки до серверов")
+    probe.add_argument('--samples', type=int, default=3)
+    probe.add_argument('--timeout', type=float, default=2.0)
+    probe.set_defaults(func=cmd_probe)
+
+    sub.add_parser('latency', help="история задержки до серверов: p50/p95 и доступность "
+                                   "за час и сутки").set_defaults(func=cmd_latency)
+
+    monitor = sub.add_parser('monitor', help="мониторинг сервера с автопереключением")
+    monitor.add_argument('--interval', type=float, help="период проверки, с")
+    monitor.add_argument('--failures', type=int, help="неудачных проверок подряд до переключения")
+    monitor.add_argument('--recovery', type=int,
+                         help="успешных проверок подряд, чтобы сервер считался исправным")
+    monitor.add_argument('--budget-ms', type=float, help="допустимая задержка, мс")
+    monitor.add_argument('--cooldown', type=float, help="пауза после переключения, с")
+    monitor.add_argument('--max-per-hour', type=int, help="максимум переключений в час")
+    monitor.add_argument('--tls', action='store_true', help="проверять TLS handshake")
+    monitor.add_argument('--once', action='store_true', help="одна проверка и выход")
+    monitor.set_defaults(func=cmd_monitor)
+
+    proxy = sub.add_parser('proxy', help="встроенный прокси вместо stunnel (до Ctrl+C)")
+    proxy.add_argument('--listen', help="адрес прослушивания (по умолчанию - accept из конфига)")
+    proxy.add_argument('--upstream', help="сервер (по умолчанию - connect из конфига)")
+    proxy.add_argument('--pool', type=int, default=4, help="готовых соединений с сервером")
+    proxy.add_argument('--stats-interval', type=float, default=10.0, help="период вывода счетчиков, с")
+    proxy.add_argument('--replace-service', action='store_true',
+                       help="остановить службу stunnel на время работы прокси")
+    proxy.set_defaults(func=cmd_proxy)
+
+    sub.add_parser('history', help="история резервных копий конфига").set_defaults(func=cmd_history)
+
+    rollback = sub.add_parser('rollback', help="откатить конфиг к версии из истории")
+    rollback.add_argument('version', type=int, help="номер версии (1 - последняя)")
+    rollback.set_defaults(func=cmd_rollback)
+
+    fleet = sub.add_parser('fleet', help="сменить сервер на всех конфигах инвентаря")
+    fleet.add_argument('inventory', help="файл инвентаря (.json/.toml) или каталог с *.conf")
+    fleet.add_argument('ip')
+    fleet.add_argument('--workers', type=int, default=4, help="целей одновременно")
+    fleet.add_argument('--timeout', type=float, default=60.0, help="таймаут одной цели, с")
+    fleet.add_argument('--canary', type=int, default=0,
+                       help="первые N целей по очереди до остальных; неудача - остановка")
+    fleet.add_argument('--max-failure-rate', type=float, default=0.25,
+                       help="доля неудач, после которой раскатка останавливается и откатывается")
+    fleet.add_argument('--strategy', choices=StunnelManager.SWITCH_STRATEGIES)
+    fleet.add_argument('--force', action='store_true', help="разрешить IP не из каталога")
+    fleet.add_argument('--state-dir', help="каталог истории и логов целей (по умолчанию AppData\\fleet)")
+    fleet.set_defaults(func=cmd_fleet)
+
+    loadtest = sub.add_parser('loadtest', help="нагрузочный тест через порт accept туннеля")
+    loadtest.add_argument('--connections', type=int, default=100, help="одновременных соединений")
+    loadtest.add_argument('--duration', type=float, default=10.0, help="длительность на сервер, с")
+    loadtest.add_argument('--mode', choices=['http', 'echo'], default='http',
+                          help="http - GET с keep-alive, echo - блок байт туда и обратно")
+    loadtest.add_argument('--path', default='/', help="путь запроса HTTP")
+    loadtest.add_argument('--payload', type=int, default=64, help="размер блока в режиме echo, байт")
+    loadtest.add_argument('--timeout', type=float, default=5.0, help="таймаут запроса, с")
+    loadtest.add_argument('--ramp-up', type=float, default=1.0,
+                          help="за сколько секунд открыть все соединения")
+    loadtest.add_argument('--target', metavar='HOST:PORT',
+                          help="адрес нагрузки вместо accept из конфига")
+    loadtest.add_argument('--compare', action='store_true',
+                          help="по очереди переключить все серверы каталога и сравнить")
+    loadtest.add_argument('--servers', nargs='+', metavar='IP', help="сравнить только эти серверы")
+    loadtest.add_argument('--strategy', choices=StunnelManager.SWITCH_STRATEGIES)
+    loadtest.add_argument('--force', action='store_true', help="разрешить IP не из каталога")
+    loadtest.add_argument('--max-error-rate', type=float, default=0.01,
+                          help="доля ошибок, при которой тест считается неудачным")
+    loadtest.set_defaults(func=cmd_loadtest)
+
+    logs = sub.add_parser('logs', help="поиск по истории логов")
+    logs.add_argument('query', nargs='*', metavar='СЛОВО',
+                      help="начала слов или IP (все сразу); без слов - все строки периода")
+    logs.add_argument('--since', metavar='ВРЕМЯ', help="начало периода: 30d, 12h, 2024-05-01")
+    logs.add_argument('--until', metavar='ВРЕМЯ', help="конец периода")
+    logs.add_argument('--limit', type=int, default=100, help="сколько последних строк вывести")
+    logs.add_argument('--current', action='store_true', help="только лог текущего запуска")
+    logs.set_defaults(func=cmd_logs)
+
+    sub.add_parser('gui', help="графический интерфейс").set_defaults(func=None)
+    return parser
+
+
+def main(argv=None):
+    """Точка входа CLI; без команды запускается GUI"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command in (None, 'gui'):
+        return cmd_gui(args)
+
+    manager = None
+    try:
+        manager = _create_manager(args)
+        return args.func(args, manager)
+    except CliError as e:
+        _report_error(args, e)
+        return e.exit_code
+    except Exception as e:
+        _report_error(args, e)
+        return EXIT_ERROR
+    finally:
+        if manager is not None:
+            manager.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
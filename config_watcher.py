@@ -0,0 +1,290 @@
+"""
+Отслеживание изменений файла конфигурации: inotify (Linux), уведомления каталога (Windows)
+или опрос stat, с подавлением серий событий (debounce)
+"""
+import os
+import sys
+import threading
+import time
+
+
+def file_key(path):
+    """Состояние файла для сравнения: (mtime_ns, размер, inode) или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class _PollSource:
+    """Опрос stat с периодом poll_interval"""
+
+    name = "poll"
+
+    def __init__(self, path, poll_interval):
+        self._path = path
+        self._poll_interval = poll_interval
+        self._key = file_key(path)
+        self._wake = threading.Event()
+
+    def wait(self, timeout):
+        """Дождаться изменения; вернуть True, если файл изменился"""
+        self._wake.wait(min(timeout, self._poll_interval))
+        key = file_key(self._path)
+        changed = key != self._key
+        self._key = key
+        return changed
+
+    def wake(self):
+        """Прервать ожидание"""
+        self._wake.set()
+
+    def close(self):
+        """Освободить ресурсы (у опроса их нет)"""
+
+
+class _InotifySource:
+    """inotify через ctypes: следим за каталогом, т.к. атомарная запись заменяет файл"""
+
+    name = "inotify"
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = 16  # struct inotify_event: int wd; uint32 mask, cookie, len
+
+    def __init__(self, path):
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify недоступен")
+        self._name = os.path.basename(path).encode()
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM
+                | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, f"inotify_add_watch: {directory}")
+        # Канал для пробуждения select() при остановке
+        self._wake_r, self._wake_w = os.pipe()
+
+    def wait(self, timeout):
+        """Дождаться событий каталога; вернуть True, если среди них есть наш файл"""
+        import select
+
+        readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+        if self._wake_r in readable:
+            os.read(self._wake_r, 64)
+        if self._fd not in readable:
+            return False
+
+        matched = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                length = int.from_bytes(data[offset + 12:offset + 16], sys.byteorder)
+                name = data[offset + self.EVENT_HEADER:offset + self.EVENT_HEADER + length]
+                if name.rstrip(b'\0') == self._name:
+                    matched = True
+                offset += self.EVENT_HEADER + length
+        return matched
+
+    def wake(self):
+        """Прервать ожидание"""
+        os.write(self._wake_w, b'\0')
+
+    def close(self):
+        """Закрыть дескрипторы inotify и канала"""
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+
+class _Win32Source:
+    """FindFirstChangeNotification на каталог конфига (события каталога, без имени файла)"""
+
+    name = "win32"
+
+    FILE_NOTIFY_CHANGE_FILE_NAME = 0x001
+    FILE_NOTIFY_CHANGE_SIZE = 0x008
+    FILE_NOTIFY_CHANGE_LAST_WRITE = 0x010
+    WAIT_OBJECT_0 = 0
+    INVALID_HANDLE_VALUE = -1
+
+    def __init__(self, path):
+        import ctypes
+        from ctypes import wintypes
+
+        k32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        k32.FindFirstChangeNotificationW.argtypes = [wintypes.LPCWSTR, wintypes.BOOL,
+                                                     wintypes.DWORD]
+        k32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        k32.FindNextChangeNotification.argtypes = [wintypes.HANDLE]
+        k32.FindNextChangeNotification.restype = wintypes.BOOL
+        k32.FindCloseChangeNotification.argtypes = [wintypes.HANDLE]
+        k32.FindCloseChangeNotification.restype = wintypes.BOOL
+        k32.CreateEventW.argtypes = [ctypes.c_void_p, wintypes.BOOL, wintypes.BOOL,
+                                     wintypes.LPCWSTR]
+        k32.CreateEventW.restype = wintypes.HANDLE
+        k32.SetEvent.argtypes = [wintypes.HANDLE]
+        k32.SetEvent.restype = wintypes.BOOL
+        k32.CloseHandle.argtypes = [wintypes.HANDLE]
+        k32.CloseHandle.restype = wintypes.BOOL
+        k32.WaitForMultipleObjects.argtypes = [wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE),
+                                               wintypes.BOOL, wintypes.DWORD]
+        k32.WaitForMultipleObjects.restype = wintypes.DWORD
+        self._k32 = k32
+
+        directory = os.path.dirname(os.path.abspath(path))
+        mask = (self.FILE_NOTIFY_CHANGE_FILE_NAME | self.FILE_NOTIFY_CHANGE_SIZE
+                | self.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        handle = k32.FindFirstChangeNotificationW(directory, False, mask)
+        if handle is None or handle == ctypes.c_void_p(self.INVALID_HANDLE_VALUE).value:
+            raise ctypes.WinError(ctypes.get_last_error())
+        self._change = handle
+        self._wake_event = k32.CreateEventW(None, False, False, None)
+        self._handles = (wintypes.HANDLE * 2)(self._change, self._wake_event)
+
+    def wait(self, timeout):
+        """Дождаться изменения в каталоге (проверка самого файла - по stat в ConfigWatcher)"""
+        result = self._k32.WaitForMultipleObjects(2, self._handles, False, int(timeout * 1000))
+        if result == self.WAIT_OBJECT_0:
+            self._k32.FindNextChangeNotification(self._change)
+            return True
+        return False
+
+    def wake(self):
+        """Прервать ожидание"""
+        self._k32.SetEvent(self._wake_event)
+
+    def close(self):
+        """Закрыть дескрипторы уведомлений"""
+        self._k32.FindCloseChangeNotification(self._change)
+        self._k32.CloseHandle(self._wake_event)
+
+
+class ConfigWatcher:
+    """Фоновое отслеживание файла конфига
+
+    on_change(path) вызывается из потока наблюдателя после того, как события по файлу
+    прекратились на debounce секунд и его состояние (mtime, размер, inode) действительно
+    изменилось. При запуске on_change вызывается один раз для начального состояния.
+    """
+
+    BACKENDS = ('inotify', 'win32', 'poll')
+
+    def __init__(self, path, on_change, debounce=0.2, poll_interval=0.5, backend=None, log=None):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.backend = backend
+        self.log = log
+        # Счетчики для диагностики: сырые события и вызовы on_change
+        self.raw_events = 0
+        self.changes = 0
+        self._source = None
+        self._initial_key = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _log(self, message):
+        """Записать сообщение в лог, если он задан"""
+        if self.log:
+            self.log(message)
+
+    def _open_source(self):
+        """Выбрать механизм уведомлений; при ошибке - опрос stat"""
+        backend = self.backend
+        if backend is None:
+            backend = ('win32' if sys.platform == 'win32'
+                       else 'inotify' if sys.platform.startswith('linux') else 'poll')
+        if backend != 'poll':
+            try:
+                source_class = _InotifySource if backend == 'inotify' else _Win32Source
+                return source_class(self.path)
+            except (OSError, AttributeError) as e:
+                self._log(f"Уведомления об изменениях ({backend}) недоступны: {e}, "
+                          f"используется опрос файла")
+        return _PollSource(self.path, self.poll_interval)
+
+    def _notify(self):
+        """Вызвать on_change, не останавливая наблюдение при ошибке обработчика"""
+        self.changes += 1
+        try:
+            self.on_change(self.path)
+        except Exception as e:
+            self._log(f"Ошибка обработки изменения конфига: {e}")
+
+    def _run(self):
+        """Цикл наблюдения: события -> пауза debounce -> сравнение stat -> on_change"""
+        source = self._source
+        last_key = self._initial_key
+        self._notify()
+        last_event = None
+        try:
+            while not self._stop.is_set():
+                if last_event is None:
+                    timeout = self.poll_interval
+                else:
+                    timeout = max(last_event + self.debounce - time.monotonic(), 0)
+                if source.wait(timeout):
+                    self.raw_events += 1
+                    last_event = time.monotonic()
+                    continue
+                if last_event is not None and time.monotonic() - last_event >= self.debounce:
+                    last_event = None
+                    key = file_key(self.path)
+                    if key != last_key:
+                        last_key = key
+                        self._notify()
+        finally:
+            source.close()
+
+    def start(self):
+        """Запустить наблюдение в фоновом потоке"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # Начальное состояние фиксируется до запуска потока: изменения сразу после start()
+        # будут замечены
+        self._source = self._open_source()
+        self._initial_key = file_key(self.path)
+        self._log(f"Отслеживание конфига ({self._source.name}): {self.path}")
+        self._thread = threading.Thread(target=self._run, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановить наблюдение"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._source.wake()
+        self._thread.join(timeout=self.poll_interval + 1)
+        self._thread = None
+
+    def set_path(self, path):
+        """Переключиться на другой файл"""
+        self.stop()
+        self.path = os.path.abspath(path)
+        self.start()
+
+    @property
+    def source_name(self):
+        """Используемый механизм уведомлений"""
+        return self._source.name if self._source else None
@@ -0,0 +1,243 @@
+"""
+Ожидание завершения соединений через порты accept перед остановкой службы stunnel и подсчет
+соединений с апстримом по таблице соединений ОС
+"""
+import ctypes
+import re
+import socket
+import struct
+import sys
+import time
+from pathlib import Path
+
+
+# Состояние ESTABLISHED: в /proc/net/tcp - 01, в MIB_TCP_STATE Windows - 5
+PROC_ESTABLISHED = '01'
+MIB_TCP_STATE_ESTAB = 5
+TCP_TABLE_OWNER_PID_CONNECTIONS = 4
+ERROR_INSUFFICIENT_BUFFER = 122
+# MIB_TCPROW_OWNER_PID: state, local addr, local port, remote addr, remote port, pid
+_ROW4 = struct.Struct('<6I')
+# MIB_TCP6ROW_OWNER_PID: local addr[16], scope, port, remote addr[16], scope, port, state, pid
+_ROW6 = struct.Struct('<16sII16sIIII')
+
+
+def _count_proc(ports):
+    """Соединения ESTABLISHED по локальному порту из /proc/net/tcp и tcp6"""
+    counts = dict.fromkeys(ports, 0)
+    if not ports:
+        return counts
+    # Строка таблицы: "  sl: локальный_адрес:ПОРТ удаленный_адрес:порт st ..." (шестнадцатерично);
+    # одно регулярное выражение по всему файлу вместо разбора тысяч строк
+    pattern = re.compile(r'^\s*\d+: [0-9A-F]+:(%s) [0-9A-F]+:[0-9A-F]+ %s ' % (
+        '|'.join(f'{port:04X}' for port in ports), PROC_ESTABLISHED), re.MULTILINE)
+    found = False
+    for name in ("tcp", "tcp6"):
+        try:
+            text = Path("/proc/net", name).read_text()
+        except OSError:
+            continue
+        found = True
+        for port in pattern.findall(text):
+            counts[int(port, 16)] += 1
+    return counts if found else None
+
+
+def _proc_address(ip):
+    """Адрес в виде /proc/net/tcp(6): 32-битные слова в порядке байт машины, шестнадцатерично"""
+    if ':' in ip:
+        packed = socket.inet_pton(socket.AF_INET6, ip)
+    else:
+        packed = socket.inet_aton(ip)
+    words = struct.unpack(f'={len(packed) // 4}I', packed)
+    return ''.join(f'{word:08X}' for word in words)
+
+
+def _proc_remote_connections(endpoints):
+    """Соединения ESTABLISHED по удаленному адресу из /proc/net/tcp и tcp6"""
+    connections = {endpoint: set() for endpoint in endpoints}
+    keys = {}
+    for ip, port in endpoints:
+        keys[f'{_proc_address(ip)}:{port:04X}'] = (ip, port)
+        if ':' not in ip:
+            # IPv4 в tcp6: ::ffff:a.b.c.d
+            keys[f'{_proc_address("::ffff:" + ip)}:{port:04X}'] = (ip, port)
+    if not keys:
+        return connections
+    pattern = re.compile(r'^\s*\d+: ([0-9A-F]+:[0-9A-F]+) (%s) %s ' % (
+        '|'.join(keys), PROC_ESTABLISHED), re.MULTILINE)
+    found = False
+    for name in ("tcp", "tcp6"):
+        try:
+            text = Path("/proc/net", name).read_text()
+        except OSError:
+            continue
+        found = True
+        for local, key in pattern.findall(text):
+            connections[keys[key]].add(local)
+    return connections if found else None
+
+
+def _tcp_table(family):
+    """Таблица соединений GetExtendedTcpTable (iphlpapi) для AF_INET/AF_INET6"""
+    get_table = ctypes.windll.iphlpapi.GetExtendedTcpTable
+    size = ctypes.c_ulong(0)
+    buffer = None
+    # Таблица может вырасти между вызовами - повторяем с новым размером
+    for _ in range(5):
+        buffer = ctypes.create_string_buffer(size.value or 1)
+        error = get_table(buffer, ctypes.byref(size), False, family,
+                          TCP_TABLE_OWNER_PID_CONNECTIONS, 0)
+        if error == 0:
+            return buffer.raw[:size.value]
+        if error != ERROR_INSUFFICIENT_BUFFER:
+            raise OSError(error, f"GetExtendedTcpTable: ошибка {error}")
+    raise OSError(ERROR_INSUFFICIENT_BUFFER, "GetExtendedTcpTable: таблица меняется слишком быстро")
+
+
+def _count_windows(ports):
+    """Соединения ESTABLISHED по локальному порту через GetExtendedTcpTable"""
+    counts = dict.fromkeys(ports, 0)
+    for family, row, port_field, state_field in ((socket.AF_INET, _ROW4, 2, 0),
+                                                 (socket.AF_INET6, _ROW6, 2, 6)):
+        table = _tcp_table(family)
+        entries = struct.unpack_from('<I', table)[0]
+        # Строки начинаются после dwNumEntries (для AF_INET6 - тоже со смещения 4)
+        for values in row.iter_unpack(table[4:4 + entries * row.size]):
+            if values[state_field] != MIB_TCP_STATE_ESTAB:
+                continue
+            port = socket.ntohs(values[port_field] & 0xFFFF)
+            if port in counts:
+                counts[port] += 1
+    return counts
+
+
+def _windows_remote_connections(endpoints):
+    """Соединения ESTABLISHED по удаленному адресу через GetExtendedTcpTable"""
+    connections = {endpoint: set() for endpoint in endpoints}
+    wanted = {}
+    for ip, port in endpoints:
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        wanted[(socket.inet_pton(family, ip), port)] = (ip, port)
+    for family, row in ((socket.AF_INET, _ROW4), (socket.AF_INET6, _ROW6)):
+        table = _tcp_table(family)
+        entries = struct.unpack_from('<I', table)[0]
+        for values in row.iter_unpack(table[4:4 + entries * row.size]):
+            if family == socket.AF_INET:
+                state, address, port = values[0], struct.pack('<I', values[3]), values[4]
+                local = (values[1], values[2])
+            else:
+                state, address, port = values[6], values[3], values[5]
+                local = (values[0], values[2])
+            if state != MIB_TCP_STATE_ESTAB:
+                continue
+            key = wanted.get((address, socket.ntohs(port & 0xFFFF)))
+            if key is not None:
+                connections[key].add(local)
+    return connections
+
+
+def remote_connections(endpoints):
+    """{(ip, порт): множество локальных адресов установленных соединений с ним} или None
+
+    Так видно, к какому апстриму подключается служба: ее соединения с connect= - исходящие,
+    удаленный адрес у них - адрес сервера. По локальным адресам новое соединение отличается
+    от закрывшегося старого, даже если их число не изменилось.
+    """
+    endpoints = set(endpoints)
+    if sys.platform == 'win32':
+        return _windows_remote_connections(endpoints)
+    return _proc_remote_connections(endpoints)
+
+
+def count_established(ports):
+    """{порт: число установленных входящих соединений} или None, если ОС не поддерживается
+
+    Считаются соединения, у которых порт accept - локальный, то есть клиенты туннеля;
+    соединения stunnel к серверу ГИИС в подсчет не входят.
+    """
+    ports = set(ports)
+    if sys.platform == 'win32':
+        return _count_windows(ports)
+    return _count_proc(ports)
+
+
+class DrainResult:
+    """Итог ожидания: соединений в начале и при остановке службы (разорвано), время"""
+
+    __slots__ = ('ports', 'initial', 'remaining', 'elapsed', 'timed_out', 'supported')
+
+    def __init__(self, ports, initial=0, remaining=0, elapsed=0.0, timed_out=False,
+                 supported=True):
+        self.ports = ports
+        self.initial = initial
+        self.remaining = remaining
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.supported = supported
+
+    @property
+    def cut(self):
+        """Сколько соединений разорвет остановка службы"""
+        return self.remaining
+
+    def summary(self):
+        """Короткая строка для лога и интерфейса"""
+        if not self.supported:
+            return "подсчет соединений не поддерживается"
+        return (f"было {self.initial}, разорвано {self.remaining} "
+                f"(ожидание {self.elapsed:.1f} с)")
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {'ports': self.ports, 'initial': self.initial, 'cut': self.cut,
+                'elapsed_s': round(self.elapsed, 3), 'timed_out': self.timed_out,
+                'supported': self.supported}
+
+    def __repr__(self):
+        return (f"DrainResult(ports={self.ports}, initial={self.initial}, "
+                f"remaining={self.remaining}, elapsed={self.elapsed:.3f}, "
+                f"timed_out={self.timed_out})")
+
+
+class ConnectionDrain:
+    """Ожидание, пока соединений через порты accept станет не больше threshold
+
+    Опрос раз в interval секунд, не дольше timeout (0 - только подсчет). on_progress(count,
+    initial, осталось секунд) вызывается после каждого подсчета в рабочем потоке.
+    """
+
+    def __init__(self, ports, timeout=10.0, threshold=0, interval=0.25, on_progress=None,
+                 counter=count_established, clock=time.monotonic, sleep=time.sleep):
+        self.ports = sorted(set(ports))
+        self.timeout = timeout
+        self.threshold = threshold
+        self.interval = interval
+        self.on_progress = on_progress
+        self.counter = counter
+        self.clock = clock
+        self.sleep = sleep
+
+    def count(self):
+        """Соединений на всех портах сейчас (None - не поддерживается)"""
+        counts = self.counter(self.ports)
+        return None if counts is None else sum(counts.values())
+
+    def wait(self):
+        """Дождаться завершения соединений или истечения timeout; вернуть DrainResult"""
+        start = self.clock()
+        count = self.count()
+        if count is None:
+            return DrainResult(self.ports, supported=False)
+        initial = count
+        deadline = start + self.timeout
+        while True:
+            left = max(0.0, deadline - self.clock())
+            if self.on_progress:
+                self.on_progress(count, initial, left)
+            if count <= self.threshold or left <= 0:
+                break
+            self.sleep(min(self.interval, left))
+            count = self.count()
+        return DrainResult(self.ports, initial, count, self.clock() - start,
+                           timed_out=count > self.threshold)
@@ -0,0 +1,378 @@
+"""
+Смена сервера на множестве конфигов stunnel (рабочие места, экземпляры) одной командой
+
+Инвентарь (JSON или TOML) перечисляет конфиги и службы:
+    {"defaults": {"service": "Stunnel", "backend": "subprocess", "settings": {"switch_strategy": "restart"}},
+     "targets": [{"name": "ws01", "config": "\\\\ws01\\stunnel\\stunnel.conf", "service": "Stunnel"}]}
+Вместо файла можно указать каталог: каждый *.conf в нем - цель с параметрами по умолчанию.
+Для каждой цели - свой StunnelManager (история копий, журнал и лог в отдельном каталоге).
+"""
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from service_control import create_service_controller
+from stunnel_manager import StunnelManager
+
+
+# Итоги по цели
+SWITCHED = 'switched'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+SKIPPED = 'skipped'
+ROLLED_BACK = 'rolled_back'
+ROLLBACK_FAILED = 'rollback_failed'
+
+# Символы, недопустимые в имени каталога состояния цели
+UNSAFE_NAME = re.compile(r"[^\w.-]+")
+
+
+class FleetTarget:
+    """Цель: конфиг stunnel и служба, которой он принадлежит"""
+
+    __slots__ = ('name', 'config', 'service', 'backend', 'options', 'settings', 'section')
+
+    def __init__(self, name, config, service=StunnelManager.SERVICE_NAME,
+                 backend=StunnelManager.DEFAULT_SERVICE_BACKEND, options=None, settings=None,
+                 section=None):
+        self.name = name
+        self.config = str(config)
+        self.service = service
+        self.backend = backend
+        self.options = dict(options or {})
+        self.settings = dict(settings or {})
+        self.section = section
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"FleetTarget({self.name}, {self.config})"
+
+
+class TargetResult:
+    """Итог смены сервера на одной цели"""
+
+    __slots__ = ('name', 'stage', 'outcome', 'previous', 'current', 'strategy', 'duration',
+                 'error', 'rollback_error')
+
+    def __init__(self, name, stage, outcome=SKIPPED, previous=None, current=None, strategy=None,
+                 duration=0.0, error=None):
+        self.name = name
+        self.stage = stage
+        self.outcome = outcome
+        self.previous = previous
+        self.current = current
+        self.strategy = strategy
+        self.duration = duration
+        self.error = error
+        self.rollback_error = None
+
+    @property
+    def failed(self):
+        """Смена на цели не удалась (ошибка или таймаут)"""
+        return self.outcome in (FAILED, TIMEOUT)
+
+    def to_dict(self):
+        """Представление для JSON"""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['duration_ms'] = round(data.pop('duration') * 1000, 1)
+        return data
+
+
+class FleetReport:
+    """Итог смены сервера на всех целях"""
+
+    def __init__(self, target_ip, results, aborted=None, elapsed=0.0):
+        self.target_ip = target_ip
+        self.results = results
+        # Причина остановки раскатки (None - раскатка выполнена целиком)
+        self.aborted = aborted
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        """Все цели переключены (или уже были на нужном сервере)"""
+        return self.aborted is None and not any(result.failed for result in self.results)
+
+    def counts(self):
+        """Число целей по итогам"""
+        counts = {}
+        for result in self.results:
+            counts[result.outcome] = counts.get(result.outcome, 0) + 1
+        return counts
+
+    def table(self):
+        """Строки сводной таблицы: цель, этап, итог, длительность, серверы, ошибка"""
+        width = max([len(result.name) for result in self.results] + [4])
+        lines = [f"{'Цель':<{width}}  {'Этап':<6}  {'Итог':<15}  {'мс':>8}  Сервер"]
+        for result in self.results:
+            server = f"{result.previous or '-'} -> {result.current or '-'}"
+            line = (f"{result.name:<{width}}  {result.stage:<6}  {result.outcome:<15}  "
+                    f"{result.duration * 1000:>8.0f}  {server}")
+            error = result.rollback_error or result.error
+            if error:
+                line += f"  ({error})"
+            lines.append(line)
+        durations = sorted(result.duration for result in self.results if result.outcome != SKIPPED)
+        summary = ", ".join(f"{outcome}: {count}" for outcome, count in self.counts().items())
+        lines.append(f"Итого за {self.elapsed:.1f} с: {summary}")
+        if durations:
+            lines.append(f"Длительность: медиана {durations[len(durations) // 2] * 1000:.0f} мс, "
+                         f"максимум {durations[-1] * 1000:.0f} мс")
+        if self.aborted:
+            lines.append(f"Раскатка остановлена: {self.aborted}")
+        return lines
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {
+            'ok': self.ok,
+            'target_ip': self.target_ip,
+            'aborted': self.aborted,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+            'counts': self.counts(),
+            'results': [result.to_dict() for result in self.results],
+        }
+
+
+def load_inventory(path):
+    """Список FleetTarget из файла инвентаря (.json / .toml) или каталога с *.conf"""
+    path = Path(path)
+    if path.is_dir():
+        return [FleetTarget(config.stem, config) for config in sorted(path.glob("*.conf"))]
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if path.suffix.lower() == '.toml':
+        import tomllib
+
+        try:
+            data = tomllib.loads(raw.decode('utf-8'))
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"Ошибка TOML: {e}")
+    else:
+        data = json.loads(raw)
+
+    items = data.get('targets') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Ожидается список targets")
+    defaults = data.get('defaults', {}) if isinstance(data, dict) else {}
+
+    targets = []
+    names = set()
+    for position, item in enumerate(items, start=1):
+        if not isinstance(item, dict) or not item.get('config'):
+            raise ValueError(f"Цель {position}: нужен объект с полем config")
+        fields = dict(defaults, **item)
+        config = Path(fields['config'])
+        # Относительные пути - от каталога инвентаря
+        if not config.is_absolute():
+            config = path.parent / config
+        name = str(fields.get('name') or config.stem)
+        if name in names:
+            raise ValueError(f"Цель {name} указана в инвентаре дважды")
+        names.add(name)
+        targets.append(FleetTarget(
+            name, config,
+            service=fields.get('service', StunnelManager.SERVICE_NAME),
+            backend=fields.get('backend', StunnelManager.DEFAULT_SERVICE_BACKEND),
+            options=dict(defaults.get('options', {}), **item.get('options', {})),
+            settings=dict(defaults.get('settings', {}), **item.get('settings', {})),
+            section=fields.get('section'),
+        ))
+    return targets
+
+
+class FleetRunner:
+    """Раскатка смены сервера по целям инвентаря
+
+    Цели обрабатываются пулом из workers потоков, каждая - полным change_server
+    (копия, запись, перезапуск или перезагрузка, проверка готовности) не дольше timeout.
+    Сначала canary целей по очереди: любая неудача останавливает раскатку. Если неудач
+    больше max_failure_rate от числа целей, новые цели не запускаются, а уже переключенные
+    откатываются к копии, сделанной перед сменой.
+    """
+
+    def __init__(self, targets, state_dir, workers=4, timeout=60.0, canary=0,
+                 max_failure_rate=0.25, strategy=None, backend=None, on_result=None, log=None):
+        self.targets = list(targets)
+        self.state_dir = Path(state_dir)
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.canary = max(0, min(canary, len(self.targets)))
+        self.max_failure_rate = max_failure_rate
+        self.strategy = strategy
+        # Реализация управления службой для всех целей (например, fake для проверки)
+        self.backend = backend
+        self.on_result = on_result
+        self.log = log or (lambda message: None)
+        self._by_name = {target.name: target for target in self.targets}
+        self._managers = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def _create_manager(self, target):
+        """Менеджер цели: своя служба и свой каталог состояния"""
+        service = create_service_controller(self.backend or target.backend, target.service,
+                                            **target.options)
+        manager = StunnelManager(service=service, console=None,
+                                 app_dir=self.state_dir / UNSAFE_NAME.sub('_', target.name))
+        manager.config_file_path = target.config
+        # Ожидание готовности - не больше трети таймаута цели: при неудаче остается время
+        # восстановить копию конфига и запустить службу
+        manager.settings = dict(manager.settings, **target.settings)
+        manager.settings['ready_timeout'] = min(
+            manager.settings.get('ready_timeout', StunnelManager.READY_TIMEOUT), self.timeout / 3)
+        return manager
+
+    def _current(self, target):
+        """Сервер цели (секции target.section, если она задана)"""
+        manager = self._managers[target.name]
+        if target.section is not None:
+            return manager.get_section_servers().get(target.section)
+        return manager.get_current_server()
+
+    def _switch(self, target, new_ip, result):
+        """Смена сервера на цели (в отдельном потоке, чтобы ограничить ее timeout)"""
+        if not os.path.exists(target.config):
+            raise FileNotFoundError(f"Конфиг не найден: {target.config}")
+        manager = self._create_manager(target)
+        with self._lock:
+            self._managers[target.name] = manager
+        # Смена, прерванная сбоем прошлой раскатки, доводится до конца
+        manager.recover_interrupted_switch()
+        result.previous = self._current(target)
+        manager.change_server(new_ip, strategy=self.strategy, section=target.section)
+        result.strategy = manager.last_switch_strategy
+        result.current = self._current(target)
+
+    def _run_target(self, target, new_ip, stage):
+        """Выполнить смену на цели с таймаутом; вернуть TargetResult"""
+        result = TargetResult(target.name, stage)
+        errors = []
+
+        def work():
+            try:
+                self._switch(target, new_ip, result)
+            except Exception as e:
+                errors.append(e)
+
+        start = time.perf_counter()
+        worker = threading.Thread(target=work, name=f"Fleet-{target.name}", daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        result.duration = time.perf_counter() - start
+        if worker.is_alive():
+            # Поток нельзя прервать: цель считается неудачной, откат - после его завершения
+            with self._lock:
+                self._workers[target.name] = worker
+            result.outcome = TIMEOUT
+            result.error = f"смена не завершилась за {self.timeout:.0f} с"
+        elif errors:
+            result.outcome = FAILED
+            result.error = str(errors[0])
+        elif result.previous == new_ip:
+            result.outcome = UNCHANGED
+        else:
+            result.outcome = SWITCHED
+        self.log(f"[Флот] {target.name}: {result.outcome} за {result.duration * 1000:.0f} мс"
+                 + (f" ({result.error})" if result.error else ""))
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    def _rollback(self, result):
+        """Откатить цель к копии конфига, сделанной перед сменой"""
+        manager = self._managers[result.name]
+        worker = self._workers.get(result.name)
+        if worker is not None:
+            worker.join(self.timeout)
+            if worker.is_alive():
+                result.rollback_error = "смена все еще выполняется - откат невозможен"
+                result.outcome = ROLLBACK_FAILED
+                return result
+        # Неудачная смена могла записать конфиг (служба не готова) - откатывается и она;
+        # если сервер не изменился, откатывать нечего
+        if self._current(self._by_name[result.name]) == result.previous:
+            return result
+        try:
+            manager.rollback(1)
+            result.current = self._current(self._by_name[result.name])
+            result.outcome = ROLLED_BACK
+        except Exception as e:
+            result.rollback_error = f"откат: {e}"
+            result.outcome = ROLLBACK_FAILED
+            result.current = self._current(self._by_name[result.name])
+        self.log(f"[Флот] {result.name}: {result.outcome}")
+        return result
+
+    def _needs_rollback(self, result):
+        """Смена на цели начиналась - при остановке раскатки проверить и откатить"""
+        return (result.outcome in (SWITCHED, FAILED, TIMEOUT) and result.previous is not None
+                and result.name in self._managers)
+
+    def run(self, new_ip):
+        """Раскатить смену на new_ip; вернуть FleetReport"""
+        start = time.perf_counter()
+        by_name = {}
+        aborted = None
+        self.log(f"[Флот] Смена сервера на {new_ip}: целей {len(self.targets)}, "
+                 f"потоков {self.workers}, канареек {self.canary}")
+
+        # Канареечные цели - по одной, до первой неудачи
+        for target in self.targets[:self.canary]:
+            result = self._run_target(target, new_ip, 'canary')
+            by_name[target.name] = result
+            if result.failed:
+                aborted = f"неудача на канареечной цели {target.name}: {result.error}"
+                break
+
+        rest = self.targets[self.canary:]
+        limit = self.max_failure_rate * len(self.targets)
+        if aborted is None and rest:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Fleet") as pool:
+                futures = {pool.submit(self._run_target, target, new_ip, 'batch'): target
+                           for target in rest}
+                failures = sum(1 for result in by_name.values() if result.failed)
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    result = future.result()
+                    by_name[result.name] = result
+                    if result.failed:
+                        failures += 1
+                    if aborted is None and failures > limit:
+                        aborted = (f"неудач {failures} из {len(self.targets)} - больше "
+                                   f"{self.max_failure_rate:.0%}")
+                        # Еще не начатые цели не запускаются, выполняющиеся - дорабатывают
+                        for pending in futures:
+                            pending.cancel()
+
+        if aborted is not None:
+            self.log(f"[Флот] Раскатка остановлена: {aborted}")
+            to_rollback = [result for result in by_name.values() if self._needs_rollback(result)]
+            if to_rollback:
+                with ThreadPoolExecutor(max_workers=self.workers,
+                                        thread_name_prefix="FleetRollback") as pool:
+                    list(pool.map(self._rollback, to_rollback))
+
+        # Зависшие смены получают еще timeout, чтобы не оставить службу остановленной
+        for worker in self._workers.values():
+            worker.join(self.timeout)
+        for name, manager in self._managers.items():
+            # Менеджер зависшей смены еще используется ее потоком
+            worker = self._workers.get(name)
+            if worker is None or not worker.is_alive():
+                manager.close()
+
+        results = [by_name.get(target.name) or
+                   TargetResult(target.name, 'canary' if i < self.canary else 'batch')
+                   for i, target in enumerate(self.targets)]
+        return FleetReport(new_ip, results, aborted, time.perf_counter() - start)
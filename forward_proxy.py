@@ -0,0 +1,331 @@
+"""
+Встроенный пересылающий прокси на asyncio: порт accept -> апстрим по TLS, без перезапуска stunnel
+
+Новые соединения идут на текущий апстрим; смена апстрима - замена одной ссылки, уже открытые
+соединения дорабатывают на прежнем. Для каждого апстрима держится пул заранее установленных
+TLS-соединений, чтобы клиент не ждал рукопожатия.
+"""
+import asyncio
+import ssl
+import threading
+import time
+from collections import deque
+
+
+class Upstream:
+    """Апстрим прокси: адрес, пул готовых соединений и число активных"""
+
+    __slots__ = ('host', 'port', 'generation', 'pool', 'active', 'retired', 'filling')
+
+    def __init__(self, host, port, generation=0):
+        self.host = host
+        self.port = port
+        self.generation = generation
+        self.pool = deque()  # (reader, writer, время установки)
+        self.active = 0
+        self.retired = False
+        self.filling = False
+
+    def __repr__(self):
+        return f"Upstream({self.host}:{self.port}, active={self.active}, pool={len(self.pool)})"
+
+
+def ssl_context_for_section(section):
+    """TLS-контекст по параметрам секции stunnel: CAfile (проверка цепочки), cert и key"""
+    context = ssl.create_default_context()
+    # Серверы задаются IP-адресами - имя в сертификате не сверяется, как и в stunnel
+    context.check_hostname = False
+    # Ключи опций в разобранном конфиге - в нижнем регистре
+    cafile = section.get('cafile')
+    if cafile:
+        context.load_verify_locations(cafile)
+        context.verify_mode = ssl.CERT_REQUIRED
+    else:
+        context.verify_mode = ssl.CERT_NONE
+    cert = section.get('cert')
+    if cert:
+        context.load_cert_chain(cert, section.get('key') or None)
+    return context
+
+
+class ForwardProxy:
+    """Пересылка соединений с listen на апстрим (TLS) в фоновом потоке с циклом asyncio"""
+
+    def __init__(self, listen, upstream, tls=True, ssl_context=None, server_hostname=None,
+                 pool_size=4, pool_max_idle=30.0, connect_timeout=5.0, log=None):
+        self.listen = listen
+        self.tls = tls
+        self.ssl_context = ssl_context if ssl_context is not None else (
+            self._default_ssl_context() if tls else None)
+        self.server_hostname = server_hostname
+        self.pool_size = pool_size
+        self.pool_max_idle = pool_max_idle
+        self.connect_timeout = connect_timeout
+        self.log = log
+        self._upstream = Upstream(*upstream)
+        self._draining = set()
+        self._clients = set()
+        # Счетчики (меняются только в потоке цикла)
+        self.connections = 0
+        self.active = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.errors = 0
+        self.switches = 0
+        self._address = None
+        self._loop = None
+        self._stop_event = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._start_error = None
+
+    @staticmethod
+    def _default_ssl_context():
+        """Контекст без проверки сертификата (как stunnel без CAfile)"""
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _log(self, message):
+        """Записать сообщение в лог, если он задан"""
+        if self.log:
+            self.log(message)
+
+    @property
+    def upstream(self):
+        """Текущий апстрим для новых соединений"""
+        return self._upstream
+
+    @property
+    def address(self):
+        """Фактический адрес прослушивания (с портом, если был указан 0)"""
+        return self._address
+
+    def switch(self, host, port=None):
+        """Направить новые соединения на другой апстрим (можно вызывать из любого потока)
+
+        Замена - присваивание одной ссылки: соединение, уже получившее апстрим, остается
+        на нем до закрытия, все следующие идут на новый. Пул прежнего апстрима закрывается,
+        пул нового заполняется в цикле прокси.
+        """
+        old = self._upstream
+        new = Upstream(host, port or old.port, old.generation + 1)
+        self._upstream = new
+        self.switches += 1
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._after_switch, old, new)
+        return new
+
+    def _after_switch(self, old, new):
+        """Закрыть пул прежнего апстрима и заполнить пул нового"""
+        self._retire(old)
+        self._fill_pool(new)
+        self._log(f"[Прокси] Апстрим: {old.host}:{old.port} -> {new.host}:{new.port}, "
+                  f"дорабатывают соединений: {old.active}")
+
+    def _retire(self, upstream):
+        """Вывести апстрим из работы: готовые соединения закрыть, активные - дождаться"""
+        upstream.retired = True
+        while upstream.pool:
+            _, writer, _ = upstream.pool.popleft()
+            writer.close()
+        if upstream.active:
+            self._draining.add(upstream)
+
+    async def _connect(self, upstream):
+        """Установить соединение с апстримом"""
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                upstream.host, upstream.port,
+                ssl=self.ssl_context if self.tls else None,
+                server_hostname=(self.server_hostname or upstream.host) if self.tls else None,
+            ),
+            self.connect_timeout
+        )
+
+    def _fill_pool(self, upstream):
+        """Запустить заполнение пула, если оно еще не идет"""
+        if self.pool_size and not upstream.retired and not upstream.filling:
+            upstream.filling = True
+            self._loop.create_task(self._refill(upstream))
+
+    async def _refill(self, upstream):
+        """Дополнить пул до pool_size готовыми соединениями (рукопожатия - параллельно)"""
+        try:
+            while not upstream.retired and len(upstream.pool) < self.pool_size:
+                missing = self.pool_size - len(upstream.pool)
+                results = await asyncio.gather(
+                    *(self._connect(upstream) for _ in range(missing)), return_exceptions=True)
+                error = None
+                for result in results:
+                    if isinstance(result, BaseException):
+                        error = result
+                    elif upstream.retired:
+                        result[1].close()
+                    else:
+                        upstream.pool.append((result[0], result[1], time.monotonic()))
+                if error is not None:
+                    # Следующая попытка - при следующем клиенте или обслуживании пула
+                    self._log(f"[Прокси] Не удалось подготовить соединение с "
+                              f"{upstream.host}:{upstream.port}: {error}")
+                    return
+        finally:
+            upstream.filling = False
+
+    async def _acquire(self, upstream):
+        """Готовое соединение из пула или новое"""
+        now = time.monotonic()
+        while upstream.pool:
+            reader, writer, created = upstream.pool.popleft()
+            # Апстрим мог закрыть простаивающее соединение
+            if writer.is_closing() or reader.at_eof() or now - created > self.pool_max_idle:
+                writer.close()
+                continue
+            self.pool_hits += 1
+            return reader, writer
+        self.pool_misses += 1
+        return await self._connect(upstream)
+
+    async def _pipe(self, reader, writer, counter):
+        """Копировать данные reader -> writer
+
+        Чистый EOF передается дальше половинным закрытием (write_eof): другая сторона
+        может еще отвечать - соединения закрывает _handle_client после обоих направлений.
+        При ошибке и на транспорте без write_eof (TLS) writer закрывается сразу.
+        """
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                writer.write(data)
+                setattr(self, counter, getattr(self, counter) + len(data))
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+                return
+        except (OSError, ssl.SSLError):
+            pass
+        writer.close()
+
+    async def _handle_client(self, reader, writer):
+        """Обслужить клиента: апстрим фиксируется в момент подключения"""
+        upstream = self._upstream
+        self.connections += 1
+        self.active += 1
+        upstream.active += 1
+        self._clients.add(writer)
+        try:
+            try:
+                up_reader, up_writer = await self._acquire(upstream)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                self.errors += 1
+                self._log(f"[Прокси] Ошибка подключения к {upstream.host}:{upstream.port}: {e}")
+                writer.close()
+                return
+            self._fill_pool(upstream)
+            try:
+                await asyncio.gather(
+                    self._pipe(reader, up_writer, 'bytes_up'),
+                    self._pipe(up_reader, writer, 'bytes_down'),
+                )
+            finally:
+                up_writer.close()
+                writer.close()
+        finally:
+            self._clients.discard(writer)
+            self.active -= 1
+            upstream.active -= 1
+            if upstream.retired and not upstream.active:
+                self._draining.discard(upstream)
+
+    async def _maintain(self):
+        """Периодически убирать устаревшие соединения из пула и дополнять его"""
+        while True:
+            await asyncio.sleep(max(self.pool_max_idle / 2, 0.1))
+            upstream = self._upstream
+            now = time.monotonic()
+            fresh = deque(item for item in upstream.pool
+                          if not item[1].is_closing() and now - item[2] <= self.pool_max_idle)
+            for item in upstream.pool:
+                if item not in fresh:
+                    item[1].close()
+            upstream.pool = fresh
+            self._fill_pool(upstream)
+
+    async def _main(self):
+        """Цикл прокси: сервер, пул и ожидание остановки"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle_client, *self.listen,
+                                                reuse_address=True, backlog=512)
+        except OSError as e:
+            self._start_error = e
+            self._ready.set()
+            return
+        self._address = server.sockets[0].getsockname()[:2]
+        self._fill_pool(self._upstream)
+        maintenance = self._loop.create_task(self._maintain())
+        self._log(f"[Прокси] {self._address[0]}:{self._address[1]} -> "
+                  f"{self._upstream.host}:{self._upstream.port} (TLS: {self.tls}, "
+                  f"пул: {self.pool_size})")
+        self._ready.set()
+
+        await self._stop_event.wait()
+        maintenance.cancel()
+        server.close()
+        for writer in list(self._clients):
+            writer.close()
+        self._retire(self._upstream)
+        # Даем соединениям закрыться до остановки цикла
+        await asyncio.sleep(0)
+
+    def start(self):
+        """Запустить прокси в фоновом потоке; OSError, если порт занят"""
+        if self._thread is not None:
+            return
+        self._ready.clear()
+        self._start_error = None
+        self._thread = threading.Thread(target=asyncio.run, args=(self._main(),),
+                                        name="ForwardProxy", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._start_error
+
+    def stop(self):
+        """Закрыть порт и все соединения"""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._loop = None
+
+    @property
+    def running(self):
+        """Работает ли прокси"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        """Счетчики для вывода и бенчмарков"""
+        upstream = self._upstream
+        return {
+            'upstream': f"{upstream.host}:{upstream.port}",
+            'connections': self.connections,
+            'active': self.active,
+            'draining': sum(u.active for u in self._draining),
+            'pool': len(upstream.pool),
+            'pool_hits': self.pool_hits,
+            'pool_misses': self.pool_misses,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'errors': self.errors,
+            'switches': self.switches,
+        }
@@ -5,242 +5,201 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import sys
-import json
-import subprocess
 import ctypes
-import shutil
-import threading
-from datetime import datetime
-from pathlib import Path
 
-
-class StunnelManager:
-    """Менеджер для работы с stunnel конфигурацией и службой"""
-
-    # Доступные серверы (из script.bat)
-    SERVERS = {
-        "195.209.130.9": "промышленный контур",
-        "195.209.130.45": "тестовый контур (промышленный)",
-        "195.209.130.19": "тестовый контур (новый функционал)"
-    }
-
-    SERVICE_NAME = "Stunnel"
-
-    def __init__(self):
-        self.config_dir = self._get_app_data_dir()
-        self.config_file_path = self._load_config_path()
-        self.log_file = self._create_log_file()
-
-    def _get_app_data_dir(self):
-        """Получить путь к директории приложения в AppData"""
-        appdata = os.getenv('APPDATA')
-        app_dir = Path(appdata) / "GIIS_ServerSelector"
-        app_dir.mkdir(exist_ok=True)
-        return app_dir
-
-    def _load_config_path(self):
-        """Загрузить сохраненный путь к конфигурационному файлу"""
-        settings_file = self.config_dir / "settings.json"
-        if settings_file.exists():
-            try:
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return settings.get('config_path', '')
-            except Exception as e:
-                self.log(f"Ошибка загрузки настроек: {e}")
-        return ''
-
-    def save_config_path(self, path):
-        """Сохранить путь к конфигурационному файлу"""
-        settings_file = self.config_dir / "settings.json"
-        try:
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump({'config_path': path}, f, ensure_ascii=False, indent=2)
-            self.config_file_path = path
-            self.log(f"Путь к конфигу сохранен: {path}")
-        except Exception as e:
-            self.log(f"Ошибка сохранения пути: {e}")
-            raise
-
-    def _create_log_file(self):
-        """Создать файл лога с временной меткой"""
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        log_file = self.config_dir / f"stunnel_manager_{timestamp}.log"
-        self.log(f"Файл лога создан: {log_file}", to_file=False)
-        return log_file
-
-    def log(self, message, to_file=True):
-        """Записать сообщение в лог"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}"
-
-        if to_file and hasattr(self, 'log_file'):
-            try:
-                with open(self.log_file, 'a', encoding='utf-8') as f:
-                    f.write(log_message + '\n')
-            except Exception as e:
-                print(f"Ошибка записи в лог: {e}")
-
-        print(log_message)
-
-    def get_current_server(self):
-        """Получить текущий IP сервера из конфига"""
-        if not self.config_file_path or not os.path.exists(self.config_file_path):
-            return None
-
-        try:
-            with open(self.config_file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('connect='):
-                        # Извлекаем IP (до двоеточия)
-                        ip_port = line.split('=', 1)[1].strip()
-                        ip = ip_port.split(':')[0].strip()
-                        self.log(f"Текущий сервер: {ip}")
-                        return ip
-            self.log("Строка connect= не найдена в конфиге")
-            return None
-        except Exception as e:
-            self.log(f"Ошибка чтения конфига: {e}")
-            return None
-
-    def stop_service(self):
-        """Остановить службу Stunnel (используя TASKKILL)"""
-        self.log(f"Остановка службы {self.SERVICE_NAME}...")
-
-        # Используем TASKKILL для остановки службы
-        result = subprocess.run(
-            ['TASKKILL', '/F', '/FI', f'SERVICES eq {self.SERVICE_NAME}'],
-            capture_output=True,
-            text=True,
-            encoding='cp866',
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-
-        if result.returncode != 0 and "not found" not in result.stderr.lower():
-            self.log(f"ОШИБКА: Не удалось остановить службу!")
-            self.log(f"Вывод: {result.stderr}")
-            return False
-
-        self.log("Служба остановлена успешно")
-        return True
-
-    def start_service(self):
-        """Запустить службу Stunnel (используя sc start)"""
-        self.log(f"Запуск службы {self.SERVICE_NAME}...")
-
-        result = subprocess.run(
-            ['sc', 'start', self.SERVICE_NAME],
-            capture_output=True,
-            text=True,
-            encoding='cp866',
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-
-        if result.returncode != 0:
-            self.log(f"ОШИБКА: Не удалось запустить службу!")
-            self.log(f"Вывод: {result.stderr}")
-            return False
-
-        self.log("Служба запущена успешно")
-        return True
-
-    def change_server(self, new_ip):
-        """Изменить IP сервера в конфиге"""
-        if not self.config_file_path or not os.path.exists(self.config_file_path):
-            raise Exception("Файл конфигурации не указан или не существует!")
-
-        current_ip = self.get_current_server()
-
-        if current_ip == new_ip:
-            self.log(f"Сервер {new_ip} уже установлен")
-            return True
-
-        self.log("="*50)
-        self.log("Изменение сервера")
-        self.log(f"Старый сервер: {current_ip or 'не определен'}")
-        self.log(f"Новый сервер: {new_ip} ({self.SERVERS.get(new_ip, 'неизвестный')})")
-        self.log("="*50)
-
-        # Остановка службы
-        if not self.stop_service():
-            raise Exception("Не удалось остановить службу!")
-
-        # Резервное копирование
-        self.log("Создание резервной копии...")
-        backup_path = self.config_file_path + ".backup"
-        try:
-            shutil.copy2(self.config_file_path, backup_path)
-            self.log(f"Резервная копия создана: {backup_path}")
-        except Exception as e:
-            self.log(f"ОШИБКА: Не удалось создать резервную копию: {e}")
-            self.start_service()  # Попытка запустить службу обратно
-            raise
-
-        # Изменение конфига
-        self.log("Изменение конфигурации...")
-        try:
-            with open(self.config_file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            replaced = False
-            new_lines = []
-
-            for line in lines:
-                if line.strip().startswith('connect='):
-                    new_lines.append(f'connect={new_ip}:443\n')
-                    replaced = True
-                    self.log(f"Строка connect заменена на: connect={new_ip}:443")
-                else:
-                    new_lines.append(line)
-
-            # Если строка connect= не найдена, добавляем
-            if not replaced:
-                new_lines.append(f'\nconnect={new_ip}:443\n')
-                self.log(f"Строка connect добавлена: connect={new_ip}:443")
-
-            # Записываем изменения
-            with open(self.config_file_path, 'w', encoding='utf-8') as f:
-                f.writelines(new_lines)
-
-            self.log("Конфигурация обновлена успешно")
-
-        except Exception as e:
-            self.log(f"ОШИБКА: Не удалось изменить конфиг: {e}")
-            # Восстановление из резервной копии
-            self.log("Восстановление из резервной копии...")
-            shutil.copy2(backup_path, self.config_file_path)
-            self.start_service()
-            raise
-
-        # Запуск службы
-        if not self.start_service():
-            raise Exception("Не удалось запустить службу! Проверьте конфигурацию.")
-
-        self.log("="*50)
-        self.log("УСПЕШНО: Сервер изменен!")
-        self.log(f"Новый сервер: {new_ip} ({self.SERVERS.get(new_ip, 'неизвестный')})")
-        self.log(f"Резервная копия: {backup_path}")
-        self.log("="*50)
-
-        return True
+from config_watcher import ConfigWatcher
+from gui_executor import StallWatchdog, TaskExecutor
+from health_monitor import HealthMonitor
+from log_viewer import LogViewer
+from latency_probe import fastest
+from latency_store import LatencySampler
+from server_catalog import ServerCatalog
+from stunnel_manager import StunnelManager, is_admin
+from switch_coordinator import SwitchCoordinator
 
 
 class StunnelGUI:
     """GUI приложение для управления Stunnel"""
 
+    # Сколько строк фильтра показывать в dropdown (остальные - уточнением запроса)
+    MAX_VISIBLE = 200
+    # Клавиши, которые не меняют текст поля и не запускают фильтр
+    NAVIGATION_KEYS = {'Up', 'Down', 'Left', 'Right', 'Home', 'End', 'Prior', 'Next', 'Return',
+                       'KP_Enter', 'Escape', 'Tab', 'Shift_L', 'Shift_R', 'Control_L', 'Control_R',
+                       'Alt_L', 'Alt_R'}
+    # Что сделано со службой при смене (manager.last_switch_strategy)
+    STRATEGY_TEXT = {
+        'reload': "Конфигурация службы перезагружена без перезапуска.",
+        'restart': "Служба перезапущена.",
+        'restart-fallback': "Перезагрузка конфигурации не подействовала - служба перезапущена.",
+    }
+
     def __init__(self, root):
         self.root = root
         self.root.title("GIIS Server Selector")
-        self.root.geometry("600x220")
+        self.root.geometry("600x260")
         self.root.resizable(False, False)
 
-        self.manager = StunnelManager()
+        self.manager = None
         self.is_processing = False
+        self.is_probing = False
         self.current_server_ip = None
+        self.probe_results = {}
+        # Сводки истории задержки {ip: {'hour': ..., 'day': ...}} - видны до первого замера
+        self.latency_history = {}
+        self.sampler = None
+        self.monitor = None
+        self.config_watcher = None
+        self.coordinator = None
+        self.log_viewer = None
+        # Секции конфига с connect= ({секция: IP}) и выбранные, но не примененные серверы
+        self.sections = {}
+        self.pending = {}
+        # Каталог серверов: до загрузки файла - встроенный список; в dropdown - записи фильтра
+        self.catalog = ServerCatalog.from_mapping(StunnelManager.SERVERS, StunnelManager.SERVER_PORT)
+        self.catalog_filter = self.catalog.filter()
+        self.filter_query = ""
+        self.visible = []
+        self.selected_entry = None
+
+        # Дисковые и сетевые операции выполняются в пуле, результаты - через after()
+        self.executor = TaskExecutor(root, log=self._log)
+        self.watchdog = StallWatchdog(root, log=self._log)
 
         self._create_widgets()
-        self._update_current_server()
+        self._refresh_server_list()
+        self._set_controls_state('disabled')
+        self.watchdog.start()
+
+        # Настройки читаются в фоне - окно отрисовывается сразу
+        self.executor.submit(StunnelManager, on_done=self._on_manager_ready,
+                             on_error=self._on_manager_error)
+
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _log(self, message):
+        """Записать сообщение в лог менеджера (если он уже создан)"""
+        if self.manager is not None:
+            self.manager.log(message)
+
+    def _on_manager_ready(self, manager):
+        """Менеджер создан: показать настройки и запустить фоновые задачи"""
+        self.manager = manager
+        self.watchdog.threshold_ms = manager.settings.get('stall_threshold_ms',
+                                                          self.watchdog.threshold_ms)
+        self._set_controls_state('normal')
+        self._show_config_path(manager.config_file_path)
+        self._update_save_button_state()
+        self.monitor_var.set(manager.settings.get('monitor_enabled', False))
+        self.coordinator = SwitchCoordinator(manager)
+        # Число соединений во время ожидания перед остановкой службы - в прогресс-бар
+        manager.on_drain_progress = lambda count, initial, left: self.executor.call_soon(
+            self._on_drain_progress, count, initial, left)
+        # Файл каталога может быть большим - читается в пуле
+        self.executor.submit(lambda: manager.catalog, on_done=self._on_catalog_loaded,
+                             on_error=lambda e: manager.log(f"Ошибка загрузки каталога: {e}"))
+        # Смена, прерванная сбоем прошлого запуска, доводится до конца до остальных задач
+        self.executor.submit(self._recover, on_done=self._on_recovery_done,
+                             on_error=self._on_recovery_error)
+
+        # Текущий сервер читается в потоке наблюдателя и приходит через очередь executor
+        self._start_config_watcher()
+        # История задержки - из файлов без замера; полный замер каталога - кнопкой "Замер"
+        self._load_latency_history()
+        interval = manager.settings.get('latency_sample_interval', 60)
+        if interval:
+            self.sampler = LatencySampler(
+                manager, interval=interval,
+                max_servers=manager.settings.get('latency_sample_max', 16),
+                on_sample=lambda results: self.executor.call_soon(self._load_latency_history)
+            )
+            self.sampler.start()
+        if self.monitor_var.get():
+            self._start_monitor()
+
+    def _on_catalog_loaded(self, catalog):
+        """Каталог из файла загружен: перестроить индекс фильтра и dropdown"""
+        if catalog is self.catalog:
+            return
+        selected_ip = self._selected_ip()
+        self.catalog = catalog
+        self.catalog_filter = catalog.filter()
+        self._refresh_server_list(select_ip=selected_ip or self.current_server_ip)
+        self._load_latency_history()
+
+    def _recover(self):
+        """Довести прерванную смену и прочитать текущий сервер из конфига (в пуле)"""
+        entry = self.manager.recover_interrupted_switch()
+        if entry is None:
+            return None, None
+        return entry, self.manager.get_current_server()
+
+    def _on_recovery_done(self, result):
+        """Сообщить о восстановлении после прерванной смены сервера"""
+        entry, current_ip = result
+        if entry is None:
+            return
+        messagebox.showinfo(
+            "Восстановление",
+            f"Предыдущая смена сервера ({entry.get('previous') or '?'} -> "
+            f"{entry.get('target') or '?'}, {entry.get('started')}) была прервана.\n\n"
+            f"Служба запущена, текущий сервер: {current_ip or 'не определен'}."
+        )
+
+    def _on_recovery_error(self, error):
+        """Не удалось восстановить службу после прерванной смены"""
+        messagebox.showerror("Ошибка", f"Не удалось восстановить службу после прерванной смены "
+                                       f"сервера:\n\n{error}\n\nПроверьте лог для деталей.")
+
+    def _on_manager_error(self, error):
+        """Не удалось создать менеджер (директория приложения недоступна)"""
+        messagebox.showerror("Ошибка", f"Не удалось загрузить настройки:\n{error}")
+
+    def _set_controls_state(self, state):
+        """Включить/выключить кнопки, которым нужен менеджер"""
+        for widget in (self.browse_btn, self.log_btn, self.history_btn, self.probe_btn,
+                       self.fastest_btn, self.monitor_check):
+            widget.config(state=state)
+
+    def _show_config_path(self, path):
+        """Показать путь к конфигу вместо placeholder и активировать dropdown (с вводом для фильтра)"""
+        if not path:
+            return
+        self.config_path_var.set(path)
+        self.config_placeholder.pack_forget()
+        self.config_entry.pack(fill='x', expand=True)
+        self.server_combo.config(state='normal')
+
+    def _on_close(self):
+        """Закрыть окно; монитор и лог останавливаются в фоне, затем окно уничтожается"""
+        self.watchdog.stop()
+        if self.manager is None:
+            self._destroy()
+            return
+        self.root.withdraw()
+        self.executor.submit(self._shutdown, on_done=lambda _: self._destroy(),
+                             on_error=lambda _: self._destroy())
+
+    def _shutdown(self):
+        """Остановить фоновые задачи и записать остаток лога (в пуле)"""
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self.coordinator is not None:
+            self.coordinator.close()
+        summary = self.watchdog.summary()
+        self.manager.log(f"Задержки интерфейса: замеров {summary['ticks']}, "
+                         f"выше порога {summary['stalls']}, p99 {summary['p99_ms']} мс, "
+                         f"максимум {summary['max_ms']} мс")
+        self.manager.close()
+
+    def _destroy(self):
+        """Остановить пул и уничтожить окно"""
+        self.executor.shutdown()
+        self.root.destroy()
 
     def _create_widgets(self):
         """Создать элементы интерфейса"""
@@ -253,7 +212,7 @@ class StunnelGUI:
         path_container.pack(side='left', fill='x', expand=True, padx=(0, 5))
 
         # Entry для отображения пути
-        self.config_path_var = tk.StringVar(value=self.manager.config_file_path)
+        self.config_path_var = tk.StringVar()
         self.config_entry = ttk.Entry(path_container, textvariable=self.config_path_var, state='readonly')
 
         # Placeholder label
@@ -263,45 +222,84 @@ class StunnelGUI:
             foreground='gray'
         )
 
-        # Показываем Entry или Placeholder в зависимости от наличия пути
-        if self.manager.config_file_path:
-            self.config_entry.pack(fill='x', expand=True)
-        else:
-            self.config_placeholder.pack(fill='x', expand=True)
+        # Entry показывается вместо placeholder, когда путь загружен из настроек
+        self.config_placeholder.pack(fill='x', expand=True)
 
-        browse_btn = ttk.Button(config_frame, text="Обзор", command=self._browse_config, width=10)
-        browse_btn.pack(side='left')
+        self.browse_btn = ttk.Button(config_frame, text="Обзор", command=self._browse_config, width=10)
+        self.browse_btn.pack(side='left')
 
         # Фрейм выбора сервера
         select_frame = ttk.LabelFrame(self.root, text="Выбор сервера", padding=10)
         select_frame.pack(fill='x', padx=20, pady=5)
 
+        # Выбор секции - только для конфигов с несколькими секциями connect= (скрыт по умолчанию)
+        self.section_frame = ttk.Frame(select_frame)
+        ttk.Label(self.section_frame, text="Секция:").pack(side='left', padx=(0, 5))
+        self.section_var = tk.StringVar()
+        self.section_combo = ttk.Combobox(
+            self.section_frame, textvariable=self.section_var, state='readonly', width=40
+        )
+        self.section_combo.pack(side='left', fill='x', expand=True, padx=(0, 5))
+        self.section_combo.bind('<<ComboboxSelected>>', lambda e: self._on_section_selected())
+        self.pending_label = ttk.Label(self.section_frame, text="", foreground='gray')
+        self.pending_label.pack(side='left', padx=2)
+
         # Создаем фрейм для dropdown и кнопок
         dropdown_frame = ttk.Frame(select_frame)
         dropdown_frame.pack(fill='x')
+        self.dropdown_frame = dropdown_frame
 
         # Dropdown со списком серверов
         self.server_var = tk.StringVar()
 
-        # Определяем начальное состояние dropdown
-        initial_state = 'readonly' if self.manager.config_file_path else 'disabled'
-
+        # Dropdown активируется, когда известен путь к конфигу
         self.server_combo = ttk.Combobox(
             dropdown_frame,
             textvariable=self.server_var,
-            state=initial_state,
+            state='disabled',
             width=50
         )
         self.server_combo.pack(side='left', fill='x', expand=True, padx=(0, 5))
         self.server_combo.bind('<<ComboboxSelected>>', lambda e: self._on_server_selected())
+        # Ввод текста фильтрует список по IP, подписи и тегам
+        self.server_combo.bind('<KeyRelease>', self._on_server_typed)
+        self.server_combo.bind('<Return>', lambda e: self._on_filter_submit())
+        self.server_combo.bind('<Escape>', lambda e: self._clear_filter())
 
         # Кнопка сохранить
         self.save_btn = ttk.Button(dropdown_frame, text="Сохранить", command=self._change_server, width=12)
         self.save_btn.pack(side='left', padx=2)
 
         # Кнопка открыть лог
-        log_btn = ttk.Button(dropdown_frame, text="Лог", command=self._open_log, width=8)
-        log_btn.pack(side='left', padx=2)
+        self.log_btn = ttk.Button(dropdown_frame, text="Лог", command=self._open_log, width=8)
+        self.log_btn.pack(side='left', padx=2)
+
+        # История резервных копий конфига и откат
+        self.history_btn = ttk.Button(dropdown_frame, text="История", command=self._show_history, width=9)
+        self.history_btn.pack(side='left', padx=2)
+
+        # Замер задержки и переключение на самый быстрый сервер
+        probe_frame = ttk.Frame(select_frame)
+        probe_frame.pack(fill='x', pady=(5, 0))
+
+        self.probe_label = ttk.Label(probe_frame, text="", foreground='gray')
+        self.probe_label.pack(side='left', fill='x', expand=True)
+
+        self.fastest_btn = ttk.Button(
+            probe_frame, text="Самый быстрый", command=self._switch_to_fastest, width=16
+        )
+        self.fastest_btn.pack(side='right', padx=2)
+
+        self.probe_btn = ttk.Button(probe_frame, text="Замер", command=self._probe_servers, width=10)
+        self.probe_btn.pack(side='right', padx=2)
+
+        # Фоновый мониторинг текущего сервера с автоматическим переключением
+        self.monitor_var = tk.BooleanVar(value=False)
+        self.monitor_check = ttk.Checkbutton(
+            probe_frame, text="Автопереключение", variable=self.monitor_var,
+            command=self._toggle_monitor
+        )
+        self.monitor_check.pack(side='right', padx=2)
 
         # Прогресс-бар (скрыт по умолчанию)
         self.progress_frame = ttk.Frame(self.root)
@@ -334,35 +332,134 @@ class StunnelGUI:
         )
 
         if filename:
-            try:
-                self.manager.save_config_path(filename)
-                self.config_path_var.set(filename)
+            # settings.json может лежать на медленном сетевом диске - пишем в фоне
+            self.executor.submit(
+                self.manager.save_config_path, filename,
+                on_done=lambda _: self._on_config_path_saved(filename),
+                on_error=lambda e: messagebox.showerror("Ошибка", f"Не удалось сохранить путь:\n{e}")
+            )
+
+    def _on_config_path_saved(self, filename):
+        """Путь к конфигу сохранен: показать его и следить за новым файлом"""
+        self._show_config_path(filename)
+        self._start_config_watcher()
+        messagebox.showinfo("Успешно", f"Путь к конфигу сохранен:\n{filename}")
 
-                # Переключаем с placeholder на entry
-                self.config_placeholder.pack_forget()
-                self.config_entry.pack(fill='x', expand=True)
+    def _on_server_typed(self, event):
+        """Текст поля изменился: отфильтровать список по мере ввода"""
+        if event.keysym in self.NAVIGATION_KEYS:
+            return
+        query = self.server_var.get()
+        if query == self.filter_query:
+            return
+        self.filter_query = query
+        # Выбор - только запись каталога: введенный текст считается выбором, если это IP из каталога
+        self.selected_entry = self.catalog.get(query.strip())
+        self._refresh_server_list()
 
-                # Активируем dropdown
-                self.server_combo.config(state='readonly')
+    def _on_filter_submit(self):
+        """Enter в поле: выбрать единственный подходящий сервер"""
+        if self.filter_query and len(self.visible) == 1:
+            self._select_entry(self.visible[0])
 
-                self._update_current_server()
-                messagebox.showinfo("Успешно", f"Путь к конфигу сохранен:\n{filename}")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось сохранить путь:\n{e}")
+    def _clear_filter(self):
+        """Escape: сбросить фильтр и вернуть выбранный (или установленный) сервер"""
+        self.filter_query = ""
+        self._refresh_server_list(select_ip=self._selected_ip() or self.current_server_ip)
 
     def _on_server_selected(self):
         """Обработчик выбора сервера в dropdown"""
+        index = self.server_combo.current()
+        if 0 <= index < len(self.visible):
+            self._select_entry(self.visible[index])
+
+    def _select_entry(self, entry):
+        """Выбрать запись каталога (из списка, фильтра или замера)"""
+        self.filter_query = ""
+        self.selected_entry = entry
+        self._refresh_server_list(select_ip=entry.ip)
+        if self._section_mode():
+            # Сервер секции только запоминается - все изменения применяются одной операцией
+            section = self._selected_section()
+            selected_ip = self._selected_ip()
+            if section is not None and selected_ip:
+                if selected_ip == self.sections.get(section):
+                    self.pending.pop(section, None)
+                else:
+                    self.pending[section] = selected_ip
+                self._refresh_sections()
+                self._refresh_server_list(select_ip=selected_ip)
         self._update_save_button_state()
 
+    def _section_mode(self):
+        """Конфиг с несколькими секциями connect=: серверы выбираются по секциям"""
+        return len(self.sections) > 1
+
+    def _selected_section(self):
+        """Имя выбранной секции или None"""
+        index = self.section_combo.current()
+        names = list(self.sections)
+        return names[index] if 0 <= index < len(names) else None
+
+    def _section_label(self, name):
+        """Строка списка секций: имя, текущий сервер и выбранный"""
+        label = f"[{name}] {self.sections[name]}"
+        if name in self.pending:
+            label += f" -> {self.pending[name]}"
+        return label
+
+    def _update_sections(self, sections):
+        """Секции конфига прочитаны заново: обновить список, если он изменился"""
+        if sections == self.sections:
+            return
+        selected = self._selected_section()
+        self.sections = sections
+        # Выбор, совпавший с новым состоянием файла, больше не изменение
+        self.pending = {name: ip for name, ip in self.pending.items()
+                        if name in sections and sections[name] != ip and len(sections) > 1}
+        self._refresh_sections(selected)
+        if self._section_mode():
+            self._refresh_server_list(select_ip=self._section_target(self._selected_section()))
+        else:
+            self._refresh_server_list(select_ip=self.current_server_ip)
+
+    def _refresh_sections(self, select=None):
+        """Перестроить список секций; показать или скрыть выбор секции"""
+        if not self._section_mode():
+            self.section_frame.pack_forget()
+            self.save_btn.config(text="Сохранить")
+            self.root.geometry("600x260")
+            return
+
+        names = list(self.sections)
+        current = select if select in self.sections else self._selected_section()
+        self.section_combo['values'] = [self._section_label(name) for name in names]
+        self.section_combo.current(names.index(current) if current in self.sections else 0)
+        self.pending_label.config(text=f"Изменений: {len(self.pending)}" if self.pending else "")
+        self.save_btn.config(text="Применить")
+        if not self.section_frame.winfo_ismapped():
+            self.section_frame.pack(fill='x', pady=(0, 5), before=self.dropdown_frame)
+            self.root.geometry("600x295")
+
+    def _section_target(self, section):
+        """Сервер секции с учетом невыполненного выбора"""
+        return self.pending.get(section, self.sections.get(section))
+
+    def _on_section_selected(self):
+        """Выбрана секция: показать ее сервер (или выбранный для нее)"""
+        self._refresh_server_list(select_ip=self._section_target(self._selected_section()))
+
     def _update_save_button_state(self):
         """Обновить состояние кнопки сохранения"""
-        selected = self.server_var.get()
-        if not selected:
-            self.save_btn.config(state='disabled')
+        if self._section_mode():
+            state = 'normal' if self.pending and self.manager is not None else 'disabled'
+            self.save_btn.config(state=state)
             return
 
-        # Извлечь IP из выбранной строки
-        selected_ip = selected.split(' - ')[0].replace(' | Установлен', '')
+        selected_ip = self._selected_ip()
+        if not selected_ip or self.manager is None:
+            self.save_btn.config(state='disabled')
+            return
 
         # Если выбран тот же сервер что и установлен - disable
         if selected_ip == self.current_server_ip:
@@ -370,30 +467,199 @@ class StunnelGUI:
         else:
             self.save_btn.config(state='normal')
 
-    def _update_current_server(self):
-        """Обновить информацию о текущем сервере"""
+    def _server_label(self, ip):
+        """Строка dropdown для сервера: IP, описание, задержка и отметка установленного"""
+        label = f"{ip} - {self.catalog.label(ip)}"
+        result = self.probe_results.get(ip)
+        if result is not None:
+            label += f" [{result.summary()}]"
+        history = self.latency_history.get(ip)
+        if history is not None:
+            # За последний час, если в нем были замеры, иначе - за сутки
+            summary = history['hour'] if history['hour'].samples else history['day']
+            if summary.samples:
+                label += f" ({summary.text()})"
+        # В режиме секций отметка относится к выбранной секции
+        if self._section_mode():
+            installed = self.sections.get(self._selected_section())
+        else:
+            installed = self.current_server_ip
+        if ip == installed:
+            label += " | Установлен"
+        return label
+
+    def _start_config_watcher(self):
+        """Следить за файлом конфига (или переключиться на новый путь)"""
+        if not self.manager.config_file_path:
+            return
+        # Запуск наблюдателя обращается к диску (stat, inotify) - выполняется в пуле
+        if self.config_watcher is None:
+            self.config_watcher = ConfigWatcher(
+                self.manager.config_file_path, self._on_config_file_changed,
+                log=self.manager.log
+            )
+            self.executor.submit(self.config_watcher.start)
+        else:
+            self.executor.submit(self.config_watcher.set_path, self.manager.config_file_path)
+
+    def _on_config_file_changed(self, path):
+        """Конфиг изменился (поток наблюдателя): прочитать сервер и передать в поток Tk"""
         current_ip = self.manager.get_current_server()
+        sections = self.manager.get_section_servers()
+        self.executor.call_soon(self._update_current_server, current_ip)
+        self.executor.call_soon(self._update_sections, sections)
+
+    def _update_current_server(self, current_ip):
+        """Обновить информацию о текущем сервере, если он изменился"""
+        if current_ip == self.current_server_ip:
+            return
         self.current_server_ip = current_ip
+        if self._section_mode():
+            self._refresh_server_list(select_ip=self._section_target(self._selected_section()))
+        else:
+            self._refresh_server_list(select_ip=current_ip)
+
+    def _refresh_server_list(self, select_ip=None):
+        """Перестроить список dropdown без повторного чтения конфига
+
+        В списке - первые MAX_VISIBLE записей текущего фильтра: подписи строятся только для них.
+        """
+        self.visible = self.catalog_filter.update(self.filter_query, limit=self.MAX_VISIBLE)
+        self.server_combo['values'] = [self._server_label(entry.ip) for entry in self.visible]
+
+        if self.filter_query:
+            # Пользователь вводит запрос - текст поля не трогаем, показываем число совпадений
+            count = self.catalog_filter.count
+            text = f"Найдено: {count} из {len(self.catalog)}"
+            if count > self.MAX_VISIBLE:
+                text += f", показаны первые {self.MAX_VISIBLE}"
+            self.probe_label.config(text=text)
+        else:
+            # Устанавливаем выбранный (по умолчанию - текущий) сервер в dropdown
+            entry = self.catalog.get(select_ip) if select_ip else None
+            if entry is None and self.visible:
+                # Если сервер не определен, выбираем первый из списка
+                entry = self.visible[0]
+            self.selected_entry = entry
+            self.server_var.set(self._server_label(entry.ip) if entry is not None else "")
+
+        self._update_save_button_state()
+
+    def _selected_ip(self):
+        """IP выбранной записи каталога"""
+        return self.selected_entry.ip if self.selected_entry is not None else None
 
-        # Формируем список для dropdown
-        server_list = []
-        for ip, desc in StunnelManager.SERVERS.items():
-            if ip == current_ip:
-                server_list.append(f"{ip} - {desc} | Установлен")
-            else:
-                server_list.append(f"{ip} - {desc}")
+    def _probe_servers(self, on_done=None):
+        """Замерить задержку до серверов в фоне и показать результат в dropdown"""
+        if self.is_probing:
+            return
+        self.is_probing = True
+        self.probe_btn.config(state='disabled')
+        self.fastest_btn.config(state='disabled')
+        self.probe_label.config(text="Замер задержки...")
+
+        self.executor.submit(
+            self.manager.probe_servers,
+            on_done=lambda results: self._on_probe_done(results, on_done),
+            on_error=self._on_probe_error
+        )
 
-        self.server_combo['values'] = server_list
+    def _load_latency_history(self):
+        """Прочитать сводки истории задержки серверов каталога (агрегаты файлов, без замера)"""
+        self.executor.submit(self.manager.latency_summaries,
+                             on_done=self._on_latency_history,
+                             on_error=lambda e: self.manager.log(f"Ошибка чтения истории задержки: {e}"))
+
+    def _on_latency_history(self, summaries):
+        """Показать сводки истории в dropdown"""
+        self.latency_history = summaries
+        self._refresh_server_list(select_ip=self._selected_ip())
+
+    def _on_probe_error(self, error):
+        """Ошибка замера задержки"""
+        self.manager.log(f"Ошибка замера задержки: {error}")
+        self._on_probe_done({}, None)
+
+    def _on_probe_done(self, results, on_done):
+        """Обработка результатов замера"""
+        self.is_probing = False
+        self.probe_results = results
+        self.probe_btn.config(state='normal')
+        self.fastest_btn.config(state='normal')
+
+        best_ip = fastest(results)
+        if best_ip:
+            self.probe_label.config(text=f"Самый быстрый: {best_ip}")
+        else:
+            self.probe_label.config(text="Нет доступных серверов")
 
-        # Устанавливаем текущий сервер в dropdown
-        if current_ip and current_ip in StunnelManager.SERVERS:
-            description = StunnelManager.SERVERS.get(current_ip)
-            self.server_var.set(f"{current_ip} - {description} | Установлен")
-        elif server_list:
-            # Если сервер не определен, выбираем первый из списка
-            self.server_var.set(server_list[0])
+        self._refresh_server_list(select_ip=self._selected_ip())
+        # Замер записан в историю - сводки включают и его
+        self._load_latency_history()
 
-        self._update_save_button_state()
+        if on_done:
+            on_done(best_ip)
+
+    def _switch_to_fastest(self):
+        """Переключиться на самый быстрый сервер по свежему замеру"""
+        if self.is_processing:
+            return
+
+        def apply(best_ip):
+            if not best_ip:
+                messagebox.showerror("Ошибка", "Ни один сервер не отвечает!")
+                return
+            if self._section_mode():
+                # Для выбранной секции - как ручной выбор, применяется кнопкой "Применить"
+                entry = self.catalog.get(best_ip)
+                if entry is not None:
+                    self._select_entry(entry)
+                return
+            self._apply_server(best_ip)
+
+        self._probe_servers(on_done=apply)
+
+    def _toggle_monitor(self):
+        """Включить/выключить мониторинг и запомнить выбор"""
+        enabled = self.monitor_var.get()
+        self.executor.submit(
+            lambda: self.manager.save_settings(monitor_enabled=enabled),
+            on_error=lambda e: self.manager.log(f"Ошибка сохранения настроек: {e}")
+        )
+        if enabled:
+            self._start_monitor()
+        elif self.monitor is not None:
+            # stop() ждет завершения текущей проверки - не в потоке Tk
+            self.executor.submit(self.monitor.stop)
+            self.probe_label.config(text="Автопереключение выключено")
+
+    def _start_monitor(self):
+        """Запустить мониторинг; события передаются в поток Tk через очередь executor"""
+        if self.monitor is None:
+            self.monitor = HealthMonitor(
+                self.manager,
+                on_event=lambda event: self.executor.call_soon(self._on_monitor_event, event),
+                **self.manager.settings.get('monitor', {})
+            )
+        self.monitor.start()
+
+    def _on_monitor_event(self, event):
+        """Показать решение монитора; после переключения обновить текущий сервер"""
+        kind = event['event']
+        if kind == 'healthy':
+            self.probe_label.config(text=f"Сервер доступен: {event['latency_ms']} мс")
+        elif kind == 'degraded':
+            self.probe_label.config(text=f"Сервер деградирует ({event['failures']})")
+        elif kind == 'switched':
+            self.probe_label.config(text=f"Автопереключение: {event['previous']} -> {event['server']}")
+            if not self.is_processing:
+                self._update_current_server(event['server'])
+        elif kind == 'failover_blocked':
+            self.probe_label.config(text=f"Автопереключение отложено: {event['reason']}")
+        elif kind == 'no_candidate':
+            self.probe_label.config(text="Нет исправного резервного сервера")
+        elif kind == 'failover_failed':
+            self.probe_label.config(text=f"Ошибка автопереключения: {event['error']}")
 
     def _show_progress(self, message):
         """Показать прогресс-бар"""
@@ -404,36 +670,66 @@ class StunnelGUI:
     def _hide_progress(self):
         """Скрыть прогресс-бар"""
         self.progress_bar.stop()
+        self.progress_bar.config(mode='indeterminate', value=0)
         self.progress_frame.pack_forget()
 
+    def _on_drain_progress(self, count, initial, left):
+        """Ожидание завершения соединений: полоса - доля завершенных, подпись - сколько осталось"""
+        if not self.is_processing:
+            return
+        if count > self.manager.settings.get('drain_threshold', 0) and left > 0:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=max(initial, 1),
+                                     value=initial - count)
+            self.progress_label.config(text=f"Ожидание завершения соединений: {count} "
+                                            f"из {initial} (еще до {left:.0f} с)")
+        else:
+            # Ожидание закончено - дальше остановка и запуск службы
+            text = "Перезапуск службы..."
+            if count:
+                text += f" (разрывается соединений: {count})"
+            self.progress_bar.config(mode='indeterminate', value=0)
+            self.progress_bar.start(10)
+            self.progress_label.config(text=text)
+
     def _change_server(self):
         """Изменить сервер"""
         if self.is_processing:
             return
 
-        selected = self.server_var.get()
-        if not selected:
+        if self._section_mode():
+            self._apply_sections()
+            return
+
+        # Запись каталога, выбранная в списке (а не разбор текста поля)
+        new_ip = self._selected_ip()
+        if not new_ip:
             messagebox.showwarning("Предупреждение", "Выберите сервер из списка!")
             return
 
-        # Извлечь IP из строки "IP - описание" или "IP - описание | Установлен"
-        new_ip = selected.split(' - ')[0].replace(' | Установлен', '')
+        self._apply_server(new_ip)
 
-        if not self.manager.config_file_path or not os.path.exists(self.manager.config_file_path):
+    def _apply_server(self, new_ip):
+        """Подтвердить и выполнить смену сервера в отдельном потоке"""
+        if self.is_processing:
+            return
+
+        # Существование файла проверяет change_server в пуле - здесь только наличие пути
+        if not self.manager.config_file_path:
             messagebox.showerror("Ошибка", "Файл конфигурации не указан или не существует!\nВыберите файл через кнопку 'Обзор'")
             return
 
         # Подтверждение
-        current_ip = self.manager.get_current_server()
+        current_ip = self.current_server_ip
 
         if current_ip == new_ip:
             messagebox.showinfo("Информация", f"Сервер {new_ip} уже установлен!")
             return
 
-        description = StunnelManager.SERVERS.get(new_ip, "неизвестный")
+        description = self.catalog.label(new_ip)
         confirm = messagebox.askyesno(
             "Подтверждение",
-            f"Изменить сервер на:\n{new_ip} ({description})?\n\nСлужба Stunnel будет перезапущена."
+            f"Изменить сервер на:\n{new_ip} ({description})?\n\n{self._planned_text()}"
         )
 
         if not confirm:
@@ -444,24 +740,99 @@ class StunnelGUI:
         self.save_btn.config(state='disabled')
         self._show_progress("Изменение сервера...")
 
-        def change_in_thread():
-            try:
-                self.manager.change_server(new_ip)
-                self.root.after(0, lambda: self._on_change_success(new_ip, description))
-            except Exception as e:
-                self.root.after(0, lambda: self._on_change_error(e))
-
-        thread = threading.Thread(target=change_in_thread, daemon=True)
-        thread.start()
+        # Через очередь: одновременный запрос из другого окна или CLI не дает второй перезапуск
+        self.executor.submit(
+            self.coordinator.request, new_ip,
+            on_done=lambda result: self._on_change_success(result, description),
+            on_error=self._on_change_error
+        )
 
-    def _on_change_success(self, new_ip, description):
+    def _on_change_success(self, result, description):
         """Обработка успешного изменения сервера"""
         self._hide_progress()
         self.is_processing = False
-        self._update_current_server()
+        new_ip = result.applied
+        self._update_current_server(new_ip)
+        if result.superseded:
+            messagebox.showinfo(
+                "Информация",
+                f"Запрос на {result.requested} заменен более новым запросом.\n\n"
+                f"Текущий сервер: {new_ip} ({self.catalog.label(new_ip)})"
+            )
+            return
+
+        # Время от запуска службы до готовности туннеля принимать соединения
+        ready_time = self.manager.last_ready_time
+        ready_text = ""
+        if ready_time is not None:
+            ready_text = f"\nТуннель готов через {ready_time * 1000:.0f} мс."
+            self.probe_label.config(text=f"Время до готовности: {ready_time * 1000:.0f} мс")
         messagebox.showinfo(
             "Успешно",
-            f"Сервер успешно изменен на:\n{new_ip} ({description})\n\nСлужба перезапущена."
+            f"Сервер успешно изменен на:\n{new_ip} ({description})\n\n"
+            f"{self._strategy_text()}{ready_text}{self._drain_text()}"
+        )
+
+    def _planned_text(self, strategy=None):
+        """Что будет со службой при смене - по способу из настроек (switch_strategy)"""
+        strategy = strategy or self.manager.settings.get('switch_strategy',
+                                                         self.manager.DEFAULT_SWITCH_STRATEGY)
+        if strategy == 'reload':
+            return ("Служба Stunnel перечитает конфигурацию без перезапуска "
+                    "(если новый сервер не будет использоваться - перезапуск).")
+        return "Служба Stunnel будет перезапущена."
+
+    def _strategy_text(self):
+        """Что сделано со службой при последней смене или откате"""
+        return self.STRATEGY_TEXT.get(self.manager.last_switch_strategy,
+                                      "Служба без изменений.")
+
+    def _drain_text(self):
+        """Итог ожидания соединений для сообщения об успехе"""
+        drain = self.manager.last_drain
+        if drain is None or not drain.initial:
+            return ""
+        if drain.cut:
+            return f"\nРазорвано соединений: {drain.cut} из {drain.initial}."
+        return f"\nСоединения завершены за {drain.elapsed:.1f} с ({drain.initial})."
+
+    def _apply_sections(self):
+        """Применить серверы всех измененных секций одной операцией (в пуле)"""
+        if self.is_processing or not self.pending:
+            return
+        changes = dict(self.pending)
+        summary = "\n".join(f"[{name}] {self.sections.get(name)} -> {ip}"
+                            for name, ip in changes.items())
+        confirm = messagebox.askyesno(
+            "Подтверждение",
+            f"Изменить серверы секций ({len(changes)}):\n{summary}\n\n"
+            f"{self._planned_text()} Все секции применяются одной операцией."
+        )
+        if not confirm:
+            return
+
+        self.is_processing = True
+        self.save_btn.config(state='disabled')
+        self._show_progress(f"Изменение серверов секций ({len(changes)})...")
+        self.executor.submit(
+            self.manager.change_servers, changes,
+            on_done=lambda applied: self._on_sections_applied(changes, applied),
+            on_error=self._on_change_error
+        )
+
+    def _on_sections_applied(self, changes, applied):
+        """Серверы секций изменены"""
+        self._hide_progress()
+        self.is_processing = False
+        sections = dict(self.sections)
+        sections.update({name: ip for name, ip in changes.items() if name in sections})
+        self._update_sections(sections)
+        self._refresh_sections()
+        self._update_save_button_state()
+        messagebox.showinfo(
+            "Успешно",
+            f"Изменено секций: {len(applied)}.\n\n"
+            f"{self._strategy_text()}{self._drain_text()}"
         )
 
     def _on_change_error(self, error):
@@ -470,20 +841,82 @@ class StunnelGUI:
         self.is_processing = False
         messagebox.showerror("Ошибка", f"Не удалось изменить сервер:\n\n{error}\n\nПроверьте лог для деталей.")
 
-    def _open_log(self):
-        """Открыть текущий файл лога"""
-        if self.manager.log_file.exists():
-            os.startfile(self.manager.log_file)
-        else:
-            messagebox.showwarning("Предупреждение", "Файл лога не найден!")
+    def _show_history(self):
+        """Загрузить историю резервных копий в фоне и показать окно выбора версии"""
+        self.executor.submit(
+            self.manager.backup_history, on_done=self._open_history_window,
+            on_error=lambda e: messagebox.showerror("Ошибка", f"Не удалось прочитать историю:\n{e}")
+        )
 
+    def _open_history_window(self, entries):
+        """Окно истории: список версий и откат к выбранной"""
+        if not entries:
+            messagebox.showinfo("История", "Резервных копий пока нет")
+            return
 
-def is_admin():
-    """Проверить, запущена ли программа с правами администратора"""
-    try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
-    except:
-        return False
+        window = tk.Toplevel(self.root)
+        window.title("История конфигурации")
+        window.transient(self.root)
+        window.resizable(False, False)
+
+        listbox = tk.Listbox(window, width=70, height=min(len(entries), 15))
+        for number, entry in enumerate(entries, start=1):
+            upstream = entry.upstream or "сервер не определен"
+            listbox.insert('end', f"{number}. {entry.timestamp.replace('T', ' ')} - "
+                                  f"{upstream} ({entry.hash[:12]})")
+        listbox.selection_set(0)
+        listbox.pack(fill='both', padx=10, pady=(10, 5))
+
+        buttons = ttk.Frame(window)
+        buttons.pack(fill='x', padx=10, pady=(0, 10))
+        ttk.Button(buttons, text="Закрыть", command=window.destroy, width=10).pack(side='right', padx=2)
+        ttk.Button(
+            buttons, text="Откатить", width=10,
+            command=lambda: self._rollback(window, listbox.curselection(), entries)
+        ).pack(side='right', padx=2)
+
+    def _rollback(self, window, selection, entries):
+        """Подтвердить и откатить конфиг к выбранной версии"""
+        if self.is_processing or not selection:
+            return
+        version = selection[0] + 1
+        entry = entries[selection[0]]
+        confirm = messagebox.askyesno(
+            "Подтверждение",
+            f"Откатить конфигурацию к версии от {entry.timestamp.replace('T', ' ')}?\n"
+            f"Сервер: {entry.upstream or 'не определен'}\n\n{self._planned_text('restart')}",
+            parent=window
+        )
+        if not confirm:
+            return
+
+        window.destroy()
+        self.is_processing = True
+        self.save_btn.config(state='disabled')
+        self._show_progress("Откат конфигурации...")
+        self.executor.submit(
+            self.manager.rollback, version,
+            on_done=self._on_rollback_success,
+            on_error=self._on_change_error
+        )
+
+    def _on_rollback_success(self, entry):
+        """Обработка успешного отката (текущий сервер обновит наблюдатель за конфигом)"""
+        self._hide_progress()
+        self.is_processing = False
+        self._update_save_button_state()
+        messagebox.showinfo(
+            "Успешно",
+            f"Конфигурация откачена к версии от {entry.timestamp.replace('T', ' ')}.\n\n"
+            f"{self._strategy_text()}{self._drain_text()}"
+        )
+
+    def _open_log(self):
+        """Открыть окно лога (или показать уже открытое)"""
+        if self.log_viewer is not None and self.log_viewer.window.winfo_exists():
+            self.log_viewer.lift()
+            return
+        self.log_viewer = LogViewer(self.root, self.manager, self.executor)
 
 
 def run_as_admin():
@@ -0,0 +1,133 @@
+"""
+Выполнение операций GUI в фоновых потоках и контроль задержек главного цикла Tk
+"""
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, SimpleQueue
+
+from latency_probe import percentile
+
+
+class TaskExecutor:
+    """Пул потоков для дисковых и сетевых операций GUI
+
+    Результаты складываются в очередь, которую поток Tk разбирает через root.after():
+    обработчики on_done/on_error всегда выполняются в потоке Tk, а виджеты не трогаются
+    из других потоков.
+    """
+
+    def __init__(self, root, workers=4, poll_interval_ms=20, log=None):
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self.log = log
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="GuiTask")
+        self._results = SimpleQueue()
+        self._closed = False
+        self._after_id = self.root.after(self.poll_interval_ms, self._drain)
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        """Выполнить fn(*args) в пуле; on_done(result) / on_error(exception) - в потоке Tk"""
+        def run():
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self._results.put((on_error, e, True))
+            else:
+                self._results.put((on_done, result, False))
+
+        return self._pool.submit(run)
+
+    def call_soon(self, fn, *args):
+        """Вызвать fn(*args) в потоке Tk (можно вызывать из любого потока)"""
+        self._results.put((lambda packed: fn(*packed), args, False))
+
+    def _drain(self):
+        """Выполнить накопившиеся обработчики в потоке Tk"""
+        while True:
+            try:
+                callback, value, failed = self._results.get_nowait()
+            except Empty:
+                break
+            if callback is None:
+                if failed and self.log:
+                    self.log(f"Ошибка фоновой операции: {value}")
+                continue
+            try:
+                callback(value)
+            except Exception as e:
+                if self.log:
+                    self.log(f"Ошибка обработчика фоновой операции: {e}")
+        if not self._closed:
+            self._after_id = self.root.after(self.poll_interval_ms, self._drain)
+
+    def shutdown(self, wait=False):
+        """Остановить разбор очереди и пул потоков"""
+        self._closed = True
+        try:
+            self.root.after_cancel(self._after_id)
+        except Exception:
+            pass
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+class StallWatchdog:
+    """Замер задержек главного цикла Tk
+
+    Каждые interval_ms ставится таймер after(); опоздание срабатывания относительно
+    ожидаемого времени - время, на которое главный цикл был занят. Задержки больше
+    threshold_ms пишутся в лог.
+    """
+
+    def __init__(self, root, interval_ms=50, threshold_ms=50, log=None, history=1000):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.threshold_ms = threshold_ms
+        self.log = log
+        self.ticks = 0
+        self.stalls = 0
+        self.max_stall_ms = 0.0
+        self.recent = deque(maxlen=history)
+        self._expected = None
+        self._after_id = None
+
+    def start(self):
+        """Начать замеры"""
+        self._schedule()
+
+    def _schedule(self):
+        """Поставить следующий таймер"""
+        self._expected = time.perf_counter() + self.interval_ms / 1000
+        self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def _tick(self):
+        """Срабатывание таймера: записать опоздание"""
+        stall_ms = max((time.perf_counter() - self._expected) * 1000, 0.0)
+        self.ticks += 1
+        self.recent.append(stall_ms)
+        if stall_ms > self.max_stall_ms:
+            self.max_stall_ms = stall_ms
+        if stall_ms > self.threshold_ms:
+            self.stalls += 1
+            if self.log:
+                self.log(f"Интерфейс не отвечал {stall_ms:.0f} мс (порог {self.threshold_ms} мс)")
+        self._schedule()
+
+    def stop(self):
+        """Остановить замеры"""
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def summary(self):
+        """Сводка: число замеров, задержек выше порога, максимум и p99 последних замеров, мс"""
+        p99 = percentile(list(self.recent), 99) if self.recent else 0.0
+        return {
+            'ticks': self.ticks,
+            'stalls': self.stalls,
+            'max_ms': round(self.max_stall_ms, 1),
+            'p99_ms': round(p99, 1),
+        }
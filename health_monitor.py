@@ -0,0 +1,218 @@
+"""
+Фоновый мониторинг активного апстрима с автоматическим переключением на резервный сервер
+"""
+import threading
+import time
+from collections import deque
+
+
+class HealthMonitor:
+    """Периодическая проверка сервера из connect= и переключение при устойчивой деградации
+
+    Защита от "дребезга":
+    - переключение только после failure_threshold неудачных проверок подряд;
+    - кандидат должен пройти recovery_threshold успешных проверок подряд;
+    - после переключения действует пауза cooldown секунд;
+    - не более max_failovers_per_hour переключений за скользящий час.
+    Неудачная попытка переключения учитывается в паузе и лимите так же, как удачная.
+
+    Кандидаты проверяются одновременно (не больше probe_concurrency), и их не больше
+    max_candidates: при большом каталоге - недавние и избранные серверы, затем серверы
+    с наименьшей задержкой по истории замеров.
+    """
+
+    def __init__(self, manager, interval=30.0, failure_threshold=3, recovery_threshold=2,
+                 latency_budget_ms=None, cooldown=300.0, max_failovers_per_hour=3,
+                 probe_timeout=2.0, tls=False, targets=None, on_event=None,
+                 clock=time.monotonic, max_candidates=8, probe_concurrency=16):
+        self.manager = manager
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.recovery_threshold = recovery_threshold
+        self.latency_budget_ms = latency_budget_ms
+        self.cooldown = cooldown
+        self.max_failovers_per_hour = max_failovers_per_hour
+        self.probe_timeout = probe_timeout
+        self.tls = tls
+        self.max_candidates = max_candidates
+        self.probe_concurrency = probe_concurrency
+        # Адреса для проверки {ip: (host, port)} - в тестах подменяются на loopback
+        self.targets = targets
+        self.on_event = on_event
+        self.clock = clock
+
+        self.consecutive_failures = 0
+        self.last_failover = None
+        self.failover_times = deque()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _target(self, ip):
+        """Адрес проверки сервера"""
+        if self.targets and ip in self.targets:
+            return self.targets[ip]
+        return ip, self.manager.catalog.port(ip, self.manager.SERVER_PORT)
+
+    def _probe(self, ips, samples):
+        """Проверить серверы одновременно, samples попыток подряд каждый: {ip: ProbeResult}"""
+        from latency_probe import LatencyProber
+
+        prober = LatencyProber(samples=samples, timeout=self.probe_timeout, tls=self.tls,
+                               max_concurrency=self.probe_concurrency)
+        return prober.run({ip: self._target(ip) for ip in ips})
+
+    def _verdict(self, result, samples):
+        """(исправен, задержка мс или None, причина): все samples попыток успешны и в бюджете"""
+        kind = 'total' if self.tls else 'tcp'
+        values = getattr(result, f"{kind}_samples")
+        if len(values) < samples:
+            return False, None, result.errors[-1] if result.errors else "нет ответа"
+        latency = result.stats(kind)['median']
+        worst = max(values) * 1000
+        if self.latency_budget_ms is not None and worst > self.latency_budget_ms:
+            return False, latency, f"задержка {worst:.0f} мс > {self.latency_budget_ms:.0f} мс"
+        return True, latency, None
+
+    def _check(self, ip):
+        """Одна проверка сервера: (исправен, задержка мс или None, причина)"""
+        return self._verdict(self._probe([ip], 1)[ip], 1)
+
+    def _emit(self, event, **details):
+        """Записать решение в лог и передать его подписчику"""
+        details['event'] = event
+        text = ", ".join(f"{key}={value}" for key, value in details.items() if key != 'event')
+        self.manager.log(f"[Монитор] {event}: {text}")
+        if self.on_event:
+            self.on_event(details)
+        return details
+
+    def _failover_allowed(self, now):
+        """Проверить паузу после переключения и лимит переключений в час"""
+        while self.failover_times and now - self.failover_times[0] >= 3600:
+            self.failover_times.popleft()
+        if self.last_failover is not None and now - self.last_failover < self.cooldown:
+            return False, f"пауза после переключения ({self.cooldown:.0f} с)"
+        if len(self.failover_times) >= self.max_failovers_per_hour:
+            return False, f"лимит {self.max_failovers_per_hour} переключений в час"
+        return True, None
+
+    def _candidates(self, current_ip):
+        """Кандидаты в порядке каталога после текущего сервера, не больше max_candidates"""
+        servers = self.manager.catalog.ips()
+        start = servers.index(current_ip) + 1 if current_ip in servers else 0
+        ordered = [ip for ip in servers[start:] + servers[:start] if ip != current_ip]
+        if self.max_candidates is None or len(ordered) <= self.max_candidates:
+            return ordered
+
+        # Недавние и избранные, затем по медиане задержки за час, затем остальные
+        allowed = set(ordered)
+        preferred = [ip for ip in self.manager.latency_tracked_servers() if ip in allowed]
+        summaries = self.manager.latency_summaries(ordered)
+        measured = sorted((ip for ip, summary in summaries.items()
+                           if summary['hour'].p50 is not None),
+                          key=lambda ip: summaries[ip]['hour'].p50)
+        chosen = set()
+        for ip in preferred + measured + ordered:
+            if len(chosen) >= self.max_candidates:
+                break
+            chosen.add(ip)
+        return [ip for ip in ordered if ip in chosen]
+
+    def _pick_candidate(self, current_ip):
+        """Первый по порядку каталога кандидат, прошедший recovery_threshold проверок подряд"""
+        candidates = self._candidates(current_ip)
+        if not candidates:
+            return None
+        results = self._probe(candidates, self.recovery_threshold)
+        for ip in candidates:
+            healthy, _, reason = self._verdict(results[ip], self.recovery_threshold)
+            if healthy:
+                return ip
+            self._emit('candidate_rejected', server=ip, reason=reason)
+        return None
+
+    def check_once(self):
+        """Одна итерация мониторинга; вернуть событие-решение"""
+        current_ip = self.manager.get_current_server()
+        if current_ip is None:
+            return self._emit('skipped', reason="сервер в конфиге не определен")
+
+        healthy, latency, reason = self._check(current_ip)
+        if healthy:
+            if self.consecutive_failures:
+                self._emit('recovered', server=current_ip, failures=self.consecutive_failures)
+            self.consecutive_failures = 0
+            return self._emit('healthy', server=current_ip, latency_ms=round(latency, 1))
+
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.failure_threshold:
+            return self._emit('degraded', server=current_ip, reason=reason,
+                              failures=f"{self.consecutive_failures}/{self.failure_threshold}")
+
+        now = self.clock()
+        allowed, blocked_reason = self._failover_allowed(now)
+        if not allowed:
+            return self._emit('failover_blocked', server=current_ip, reason=blocked_reason)
+
+        candidate = self._pick_candidate(current_ip)
+        if candidate is None:
+            return self._emit('no_candidate', server=current_ip, reason=reason)
+
+        # Смена, начатая вручную, имеет приоритет - монитор ее не ждет и не перебивает
+        if not self.manager.switch_lock.acquire(blocking=False):
+            return self._emit('skipped', reason="выполняется смена сервера")
+        # Смену может выполнять и другой процесс (второе окно, CLI, планировщик)
+        if not self.manager.process_lock.acquire(timeout=0):
+            self.manager.switch_lock.release()
+            return self._emit('skipped', reason="смена сервера выполняется другим процессом")
+        try:
+            if self.manager.get_current_server() != current_ip:
+                self.consecutive_failures = 0
+                return self._emit('skipped', reason="сервер изменен во время проверки")
+            self._emit('failover', server=current_ip, target=candidate, reason=reason)
+            # Неудачная попытка тоже учитывается в паузе и лимите: иначе монитор
+            # перезапускал бы службу на каждой проверке
+            self.consecutive_failures = 0
+            self.last_failover = now
+            self.failover_times.append(now)
+            # В конфиге с несколькими секциями меняется только секция текущего сервера
+            self.manager.change_server(candidate, section=self.manager.get_primary_section())
+        except Exception as e:
+            return self._emit('failover_failed', server=current_ip, target=candidate, error=e)
+        finally:
+            self.manager.process_lock.release()
+            self.manager.switch_lock.release()
+
+        return self._emit('switched', server=candidate, previous=current_ip)
+
+    def _run(self):
+        """Цикл мониторинга до вызова stop()"""
+        while not self._stop.is_set():
+            try:
+                self.check_once()
+            except Exception as e:
+                self.manager.log(f"[Монитор] ОШИБКА проверки: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Запустить мониторинг в фоновом потоке"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="HealthMonitor", daemon=True)
+        self._thread.start()
+        self.manager.log(f"[Монитор] Запущен: интервал {self.interval} с, "
+                         f"порог {self.failure_threshold} ошибок")
+
+    def stop(self):
+        """Остановить мониторинг"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.probe_timeout * 3 + 1)
+            self._thread = None
+            self.manager.log("[Монитор] Остановлен")
+
+    @property
+    def running(self):
+        """Работает ли фоновый поток"""
+        return self._thread is not None and self._thread.is_alive()
@@ -0,0 +1,191 @@
+"""
+Асинхронный замер задержки до серверов stunnel (TCP connect + TLS handshake)
+"""
+import asyncio
+import math
+import ssl
+import statistics
+import time
+from dataclasses import dataclass, field
+
+
+DEFAULT_PORT = 443
+
+
+def percentile(samples, pct):
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@dataclass
+class ProbeResult:
+    """Результат замера одного сервера (время в секундах)"""
+    name: str
+    host: str
+    port: int
+    tcp_samples: list = field(default_factory=list)
+    tls_samples: list = field(default_factory=list)
+    total_samples: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+
+    @property
+    def reachable(self):
+        """Удалось ли хотя бы раз установить TCP соединение"""
+        return bool(self.tcp_samples)
+
+    @property
+    def tls_ok(self):
+        """Удалось ли хотя бы раз пройти TLS handshake"""
+        return bool(self.tls_samples)
+
+    def stats(self, kind='tcp'):
+        """Вернуть min/median/p95 в миллисекундах для 'tcp', 'tls' или 'total'"""
+        samples = {
+            'tcp': self.tcp_samples,
+            'tls': self.tls_samples,
+            'total': self.total_samples,
+        }[kind]
+        if not samples:
+            return None
+        return {
+            'min': min(samples) * 1000,
+            'median': statistics.median(samples) * 1000,
+            'p95': percentile(samples, 95) * 1000,
+        }
+
+    def sort_key(self):
+        """Ключ ранжирования: сначала доступные, затем с рабочим TLS, затем по медиане"""
+        if not self.reachable:
+            return (1, 1, math.inf)
+        kind = 'total' if self.tls_ok else 'tcp'
+        return (0, 0 if self.tls_ok else 1, self.stats(kind)['median'])
+
+    def summary(self):
+        """Короткая строка для отображения в интерфейсе"""
+        if not self.reachable:
+            return "недоступен"
+        tcp = self.stats('tcp')
+        text = f"{tcp['median']:.0f} мс (p95 {tcp['p95']:.0f})"
+        if self.tls_ok:
+            text += f", TLS {self.stats('tls')['median']:.0f} мс"
+        return text
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {
+            'name': self.name,
+            'host': self.host,
+            'port': self.port,
+            'reachable': self.reachable,
+            'tcp_ms': self.stats('tcp'),
+            'tls_ms': self.stats('tls'),
+            'errors': self.errors,
+        }
+
+
+class LatencyProber:
+    """Параллельный замер задержки до набора серверов через asyncio"""
+
+    def __init__(self, samples=3, timeout=2.0, tls=True, port=DEFAULT_PORT, ssl_context=None,
+                 max_concurrency=None):
+        self.samples = samples
+        self.timeout = timeout
+        self.tls = tls
+        self.port = port
+        # Сколько серверов замеряется одновременно (None - все): большой каталог не открывает
+        # тысячи соединений разом
+        self.max_concurrency = max_concurrency
+        self.ssl_context = ssl_context or self._default_ssl_context()
+
+    @staticmethod
+    def _default_ssl_context():
+        """Контекст без проверки сертификата - важно только время рукопожатия"""
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _normalize_targets(self, targets):
+        """Привести цели к виду {имя: (host, port)}"""
+        normalized = {}
+        for name, target in targets.items():
+            if isinstance(target, tuple):
+                normalized[name] = target
+            else:
+                normalized[name] = (target, self.port)
+        return normalized
+
+    async def _probe_once(self, result):
+        """Один замер: TCP connect и (опционально) TLS handshake"""
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(result.host, result.port),
+                self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            result.errors.append(f"tcp: {type(e).__name__}: {e}")
+            return
+        tcp_time = time.perf_counter() - start
+        result.tcp_samples.append(tcp_time)
+
+        if self.tls:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    writer.start_tls(self.ssl_context, server_hostname=result.host),
+                    self.timeout
+                )
+                tls_time = time.perf_counter() - start
+                result.tls_samples.append(tls_time)
+                result.total_samples.append(tcp_time + tls_time)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                result.errors.append(f"tls: {type(e).__name__}: {e}")
+                # После неудачного handshake корректное закрытие может зависнуть
+                writer.transport.abort()
+                return
+
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), self.timeout)
+        except (OSError, ssl.SSLError, asyncio.TimeoutError):
+            pass
+
+    async def _probe_target(self, name, host, port):
+        """Серия замеров одного сервера (последовательно, чтобы не мешать самим себе)"""
+        result = ProbeResult(name=name, host=host, port=port)
+        for _ in range(self.samples):
+            await self._probe_once(result)
+        return result
+
+    async def probe_all(self, targets):
+        """Замерить все цели одновременно; targets - {имя: host} или {имя: (host, port)}"""
+        normalized = self._normalize_targets(targets)
+        if self.max_concurrency:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def limited(name, host, port):
+                async with semaphore:
+                    return await self._probe_target(name, host, port)
+            probe = limited
+        else:
+            probe = self._probe_target
+        results = await asyncio.gather(*(
+            probe(name, host, port)
+            for name, (host, port) in normalized.items()
+        ))
+        return {result.name: result for result in results}
+
+    def run(self, targets):
+        """Синхронная обертка для вызова из рабочего потока"""
+        return asyncio.run(self.probe_all(targets))
+
+
+def fastest(results):
+    """Имя самого быстрого доступного сервера или None"""
+    candidates = [r for r in results.values() if r.reachable]
+    if not candidates:
+        return None
+    return min(candidates, key=ProbeResult.sort_key).name
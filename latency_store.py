@@ -0,0 +1,395 @@
+"""
+История задержки до серверов: кольцевые буферы замеров и агрегаты по минутам и часам (mmap)
+"""
+import math
+import mmap
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+
+MAGIC = 0x53544C47  # "GLTS"
+VERSION = 1
+HEADER_WORDS = 16
+# Корзины гистограммы: 0 - меньше 1 мс, k - [1.2^(k-1), 1.2^k) мс, последняя - все больше
+HISTOGRAM_BINS = 48
+HISTOGRAM_RATIO = 1.2
+_LOG_RATIO = math.log(HISTOGRAM_RATIO)
+# Слот агрегата: начало периода, успешных замеров, неудачных, гистограмма
+SLOT_WORDS = 3 + HISTOGRAM_BINS
+MINUTE_SLOTS = 60
+HOUR_SLOTS = 24
+# Неудачный замер в кольцевом буфере
+FAILED = 0xFFFFFFFF
+WINDOWS = {'hour': 3600, 'day': 86400}
+
+# Поля заголовка (номера 32-битных слов)
+_MAGIC, _VERSION, _CAPACITY, _BINS, _COUNT, _LAST = range(6)
+_EMPTY_SLOT = memoryview(bytes(4 * SLOT_WORDS)).cast('I')
+
+
+def bin_for(latency_ms):
+    """Номер корзины гистограммы для задержки в мс"""
+    if latency_ms < 1.0:
+        return 0
+    return min(HISTOGRAM_BINS - 1, int(math.log(latency_ms) / _LOG_RATIO) + 1)
+
+
+def bin_value(number):
+    """Оценка задержки корзины (мс): середина в логарифмической шкале"""
+    if number == 0:
+        return 0.5
+    if number == HISTOGRAM_BINS - 1:
+        return HISTOGRAM_RATIO ** (number - 1)
+    return HISTOGRAM_RATIO ** (number - 0.5)
+
+
+class LatencySummary:
+    """Сводка замеров сервера за окно: число замеров, p50/p95 (мс), доступность"""
+
+    __slots__ = ('window', 'samples', 'failures', 'p50', 'p95')
+
+    def __init__(self, window, samples=0, failures=0, p50=None, p95=None):
+        self.window = window
+        self.samples = samples
+        self.failures = failures
+        self.p50 = p50
+        self.p95 = p95
+
+    @classmethod
+    def from_histogram(cls, window, counts, failures):
+        """Сводка по сумме гистограмм слотов"""
+        total = sum(counts)
+        summary = cls(window, total + failures, failures)
+        if total:
+            summary.p50 = cls._quantile(counts, total, 0.5)
+            summary.p95 = cls._quantile(counts, total, 0.95)
+        return summary
+
+    @staticmethod
+    def _quantile(counts, total, q):
+        """Квантиль q по гистограмме: оценка корзины, в которую попадает замер ранга q"""
+        rank = max(1, math.ceil(q * total))
+        seen = 0
+        for number, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return bin_value(number)
+        return bin_value(len(counts) - 1)
+
+    @property
+    def availability(self):
+        """Доля успешных замеров (None - замеров не было)"""
+        if not self.samples:
+            return None
+        return (self.samples - self.failures) / self.samples
+
+    def text(self):
+        """Короткая строка для dropdown"""
+        label = {'hour': "час", 'day': "сутки"}.get(self.window, self.window)
+        if not self.samples:
+            return f"{label}: нет замеров"
+        if self.p50 is None:
+            return f"{label}: недоступен"
+        return f"{label}: {self.p50:.0f}/{self.p95:.0f} мс, {self.availability:.0%}"
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {
+            'window': self.window,
+            'samples': self.samples,
+            'failures': self.failures,
+            'p50_ms': None if self.p50 is None else round(self.p50, 1),
+            'p95_ms': None if self.p95 is None else round(self.p95, 1),
+            'availability': self.availability,
+        }
+
+    def __repr__(self):
+        return (f"LatencySummary({self.window}, samples={self.samples}, failures={self.failures}, "
+                f"p50={self.p50}, p95={self.p95})")
+
+
+class LatencySeries:
+    """Файл истории одного сервера, отображенный в память
+
+    Файл - массив 32-битных слов: заголовок, 60 минутных и 24 часовых слота агрегатов,
+    кольцевой буфер из capacity замеров (время, задержка в мкс). Добавление замера меняет
+    запись буфера и два слота; сводка за час/сутки читает только слоты - объем чтения
+    не зависит от длины истории.
+    """
+
+    def __init__(self, path, capacity=16384):
+        self.path = Path(path)
+        exists = self.path.exists() and self.path.stat().st_size > 0
+        with open(self.path, 'r+b' if exists else 'w+b') as f:
+            if exists:
+                capacity = self._read_capacity(f) or capacity
+            size = self._file_size(capacity)
+            if os.fstat(f.fileno()).st_size != size:
+                # Новый файл или файл другого формата - история начинается заново
+                exists = False
+                f.truncate(0)
+                f.truncate(size)
+            self._mmap = mmap.mmap(f.fileno(), size)
+        self._words = memoryview(self._mmap).cast('I')
+        if not exists:
+            self._words[_MAGIC] = MAGIC
+            self._words[_VERSION] = VERSION
+            self._words[_CAPACITY] = capacity
+            self._words[_BINS] = HISTOGRAM_BINS
+        self.capacity = capacity
+        self._minutes = HEADER_WORDS
+        self._hours = self._minutes + MINUTE_SLOTS * SLOT_WORDS
+        self._ring = self._hours + HOUR_SLOTS * SLOT_WORDS
+
+    @staticmethod
+    def _file_size(capacity):
+        """Размер файла в байтах: заголовок, слоты минут и часов, кольцевой буфер"""
+        return 4 * (HEADER_WORDS + (MINUTE_SLOTS + HOUR_SLOTS) * SLOT_WORDS + 2 * capacity)
+
+    @staticmethod
+    def _read_capacity(f):
+        """Емкость из заголовка существующего файла (None - чужой формат)"""
+        header = memoryview(f.read(4 * HEADER_WORDS)).cast('I')
+        if (len(header) == HEADER_WORDS and header[_MAGIC] == MAGIC
+                and header[_VERSION] == VERSION and header[_BINS] == HISTOGRAM_BINS):
+            return header[_CAPACITY]
+        return None
+
+    @property
+    def count(self):
+        """Сколько замеров добавлено за все время"""
+        return self._words[_COUNT]
+
+    @property
+    def last_time(self):
+        """Время последнего замера (секунды) или None"""
+        return self._words[_LAST] or None
+
+    def append(self, latency_ms, timestamp=None):
+        """Добавить замер; latency_ms=None - сервер не ответил"""
+        words = self._words
+        moment = int(time.time() if timestamp is None else timestamp)
+        count = words[_COUNT]
+        position = self._ring + 2 * (count % self.capacity)
+        words[position] = moment
+        if latency_ms is None:
+            words[position + 1] = FAILED
+            column = 2
+        else:
+            words[position + 1] = min(FAILED - 1, int(latency_ms * 1000))
+            column = 3 + bin_for(latency_ms)
+        words[_COUNT] = (count + 1) & FAILED
+        if moment > words[_LAST]:
+            words[_LAST] = moment
+        self._add(self._minutes, MINUTE_SLOTS, 60, moment, column)
+        self._add(self._hours, HOUR_SLOTS, 3600, moment, column)
+
+    def _add(self, base, slots, period, moment, column):
+        """Учесть замер в слоте своего периода (устаревший слот обнуляется)"""
+        words = self._words
+        start = moment - moment % period
+        slot = base + (moment // period % slots) * SLOT_WORDS
+        if words[slot] != start:
+            if words[slot] > start:
+                # Слот уже занят более новым периодом - замер старше окна агрегатов
+                return
+            words[slot:slot + SLOT_WORDS] = _EMPTY_SLOT
+            words[slot] = start
+        if column == 2:
+            words[slot + 2] += 1
+        else:
+            words[slot + 1] += 1
+            words[slot + column] += 1
+
+    def _merge(self, base, slots, since):
+        """Сумма слотов с началом периода не раньше since: (гистограмма, неудачных)"""
+        # Одно чтение всех слотов; слоты вне окна обнуляются в копии, суммы - по столбцам
+        region = self._words[base:base + slots * SLOT_WORDS].tolist()
+        for slot in range(0, slots * SLOT_WORDS, SLOT_WORDS):
+            if region[slot] < since:
+                region[slot:slot + SLOT_WORDS] = _EMPTY_SLOT
+        counts = [sum(region[column::SLOT_WORDS]) for column in range(3, SLOT_WORDS)]
+        return counts, sum(region[2::SLOT_WORDS])
+
+    def summary(self, window='hour', now=None):
+        """Сводка за последний час (минутные слоты) или сутки (текущий и 23 прошлых часа)"""
+        now = int(time.time() if now is None else now)
+        if window == 'hour':
+            counts, failures = self._merge(self._minutes, MINUTE_SLOTS, now - now % 60 - 3540)
+        elif window == 'day':
+            counts, failures = self._merge(self._hours, HOUR_SLOTS,
+                                           now - now % 3600 - 23 * 3600)
+        else:
+            raise ValueError(f"Неизвестное окно: {window} (hour или day)")
+        return LatencySummary.from_histogram(window, counts, failures)
+
+    def samples(self, since=None):
+        """Сохраненные замеры по времени: [(секунды, мс или None)]"""
+        words = self._words
+        count = words[_COUNT]
+        kept = min(count, self.capacity)
+        result = []
+        for index in range(count - kept, count):
+            position = self._ring + 2 * (index % self.capacity)
+            moment, value = words[position], words[position + 1]
+            if since is None or moment >= since:
+                result.append((moment, None if value == FAILED else value / 1000))
+        return result
+
+    def flush(self):
+        """Сбросить страницы на диск"""
+        self._mmap.flush()
+
+    def close(self):
+        """Освободить отображение файла"""
+        if self._mmap is not None:
+            self._words.release()
+            self._mmap.close()
+            self._mmap = None
+
+
+class LatencyStore:
+    """История задержки по серверам: latency/<сервер>.lts в каталоге приложения
+
+    Файл сервера создается при первом записанном замере и не растет: старые замеры
+    перезаписываются. Замеры серверов без файла можно не записывать (create в record).
+    """
+
+    SUFFIX = ".lts"
+
+    def __init__(self, directory, capacity=16384):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _path(self, server):
+        """Файл истории сервера (символы вне [\\w.-] заменяются на _)"""
+        return self.directory / (re.sub(r'[^\w.-]', '_', server) + self.SUFFIX)
+
+    def series(self, server, create=False):
+        """Файл истории сервера (None - замеров еще не было и create=False)"""
+        with self._lock:
+            series = self._series.get(server)
+            if series is None:
+                path = self._path(server)
+                if not create and not path.exists():
+                    return None
+                self.directory.mkdir(parents=True, exist_ok=True)
+                series = self._series[server] = LatencySeries(path, self.capacity)
+            return series
+
+    def record(self, server, latency_ms, timestamp=None, create=True):
+        """Добавить замер сервера; latency_ms=None - не ответил. Вернуть, записан ли замер
+
+        С create=False замер записывается, только если у сервера уже есть файл истории.
+        """
+        series = self.series(server, create=create)
+        if series is None:
+            return False
+        with self._lock:
+            series.append(latency_ms, timestamp)
+        return True
+
+    def record_results(self, results, timestamp=None, create=True):
+        """Добавить результаты LatencyProber: медиана TCP connect или неудача
+
+        create - True, False или набор серверов, для которых можно создать файл истории;
+        остальные серверы записываются, только если история у них уже есть.
+        """
+        for name, result in results.items():
+            stats = result.stats('tcp')
+            allowed = create if isinstance(create, bool) else name in create
+            self.record(name, stats['median'] if stats else None, timestamp, create=allowed)
+
+    def summaries(self, servers, now=None):
+        """{сервер: {'hour': LatencySummary, 'day': LatencySummary}} для серверов с историей"""
+        # Одно чтение каталога вместо проверки файла для каждого сервера каталога
+        try:
+            existing = {entry.name for entry in os.scandir(self.directory)}
+        except OSError:
+            existing = set()
+        result = {}
+        for server in servers:
+            if server not in self._series and self._path(server).name not in existing:
+                continue
+            series = self.series(server)
+            if series is not None:
+                with self._lock:
+                    result[server] = {window: series.summary(window, now) for window in WINDOWS}
+        return result
+
+    def flush(self):
+        """Сбросить страницы открытых файлов на диск"""
+        with self._lock:
+            for series in self._series.values():
+                series.flush()
+
+    def close(self):
+        """Закрыть файлы (изменения уже в страницах mmap - ОС запишет их сама)"""
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+            self._series.clear()
+
+
+class LatencySampler:
+    """Фоновый замер задержки раз в interval секунд (в LatencyStore)
+
+    Замеряются не все серверы каталога, а не больше max_servers из
+    StunnelManager.latency_tracked_servers(): текущий, избранные и недавно использованные.
+    Замер только TCP connect, одна попытка на сервер и без записи в лог - чтобы работать
+    все время, пока открыто приложение.
+    """
+
+    def __init__(self, manager, interval=60.0, timeout=2.0, max_servers=16, on_sample=None):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self.max_servers = max_servers
+        self.on_sample = on_sample
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample_once(self):
+        """Один замер отслеживаемых серверов; вернуть результаты замера"""
+        from latency_probe import LatencyProber
+
+        servers = self.manager.latency_tracked_servers(self.max_servers)
+        if not servers:
+            return {}
+        catalog = self.manager.catalog
+        prober = LatencyProber(samples=1, timeout=self.timeout, tls=False,
+                               max_concurrency=self.manager.settings.get('probe_concurrency', 64))
+        results = prober.run({ip: (ip, catalog.port(ip, self.manager.SERVER_PORT))
+                              for ip in servers})
+        self.manager.latency_store.record_results(results)
+        if self.on_sample:
+            self.on_sample(results)
+        return results
+
+    def _run(self):
+        """Цикл замеров до вызова stop()"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample_once()
+            except Exception as e:
+                self.manager.log(f"[История задержки] ОШИБКА замера: {e}")
+
+    def start(self):
+        """Запустить замеры в фоновом потоке (первый - через interval)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="LatencySampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановить замеры"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout + 1)
+            self._thread = None
@@ -0,0 +1,386 @@
+"""
+Нагрузочный тест через туннель: N одновременных соединений к порту accept stunnel,
+запросы HTTP (или эхо) по кругу, пропускная способность, доля ошибок и гистограмма задержки
+
+Все соединения обслуживает один цикл asyncio: тысячи соединений - без потоков на каждое.
+"""
+import asyncio
+import math
+import sys
+import time
+
+
+# Гистограмма: логарифмические корзины с шагом ~2% от 10 мкс до 100 с
+HISTOGRAM_MIN = 1e-5
+HISTOGRAM_MAX = 100.0
+HISTOGRAM_STEP = 1.02
+REPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+MODES = ('http', 'echo')
+
+
+class LatencyHistogram:
+    """Гистограмма задержки с постоянной памятью (логарифмические корзины)
+
+    Квантиль - верхняя граница корзины, погрешность не больше шага (2%). Гистограммы
+    соединений складываются (merge) без хранения отдельных замеров.
+    """
+
+    def __init__(self):
+        self._log_step = math.log(HISTOGRAM_STEP)
+        self.size = int(math.log(HISTOGRAM_MAX / HISTOGRAM_MIN) / self._log_step) + 2
+        self.counts = [0] * self.size
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        """Номер корзины значения (секунды)"""
+        if value <= HISTOGRAM_MIN:
+            return 0
+        return min(int(math.log(value / HISTOGRAM_MIN) / self._log_step) + 1, self.size - 1)
+
+    def _bound(self, index):
+        """Верхняя граница корзины, секунды"""
+        return HISTOGRAM_MIN * HISTOGRAM_STEP ** index
+
+    def record(self, value):
+        """Добавить замер (секунды)"""
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Добавить замеры другой гистограммы"""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def quantile(self, q):
+        """Квантиль (секунды) или None без замеров"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._bound(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        """Среднее (секунды) или None"""
+        return self.sum / self.count if self.count else None
+
+    def buckets(self, edges_ms=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)):
+        """Число замеров до каждой границы (мс) - для отчета"""
+        result = {}
+        for edge in edges_ms:
+            limit = self._index(edge / 1000)
+            result[edge] = sum(self.counts[:limit + 1])
+        result['+Inf'] = self.count
+        return result
+
+    def to_dict(self):
+        """Представление для JSON (миллисекунды)"""
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        data = {'count': self.count, 'mean_ms': ms(self.mean), 'min_ms': ms(self.min),
+                'max_ms': ms(self.max)}
+        for q in REPORT_QUANTILES:
+            data[f"p{q * 100:g}_ms"] = ms(self.quantile(q))
+        data['buckets_ms'] = self.buckets()
+        return data
+
+
+class LoadResult:
+    """Итог нагрузочного теста одного сервера"""
+
+    __slots__ = ('server', 'connections', 'duration', 'requests', 'errors', 'error_kinds',
+                 'statuses', 'bytes', 'latency', 'connect')
+
+    def __init__(self, server, connections):
+        self.server = server
+        self.connections = connections
+        self.duration = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.error_kinds = {}
+        self.statuses = {}
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+        self.connect = LatencyHistogram()
+
+    def error(self, kind):
+        """Учесть ошибку запроса или соединения"""
+        self.errors += 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+    @property
+    def throughput(self):
+        """Успешных запросов в секунду"""
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self):
+        """Доля ошибок среди всех попыток"""
+        total = self.requests + self.errors
+        return self.errors / total if total else 0.0
+
+    def summary(self):
+        """Короткая строка для вывода"""
+        p50, p99 = self.latency.quantile(0.5), self.latency.quantile(0.99)
+        text = (f"{self.throughput:.0f} запр/с, ошибок {self.error_rate:.1%}, "
+                f"{self.bytes / max(self.duration, 1e-9) / 1e6:.1f} МБ/с")
+        if p50 is not None:
+            text += f", p50 {p50 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс"
+        return text
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {
+            'server': self.server,
+            'connections': self.connections,
+            'duration_s': round(self.duration, 3),
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.error_rate, 5),
+            'error_kinds': self.error_kinds,
+            'statuses': self.statuses,
+            'throughput_rps': round(self.throughput, 1),
+            'megabytes_per_s': round(self.bytes / max(self.duration, 1e-9) / 1e6, 3),
+            'latency': self.latency.to_dict(),
+            'connect': self.connect.to_dict(),
+        }
+
+
+class LoadGenerator:
+    """Генератор нагрузки на адрес (host, port): connections соединений в течение duration
+
+    Каждое соединение в цикле отправляет запрос и ждет ответ (замкнутая модель). mode='http' -
+    GET path по HTTP/1.1 с keep-alive (ответ читается по Content-Length), 'echo' - payload
+    байт и столько же в ответ. Ошибка закрывает соединение, затем оно открывается заново.
+    Соединения открываются равномерно за ramp_up секунд, чтобы не переполнить backlog.
+    """
+
+    def __init__(self, host, port, connections=100, duration=10.0, mode='http', path='/',
+                 payload=64, timeout=5.0, ramp_up=1.0, keepalive=True, ssl_context=None,
+                 server_hostname=None):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим нагрузки: {mode}")
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.duration = duration
+        self.mode = mode
+        self.timeout = timeout
+        self.ramp_up = ramp_up
+        self.keepalive = keepalive
+        # TLS нужен только при нагрузке напрямую на сервер, а не на порт accept stunnel
+        self.ssl_context = ssl_context
+        self.server_hostname = server_hostname
+        connection = "keep-alive" if keepalive else "close"
+        self.request = (f"GET {path} HTTP/1.1\r\nHost: {server_hostname or host}\r\n"
+                        f"User-Agent: giis-srv-selector-loadtest\r\n"
+                        f"Connection: {connection}\r\n\r\n").encode('ascii')
+        self.payload = b"x" * payload
+
+    async def _open(self, result):
+        """Открыть соединение и учесть время подключения"""
+        start = time.perf_counter()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context,
+                                    server_hostname=self.server_hostname if self.ssl_context else None),
+            self.timeout
+        )
+        result.connect.record(time.perf_counter() - start)
+        return reader, writer
+
+    async def _http_exchange(self, reader, writer):
+        """Запрос HTTP и чтение ответа; вернуть (статус, байт, соединение можно продолжать)"""
+        writer.write(self.request)
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode('latin-1').split("\r\n")
+        parts = lines[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError("некорректный ответ HTTP")
+        status = int(parts[1])
+        headers = {}
+        for line in lines[1:]:
+            key, separator, value = line.partition(":")
+            if separator:
+                headers[key.strip().lower()] = value.strip()
+        size = len(head)
+        length = headers.get('content-length')
+        if length is not None:
+            body = await reader.readexactly(int(length))
+            size += len(body)
+            # HTTP/1.0 закрывает соединение после ответа, если не запрошено иное
+            connection = headers.get('connection', '').lower()
+            if parts[0] == 'HTTP/1.0':
+                reusable = connection == 'keep-alive'
+            else:
+                reusable = connection != 'close'
+        else:
+            # Без Content-Length тело - до закрытия соединения
+            size += len(await reader.read())
+            reusable = False
+        return status, size, reusable and self.keepalive
+
+    async def _echo_exchange(self, reader, writer):
+        """payload байт туда и обратно"""
+        writer.write(self.payload)
+        await writer.drain()
+        data = await reader.readexactly(len(self.payload))
+        return None, len(data), True
+
+    async def _worker(self, number, deadline, result):
+        """Одно соединение: запросы по кругу до deadline, при ошибке - новое соединение"""
+        if self.ramp_up and self.connections > 1:
+            await asyncio.sleep(self.ramp_up * number / self.connections)
+        exchange = self._http_exchange if self.mode == 'http' else self._echo_exchange
+        writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await self._open(result)
+                start = time.perf_counter()
+                status, size, reusable = await asyncio.wait_for(exchange(reader, writer),
+                                                                self.timeout)
+                elapsed = time.perf_counter() - start
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, ValueError) as e:
+                result.error(type(e).__name__)
+                if writer is not None:
+                    writer.transport.abort()
+                    writer = None
+                # Пауза перед переподключением, чтобы отказ сервера не превратился в шторм
+                await asyncio.sleep(min(0.05, max(0.0, deadline - time.perf_counter())))
+                continue
+
+            if status is not None:
+                result.statuses[status] = result.statuses.get(status, 0) + 1
+            if status is not None and status >= 500:
+                result.error(f"HTTP {status}")
+            else:
+                result.requests += 1
+                result.bytes += size
+                result.latency.record(elapsed)
+            if not reusable:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    async def run_async(self, server=None):
+        """Выполнить тест; вернуть LoadResult"""
+        raise_fd_limit(self.connections * 2 + 64)
+        result = LoadResult(server or f"{self.host}:{self.port}", self.connections)
+        start = time.perf_counter()
+        deadline = start + self.ramp_up + self.duration
+        await asyncio.gather(*(self._worker(number, deadline, result)
+                               for number in range(self.connections)))
+        result.duration = time.perf_counter() - start
+        return result
+
+    def run(self, server=None):
+        """Синхронная обертка для CLI и рабочих потоков"""
+        return asyncio.run(self.run_async(server))
+
+
+def raise_fd_limit(needed):
+    """Поднять мягкий лимит открытых файлов до needed (Unix); вернуть итоговый лимит"""
+    if sys.platform == 'win32':
+        return None
+    import resource
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def accept_ssl_context():
+    """TLS-контекст для порта accept в режиме сервера (сертификат туннеля не проверяется)"""
+    import ssl
+
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def compare_servers(manager, servers, strategy=None, on_result=None, **options):
+    """Нагрузка на каждый сервер по очереди через change_server; вернуть [LoadResult]
+
+    После теста восстанавливается исходный сервер. options - параметры LoadGenerator.
+    """
+    endpoint = manager.get_accept_endpoint()
+    if endpoint is None:
+        raise ValueError("В конфиге нет секции с accept= и connect=")
+    host, port, client = endpoint
+    if not client:
+        # Секция в режиме сервера: на порту accept ждут TLS
+        options.setdefault('ssl_context', accept_ssl_context())
+    original = manager.get_current_server()
+    results = []
+    try:
+        for ip in servers:
+            manager.log(f"[Нагрузка] Сервер {ip}: {options.get('connections', 100)} соединений")
+            try:
+                manager.change_server(ip, strategy=strategy)
+            except Exception as e:
+                result = LoadResult(ip, options.get('connections', 100))
+                result.error(f"смена сервера: {e}")
+                results.append(result)
+                if on_result:
+                    on_result(result)
+                continue
+            result = LoadGenerator(host, port, **options).run(server=ip)
+            manager.log(f"[Нагрузка] {ip}: {result.summary()}")
+            results.append(result)
+            if on_result:
+                on_result(result)
+    finally:
+        if original and manager.get_current_server() != original:
+            manager.change_server(original, strategy=strategy)
+    return results
+
+
+def comparison_table(results):
+    """Строки таблицы сравнения серверов"""
+    lines = [f"{'Сервер':<18}{'запр/с':>10}{'ошибок':>9}{'p50 мс':>9}{'p90 мс':>9}"
+             f"{'p99 мс':>9}{'макс мс':>9}"]
+    for result in results:
+        latency = result.latency
+
+        def ms(q):
+            value = latency.quantile(q)
+            return f"{value * 1000:.1f}" if value is not None else "-"
+
+        maximum = f"{latency.max * 1000:.1f}" if latency.max is not None else "-"
+        lines.append(f"{result.server:<18}{result.throughput:>10.0f}{result.error_rate:>9.1%}"
+                     f"{ms(0.5):>9}{ms(0.9):>9}{ms(0.99):>9}{maximum:>9}")
+    ranked = [r for r in results if r.requests]
+    if len(ranked) > 1:
+        best = min(ranked, key=lambda r: (r.error_rate, r.latency.quantile(0.99)))
+        lines.append(f"Лучший под нагрузкой: {best.server}")
+    return lines
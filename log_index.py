@@ -0,0 +1,575 @@
+"""
+Индекс файлов лога: смещения строк, время и списки строк по словам для поиска по истории
+
+Индекс каждого файла хранится в log_index/<имя файла>.idx: смещения начала строк, время
+строк (секунды) и номера строк для каждого слова. Файлы лога и индексов открываются через
+mmap - история в сотни МБ не читается целиком. Текущий лог индексируется по мере записи:
+читаются только дописанные байты.
+"""
+import array
+import bisect
+import json
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+INDEX_MAGIC = b"GLIX1\n"
+INDEX_SUFFIX = ".idx"
+# Слово строки лога - с буквы; IP-адрес - целиком
+TOKEN_PATTERN = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}|[^\W\d_]\w*")
+# Слово запроса: начало слова или начало IP ('195.209')
+QUERY_PATTERN = re.compile(r"\d[\d.]*|[^\W\d_]\w*")
+# Префикс строки LogWriter: "[2024-05-01 12:00:00] "
+TIME_LENGTH = 22
+SCAN_CHUNK = 1024 * 1024
+PREFIX_END = chr(0x10FFFF)
+
+
+def _align(value, size=8):
+    """Выровнять смещение секции индекса"""
+    return (value + size - 1) // size * size
+
+
+def _parse_time(stamp):
+    """Время из b'ГГГГ-ММ-ДД ЧЧ:ММ:СС' (секунды) или None"""
+    try:
+        return int(time.mktime((int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                                int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]),
+                                0, 0, -1)))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _contains(numbers, value):
+    """Есть ли value в отсортированной последовательности numbers"""
+    position = bisect.bisect_left(numbers, value)
+    return position < len(numbers) and numbers[position] == value
+
+
+def _message(text):
+    """Текст строки без метки времени"""
+    return text[TIME_LENGTH:] if text[:1] == "[" and text[20:21] == "]" else text
+
+
+def query_terms(query):
+    """Слова запроса в нижнем регистре"""
+    return QUERY_PATTERN.findall(query.lower())
+
+
+def parse_period(value, now=None):
+    """'30d', '12h', '90m', '2024-05-01' или '2024-05-01 12:00' -> время (секунды)"""
+    value = value.strip()
+    now = time.time() if now is None else now
+    units = {'d': 86400, 'h': 3600, 'm': 60}
+    if value[-1:].lower() in units and value[:-1].isdigit():
+        return now - int(value[:-1]) * units[value[-1:].lower()]
+    for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, pattern).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Неизвестный формат времени: {value} (примеры: 30d, 12h, 2024-05-01)")
+
+
+def start_of_day(days_ago=0):
+    """Начало дня days_ago дней назад (секунды)"""
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (day - timedelta(days=days_ago)).timestamp()
+
+
+class LogLine:
+    """Строка лога из индекса"""
+
+    __slots__ = ('path', 'number', 'timestamp', 'text')
+
+    def __init__(self, path, number, timestamp, text):
+        self.path = path
+        self.number = number
+        self.timestamp = timestamp
+        self.text = text
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {'file': self.path.name, 'line': self.number + 1, 'text': self.text}
+
+    def __repr__(self):
+        return f"LogLine({self.path.name}:{self.number + 1})"
+
+
+class LogSegment:
+    """Индекс одного файла лога
+
+    Прочитанный с диска индекс - представления memoryview поверх mmap файла .idx (без
+    копирования). Если файл лога дописан, индекс переводится в массивы в памяти
+    и дополняется только новыми строками.
+    """
+
+    def __init__(self, path, index_path):
+        self.path = Path(path)
+        self.index_path = Path(index_path)
+        self._index_map = None
+        self._index_views = []
+        self._reset()
+
+    def _reset(self):
+        """Пустой изменяемый индекс"""
+        self.size = 0
+        self.mtime_ns = 0
+        self.offsets = array.array('Q')
+        self.times = array.array('I')
+        # Изменяемый индекс: {слово: array('I')}; прочитанный - None и словарь в _vocab
+        self.postings = {}
+        self.dirty = False
+        # Слова изменяемого индекса по алфавиту (для поиска по началу слова)
+        self._sorted = None
+        self._tokens = None
+        self._vocab = None
+        self._postings_view = None
+        self._log_map = None
+
+    @classmethod
+    def open(cls, path, index_path):
+        """Индекс из файла .idx, если он соответствует логу, иначе пустой"""
+        segment = cls(path, index_path)
+        try:
+            segment._load()
+        except (OSError, ValueError, KeyError):
+            segment._release_index()
+            segment = cls(path, index_path)
+        return segment
+
+    def __len__(self):
+        # times дополняется последним - его длина не больше длины остальных массивов
+        return len(self.times)
+
+    @property
+    def first_time(self):
+        return self.times[0] if len(self.times) else None
+
+    @property
+    def last_time(self):
+        return self.times[-1] if len(self.times) else None
+
+    def _load(self):
+        """Прочитать индекс с диска через mmap"""
+        with open(self.index_path, 'rb') as f:
+            index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index_map = index_map
+        if index_map[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("не индекс лога")
+        start = len(INDEX_MAGIC) + 4
+        header_size = int.from_bytes(index_map[len(INDEX_MAGIC):start], 'little')
+        header = json.loads(index_map[start:start + header_size])
+        view = memoryview(index_map)
+        self._index_views.append(view)
+
+        def section(offset, count, code, size):
+            part = view[offset:offset + count * size].cast(code)
+            self._index_views.append(part)
+            return part
+
+        lines = header['lines']
+        self.size = header['size']
+        self.mtime_ns = header['mtime_ns']
+        self.offsets = section(header['offsets_at'], lines, 'Q', 8)
+        self.times = section(header['times_at'], lines, 'I', 4)
+        self._postings_view = section(header['postings_at'], header['postings'], 'I', 4)
+        self._vocab = (header['vocab_at'], header['vocab_size'])
+        self.postings = None
+
+    def _release_index(self):
+        """Освободить представления и mmap файла .idx"""
+        for view in reversed(self._index_views):
+            view.release()
+        self._index_views = []
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+
+    def _vocabulary(self):
+        """(слова по алфавиту, начало, число) прочитанного индекса - разбирается при первом поиске"""
+        if self._tokens is None:
+            offset, size = self._vocab
+            tokens, starts, counts = json.loads(self._index_map[offset:offset + size])
+            self._tokens = (tokens, array.array('I', starts), array.array('I', counts))
+        return self._tokens
+
+    def _thaw(self):
+        """Перевести прочитанный индекс в изменяемые массивы"""
+        tokens, starts, counts = self._vocabulary()
+        view = self._postings_view
+        self.postings = {token: array.array('I', view[start:start + count])
+                         for token, start, count in zip(tokens, starts, counts)}
+        self.offsets = array.array('Q', self.offsets)
+        self.times = array.array('I', self.times)
+        self._postings_view = None
+        self._vocab = None
+        self._tokens = None
+        self._release_index()
+
+    def update(self):
+        """Дочитать новые строки лога; вернуть их число (-1 - файл заменен и индекс построен заново)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        if stat.st_size == self.size:
+            return 0
+        rebuilt = stat.st_size < self.size
+        if rebuilt:
+            self._release_index()
+            self._reset()
+            self.dirty = True
+            if not stat.st_size:
+                return -1
+        elif self.postings is None:
+            self._thaw()
+
+        before = len(self.times)
+        with open(self.path, 'rb') as f:
+            log_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._scan(log_map, self.size, min(stat.st_size, len(log_map)))
+        finally:
+            log_map.close()
+        self.mtime_ns = stat.st_mtime_ns
+        # Строки читаются через mmap нового размера
+        self._log_map = None
+        self._sorted = None
+        self.dirty = True
+        return -1 if rebuilt else len(self.times) - before
+
+    def _scan(self, log_map, start, end):
+        """Проиндексировать полные строки [start, end) частями по SCAN_CHUNK"""
+        offsets, times, postings = self.offsets, self.times, self.postings
+        findall = TOKEN_PATTERN.findall
+        number = len(times)
+        last_stamp = None
+        last_time = times[-1] if number else 0
+        position = start
+        while position < end:
+            chunk = log_map[position:min(position + SCAN_CHUNK, end)]
+            cut = chunk.rfind(b"\n")
+            if cut < 0:
+                if position + len(chunk) < end:
+                    # Строка длиннее части - дочитываем до ее конца
+                    cut = log_map.find(b"\n", position, end) - position
+                    if cut < 0:
+                        break
+                    chunk = log_map[position:position + cut + 1]
+                else:
+                    # Незавершенная последняя строка - дождется следующего обновления
+                    break
+            chunk = chunk[:cut + 1]
+            line_start = position
+            for raw in chunk.split(b"\n")[:-1]:
+                offsets.append(line_start)
+                line_start += len(raw) + 1
+                text_at = 0
+                # Строка без метки времени (продолжение сообщения) получает время предыдущей
+                if raw[:1] == b"[" and raw[20:21] == b"]":
+                    stamp = raw[1:20]
+                    if stamp != last_stamp:
+                        parsed = _parse_time(stamp)
+                        if parsed is not None:
+                            last_stamp = stamp
+                            last_time = parsed
+                    if stamp == last_stamp:
+                        text_at = TIME_LENGTH
+                text = raw[text_at:].decode('utf-8', 'replace').lower()
+                for token in set(findall(text)):
+                    numbers = postings.get(token)
+                    if numbers is None:
+                        numbers = postings[token] = array.array('I')
+                    numbers.append(number)
+                times.append(last_time)
+                number += 1
+            position += cut + 1
+        self.size = position
+
+    def save(self):
+        """Записать индекс в .idx (атомарно: временный файл и замена)"""
+        tokens = sorted(self.postings)
+        starts, counts = [], []
+        total = 0
+        for token in tokens:
+            starts.append(total)
+            counts.append(len(self.postings[token]))
+            total += counts[-1]
+        vocab = json.dumps([tokens, starts, counts], ensure_ascii=False).encode('utf-8')
+
+        lines = len(self.times)
+        header = {'size': self.size, 'mtime_ns': self.mtime_ns, 'lines': lines,
+                  'postings': total, 'vocab_size': len(vocab)}
+        # Размер заголовка зависит от смещений секций - резерв под числа
+        probe = json.dumps(dict(header, offsets_at=10 ** 12, times_at=10 ** 12,
+                                postings_at=10 ** 12, vocab_at=10 ** 12)).encode()
+        base = _align(len(INDEX_MAGIC) + 4 + len(probe))
+        header['offsets_at'] = base
+        header['times_at'] = base + lines * 8
+        header['postings_at'] = _align(header['times_at'] + lines * 4)
+        header['vocab_at'] = header['postings_at'] + total * 4
+        encoded = json.dumps(header).encode().ljust(len(probe))
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Уникальный временный файл: тот же лог может индексировать и другой процесс (GUI и CLI)
+        fd, temp_path = tempfile.mkstemp(prefix='.' + self.index_path.name + '.', suffix='.tmp',
+                                         dir=self.index_path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(INDEX_MAGIC + len(encoded).to_bytes(4, 'little') + encoded)
+                f.write(b"\0" * (base - f.tell()))
+                f.write(self.offsets.tobytes())
+                f.write(self.times.tobytes())
+                f.write(b"\0" * (header['postings_at'] - f.tell()))
+                for token in tokens:
+                    f.write(self.postings[token].tobytes())
+                f.write(vocab)
+            os.replace(temp_path, self.index_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        self.dirty = False
+
+    def _term_postings(self, term):
+        """Списки строк (по возрастанию) всех слов, начинающихся с term"""
+        if self.postings is not None:
+            if self._sorted is None:
+                self._sorted = sorted(self.postings)
+            tokens = self._sorted
+            lo = bisect.bisect_left(tokens, term)
+            hi = bisect.bisect_left(tokens, term + PREFIX_END, lo)
+            return [self.postings[tokens[position]] for position in range(lo, hi)]
+        tokens, starts, counts = self._vocabulary()
+        lo = bisect.bisect_left(tokens, term)
+        hi = bisect.bisect_left(tokens, term + PREFIX_END, lo)
+        view = self._postings_view
+        return [view[starts[position]:starts[position] + counts[position]]
+                for position in range(lo, hi)]
+
+    def lines_for(self, terms):
+        """Номера строк, где есть слова, начинающиеся с каждого из terms (по возрастанию)
+
+        Пересечение начинается с самого редкого слова; кандидаты проверяются в длинных
+        списках частых слов двоичным поиском, без построения множества из них.
+        """
+        groups = sorted((self._term_postings(term) for term in terms),
+                        key=lambda group: sum(len(numbers) for numbers in group))
+        if not groups or not groups[0]:
+            return []
+        matched = set()
+        for numbers in groups[0]:
+            matched.update(numbers)
+        for group in groups[1:]:
+            if sum(len(numbers) for numbers in group) <= 8 * len(matched):
+                found = set()
+                for numbers in group:
+                    found.update(numbers)
+                matched &= found
+            else:
+                matched = {line for line in matched
+                           if any(_contains(numbers, line) for numbers in group)}
+            if not matched:
+                return []
+        return sorted(matched)
+
+    def time_range(self, since=None, until=None):
+        """Номера строк [lo, hi) со временем в интервале (время строк не убывает)"""
+        lo = 0 if since is None else bisect.bisect_left(self.times, since)
+        hi = len(self.times) if until is None else bisect.bisect_right(self.times, until)
+        return lo, max(lo, hi)
+
+    def text(self, number):
+        """Текст строки number из mmap файла лога"""
+        log_map = self._log_map
+        if log_map is None:
+            with open(self.path, 'rb') as f:
+                log_map = self._log_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.offsets[number]
+        end = self.offsets[number + 1] if number + 1 < len(self.offsets) else self.size
+        return log_map[start:end].rstrip(b"\r\n").decode('utf-8', 'replace')
+
+    def line(self, number):
+        """Строка number (LogLine)"""
+        return LogLine(self.path, number, self.times[number], self.text(number))
+
+    def close(self):
+        """Закрыть mmap лога и индекса"""
+        if self._log_map is not None:
+            self._log_map.close()
+            self._log_map = None
+        if self.postings is None:
+            self._tokens = None
+            self._postings_view = None
+            self.offsets = array.array('Q')
+            self.times = array.array('I')
+            self._release_index()
+
+
+class LogSelection:
+    """Строки нескольких файлов лога одной последовательностью - для виртуального списка
+
+    Хранятся только номера строк; текст читается из mmap при обращении к элементу.
+    """
+
+    def __init__(self, parts):
+        self.parts = [(segment, numbers) for segment, numbers in parts if len(numbers)]
+        self._starts = []
+        total = 0
+        for _, numbers in self.parts:
+            self._starts.append(total)
+            total += len(numbers)
+        self._total = total
+
+    def __len__(self):
+        return self._total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._total
+        if not 0 <= index < self._total:
+            raise IndexError(index)
+        part = bisect.bisect_right(self._starts, index) - 1
+        segment, numbers = self.parts[part]
+        return segment.line(numbers[index - self._starts[part]])
+
+    def files(self):
+        """Файлы, в которых есть строки выборки"""
+        return [segment.path for segment, _ in self.parts]
+
+
+class LogIndex:
+    """Индекс всех файлов лога каталога (prefix_*.log) с поиском по словам и времени
+
+    live - функция, возвращающая путь текущего файла лога: его индекс пишется на диск
+    только при close(), остальные - сразу после индексации.
+    """
+
+    def __init__(self, directory, prefix="stunnel_manager", suffix=".log", index_dir=None,
+                 live=None):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.suffix = suffix
+        self.index_dir = Path(index_dir) if index_dir else self.directory / "log_index"
+        self.live = live
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def _live_path(self):
+        return Path(self.live()) if self.live else None
+
+    def refresh(self):
+        """Найти новые и удаленные файлы, дочитать дописанные; вернуть число новых строк"""
+        with self._lock:
+            paths = sorted(self.directory.glob(f"{self.prefix}_*{self.suffix}"))
+            names = {path.name for path in paths}
+            for name in list(self._segments):
+                if name not in names:
+                    self._segments.pop(name).close()
+            live = self._live_path()
+            added = 0
+            for path in paths:
+                segment = self._segments.get(path.name)
+                if segment is None:
+                    segment = LogSegment.open(path, self.index_dir / (path.name + INDEX_SUFFIX))
+                    self._segments[path.name] = segment
+                lines = segment.update()
+                added += max(lines, 0)
+                if segment.dirty and path != live:
+                    try:
+                        segment.save()
+                    except OSError:
+                        # Windows: индекс открыт через mmap другим процессом - замена
+                        # не удалась, сегмент остается несохраненным до следующего раза
+                        pass
+            self._prune(names)
+            return added
+
+    def _prune(self, names):
+        """Удалить индексы файлов лога, которых больше нет"""
+        if not self.index_dir.exists():
+            return
+        for index_path in self.index_dir.glob(f"*{INDEX_SUFFIX}"):
+            if index_path.name[:-len(INDEX_SUFFIX)] not in names:
+                try:
+                    index_path.unlink()
+                except OSError:
+                    pass
+
+    def segments(self):
+        """Индексы файлов в порядке создания"""
+        return [self._segments[name] for name in sorted(self._segments)]
+
+    def segment(self, path):
+        """Индекс файла path или None"""
+        return self._segments.get(Path(path).name)
+
+    def search(self, query="", since=None, until=None, paths=None):
+        """Строки со всеми словами запроса (по началу слова) во временном интервале
+
+        paths - искать только в этих файлах. Без слов - все строки интервала. Числа без
+        точки в индекс не входят: они проверяются по тексту строк, найденных остальными словами.
+        """
+        terms = query_terms(query)
+        numeric = [re.compile(r"(?<![\d.])" + re.escape(term)) for term in terms if term.isdigit()]
+        terms = [term for term in terms if not term.isdigit()]
+        wanted = {Path(path).name for path in paths} if paths is not None else None
+        parts = []
+        with self._lock:
+            for segment in self.segments():
+                if wanted is not None and segment.path.name not in wanted:
+                    continue
+                if not len(segment):
+                    continue
+                if (since is not None and segment.last_time < since) or (
+                        until is not None and segment.first_time > until):
+                    continue
+                lo, hi = segment.time_range(since, until)
+                if terms:
+                    numbers = segment.lines_for(terms)
+                    if lo or hi < len(segment):
+                        numbers = numbers[bisect.bisect_left(numbers, lo):
+                                          bisect.bisect_left(numbers, hi)]
+                else:
+                    numbers = range(lo, hi)
+                if numeric:
+                    numbers = [number for number in numbers
+                               if all(pattern.search(_message(segment.text(number)))
+                                      for pattern in numeric)]
+                parts.append((segment, numbers))
+        return LogSelection(parts)
+
+    def stats(self):
+        """Число файлов, строк, размер логов и индексов (байт)"""
+        segments = self.segments()
+        index_bytes = 0
+        if self.index_dir.exists():
+            index_bytes = sum(path.stat().st_size
+                              for path in self.index_dir.glob(f"*{INDEX_SUFFIX}"))
+        return {
+            'files': len(segments),
+            'lines': sum(len(segment) for segment in segments),
+            'log_bytes': sum(segment.size for segment in segments),
+            'index_bytes': index_bytes,
+        }
+
+    def close(self):
+        """Записать индекс текущего лога и закрыть файлы"""
+        with self._lock:
+            for segment in self._segments.values():
+                if segment.dirty:
+                    try:
+                        segment.save()
+                    except OSError:
+                        pass
+                segment.close()
+            self._segments = {}
@@ -0,0 +1,297 @@
+"""
+Окно просмотра лога: текущий сеанс с дочитыванием, файлы истории и поиск по индексу
+"""
+import os
+import time
+import tkinter as tk
+from tkinter import font as tkfont, messagebox, ttk
+
+from log_index import start_of_day
+
+
+class VirtualList:
+    """Список, в котором отрисованы только видимые строки источника
+
+    Источник - любая последовательность (len и индексирование), например LogSelection
+    из миллионов строк: Listbox содержит только окно из rows строк, полоса прокрутки
+    управляет номером первой видимой строки.
+    """
+
+    def __init__(self, parent, width=110, height=25, format_row=str):
+        self.frame = ttk.Frame(parent)
+        self.listbox = tk.Listbox(self.frame, width=width, height=height, activestyle='none',
+                                  font=('Consolas', 9), selectmode='extended',
+                                  exportselection=False)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient='vertical', command=self._on_scroll)
+        self.scrollbar.pack(side='right', fill='y')
+        self.listbox.pack(side='left', fill='both', expand=True)
+        self.format_row = format_row
+        self.source = ()
+        self.first = 0
+        self.rows = height
+        # Прокручено до конца: новые строки источника сразу видны
+        self.follow = False
+        self._row_height = tkfont.Font(font=self.listbox['font']).metrics('linespace') + 1
+
+        self.listbox.bind('<Configure>', self._on_resize)
+        self.listbox.bind('<MouseWheel>', self._on_wheel)
+        self.listbox.bind('<Button-4>', self._on_wheel)
+        self.listbox.bind('<Button-5>', self._on_wheel)
+        self.listbox.bind('<Prior>', lambda e: self._scroll_by(-self.rows))
+        self.listbox.bind('<Next>', lambda e: self._scroll_by(self.rows))
+        self.listbox.bind('<Control-Home>', lambda e: self.scroll_to(0))
+        self.listbox.bind('<Control-End>', lambda e: self.scroll_to(len(self.source)))
+        self.listbox.bind('<Up>', lambda e: self._scroll_by(-1) if self._at_edge(0) else None)
+        self.listbox.bind('<Down>', lambda e: self._scroll_by(1) if self._at_edge(-1) else None)
+
+    def set_source(self, source, follow=None):
+        """Показать новый источник; follow=True - перейти к концу и следовать за ним"""
+        self.source = source
+        if follow is not None:
+            self.follow = follow
+        if self.follow:
+            self.first = max(0, len(source) - self.rows)
+        else:
+            self.first = max(0, min(self.first, len(source) - self.rows))
+        self._render()
+
+    def scroll_to(self, first):
+        """Сделать first первой видимой строкой"""
+        last_page = max(0, len(self.source) - self.rows)
+        self.first = max(0, min(first, last_page))
+        self.follow = self.first >= last_page
+        self._render()
+
+    def selected_rows(self):
+        """Отформатированные выделенные строки"""
+        return [self.listbox.get(index) for index in self.listbox.curselection()]
+
+    def _scroll_by(self, count):
+        self.scroll_to(self.first + count)
+        return 'break'
+
+    def _at_edge(self, position):
+        """Курсор на первой (0) или последней (-1) строке окна"""
+        active = self.listbox.index('active')
+        return active == (0 if position == 0 else self.listbox.size() - 1)
+
+    def _render(self):
+        """Заполнить Listbox строками окна [first, first + rows)"""
+        total = len(self.source)
+        end = min(total, self.first + self.rows)
+        rows = []
+        for index in range(self.first, end):
+            try:
+                rows.append(self.format_row(self.source[index]))
+            except (OSError, ValueError, IndexError) as e:
+                rows.append(f"<строка недоступна: {e}>")
+        self.listbox.delete(0, 'end')
+        if rows:
+            self.listbox.insert('end', *rows)
+        if total:
+            self.scrollbar.set(self.first / total, end / total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_scroll(self, action, value, unit=None):
+        """Команда полосы прокрутки: moveto доля / scroll n units|pages"""
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * len(self.source)))
+        elif action == 'scroll':
+            step = self.rows if unit == 'pages' else 1
+            self.scroll_to(self.first + int(value) * step)
+
+    def _on_wheel(self, event):
+        direction = -1 if event.num == 4 or event.delta > 0 else 1
+        return self._scroll_by(direction * 3)
+
+    def _on_resize(self, event):
+        rows = max(1, event.height // self._row_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.set_source(self.source)
+
+
+class LogViewer:
+    """Окно лога: дочитывание текущего сеанса, файлы истории и поиск по индексу
+
+    Индексация и поиск выполняются в пуле GUI; в окне отрисовываются только видимые строки.
+    """
+
+    POLL_MS = 1000
+    SEARCH_DELAY_MS = 250
+    CURRENT = "Текущий сеанс"
+    ALL = "Все файлы"
+    # (подпись, дней назад; 0 - с начала суток, None - без ограничения)
+    PERIODS = [("За все время", None), ("Сегодня", 0), ("7 дней", 7), ("30 дней", 30),
+               ("90 дней", 90)]
+
+    def __init__(self, root, manager, executor):
+        self.manager = manager
+        self.executor = executor
+        self.index = manager.log_index
+        self.files = []
+        self._busy = False
+        self._pending = False
+        self._poll_id = None
+        self._search_id = None
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Лог")
+        self.window.geometry("900x520")
+        self.window.minsize(600, 300)
+        self._create_widgets()
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.status.config(text="Индексация логов...")
+        self._reload(refresh=True, follow=True)
+        self._poll_id = self.window.after(self.POLL_MS, self._poll)
+
+    def _create_widgets(self):
+        """Панель поиска, список и строка состояния"""
+        bar = ttk.Frame(self.window)
+        bar.pack(fill='x', padx=8, pady=(8, 4))
+
+        self.scope_var = tk.StringVar(value=self.CURRENT)
+        self.scope_combo = ttk.Combobox(bar, textvariable=self.scope_var, state='readonly',
+                                        width=34, values=[self.CURRENT, self.ALL])
+        self.scope_combo.pack(side='left', padx=(0, 4))
+        self.scope_combo.bind('<<ComboboxSelected>>', lambda e: self._reload(follow=True))
+
+        self.period_var = tk.StringVar(value=self.PERIODS[0][0])
+        period_combo = ttk.Combobox(bar, textvariable=self.period_var, state='readonly', width=12,
+                                    values=[label for label, _ in self.PERIODS])
+        period_combo.pack(side='left', padx=4)
+        period_combo.bind('<<ComboboxSelected>>', lambda e: self._reload(follow=True))
+
+        self.query_var = tk.StringVar()
+        query_entry = ttk.Entry(bar, textvariable=self.query_var, width=30)
+        query_entry.pack(side='left', fill='x', expand=True, padx=4)
+        query_entry.bind('<KeyRelease>', self._on_query_typed)
+        query_entry.bind('<Return>', lambda e: self._reload(follow=True))
+        query_entry.bind('<Escape>', lambda e: (self.query_var.set(""), self._reload(follow=True)))
+        query_entry.focus_set()
+
+        self.open_btn = ttk.Button(bar, text="Открыть файл", command=self._open_file, width=14)
+        self.open_btn.pack(side='right', padx=(4, 0))
+        if not hasattr(os, 'startfile'):
+            self.open_btn.config(state='disabled')
+
+        self.list = VirtualList(self.window, format_row=lambda line: line.text)
+        self.list.frame.pack(fill='both', expand=True, padx=8)
+        self.list.listbox.bind('<Control-c>', self._copy_rows)
+
+        self.status = ttk.Label(self.window, text="", foreground='gray')
+        self.status.pack(fill='x', padx=8, pady=(4, 8))
+
+    def _since(self):
+        """Начало выбранного периода (секунды) или None"""
+        days = dict(self.PERIODS).get(self.period_var.get())
+        if days is None:
+            return None
+        return start_of_day() if days == 0 else time.time() - days * 86400
+
+    def _paths(self):
+        """Файлы выбранной области поиска (None - все)"""
+        scope = self.scope_var.get()
+        if scope == self.CURRENT:
+            return [self.manager.log_file]
+        if scope == self.ALL:
+            return None
+        labels = self.scope_combo['values']
+        position = list(labels).index(scope) - 2 if scope in labels else -1
+        return [self.files[position]] if 0 <= position < len(self.files) else None
+
+    def _reload(self, refresh=False, follow=None):
+        """Обновить индекс (refresh) и выполнить поиск в пуле"""
+        if self._busy:
+            self._pending = True
+            return
+        self._busy = True
+        self.executor.submit(self._load, refresh, self.query_var.get(), self._since(),
+                             self._paths(), on_done=lambda result: self._on_loaded(result, follow),
+                             on_error=self._on_load_error)
+
+    def _load(self, refresh, query, since, paths):
+        """Дочитать логи и найти строки (в пуле); вернуть (выборка, файлы, мс поиска, статистика)"""
+        if refresh:
+            self.index.refresh()
+        start = time.perf_counter()
+        selection = self.index.search(query, since=since, paths=paths)
+        elapsed = (time.perf_counter() - start) * 1000
+        files = [segment.path for segment in self.index.segments()]
+        return selection, files, elapsed, self.index.stats()
+
+    def _on_loaded(self, result, follow):
+        """Показать результат поиска"""
+        self._busy = False
+        if not self.window.winfo_exists():
+            return
+        selection, files, elapsed, stats = result
+        if files != self.files:
+            self.files = files
+            self.scope_combo['values'] = [self.CURRENT, self.ALL] + [path.name for path in files]
+        self.list.set_source(selection, follow=follow)
+        text = f"Строк: {len(selection)} ({elapsed:.1f} мс)"
+        if self.query_var.get().strip():
+            text += f" в {len(selection.files())} файлах"
+        text += (f" | в истории: файлов {stats['files']}, строк {stats['lines']}, "
+                 f"{stats['log_bytes'] / 1e6:.1f} МБ")
+        self.status.config(text=text)
+        if self._pending:
+            self._pending = False
+            self._reload(follow=True)
+
+    def _on_load_error(self, error):
+        self._busy = False
+        if self.window.winfo_exists():
+            self.status.config(text=f"Ошибка чтения лога: {error}")
+
+    def _poll(self):
+        """Дочитать новые строки; окно, прокрученное до конца, следует за ними"""
+        if not self._busy:
+            self._reload(refresh=True)
+        self._poll_id = self.window.after(self.POLL_MS, self._poll)
+
+    def _on_query_typed(self, event):
+        """Поиск по мере ввода - после паузы SEARCH_DELAY_MS"""
+        if event.keysym in ('Return', 'Escape'):
+            return
+        if self._search_id is not None:
+            self.window.after_cancel(self._search_id)
+        self._search_id = self.window.after(self.SEARCH_DELAY_MS, self._search_typed)
+
+    def _search_typed(self):
+        self._search_id = None
+        self._reload(follow=True)
+
+    def _copy_rows(self, event):
+        """Скопировать выделенные строки в буфер обмена"""
+        rows = self.list.selected_rows()
+        if rows:
+            self.window.clipboard_clear()
+            self.window.clipboard_append("\n".join(rows))
+        return 'break'
+
+    def _open_file(self):
+        """Открыть файл выбранной области во внешнем редакторе"""
+        paths = self._paths() or [self.manager.log_file]
+        self.executor.submit(self._open_path, paths[0], on_error=lambda e: messagebox.showerror(
+            "Ошибка", f"Не удалось открыть файл лога:\n{e}", parent=self.window))
+
+    def _open_path(self, path):
+        """Сбросить лог на диск и открыть файл (в пуле)"""
+        self.manager.flush_log()
+        os.startfile(path)
+
+    def lift(self):
+        """Показать уже открытое окно"""
+        self.window.deiconify()
+        self.window.lift()
+
+    def close(self):
+        """Закрыть окно (индекс остается у менеджера до завершения программы)"""
+        for after_id in (self._poll_id, self._search_id):
+            if after_id is not None:
+                self.window.after_cancel(after_id)
+        self.window.destroy()
@@ -0,0 +1,151 @@
+"""
+Фоновая пакетная запись лога с ротацией по размеру и очисткой старых файлов
+"""
+import atexit
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class _FlushRequest:
+    """Маркер в очереди: записать накопленное и сообщить об этом"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_CLOSE = object()
+
+
+class LogWriter:
+    """Запись строк лога через очередь и один долгоживущий буферизованный файл"""
+
+    def __init__(self, directory, prefix="stunnel_manager", flush_interval=0.5, batch_size=64,
+                 max_bytes=5 * 1024 * 1024, max_age_days=30, max_files=20, suffix=".log"):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.suffix = suffix
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.max_files = max_files
+
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._handle = None
+        self.path = None
+        self._open_new_file()
+        self.cleanup()
+
+        self._thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _open_new_file(self):
+        """Открыть новый файл лога с временной меткой в имени"""
+        if self._handle is not None:
+            self._handle.close()
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = self.directory / f"{self.prefix}_{timestamp}{self.suffix}"
+        counter = 1
+        while path.exists():
+            path = self.directory / f"{self.prefix}_{timestamp}_{counter}{self.suffix}"
+            counter += 1
+        self._handle = open(path, 'ab', buffering=64 * 1024)
+        self._size = 0
+        self.path = path
+
+    def cleanup(self):
+        """Удалить файлы логов старше max_age_days и сверх max_files (кроме текущего)
+
+        Файлы может удалять и другой процесс (GUI и CLI пишут в один каталог): каждый
+        файл читается stat() один раз, исчезнувшие пропускаются.
+        """
+        files = []
+        for path in self.directory.glob(f"{self.prefix}_*{self.suffix}"):
+            if path == self.path:
+                continue
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+        cutoff = time.time() - self.max_age_days * 86400
+        for index, (mtime, path) in enumerate(files):
+            # Текущий файл тоже занимает место в лимите max_files
+            if index + 1 >= self.max_files or mtime < cutoff:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def write(self, line):
+        """Поставить строку в очередь на запись (не блокирует вызывающий поток)"""
+        if not self._closed:
+            self._queue.put(line)
+
+    def flush(self, timeout=5.0):
+        """Дождаться записи на диск всех ранее поставленных строк"""
+        if self._closed or not self._thread.is_alive():
+            return
+        request = _FlushRequest()
+        self._queue.put(request)
+        request.done.wait(timeout)
+
+    def close(self):
+        """Записать остаток очереди и закрыть файл"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join(timeout=5.0)
+
+    def _write_batch(self, batch):
+        """Записать пакет строк и сбросить буфер на диск"""
+        if not batch:
+            return
+        try:
+            data = ('\n'.join(batch) + '\n').encode('utf-8')
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._open_new_file()
+                self.cleanup()
+            self._handle.write(data)
+            self._handle.flush()
+            self._size += len(data)
+        except Exception as e:
+            print(f"Ошибка записи в лог: {e}", file=sys.stderr)
+        batch.clear()
+
+    def _run(self):
+        """Цикл записи: пакет пишется по размеру или по истечении flush_interval"""
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write_batch(batch)
+                deadline = None
+                continue
+
+            if item is _CLOSE:
+                self._write_batch(batch)
+                self._handle.close()
+                return
+            if isinstance(item, _FlushRequest):
+                self._write_batch(batch)
+                deadline = None
+                item.done.set()
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                deadline = None
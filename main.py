@@ -1,6 +1,10 @@
-def main():
-    print("Hello from giis-srv-selector!")
+"""
+Точка входа: без аргументов - GUI, с командой - консольный интерфейс (см. cli.py)
+"""
+import sys
+
+from cli import main
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
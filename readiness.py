@@ -0,0 +1,140 @@
+"""
+Ожидание готовности stunnel после запуска: опрос порта accept и проверка апстрима через туннель
+"""
+import socket
+import time
+
+
+DEFAULT_UPSTREAM_PAYLOAD = b"HEAD / HTTP/1.0\r\n\r\n"
+
+
+class ReadyResult:
+    """Результат ожидания готовности"""
+
+    def __init__(self, ready, elapsed, attempts, error=None):
+        self.ready = ready
+        self.elapsed = elapsed
+        self.attempts = attempts
+        self.error = error
+
+    def __repr__(self):
+        return (f"ReadyResult(ready={self.ready}, elapsed={self.elapsed:.3f}, "
+                f"attempts={self.attempts}, error={self.error!r})")
+
+
+def parse_endpoint(value, default_host='127.0.0.1'):
+    """Разобрать значение accept/connect stunnel: '1501', 'host:1501', '[::1]:1501'"""
+    value = value.strip()
+    if ':' not in value:
+        return default_host, int(value)
+    host, port = value.rsplit(':', 1)
+    host = host.strip('[]')
+    # Слушающий на всех интерфейсах порт проверяем через loopback
+    if host in ('', '0.0.0.0', '::', '*'):
+        host = default_host
+    return host, int(port)
+
+
+def wait_for_port(host, port, timeout=15.0, initial_delay=0.02, max_delay=1.0, factor=2.0,
+                  connect_timeout=0.5):
+    """Опрашивать порт с экспоненциальной задержкой, пока он не начнет принимать соединения"""
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = initial_delay
+    attempts = 0
+    error = None
+
+    while True:
+        attempts += 1
+        remaining = deadline - time.monotonic()
+        try:
+            with socket.create_connection((host, port), min(connect_timeout, max(remaining, 0.01))):
+                return ReadyResult(True, time.monotonic() - start, attempts)
+        except OSError as e:
+            error = e
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return ReadyResult(False, time.monotonic() - start, attempts, error)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+def check_upstream(host, port, timeout=5.0, tls=False, payload=DEFAULT_UPSTREAM_PAYLOAD):
+    """Проверить, что апстрим отвечает через туннель
+
+    Для клиентского туннеля (client = yes) отправляется payload и ожидается хотя бы один байт
+    ответа: stunnel закрывает соединение без данных, если не смог подключиться к апстриму
+    или пройти с ним TLS handshake. Для серверного туннеля (tls=True) проверяется handshake
+    на порту accept.
+    """
+    start = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout) as sock:
+            sock.settimeout(timeout)
+            if tls:
+                # ssl нужен только для серверных туннелей - не загружаем его заранее
+                import ssl
+
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                with context.wrap_socket(sock, server_hostname=host):
+                    return ReadyResult(True, time.monotonic() - start, 1)
+            sock.sendall(payload)
+            if sock.recv(1):
+                return ReadyResult(True, time.monotonic() - start, 1)
+            return ReadyResult(False, time.monotonic() - start, 1,
+                               ConnectionError("туннель закрыл соединение без ответа"))
+    except OSError as e:  # включая ssl.SSLError
+        return ReadyResult(False, time.monotonic() - start, 1, e)
+
+
+def wait_for_upstream(host, port, upstream, timeout=2.0, tls=False, connections=None,
+                      poll_interval=0.02):
+    """Проверить, что новое соединение через туннель идет на один из адресов upstream
+
+    Открывается соединение с портом accept, и по таблице соединений ОС (connections -
+    connection_drain.remote_connections) ждется новое соединение службы с апстримом upstream
+    ({(ip, порт)}). Порт accept при перезагрузке конфига не закрывается, и ответ через туннель
+    не говорит, какой апстрим его дал, - а соединение с адресом сервера говорит.
+    Результат error=NotImplementedError - ОС не поддерживается.
+    """
+    if connections is None:
+        from connection_drain import remote_connections as connections
+
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        before = connections(upstream)
+        if before is None:
+            return ReadyResult(False, 0.0, 0,
+                               NotImplementedError("подсчет соединений не поддерживается"))
+        attempts = 0
+        sock = socket.create_connection((host, port), timeout)
+        if tls:
+            # Серверный туннель подключается к апстриму после TLS handshake
+            import ssl
+
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            sock.settimeout(timeout)
+            try:
+                sock = context.wrap_socket(sock, server_hostname=host)
+            except OSError:
+                sock.close()
+                raise
+        with sock:
+            while True:
+                attempts += 1
+                current = connections(upstream)
+                if any(current[endpoint] - before[endpoint] for endpoint in current):
+                    return ReadyResult(True, time.monotonic() - start, attempts)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return ReadyResult(False, time.monotonic() - start, attempts, ConnectionError(
+                        "служба не подключилась к новому апстриму"))
+                time.sleep(min(poll_interval, remaining))
+    except OSError as e:
+        return ReadyResult(False, time.monotonic() - start, 1, e)
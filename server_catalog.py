@@ -0,0 +1,241 @@
+"""
+Каталог серверов: загрузка из JSON/TOML, индекс префиксов IP и слов подписи, инкрементальный фильтр
+
+Формат файла (JSON):
+    {"servers": [{"ip": "195.209.130.9", "label": "промышленный контур", "tags": ["prod"], "port": 443}]}
+TOML:
+    [[servers]]
+    ip = "195.209.130.9"
+    label = "промышленный контур"
+    tags = ["prod"]
+"""
+import json
+import os
+import re
+from array import array
+from bisect import bisect_left
+
+
+# Слова подписи: буквы и цифры, разделители - все остальное
+WORD_SPLIT = re.compile(r"[^\w.]+")
+# Больше любого символа ключа: token + PREFIX_END - граница диапазона ключей с префиксом token
+PREFIX_END = chr(0x10FFFF)
+
+
+class ServerEntry:
+    """Запись каталога"""
+
+    __slots__ = ('ip', 'label', 'tags', 'port', 'index', 'keys')
+
+    def __init__(self, ip, label='', tags=(), port=443, index=0):
+        self.ip = ip
+        self.label = label
+        self.tags = tuple(tags)
+        self.port = port
+        self.index = index
+        # Ключи поиска: IP, слова подписи и теги в нижнем регистре
+        self.keys = (ip.lower(), *(word for word in WORD_SPLIT.split(label.lower()) if word),
+                     *(tag.lower() for tag in self.tags))
+
+    @property
+    def address(self):
+        """Значение для connect=: ip:port"""
+        return f"{self.ip}:{self.port}"
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {'ip': self.ip, 'label': self.label, 'tags': list(self.tags), 'port': self.port}
+
+    def __repr__(self):
+        return f"ServerEntry({self.address}, {self.label!r})"
+
+
+class ServerCatalog:
+    """Неизменяемый каталог серверов с индексом префиксов
+
+    Индекс - отсортированный список уникальных ключей (IP, слова подписи, теги) и array
+    номеров записей, сгруппированных по ключам (_starts - начало группы ключа). Ключи с
+    одним префиксом идут подряд: поиск - два bisect и один срез array.
+    """
+
+    def __init__(self, entries):
+        self.entries = []
+        self._by_ip = {}
+        for entry in entries:
+            if entry.ip in self._by_ip:
+                raise ValueError(f"Сервер {entry.ip} указан в каталоге дважды")
+            entry.index = len(self.entries)
+            self.entries.append(entry)
+            self._by_ip[entry.ip] = entry
+
+        groups = {}
+        for entry in self.entries:
+            for key in set(entry.keys):
+                owners = groups.get(key)
+                if owners is None:
+                    groups[key] = [entry.index]
+                else:
+                    owners.append(entry.index)
+        self._keys = sorted(groups)
+        self._owners = array('I')
+        self._starts = array('I')
+        for key in self._keys:
+            self._starts.append(len(self._owners))
+            self._owners.extend(groups[key])
+        self._starts.append(len(self._owners))
+
+    @classmethod
+    def from_mapping(cls, servers, port=443):
+        """Каталог из словаря {IP: подпись} (встроенный список StunnelManager.SERVERS)"""
+        return cls(ServerEntry(ip, label, port=port) for ip, label in servers.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, ip):
+        return ip in self._by_ip
+
+    def get(self, ip):
+        """Запись по IP или None"""
+        return self._by_ip.get(ip)
+
+    def label(self, ip, default="неизвестный"):
+        """Подпись сервера по IP"""
+        entry = self._by_ip.get(ip)
+        return entry.label if entry is not None else default
+
+    def port(self, ip, default=443):
+        """Порт сервера по IP"""
+        entry = self._by_ip.get(ip)
+        return entry.port if entry is not None else default
+
+    def ips(self):
+        """IP в порядке каталога"""
+        return [entry.ip for entry in self.entries]
+
+    def _prefix(self, token):
+        """Номера записей, у которых есть ключ с префиксом token"""
+        keys = self._keys
+        low = bisect_left(keys, token)
+        high = bisect_left(keys, token + PREFIX_END, low)
+        return set(self._owners[self._starts[low]:self._starts[high]])
+
+    def lookup(self, tokens, candidates=None):
+        """Номера записей (по порядку каталога), подходящих под все tokens
+
+        candidates - множество номеров, среди которых искать (прошлый результат фильтра).
+        """
+        if not tokens:
+            return sorted(candidates) if candidates is not None else list(range(len(self.entries)))
+        found = candidates
+        # Начинаем с самого редкого префикса - пересечение меньше
+        for other in sorted((self._prefix(token) for token in tokens), key=len):
+            found = other if found is None else found & other
+            if not found:
+                break
+        return sorted(found)
+
+    def search(self, query, limit=None):
+        """Записи, у которых каждое слово запроса - префикс IP, слова подписи или тега"""
+        indexes = self.lookup(tokenize(query))
+        if limit is not None:
+            indexes = indexes[:limit]
+        return [self.entries[index] for index in indexes]
+
+    def filter(self):
+        """Инкрементальный фильтр для поля ввода"""
+        return CatalogFilter(self)
+
+
+class CatalogFilter:
+    """Фильтр по мере ввода: уточнение запроса проверяет только прошлый результат
+
+    Если новый запрос продолжает предыдущий (каждое слово удлиняет прежнее, новые слова
+    добавлены в конец), по индексу ищутся только измененные слова, а результат пересекается
+    с прошлым; иначе - поиск по индексу заново.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._tokens = []
+        self._indexes = None
+
+    def _extends(self, tokens):
+        """Новый запрос уточняет предыдущий"""
+        previous = self._tokens
+        if self._indexes is None or len(tokens) < len(previous):
+            return False
+        return all(new.startswith(old) for old, new in zip(previous, tokens))
+
+    def update(self, query, limit=None):
+        """Записи для текста поля ввода; limit - сколько вернуть (фильтруются все)"""
+        tokens = tokenize(query)
+        if tokens == self._tokens and self._indexes is not None:
+            indexes = self._indexes
+        elif tokens and self._extends(tokens):
+            previous = self._tokens
+            changed = [new for old, new in zip(previous, tokens) if new != old]
+            changed += tokens[len(previous):]
+            indexes = self.catalog.lookup(changed, set(self._indexes))
+        else:
+            indexes = self.catalog.lookup(tokens)
+        self._tokens = tokens
+        self._indexes = indexes
+        if limit is not None:
+            indexes = indexes[:limit]
+        entries = self.catalog.entries
+        return [entries[index] for index in indexes]
+
+    @property
+    def count(self):
+        """Сколько записей подходит под последний запрос"""
+        return len(self._indexes) if self._indexes is not None else len(self.catalog)
+
+    def reset(self):
+        """Забыть прошлый запрос"""
+        self._tokens = []
+        self._indexes = None
+
+
+def tokenize(query):
+    """Слова запроса в нижнем регистре"""
+    return [word for word in WORD_SPLIT.split(query.lower()) if word]
+
+
+def _entry_from_dict(item, position, default_port):
+    """Запись каталога из словаря файла с проверкой полей"""
+    if not isinstance(item, dict) or not item.get('ip'):
+        raise ValueError(f"Запись {position}: нужен объект с полем ip")
+    tags = item.get('tags', ())
+    if isinstance(tags, str):
+        tags = [tags]
+    try:
+        port = int(item.get('port', default_port))
+    except (TypeError, ValueError):
+        raise ValueError(f"Запись {position}: некорректный порт {item.get('port')!r}")
+    return ServerEntry(str(item['ip']).strip(), str(item.get('label', '')), tags, port)
+
+
+def load_catalog(path, default_port=443):
+    """Прочитать каталог из .json или .toml; ValueError при ошибке формата"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if os.path.splitext(str(path))[1].lower() == '.toml':
+        import tomllib
+
+        try:
+            data = tomllib.loads(raw.decode('utf-8'))
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"Ошибка TOML: {e}")
+    else:
+        data = json.loads(raw)
+
+    items = data.get('servers') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Ожидается список servers")
+    default_port = data.get('port', default_port) if isinstance(data, dict) else default_port
+    return ServerCatalog(_entry_from_dict(item, position, default_port)
+                         for position, item in enumerate(items, start=1))
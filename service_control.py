@@ -0,0 +1,495 @@
+"""
+Управление службой stunnel: подменяемые реализации (subprocess, Win32 API, дочерний процесс,
+фейк для тестов)
+"""
+import sys
+import threading
+import time
+
+
+class ServiceResult:
+    """Результат операции со службой"""
+
+    def __init__(self, ok, returncode=0, output=""):
+        self.ok = ok
+        self.returncode = returncode
+        self.output = output
+
+    def __repr__(self):
+        return f"ServiceResult(ok={self.ok}, returncode={self.returncode}, output={self.output!r})"
+
+
+class ServiceController:
+    """Базовый интерфейс управления службой"""
+
+    name = "base"
+    # Пользовательский код управления службой stunnel в Windows: перечитать конфигурацию
+    RELOAD_CONTROL = 128
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    @property
+    def supports_reload(self):
+        """Умеет ли реализация перечитывать конфиг без перезапуска"""
+        return type(self).reload is not ServiceController.reload
+
+    def stop(self):
+        """Остановить службу, вернуть ServiceResult"""
+        raise NotImplementedError
+
+    def start(self):
+        """Запустить службу, вернуть ServiceResult"""
+        raise NotImplementedError
+
+    def reload(self):
+        """Перечитать конфиг без остановки службы (открытые соединения сохраняются)"""
+        return ServiceResult(False, 1, f"{self.name}: перезагрузка конфигурации не поддерживается")
+
+
+class SubprocessServiceController(ServiceController):
+    """Управление через TASKKILL и sc start (порождает процессы)"""
+
+    name = "subprocess"
+
+    def _run(self, args):
+        """Выполнить команду без окна консоли"""
+        # subprocess загружается только при первом вызове - быстрее старт CLI
+        import subprocess
+
+        result = subprocess.run(
+            args,
+            capture_output=True,
+            text=True,
+            encoding='cp866',
+            creationflags=subprocess.CREATE_NO_WINDOW
+        )
+        return result.returncode, result.stderr or result.stdout
+
+    def stop(self):
+        """Остановить службу (TASKKILL /F по имени службы)"""
+        returncode, output = self._run(
+            ['TASKKILL', '/F', '/FI', f'SERVICES eq {self.service_name}']
+        )
+        ok = returncode == 0 or "not found" in output.lower()
+        return ServiceResult(ok, returncode, output)
+
+    def start(self):
+        """Запустить службу (sc start)"""
+        returncode, output = self._run(['sc', 'start', self.service_name])
+        return ServiceResult(returncode == 0, returncode, output)
+
+    def reload(self):
+        """Перечитать конфиг (sc control с кодом RELOAD_CONTROL)"""
+        returncode, output = self._run(
+            ['sc', 'control', self.service_name, str(self.RELOAD_CONTROL)]
+        )
+        return ServiceResult(returncode == 0, returncode, output)
+
+
+class Win32ServiceController(ServiceController):
+    """Управление напрямую через Service Control Manager (без порождения процессов)"""
+
+    name = "win32"
+
+    SC_MANAGER_CONNECT = 0x0001
+    SERVICE_START = 0x0010
+    SERVICE_QUERY_STATUS = 0x0004
+    SERVICE_USER_DEFINED_CONTROL = 0x0100
+    PROCESS_TERMINATE = 0x0001
+    SYNCHRONIZE = 0x00100000
+    SC_STATUS_PROCESS_INFO = 0
+    SERVICE_STOPPED = 0x1
+    ERROR_SERVICE_NOT_ACTIVE = 1062
+
+    def __init__(self, service_name, stop_timeout=10.0):
+        super().__init__(service_name)
+        import ctypes
+        from ctypes import wintypes
+
+        self._ctypes = ctypes
+        self._advapi32 = ctypes.WinDLL('advapi32', use_last_error=True)
+        self._kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        self.stop_timeout = stop_timeout
+
+        class SERVICE_STATUS_PROCESS(ctypes.Structure):
+            _fields_ = [
+                ('dwServiceType', wintypes.DWORD),
+                ('dwCurrentState', wintypes.DWORD),
+                ('dwControlsAccepted', wintypes.DWORD),
+                ('dwWin32ExitCode', wintypes.DWORD),
+                ('dwServiceSpecificExitCode', wintypes.DWORD),
+                ('dwCheckPoint', wintypes.DWORD),
+                ('dwWaitHint', wintypes.DWORD),
+                ('dwProcessId', wintypes.DWORD),
+                ('dwServiceFlags', wintypes.DWORD),
+            ]
+
+        class SERVICE_STATUS(ctypes.Structure):
+            _fields_ = [
+                ('dwServiceType', wintypes.DWORD),
+                ('dwCurrentState', wintypes.DWORD),
+                ('dwControlsAccepted', wintypes.DWORD),
+                ('dwWin32ExitCode', wintypes.DWORD),
+                ('dwServiceSpecificExitCode', wintypes.DWORD),
+                ('dwCheckPoint', wintypes.DWORD),
+                ('dwWaitHint', wintypes.DWORD),
+            ]
+
+        self._status_type = SERVICE_STATUS_PROCESS
+        self._control_status_type = SERVICE_STATUS
+
+        adv = self._advapi32
+        adv.OpenSCManagerW.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.DWORD]
+        adv.OpenSCManagerW.restype = wintypes.HANDLE
+        adv.OpenServiceW.argtypes = [wintypes.HANDLE, wintypes.LPCWSTR, wintypes.DWORD]
+        adv.OpenServiceW.restype = wintypes.HANDLE
+        adv.StartServiceW.argtypes = [wintypes.HANDLE, wintypes.DWORD, ctypes.c_void_p]
+        adv.StartServiceW.restype = wintypes.BOOL
+        adv.ControlService.argtypes = [wintypes.HANDLE, wintypes.DWORD, ctypes.c_void_p]
+        adv.ControlService.restype = wintypes.BOOL
+        adv.QueryServiceStatusEx.argtypes = [
+            wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p, wintypes.DWORD,
+            ctypes.POINTER(wintypes.DWORD)
+        ]
+        adv.QueryServiceStatusEx.restype = wintypes.BOOL
+        adv.CloseServiceHandle.argtypes = [wintypes.HANDLE]
+        adv.CloseServiceHandle.restype = wintypes.BOOL
+
+        k32 = self._kernel32
+        k32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        k32.OpenProcess.restype = wintypes.HANDLE
+        k32.TerminateProcess.argtypes = [wintypes.HANDLE, wintypes.UINT]
+        k32.TerminateProcess.restype = wintypes.BOOL
+        k32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+        k32.WaitForSingleObject.restype = wintypes.DWORD
+        k32.CloseHandle.argtypes = [wintypes.HANDLE]
+        k32.CloseHandle.restype = wintypes.BOOL
+
+    def _error(self, action):
+        """ServiceResult с последней ошибкой Win32"""
+        code = self._ctypes.get_last_error()
+        return ServiceResult(False, code, f"{action}: {self._ctypes.FormatError(code)}")
+
+    def _open_service(self, access):
+        """Открыть SCM и службу, вернуть (scm, service) или (None, ServiceResult)"""
+        scm = self._advapi32.OpenSCManagerW(None, None, self.SC_MANAGER_CONNECT)
+        if not scm:
+            return None, self._error("OpenSCManager")
+        service = self._advapi32.OpenServiceW(scm, self.service_name, access)
+        if not service:
+            error = self._error("OpenService")
+            self._advapi32.CloseServiceHandle(scm)
+            return None, error
+        return (scm, service), None
+
+    def _close(self, handles):
+        """Закрыть дескрипторы службы и SCM"""
+        scm, service = handles
+        self._advapi32.CloseServiceHandle(service)
+        self._advapi32.CloseServiceHandle(scm)
+
+    def _query(self, service):
+        """Текущее состояние службы или None"""
+        status = self._status_type()
+        needed = self._ctypes.c_ulong()
+        ok = self._advapi32.QueryServiceStatusEx(
+            service, self.SC_STATUS_PROCESS_INFO, self._ctypes.byref(status),
+            self._ctypes.sizeof(status), self._ctypes.byref(needed)
+        )
+        return status if ok else None
+
+    def stop(self):
+        """Остановить службу, завершив ее процесс (аналог TASKKILL /F)"""
+        handles, error = self._open_service(self.SERVICE_QUERY_STATUS)
+        if error:
+            return error
+        try:
+            status = self._query(handles[1])
+            if status is None:
+                return self._error("QueryServiceStatusEx")
+            if status.dwCurrentState == self.SERVICE_STOPPED or not status.dwProcessId:
+                return ServiceResult(True, self.ERROR_SERVICE_NOT_ACTIVE, "служба не запущена")
+
+            process = self._kernel32.OpenProcess(
+                self.PROCESS_TERMINATE | self.SYNCHRONIZE, False, status.dwProcessId
+            )
+            if not process:
+                return self._error("OpenProcess")
+            try:
+                if not self._kernel32.TerminateProcess(process, 1):
+                    return self._error("TerminateProcess")
+                self._kernel32.WaitForSingleObject(process, int(self.stop_timeout * 1000))
+            finally:
+                self._kernel32.CloseHandle(process)
+
+            # SCM фиксирует остановку асинхронно - дожидаемся SERVICE_STOPPED
+            deadline = time.monotonic() + self.stop_timeout
+            while time.monotonic() < deadline:
+                status = self._query(handles[1])
+                if status is not None and status.dwCurrentState == self.SERVICE_STOPPED:
+                    return ServiceResult(True)
+                time.sleep(0.05)
+            return ServiceResult(False, 0, "служба не перешла в состояние STOPPED")
+        finally:
+            self._close(handles)
+
+    def start(self):
+        """Запустить службу (StartService)"""
+        handles, error = self._open_service(self.SERVICE_START | self.SERVICE_QUERY_STATUS)
+        if error:
+            return error
+        try:
+            if not self._advapi32.StartServiceW(handles[1], 0, None):
+                return self._error("StartService")
+            return ServiceResult(True)
+        finally:
+            self._close(handles)
+
+    def reload(self):
+        """Перечитать конфиг (ControlService с кодом RELOAD_CONTROL)"""
+        handles, error = self._open_service(self.SERVICE_USER_DEFINED_CONTROL)
+        if error:
+            return error
+        try:
+            status = self._control_status_type()
+            if not self._advapi32.ControlService(handles[1], self.RELOAD_CONTROL,
+                                                 self._ctypes.byref(status)):
+                return self._error("ControlService")
+            return ServiceResult(True)
+        finally:
+            self._close(handles)
+
+
+class ProcessServiceController(ServiceController):
+    """stunnel как дочерний процесс (Linux с foreground = yes, бенчмарки)
+
+    stop завершает процесс SIGKILL, как TASKKILL /F; reload отправляет SIGHUP - stunnel
+    перечитывает конфиг, не разрывая открытые соединения.
+    """
+
+    name = "process"
+
+    def __init__(self, service_name="Stunnel", command=None, cwd=None):
+        super().__init__(service_name)
+        self.command = list(command or ['stunnel'])
+        self.cwd = cwd
+        self._process = None
+
+    @property
+    def running(self):
+        """Запущен ли процесс"""
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def pid(self):
+        """PID запущенного процесса или None"""
+        return self._process.pid if self.running else None
+
+    def stop(self):
+        """Завершить процесс (SIGKILL)"""
+        if not self.running:
+            return ServiceResult(True, 0, "процесс не запущен")
+        self._process.kill()
+        returncode = self._process.wait()
+        return ServiceResult(True, returncode)
+
+    def start(self):
+        """Запустить процесс"""
+        import subprocess
+
+        if self.running:
+            return ServiceResult(False, 1056, "процесс уже запущен")
+        try:
+            self._process = subprocess.Popen(self.command, cwd=self.cwd)
+        except OSError as e:
+            return ServiceResult(False, e.errno or 1, str(e))
+        return ServiceResult(True)
+
+    def reload(self):
+        """Перечитать конфиг (SIGHUP)"""
+        import signal
+
+        if not hasattr(signal, 'SIGHUP'):
+            return ServiceResult(False, 1, "SIGHUP недоступен на этой платформе")
+        if not self.running:
+            return ServiceResult(False, 1062, "процесс не запущен")
+        self._process.send_signal(signal.SIGHUP)
+        return ServiceResult(True)
+
+
+class FakeServiceController(ServiceController):
+    """Имитация службы в памяти процесса с настраиваемыми задержками (для Linux и тестов)
+
+    Если указан listen=(host, port), после запуска (и еще ready_delay секунд) служба
+    начинает принимать соединения на этом порту, как stunnel на порту accept. reload
+    порт не закрывает.
+
+    upstream - функция, возвращающая (host, port) апстрима (как connect= конфига): она
+    вызывается при запуске и перезагрузке, и на каждое принятое соединение служба открывает
+    соединение с этим адресом. С ignore_reload=True перезагрузка "успешна", но апстрим
+    остается прежним - как у stunnel, пропустившего сигнал.
+    """
+
+    name = "fake"
+
+    def __init__(self, service_name="Stunnel", stop_delay=0.0, start_delay=0.0, running=True,
+                 listen=None, ready_delay=0.0, reload_delay=0.0, upstream=None):
+        super().__init__(service_name)
+        self.stop_delay = stop_delay
+        self.start_delay = start_delay
+        self.reload_delay = reload_delay
+        self.running = running
+        self.listen = listen
+        self.ready_delay = ready_delay
+        self.upstream = upstream
+        self.upstream_address = upstream() if running and upstream else None
+        self.ignore_reload = False
+        self.fail_stop = False
+        self.fail_start = False
+        self.fail_reload = False
+        self.stop_calls = 0
+        self.start_calls = 0
+        self.reload_calls = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        if running and listen:
+            self._start_listener(0.0)
+
+    def _start_listener(self, delay):
+        """Начать принимать соединения через delay секунд"""
+        self._listener = _FakeListener(self.listen, delay, lambda: self.upstream_address)
+
+    def _stop_listener(self):
+        """Перестать принимать соединения"""
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def stop(self):
+        """Остановить фейковую службу"""
+        with self._lock:
+            self.stop_calls += 1
+            time.sleep(self.stop_delay)
+            if self.fail_stop:
+                return ServiceResult(False, 1, "fake: stop failed")
+            self.running = False
+            self._stop_listener()
+            return ServiceResult(True)
+
+    def start(self):
+        """Запустить фейковую службу"""
+        with self._lock:
+            self.start_calls += 1
+            time.sleep(self.start_delay)
+            if self.fail_start:
+                return ServiceResult(False, 1, "fake: start failed")
+            if self.running:
+                return ServiceResult(False, 1056, "fake: служба уже запущена")
+            self.running = True
+            if self.upstream:
+                self.upstream_address = self.upstream()
+            if self.listen:
+                self._start_listener(self.ready_delay)
+            return ServiceResult(True)
+
+    def reload(self):
+        """Перечитать конфиг: слушающий порт и соединения не затрагиваются"""
+        with self._lock:
+            self.reload_calls += 1
+            time.sleep(self.reload_delay)
+            if self.fail_reload:
+                return ServiceResult(False, 1, "fake: reload failed")
+            if not self.running:
+                return ServiceResult(False, 1062, "fake: служба не запущена")
+            if self.upstream and not self.ignore_reload:
+                self.upstream_address = self.upstream()
+            return ServiceResult(True)
+
+
+class _FakeListener:
+    """Слушающий сокет фейковой службы, открывается с задержкой в отдельном потоке"""
+
+    def __init__(self, address, delay, upstream=None):
+        import socket
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._address = address
+        self._delay = delay
+        self._upstream = upstream
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="FakeListener", daemon=True)
+        self._thread.start()
+
+    REPLY = b"HTTP/1.0 200 OK\r\n\r\n"
+
+    def _run(self):
+        """Через delay начать слушать порт; на запрос отвечать, как апстрим через туннель"""
+        if self._closed.wait(self._delay):
+            return
+        try:
+            self._socket.bind(self._address)
+            self._socket.listen(128)
+            # accept с таймаутом, чтобы поток завершался после close()
+            self._socket.settimeout(0.1)
+            while not self._closed.is_set():
+                try:
+                    connection, _ = self._socket.accept()
+                except TimeoutError:
+                    continue
+                self._answer(connection)
+        except OSError:
+            pass
+
+    def _answer(self, connection):
+        """Прочитать запрос (проверка порта не шлет данных) и ответить
+
+        Пока соединение открыто, открыто и соединение с апстримом (если он задан).
+        """
+        import socket
+
+        address = self._upstream() if self._upstream else None
+        upstream = None
+        with connection:
+            try:
+                if address is not None:
+                    upstream = socket.create_connection(address, 1.0)
+                connection.settimeout(0.2)
+                if connection.recv(1024):
+                    connection.sendall(self.REPLY)
+            except OSError:
+                pass
+            finally:
+                if upstream is not None:
+                    upstream.close()
+
+    def close(self):
+        """Закрыть сокет и дождаться остановки потока"""
+        import socket
+
+        self._closed.set()
+        try:
+            # shutdown сразу прекращает прием соединений, даже если поток еще ждет в accept
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._thread.join()
+
+
+SERVICE_BACKENDS = {
+    SubprocessServiceController.name: SubprocessServiceController,
+    Win32ServiceController.name: Win32ServiceController,
+    ProcessServiceController.name: ProcessServiceController,
+    FakeServiceController.name: FakeServiceController,
+}
+
+
+def create_service_controller(backend, service_name, **options):
+    """Создать контроллер службы по имени реализации (options - параметры реализации)"""
+    if backend not in SERVICE_BACKENDS:
+        raise ValueError(f"Неизвестная реализация управления службой: {backend}")
+    if backend == Win32ServiceController.name and sys.platform != 'win32':
+        raise RuntimeError(f"Реализация '{backend}' доступна только в Windows")
+    return SERVICE_BACKENDS[backend](service_name, **options)
@@ -0,0 +1,276 @@
+"""
+Разбор конфигурации stunnel с кэшированием и атомарной записью
+"""
+import os
+import shutil
+import threading
+
+
+COMMENT_PREFIXES = (';', '#')
+
+
+class ConfigSection:
+    """Секция [name] (name=None - глобальные опции до первой секции)"""
+
+    __slots__ = ('name', 'header_index', 'options')
+
+    def __init__(self, name, header_index, options=None):
+        self.name = name
+        self.header_index = header_index
+        # {ключ: [(индекс строки, значение), ...]}
+        self.options = {} if options is None else options
+
+    def get(self, key, default=None):
+        """Значение первой опции key в секции"""
+        entries = self.options.get(key)
+        return entries[0][1] if entries else default
+
+    def get_all(self, key):
+        """Все значения опции key в секции"""
+        return [value for _, value in self.options.get(key, [])]
+
+
+class StunnelConfig:
+    """Разобранный конфиг stunnel; исходный текст (включая комментарии) сохраняется построчно"""
+
+    def __init__(self, text):
+        self.lines = text.splitlines(keepends=True)
+        self.newline = self._detect_newline()
+        self.sections = []
+        self._by_name = {}
+        self._first = {}
+        self._parse()
+
+    def _detect_newline(self):
+        """Окончание строк файла (для добавляемых строк)"""
+        for line in self.lines:
+            if line.endswith('\r\n'):
+                return '\r\n'
+            if line.endswith('\n'):
+                return '\n'
+        return '\n'
+
+    @staticmethod
+    def parse_line(line):
+        """Разобрать строку: ('section', имя) / ('option', (ключ, значение)) / (None, None)"""
+        stripped = line.strip()
+        if not stripped or stripped.startswith(COMMENT_PREFIXES):
+            return None, None
+        if stripped.startswith('[') and stripped.endswith(']'):
+            return 'section', stripped[1:-1].strip()
+        if '=' in stripped:
+            key, value = stripped.split('=', 1)
+            return 'option', (key.strip().lower(), value.strip())
+        return None, None
+
+    def _parse(self):
+        """Построить индекс секций и опций по номерам строк"""
+        current = ConfigSection(name=None, header_index=-1)
+        self.sections.append(current)
+        options = current.options
+        first = self._first
+        parse_line = self.parse_line
+        for index, line in enumerate(self.lines):
+            kind, value = parse_line(line)
+            if kind == 'option':
+                key, option_value = value
+                entries = options.get(key)
+                if entries is None:
+                    options[key] = [(index, option_value)]
+                else:
+                    entries.append((index, option_value))
+                if key not in first:
+                    first[key] = option_value
+            elif kind == 'section':
+                current = ConfigSection(name=value, header_index=index)
+                options = current.options
+                self.sections.append(current)
+                self._by_name.setdefault(value, current)
+
+    @property
+    def global_options(self):
+        """Глобальные опции (до первой секции)"""
+        return self.sections[0]
+
+    @property
+    def services(self):
+        """Секции служб [name]"""
+        return self.sections[1:]
+
+    def section(self, name):
+        """Секция по имени или None"""
+        return self._by_name.get(name)
+
+    def _option_entries(self, key, section=None):
+        """Все (индекс строки, значение) опции key - во всем файле или в одной секции"""
+        sections = self.sections if section is None else [self.section(section)]
+        entries = []
+        for item in sections:
+            if item is not None:
+                entries.extend(item.options.get(key, []))
+        return sorted(entries)
+
+    def first(self, key):
+        """Первое значение опции key в файле или None"""
+        return self._first.get(key)
+
+    def with_option(self, key, value, section=None):
+        """Новый конфиг, где все строки key заменены на key=value; вернуть (конфиг, число замен)"""
+        if section is not None and self.section(section) is None:
+            raise KeyError(f"Секция [{section}] не найдена")
+
+        lines = list(self.lines)
+        entries = self._option_entries(key, section)
+        if entries:
+            for index, _ in entries:
+                ending = lines[index][len(lines[index].rstrip('\r\n')):] or self.newline
+                lines[index] = f"{key}={value}{ending}"
+            # Структура файла не изменилась - повторный разбор не нужен
+            values = {index: value for index, _ in entries}
+            return self._with_values(lines, key, values), len(entries)
+
+        # Строка не найдена - добавляем в конец файла (или секции)
+        if section is not None:
+            lines.insert(self._section_end(section), f"{key}={value}{self.newline}")
+        else:
+            if lines and not lines[-1].endswith(('\n', '\r')):
+                lines[-1] += self.newline
+            lines.append(f"{self.newline}{key}={value}{self.newline}")
+        return StunnelConfig(''.join(lines)), 0
+
+    def with_options(self, key, values):
+        """Новый конфиг, где в каждой секции из values ({секция: значение}) строки key заменены
+
+        Все изменения - за один проход по строкам: пакет из K секций не копирует и не разбирает
+        файл K раз. В секцию без строки key она добавляется. Вернуть (конфиг, число замен).
+        """
+        missing = [name for name in values if self.section(name) is None]
+        if missing:
+            raise KeyError(f"Секция [{missing[0]}] не найдена")
+
+        lines = list(self.lines)
+        replaced = {}
+        appended = []
+        for name, value in values.items():
+            entries = self.section(name).options.get(key)
+            if not entries:
+                appended.append((self._section_end(name), f"{key}={value}{self.newline}"))
+                continue
+            for index, _ in entries:
+                ending = lines[index][len(lines[index].rstrip('\r\n')):] or self.newline
+                lines[index] = f"{key}={value}{ending}"
+                replaced[index] = value
+
+        if appended:
+            # Вставка с конца файла не сдвигает индексы следующих вставок
+            for index, line in sorted(appended, reverse=True):
+                lines.insert(index, line)
+            return StunnelConfig(''.join(lines)), len(replaced)
+        return self._with_values(lines, key, replaced), len(replaced)
+
+    def _with_values(self, lines, key, values):
+        """Копия конфига с новыми строками, где у опции key новые значения ({индекс строки: значение})"""
+        clone = object.__new__(StunnelConfig)
+        clone.lines = lines
+        clone.newline = self.newline
+        clone.sections = []
+        clone._by_name = {}
+        for section in self.sections:
+            options = section.options
+            if key in options:
+                options = dict(options)
+                options[key] = [(index, values.get(index, old)) for index, old in options[key]]
+            copy = ConfigSection(section.name, section.header_index, options)
+            clone.sections.append(copy)
+            if section.name is not None:
+                clone._by_name.setdefault(section.name, copy)
+        clone._first = dict(self._first)
+        first_entries = clone._option_entries(key)
+        if first_entries:
+            clone._first[key] = first_entries[0][1]
+        return clone
+
+    def _section_end(self, name):
+        """Индекс строки после последней непустой строки секции"""
+        section = self._by_name[name]
+        position = self.sections.index(section)
+        end = (self.sections[position + 1].header_index if position + 1 < len(self.sections)
+               else len(self.lines))
+        while end > section.header_index + 1 and not self.lines[end - 1].strip():
+            end -= 1
+        return end
+
+    def render(self):
+        """Текст конфига"""
+        return ''.join(self.lines)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _stat_key(path):
+    """Ключ актуальности файла: (mtime_ns, size)"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_config(path):
+    """Прочитать и разобрать конфиг; повторное чтение неизмененного файла берется из кэша"""
+    path = os.path.abspath(path)
+    key = _stat_key(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        config = StunnelConfig(f.read())
+
+    with _cache_lock:
+        _cache[path] = (key, config)
+    return config
+
+
+def atomic_write(path, data):
+    """Записать файл через временный файл и os.replace (без обрезанного файла при сбое)"""
+    import tempfile
+
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_config(path, config):
+    """Атомарно записать конфиг и обновить кэш"""
+    atomic_write(path, config.render())
+    path = os.path.abspath(path)
+    with _cache_lock:
+        _cache[path] = (_stat_key(path), config)
+
+
+def invalidate(path=None):
+    """Сбросить кэш для файла (или целиком)"""
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(path), None)
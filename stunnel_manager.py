@@ -0,0 +1,1006 @@
+"""
+StunnelManager - работа с конфигурацией stunnel и службой (без зависимостей от GUI)
+"""
+import os
+import json
+import ctypes
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from backup_store import BackupStore
+from log_writer import LogWriter
+from readiness import check_upstream, parse_endpoint, wait_for_port, wait_for_upstream
+from stunnel_config import atomic_write, invalidate, load_config, save_config
+from tracing import Tracer
+from server_catalog import ServerCatalog, load_catalog
+from service_control import create_service_controller
+from switch_coordinator import FileLock, SwitchJournal
+
+
+class SectionUpstream:
+    """Секция конфига stunnel: адреса accept и connect"""
+
+    __slots__ = ('name', 'accept', 'connect')
+
+    def __init__(self, name, accept=None, connect=None):
+        self.name = name
+        self.accept = accept
+        self.connect = connect
+
+    @property
+    def server(self):
+        """IP (хост) из connect= или None"""
+        if not self.connect:
+            return None
+        return self.connect.rsplit(':', 1)[0].strip() if ':' in self.connect else self.connect
+
+    def to_dict(self):
+        """Представление для JSON"""
+        return {'name': self.name, 'accept': self.accept, 'connect': self.connect,
+                'server': self.server}
+
+    def __repr__(self):
+        return f"SectionUpstream([{self.name}] {self.accept} -> {self.connect})"
+
+
+class StunnelManager:
+    """Менеджер для работы с stunnel конфигурацией и службой"""
+
+    # Встроенный каталог серверов (из script.bat) - если файл каталога не задан
+    SERVERS = {
+        "195.209.130.9": "промышленный контур",
+        "195.209.130.45": "тестовый контур (промышленный)",
+        "195.209.130.19": "тестовый контур (новый функционал)"
+    }
+
+    SERVICE_NAME = "Stunnel"
+    SERVER_PORT = 443
+    DEFAULT_SERVICE_BACKEND = "subprocess"
+    READY_TIMEOUT = 15.0
+    # reload - перечитать конфиг без остановки службы, restart - остановка и запуск
+    SWITCH_STRATEGIES = ('reload', 'restart')
+    DEFAULT_SWITCH_STRATEGY = "reload"
+    # Пауза после команды перезагрузки: stunnel перечитывает конфиг асинхронно
+    RELOAD_SETTLE = 0.1
+    # Ожидание завершения клиентских соединений перед остановкой службы (0 - только подсчет)
+    DRAIN_TIMEOUT = 10.0
+    # Недавно установленные серверы (recent_servers в settings.json) - для истории задержки
+    RECENT_SERVERS = 8
+    # Ожидание соединения службы с новым апстримом после перезагрузки конфига, с
+    UPSTREAM_VERIFY_TIMEOUT = 2.0
+
+    def __init__(self, service=None, app_dir=None, console=True):
+        self.console = console
+        self.config_dir = self._get_app_data_dir(app_dir)
+        self.settings = self._load_settings()
+        self.config_file_path = self.settings.get('config_path', '')
+        self.log_writer = self._create_log_writer()
+        self.service = service or create_service_controller(
+            self.settings.get('service_backend', self.DEFAULT_SERVICE_BACKEND),
+            self.SERVICE_NAME,
+            **self.settings.get('service_options', {})
+        )
+        self.backup_store = BackupStore(
+            self.config_dir / "backups",
+            max_entries=self.settings.get('backup_max_entries', 50),
+            max_age_days=self.settings.get('backup_max_age_days', 90),
+            pinned=self._pinned_backups,
+        )
+        # Спаны фаз - в switch_trace_*.jsonl, снимок метрик - для textfile collector
+        self.tracer = Tracer(
+            self.config_dir,
+            metrics_path=self.settings.get('metrics_path') or self.config_dir / "giis_srv_selector.prom",
+            on_error=self.log,
+        )
+        self.last_switch_timings = {}
+        self.last_ready_time = None
+        self.last_switch_strategy = None
+        # Соединения, разорванные последней остановкой службы (DrainResult)
+        self.last_drain = None
+        # Вызывается из рабочего потока при каждом подсчете соединений: (число, в начале, осталось с)
+        self.on_drain_progress = None
+        # {значение connect=: (host, port)} для проверки апстрима после перезагрузки -
+        # в тестах адреса серверов подменяются на loopback
+        self.upstream_addresses = {}
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+        self._log_index = None
+        self._latency_store = None
+        # Смена сервера из GUI и из монитора не должна выполняться одновременно
+        self.switch_lock = threading.RLock()
+        # То же между процессами: второе окно, CLI, планировщик
+        self.process_lock = FileLock(self.config_dir / "switch.lock")
+        self.journal = SwitchJournal(self.config_dir / "switch_journal.json")
+
+    def _get_app_data_dir(self, app_dir=None):
+        """Получить путь к директории приложения в AppData"""
+        if app_dir is None:
+            appdata = os.getenv('APPDATA') or Path.home()
+            app_dir = Path(appdata) / "GIIS_ServerSelector"
+        app_dir = Path(app_dir)
+        app_dir.mkdir(parents=True, exist_ok=True)
+        return app_dir
+
+    def _load_settings(self):
+        """Загрузить сохраненные настройки (путь к конфигу, реализация управления службой)"""
+        settings_file = self.config_dir / "settings.json"
+        if settings_file.exists():
+            try:
+                with open(settings_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                self.log(f"Ошибка загрузки настроек: {e}")
+        return {}
+
+    def save_settings(self, **values):
+        """Обновить и сохранить настройки"""
+        settings_file = self.config_dir / "settings.json"
+        settings = dict(self.settings, **values)
+        with open(settings_file, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+        self.settings = settings
+
+    def save_config_path(self, path):
+        """Сохранить путь к конфигурационному файлу"""
+        try:
+            self.save_settings(config_path=path)
+            self.config_file_path = path
+            self.log(f"Путь к конфигу сохранен: {path}")
+        except Exception as e:
+            self.log(f"Ошибка сохранения пути: {e}")
+            raise
+
+    @property
+    def catalog(self):
+        """Каталог серверов (читается при первом обращении)"""
+        # Первое обращение может прийти одновременно из замера и из GUI - файл читается один раз
+        with self._catalog_lock:
+            if self._catalog is None:
+                self._catalog = self._load_catalog()
+        return self._catalog
+
+    @property
+    def log_index(self):
+        """Индекс файлов лога для просмотра и поиска (создается при первом обращении)"""
+        # mmap и индекс нужны только окну лога и команде logs - не замедляют запуск CLI
+        from log_index import LogIndex
+
+        with self._catalog_lock:
+            if self._log_index is None:
+                self._log_index = LogIndex(self.config_dir, live=lambda: self.log_file)
+        return self._log_index
+
+    @property
+    def latency_store(self):
+        """История задержки до серверов в latency\\ (создается при первом обращении)"""
+        from latency_store import LatencyStore
+
+        with self._catalog_lock:
+            if self._latency_store is None:
+                self._latency_store = LatencyStore(
+                    self.config_dir / "latency",
+                    capacity=self.settings.get('latency_capacity', 16384),
+                )
+        return self._latency_store
+
+    def latency_summaries(self, ips=None):
+        """Сводки истории задержки за час и сутки {ip: {'hour': ..., 'day': ...}} без замера"""
+        return self.latency_store.summaries(self.catalog.ips() if ips is None else ips)
+
+    def latency_tracked_servers(self, limit=None):
+        """Серверы с историей задержки: текущий, избранные (favorite_servers) и недавние
+
+        Фоновый замер идет только по ним, и только для них замер создает файл истории -
+        каталог на тысячи серверов не превращается в тысячи файлов и соединений в минуту.
+        """
+        servers = []
+        candidates = ([self.get_current_server()] + list(self.settings.get('favorite_servers', []))
+                      + list(self.settings.get('recent_servers', [])))
+        for ip in candidates:
+            if ip and ip not in servers:
+                servers.append(ip)
+        return servers if limit is None else servers[:limit]
+
+    def _remember_servers(self, ips):
+        """Добавить установленные серверы в начало recent_servers (settings.json)
+
+        Значения вида host:port ([::1]:443) сохраняются без порта - как IP каталога.
+        """
+        recent = []
+        for ip in ips:
+            if ':' in ip:
+                try:
+                    ip = parse_endpoint(ip)[0]
+                except ValueError:
+                    ip = ip.rsplit(':', 1)[0].strip('[]')
+            if ip not in recent:
+                recent.append(ip)
+        recent += [ip for ip in self.settings.get('recent_servers', []) if ip not in recent]
+        recent = recent[:self.RECENT_SERVERS]
+        if recent == self.settings.get('recent_servers'):
+            return
+        try:
+            self.save_settings(recent_servers=recent)
+        except OSError as e:
+            self.log(f"Ошибка сохранения настроек: {e}")
+
+    def _load_catalog(self):
+        """Каталог из catalog_path (settings.json) или servers.json/servers.toml в AppData
+
+        Без файла - встроенный список SERVERS; при ошибке в файле - он же с записью в лог.
+        """
+        path = self.settings.get('catalog_path')
+        if not path:
+            for name in ("servers.json", "servers.toml"):
+                if (self.config_dir / name).exists():
+                    path = self.config_dir / name
+                    break
+        if path:
+            try:
+                catalog = load_catalog(path, default_port=self.SERVER_PORT)
+                self.log(f"Каталог серверов: {path} ({len(catalog)} записей)")
+                return catalog
+            except (OSError, ValueError) as e:
+                self.log(f"ОШИБКА: Не удалось загрузить каталог серверов {path}: {e}")
+        return ServerCatalog.from_mapping(self.SERVERS, self.SERVER_PORT)
+
+    def _create_log_writer(self):
+        """Создать фоновую запись лога в файл с временной меткой"""
+        log_writer = LogWriter(self.config_dir)
+        self.log(f"Файл лога создан: {log_writer.path}", to_file=False)
+        return log_writer
+
+    @property
+    def log_file(self):
+        """Путь к текущему файлу лога (меняется при ротации)"""
+        return self.log_writer.path
+
+    def log(self, message, to_file=True):
+        """Записать сообщение в лог"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log_message = f"[{timestamp}] {message}"
+
+        if to_file and hasattr(self, 'log_writer'):
+            self.log_writer.write(log_message)
+            # Ошибки сразу сбрасываем на диск, чтобы они не потерялись при падении
+            if message.startswith("ОШИБКА"):
+                self.log_writer.flush()
+
+        # console: True - stdout, поток - вывод в него, None/False - без вывода
+        if self.console:
+            print(log_message, file=None if self.console is True else self.console)
+
+    def flush_log(self):
+        """Дождаться записи лога и трассировки на диск"""
+        self.log_writer.flush()
+        self.tracer.flush()
+
+    def close(self):
+        """Завершить работу: записать остаток лога и трассировки и закрыть файлы"""
+        self.tracer.close()
+        self.log_writer.close()
+        if self._log_index is not None:
+            self._log_index.close()
+        if self._latency_store is not None:
+            self._latency_store.close()
+
+    def get_current_server(self):
+        """Получить текущий IP сервера из конфига"""
+        if not self.config_file_path or not os.path.exists(self.config_file_path):
+            return None
+
+        try:
+            # Повторное чтение неизмененного файла берется из кэша
+            ip_port = load_config(self.config_file_path).first('connect')
+            if ip_port is None:
+                self.log("Строка connect= не найдена в конфиге")
+                return None
+            # Извлекаем IP (до двоеточия)
+            ip = ip_port.split(':')[0].strip()
+            self.log(f"Текущий сервер: {ip}")
+            return ip
+        except Exception as e:
+            self.log(f"Ошибка чтения конфига: {e}")
+            return None
+
+    def probe_servers(self, samples=3, timeout=2.0, ips=None):
+        """Замерить задержку до серверов каталога (или ips) одновременно (TCP + TLS)"""
+        # asyncio и ssl загружаются только при замере - не замедляют запуск CLI
+        from latency_probe import LatencyProber
+
+        self.log(f"Замер задержки до серверов ({samples} попыток, таймаут {timeout} с)...")
+        prober = LatencyProber(samples=samples, timeout=timeout, port=self.SERVER_PORT,
+                               max_concurrency=self.settings.get('probe_concurrency', 64))
+        catalog = self.catalog
+        ips = catalog.ips() if ips is None else ips
+        results = prober.run({ip: (ip, catalog.port(ip, self.SERVER_PORT)) for ip in ips})
+        for ip, result in results.items():
+            self.log(f"  {ip}: {result.summary()}")
+        try:
+            # Файлы истории создаются только для отслеживаемых серверов
+            self.latency_store.record_results(results, create=set(self.latency_tracked_servers()))
+        except (OSError, ValueError) as e:
+            self.log(f"Ошибка записи истории задержки: {e}")
+        return results
+
+    def stop_service(self):
+        """Остановить службу Stunnel"""
+        self.log(f"Остановка службы {self.service.service_name} ({self.service.name})...")
+
+        result = self.service.stop()
+        self.tracer.annotate(backend=self.service.name, returncode=result.returncode, ok=result.ok)
+        if not result.ok:
+            self.log(f"ОШИБКА: Не удалось остановить службу!")
+            self.log(f"Вывод: {result.output}")
+            return False
+
+        self.log("Служба остановлена успешно")
+        return True
+
+    def start_service(self):
+        """Запустить службу Stunnel"""
+        self.log(f"Запуск службы {self.service.service_name} ({self.service.name})...")
+
+        result = self.service.start()
+        self.tracer.annotate(backend=self.service.name, returncode=result.returncode, ok=result.ok)
+        if not result.ok:
+            self.log(f"ОШИБКА: Не удалось запустить службу!")
+            self.log(f"Вывод: {result.output}")
+            return False
+
+        self.log("Служба запущена успешно")
+        return True
+
+    def reload_service(self):
+        """Перечитать конфиг службой без перезапуска"""
+        self.log(f"Перезагрузка конфигурации службы {self.service.service_name} ({self.service.name})...")
+
+        result = self.service.reload()
+        self.tracer.annotate(backend=self.service.name, returncode=result.returncode, ok=result.ok)
+        if not result.ok:
+            self.log(f"Перезагрузка конфигурации не выполнена: {result.output}")
+            return False
+
+        time.sleep(self.settings.get('reload_settle', self.RELOAD_SETTLE))
+        self.log("Команда перезагрузки конфигурации принята")
+        return True
+
+    def list_sections(self):
+        """Секции служб конфига с адресами accept и connect (в порядке файла)"""
+        if not self.config_file_path or not os.path.exists(self.config_file_path):
+            return []
+        return [SectionUpstream(section.name, section.get('accept'), section.get('connect'))
+                for section in load_config(self.config_file_path).services]
+
+    def get_section_servers(self):
+        """{секция: IP из connect=} для секций со строкой connect="""
+        return {section.name: section.server for section in self.list_sections()
+                if section.connect}
+
+    def get_primary_section(self):
+        """Секция первой строки connect=, если секций с connect= несколько (иначе None)
+
+        В такой конфиг автопереключение должно менять только эту секцию, а не весь файл.
+        """
+        servers = self.get_section_servers()
+        if len(servers) < 2:
+            return None
+        config = load_config(self.config_file_path)
+        if config.global_options.get('connect'):
+            return None
+        return next(iter(servers))
+
+    def get_tunnel_section(self):
+        """Первая секция конфига с accept= и connect= или None"""
+        config = load_config(self.config_file_path)
+        for section in config.services:
+            if section.get('accept') and section.get('connect'):
+                return section
+        return None
+
+    def get_accept_endpoint(self):
+        """Адрес accept туннеля с connect= из конфига: (host, port, client) или None"""
+        section = self.get_tunnel_section()
+        if section is None:
+            return None
+        client_default = load_config(self.config_file_path).global_options.get('client', 'no')
+        host, port = parse_endpoint(section.get('accept'))
+        client = section.get('client', client_default).lower() == 'yes'
+        return host, port, client
+
+    def wait_until_ready(self, verify_upstream=None):
+        """Дождаться, пока туннель начнет принимать соединения (и, опционально, ответит апстрим)"""
+        endpoint = self.get_accept_endpoint()
+        if endpoint is None:
+            self.log("Строка accept= не найдена - проверка готовности пропущена")
+            return None
+
+        host, port, client = endpoint
+        timeout = self.settings.get('ready_timeout', self.READY_TIMEOUT)
+        self.log(f"Ожидание готовности туннеля {host}:{port} (до {timeout} с)...")
+        result = wait_for_port(host, port, timeout=timeout)
+        self.tracer.annotate(endpoint=f"{host}:{port}", attempts=result.attempts,
+                             port_ready=result.ready)
+        if not result.ready:
+            self.log(f"ОШИБКА: Порт {host}:{port} не принимает соединения: {result.error}")
+            return result
+        self.log(f"Порт {host}:{port} принимает соединения "
+                 f"({result.elapsed * 1000:.0f} мс, попыток: {result.attempts})")
+
+        if verify_upstream is None:
+            verify_upstream = self.settings.get('verify_upstream', False)
+        if verify_upstream:
+            upstream = check_upstream(host, port, tls=not client)
+            self.tracer.annotate(upstream_ready=upstream.ready,
+                                 upstream_ms=round(upstream.elapsed * 1000, 3))
+            if not upstream.ready:
+                self.log(f"ОШИБКА: Апстрим не отвечает через туннель: {upstream.error}")
+                return upstream
+            self.log(f"Апстрим отвечает через туннель ({upstream.elapsed * 1000:.0f} мс)")
+        return result
+
+    @contextmanager
+    def _phase(self, name):
+        """Спан фазы смены сервера; длительность также сохраняется в last_switch_timings"""
+        span = None
+        try:
+            with self.tracer.span(name) as span:
+                yield span
+        finally:
+            if span is not None:
+                self.last_switch_timings[name] = span.duration
+
+    @contextmanager
+    def _journaled(self, operation, target, previous):
+        """Операция со службой в журнале: 'in_progress' до начала, 'ok'/'error' - после"""
+        self.journal.begin(operation, target, previous)
+        try:
+            yield
+        except Exception:
+            self.journal.finish('error')
+            raise
+        self.journal.finish('ok')
+
+    def interrupted_switch(self):
+        """Запись прерванной операции (None - ее нет или смена выполняется сейчас)"""
+        if not self.process_lock.acquire(timeout=0):
+            return None
+        try:
+            return self.journal.interrupted()
+        finally:
+            self.process_lock.release()
+
+    def recover_interrupted_switch(self):
+        """Довести до конца смену, прерванную аварийным завершением процесса
+
+        Вызывается при запуске. Если журнал остался в состоянии 'in_progress', служба могла
+        остаться остановленной, а конфиг - недописанным: битый конфиг восстанавливается
+        из последней резервной копии, служба запускается. Вернуть запись журнала или None.
+        """
+        with self.switch_lock, self.process_lock:
+            entry = self.journal.interrupted()
+            if entry is None:
+                return None
+
+            self.log("="*50)
+            self.log(f"Обнаружена прерванная операция: {entry.get('operation')} "
+                     f"{entry.get('previous') or '?'} -> {entry.get('target') or '?'} "
+                     f"(PID {entry.get('pid')}, {entry.get('started')})")
+            self.log("="*50)
+
+            with self.tracer.span('recover', target=entry.get('target')):
+                if self.config_file_path and self.get_current_server() is None:
+                    self._restore_after_crash(entry.get('backup'))
+
+                result = self.service.start()
+                # 1056 - служба уже запущена (ERROR_SERVICE_ALREADY_RUNNING)
+                running = result.ok or result.returncode == 1056
+                self.tracer.annotate(backend=self.service.name, returncode=result.returncode,
+                                     ok=running)
+                if not running:
+                    self.log(f"ОШИБКА: Не удалось запустить службу после сбоя: {result.output}")
+                else:
+                    ready = self.wait_until_ready()
+                    if ready is not None and not ready.ready:
+                        self.log(f"Служба запущена, но туннель не готов: {ready.error}")
+
+            self.journal.finish('recovered')
+            self.log(f"Восстановление завершено, сервер: {self.get_current_server() or 'не определен'}")
+            return entry
+
+    def _pinned_backups(self):
+        """Копия, записанная прерванной операцией: очистка истории не удаляет ее блоб"""
+        entry = self.journal.interrupted()
+        return {entry['backup']} if entry and entry.get('backup') else set()
+
+    def _restore_after_crash(self, digest):
+        """Восстановить конфиг из копии, сделанной прерванной операцией (или последней)
+
+        Если копию прерванной операции прочитать не удалось (блоб удален или поврежден),
+        используются версии из истории, от последней к старым.
+        """
+        digests = [digest] if digest else []
+        digests += [entry.hash for entry in self.backup_history() if entry.hash not in digests]
+        if not digests:
+            self.log("ОШИБКА: Конфиг поврежден, а резервных копий нет")
+            return
+        for digest in digests:
+            try:
+                data = self.backup_store.read(digest)
+            except (OSError, ValueError) as e:
+                self.log(f"ОШИБКА: Резервная копия {digest[:12]} недоступна: {e}")
+                continue
+            atomic_write(self.config_file_path, data)
+            invalidate(self.config_file_path)
+            self.tracer.annotate(restored=digest[:12])
+            self.log(f"Конфиг восстановлен из резервной копии {digest[:12]}")
+            return
+        self.log("ОШИБКА: Конфиг поврежден, а ни одну резервную копию прочитать не удалось")
+
+    def change_server(self, new_ip, strategy=None, section=None):
+        """Изменить IP сервера в конфиге
+
+        strategy: 'reload' (по умолчанию - ключ switch_strategy в settings.json) перечитывает
+        конфиг без остановки службы и при неудаче переходит к 'restart' - остановке и запуску.
+        section: изменить только секцию [section]; без нее меняются все строки connect=.
+        """
+        with self.switch_lock, self.process_lock, self.tracer.span('switch', target=new_ip,
+                                                                   section=section):
+            if section is not None:
+                self._change_servers({section: new_ip}, strategy)
+                return True
+            return self._change_server(new_ip, strategy)
+
+    def change_servers(self, targets, strategy=None):
+        """Применить серверы нескольких секций одной операцией: {секция: IP или IP:порт}
+
+        Конфиг записывается один раз, служба перезагружается (или перезапускается) один раз,
+        сколько бы секций ни менялось. Вернуть {секция: новое значение connect=} - только
+        реально измененные секции.
+        """
+        with self.switch_lock, self.process_lock, self.tracer.span('switch', target=dict(targets)):
+            return self._change_servers(targets, strategy)
+
+    def _resolve_strategy(self, strategy):
+        """Проверить конфиг и выбрать способ смены с учетом возможностей службы"""
+        if not self.config_file_path or not os.path.exists(self.config_file_path):
+            raise Exception("Файл конфигурации не указан или не существует!")
+
+        strategy = strategy or self.settings.get('switch_strategy', self.DEFAULT_SWITCH_STRATEGY)
+        if strategy not in self.SWITCH_STRATEGIES:
+            raise ValueError(f"Неизвестный способ смены сервера: {strategy}")
+        if strategy == 'reload' and not self.service.supports_reload:
+            strategy = 'restart'
+        return strategy
+
+    def _connect_value(self, target, current):
+        """Значение connect= для секции: порт берется из текущего значения, если не указан"""
+        if ':' in target:
+            return target
+        port = self.SERVER_PORT
+        if current:
+            try:
+                port = parse_endpoint(current)[1]
+            except ValueError:
+                pass
+        return f"{target}:{port}"
+
+    def _change_server(self, new_ip, strategy=None):
+        """Смена сервера (вызывается под switch_lock и process_lock)"""
+        strategy = self._resolve_strategy(strategy)
+
+        current_ip = self.get_current_server()
+        self.tracer.annotate(previous=current_ip)
+
+        if current_ip == new_ip:
+            self.log(f"Сервер {new_ip} уже установлен")
+            self.tracer.annotate(outcome='noop')
+            return True
+
+        self.last_switch_timings = {}
+        self.last_ready_time = None
+        self.last_drain = None
+        self.last_switch_strategy = None
+
+        self.log("="*50)
+        self.log("Изменение сервера")
+        self.log(f"Старый сервер: {current_ip or 'не определен'}")
+        self.log(f"Новый сервер: {new_ip} ({self.catalog.label(new_ip)})")
+        self.log(f"Способ: {strategy}")
+        self.log("="*50)
+
+        # None - все строки connect= файла
+        changes = {None: f"{new_ip}:{self.catalog.port(new_ip, self.SERVER_PORT)}"}
+        with self._journaled('switch', new_ip, current_ip):
+            backup = self._apply_changes(current_ip, changes, strategy)
+
+        self.log("="*50)
+        self.log("УСПЕШНО: Сервер изменен!")
+        self.log(f"Новый сервер: {new_ip} ({self.catalog.label(new_ip)})")
+        self.log(f"Резервная копия: версия {backup.hash[:12]} ({backup.timestamp})")
+        self.log("="*50)
+        self._remember_servers([new_ip])
+
+        return True
+
+    def _change_servers(self, targets, strategy=None):
+        """Смена серверов секций (вызывается под switch_lock и process_lock)"""
+        strategy = self._resolve_strategy(strategy)
+
+        config = load_config(self.config_file_path)
+        changes = {}
+        previous = {}
+        for name, target in targets.items():
+            section = config.section(name)
+            if section is None:
+                raise Exception(f"Секция [{name}] не найдена в конфиге")
+            current = section.get('connect')
+            value = self._connect_value(target, current)
+            if value != current:
+                changes[name] = value
+                previous[name] = current
+        self.tracer.annotate(sections=len(targets), changed=len(changes))
+
+        if not changes:
+            self.log(f"Серверы секций уже установлены ({len(targets)})")
+            self.tracer.annotate(outcome='noop')
+            return {}
+
+        self.last_switch_timings = {}
+        self.last_ready_time = None
+        self.last_drain = None
+        self.last_switch_strategy = None
+
+        self.log("="*50)
+        self.log(f"Изменение серверов секций: {len(changes)}")
+        for name, value in changes.items():
+            self.log(f"[{name}] {previous[name] or 'не задан'} -> {value}")
+        self.log(f"Способ: {strategy}")
+        self.log("="*50)
+
+        current_ip = self.get_current_server()
+        with self._journaled('switch', changes, previous):
+            backup = self._apply_changes(current_ip, changes, strategy)
+
+        self.log("="*50)
+        self.log(f"УСПЕШНО: Изменено секций: {len(changes)}, "
+                 f"служба: {self.last_switch_strategy}")
+        self.log(f"Резервная копия: версия {backup.hash[:12]} ({backup.timestamp})")
+        self.log("="*50)
+        self._remember_servers(targets[name] for name in changes)
+        return changes
+
+    def _apply_changes(self, current_ip, changes, strategy):
+        """Записать изменения connect= и применить их одной перезагрузкой или перезапуском"""
+        if strategy == 'reload':
+            backup = self._switch_by_reload(current_ip, changes)
+        else:
+            backup = self._switch_by_restart(current_ip, changes)
+        self.tracer.annotate(strategy=self.last_switch_strategy)
+        return backup
+
+    def _switch_by_restart(self, current_ip, changes):
+        """Остановить службу, сохранить копию, записать connect= и запустить службу"""
+        self.last_switch_strategy = 'restart'
+
+        self._drain_and_stop()
+
+        # Резервное копирование
+        backup = self._backup_config(current_ip)
+        try:
+            self._rewrite_config(changes, backup)
+            self._start_and_wait_ready(backup)
+        finally:
+            # Индекс истории записывается после запуска службы, а не пока она остановлена
+            self.backup_store.commit()
+        return backup
+
+    def _switch_by_reload(self, current_ip, changes):
+        """Записать connect= и перечитать конфиг службой; при неудаче - перезапуск"""
+        self.last_switch_strategy = 'reload'
+        backup = self._backup_config(current_ip, restart_on_error=False)
+        try:
+            self._rewrite_config(changes, backup, restart_on_error=False)
+            if self._reload_and_verify(changes):
+                return backup
+
+            # Конфиг уже записан - остается перезапустить службу, как раньше
+            self.log("Перезагрузка не удалась - перезапуск службы")
+            self.last_switch_strategy = 'restart-fallback'
+            self._drain_and_stop()
+            self._start_and_wait_ready(backup)
+        finally:
+            self.backup_store.commit()
+        return backup
+
+    def _reload_and_verify(self, changes):
+        """Перезагрузить конфиг и проверить туннель и апстрим; False - нужен перезапуск"""
+        with self._phase('reload'):
+            reloaded = self.reload_service()
+        if not reloaded:
+            return False
+
+        # Порт accept при перезагрузке не закрывается, поэтому проверяется и апстрим:
+        # новые соединения должны идти через новый connect=
+        with self._phase('verify'):
+            ready = self.wait_until_ready(verify_upstream=True)
+            if ready is not None and not ready.ready:
+                return False
+            if self.verify_upstream_switch(changes) is False:
+                return False
+        if ready is not None:
+            timings = self.last_switch_timings
+            self.last_ready_time = timings['reload'] + timings['verify']
+            self.log(f"Туннель готов через {self.last_ready_time * 1000:.0f} мс "
+                     f"после перезагрузки конфигурации")
+        return True
+
+    def _upstream_endpoints(self, connect):
+        """Адреса {(ip, порт)}, с которыми служба соединяется для значения connect="""
+        if connect in self.upstream_addresses:
+            host, port = self.upstream_addresses[connect]
+        else:
+            host, port = parse_endpoint(connect)
+        return {(info[4][0], port) for info in socket.getaddrinfo(host, port,
+                                                                  type=socket.SOCK_STREAM)}
+
+    def verify_upstream_switch(self, changes):
+        """Проверить, что новые соединения туннеля идут на новый connect= (после перезагрузки)
+
+        Ответ через порт accept дает и старый апстрим, если служба проигнорировала сигнал
+        перезагрузки, поэтому по таблице соединений ОС проверяется адрес апстрима.
+        None - туннельная секция не менялась, True/False - новый апстрим используется или нет.
+        """
+        section = self.get_tunnel_section()
+        if section is None or (None not in changes and section.name not in changes):
+            return None
+        connect = section.get('connect')
+        host, port, client = self.get_accept_endpoint()
+        try:
+            upstream = self._upstream_endpoints(connect)
+        except (OSError, ValueError) as e:
+            self.log(f"ОШИБКА: Не удалось определить адрес апстрима {connect}: {e}")
+            return False
+        timeout = self.settings.get('upstream_verify_timeout', self.UPSTREAM_VERIFY_TIMEOUT)
+        result = wait_for_upstream(host, port, upstream, timeout=timeout, tls=not client)
+        if isinstance(result.error, NotImplementedError):
+            self.log("Проверка апстрима пропущена: таблица соединений ОС недоступна")
+            return None
+        self.tracer.annotate(upstream_switched=result.ready)
+        if not result.ready:
+            self.log(f"ОШИБКА: Новые соединения туннеля не идут на {connect}: {result.error}")
+            return False
+        self.log(f"Новые соединения туннеля идут на {connect} ({result.elapsed * 1000:.0f} мс)")
+        return True
+
+    def _rewrite_config(self, changes, backup, restart_on_error=True):
+        """Записать новые connect= (при ошибке - восстановить копию)
+
+        changes: {секция: значение connect=}; ключ None - все строки connect= файла.
+        """
+        # Изменение конфига
+        self.log("Изменение конфигурации...")
+        try:
+            with self._phase('rewrite'):
+                config = load_config(self.config_file_path)
+                if None in changes:
+                    connect = changes[None]
+                    new_config, replaced = config.with_option('connect', connect)
+                    if replaced:
+                        self.log(f"Строка connect заменена на: connect={connect} ({replaced} шт.)")
+                    else:
+                        # Если строка connect= не найдена, она добавлена в конец файла
+                        self.log(f"Строка connect добавлена: connect={connect}")
+                else:
+                    # Все секции пакета - одной записью файла
+                    new_config, replaced = config.with_options('connect', changes)
+                    self.log(f"Строки connect изменены в секциях: {len(changes)} "
+                             f"(заменено строк: {replaced})")
+                self.tracer.annotate(replaced=replaced)
+
+                # Записываем изменения атомарно: временный файл + os.replace
+                save_config(self.config_file_path, new_config)
+
+            self.log("Конфигурация обновлена успешно")
+
+        except Exception as e:
+            self.log(f"ОШИБКА: Не удалось изменить конфиг: {e}")
+            # Восстановление из резервной копии
+            self.log("Восстановление из резервной копии...")
+            self.backup_store.restore(backup, self.config_file_path)
+            invalidate(self.config_file_path)
+            if restart_on_error:
+                self.start_service()
+            raise
+
+    def _backup_config(self, current_ip, restart_on_error=True):
+        """Сохранить текущий конфиг в историю; при ошибке запустить службу обратно"""
+        self.log("Создание резервной копии...")
+        try:
+            with self._phase('backup'):
+                # Содержимое берется из кэша разобранного конфига - файл не читается повторно
+                data = load_config(self.config_file_path).render().encode('utf-8')
+                entry, created = self.backup_store.save(data, upstream=current_ip,
+                                                        source=self.config_file_path,
+                                                        commit=False)
+                self.tracer.annotate(hash=entry.hash[:12], blob_created=created)
+                # Индекс истории записывается позже - копию после сбоя найдет журнал
+                self.journal.record(backup=entry.hash)
+            if created:
+                self.log(f"Резервная копия создана: версия {entry.hash[:12]}")
+            else:
+                self.log(f"Резервная копия: версия {entry.hash[:12]} уже сохранена, "
+                         f"копирование пропущено")
+            return entry
+        except Exception as e:
+            self.log(f"ОШИБКА: Не удалось создать резервную копию: {e}")
+            if restart_on_error:
+                self.start_service()  # Попытка запустить службу обратно
+            raise
+
+    def accept_ports(self):
+        """Порты accept всех секций конфига - через них идут клиентские соединения"""
+        ports = []
+        for section in self.list_sections():
+            if not section.accept:
+                continue
+            try:
+                port = parse_endpoint(section.accept)[1]
+            except ValueError:
+                continue
+            if port not in ports:
+                ports.append(port)
+        return ports
+
+    def drain_connections(self, timeout=None):
+        """Дождаться, пока соединений через порты accept станет не больше drain_threshold
+
+        Не дольше drain_timeout секунд (settings.json); вернуть DrainResult - сколько
+        соединений было и сколько разорвет остановка службы.
+        """
+        from connection_drain import ConnectionDrain
+
+        if timeout is None:
+            timeout = self.settings.get('drain_timeout', self.DRAIN_TIMEOUT)
+        ports = self.accept_ports()
+        if not ports:
+            self.log("Строка accept= не найдена - ожидание соединений пропущено")
+            return None
+        drain = ConnectionDrain(ports, timeout=timeout,
+                                threshold=self.settings.get('drain_threshold', 0),
+                                on_progress=self.on_drain_progress)
+        initial = drain.count()
+        if initial is None:
+            self.log("Подсчет соединений на этой ОС не поддерживается - ожидание пропущено")
+            return None
+        port_list = ", ".join(map(str, ports))
+        if initial > drain.threshold and timeout > 0:
+            self.log(f"Соединений через порт {port_list}: {initial}, ожидание завершения "
+                     f"(до {timeout} с, порог {drain.threshold})...")
+        result = drain.wait()
+        self.tracer.annotate(connections=result.initial, cut=result.cut,
+                             timed_out=result.timed_out)
+        if result.cut:
+            self.log(f"Остановка разорвет соединений: {result.cut} из {result.initial} "
+                     f"(ожидание {result.elapsed:.1f} с)")
+        elif result.initial:
+            self.log(f"Соединения завершены за {result.elapsed:.1f} с ({result.initial})")
+        return result
+
+    def _drain_and_stop(self):
+        """Дождаться завершения соединений и остановить службу"""
+        with self._phase('drain'):
+            try:
+                self.last_drain = self.drain_connections()
+            except OSError as e:
+                self.log(f"Не удалось подсчитать соединения: {e}")
+        with self._phase('stop'):
+            stopped = self.stop_service()
+        if not stopped:
+            raise Exception("Не удалось остановить службу!")
+
+    def _start_and_wait_ready(self, backup=None):
+        """Запустить службу и дождаться готовности туннеля
+
+        backup - копия конфига до изменения: если служба не запустилась или туннель не готов,
+        конфиг восстанавливается из нее и служба запускается с прежним конфигом.
+        """
+        with self._phase('start'):
+            started = self.start_service()
+        if not started:
+            restored = backup is not None and self._revert_config(backup, running=False)
+            raise Exception("Не удалось запустить службу! Проверьте конфигурацию."
+                            + (" Прежняя конфигурация восстановлена." if restored else ""))
+
+        # Ожидание готовности: служба запущена, но stunnel может еще не слушать порт
+        with self._phase('ready'):
+            ready = self.wait_until_ready()
+        if ready is not None:
+            if not ready.ready:
+                restored = backup is not None and self._revert_config(backup, running=True)
+                raise Exception(f"Служба запущена, но туннель не готов: {ready.error}"
+                                + (". Прежняя конфигурация восстановлена" if restored else ""))
+            timings = self.last_switch_timings
+            self.last_ready_time = timings['start'] + timings['ready']
+            self.log(f"Туннель готов через {self.last_ready_time * 1000:.0f} мс после запуска")
+
+    def _revert_config(self, backup, running):
+        """Восстановить конфиг из копии после неудачного запуска и запустить службу с ним"""
+        self.log("Восстановление из резервной копии...")
+        try:
+            with self._phase('revert'):
+                self.backup_store.restore(backup, self.config_file_path)
+                invalidate(self.config_file_path)
+        except Exception as e:
+            self.log(f"ОШИБКА: Не удалось восстановить конфиг: {e}")
+            return False
+        self.tracer.annotate(reverted=backup.hash[:12])
+        if running:
+            self.stop_service()
+        self.start_service()
+        return True
+
+    def backup_history(self):
+        """Версии текущего конфига из истории резервных копий (1-я - последняя)"""
+        return self.backup_store.history(source=self.config_file_path or None)
+
+    def rollback(self, version):
+        """Откатить конфиг к версии из истории (1 - последняя) и перезапустить службу"""
+        with self.switch_lock, self.process_lock, self.tracer.span('rollback', version=version):
+            return self._rollback(version)
+
+    def _rollback(self, version):
+        """Откат (вызывается под switch_lock и process_lock)"""
+        if not self.config_file_path or not os.path.exists(self.config_file_path):
+            raise Exception("Файл конфигурации не указан или не существует!")
+
+        entry = self.backup_store.get(version, source=self.config_file_path)
+        current_ip = self.get_current_server()
+
+        self.last_switch_timings = {}
+        self.last_ready_time = None
+        self.last_drain = None
+        # Откат всегда перезапускает службу
+        self.last_switch_strategy = 'restart'
+
+        self.log("="*50)
+        self.log(f"Откат конфигурации к версии {version}")
+        self.log(f"Версия: {entry.hash[:12]} от {entry.timestamp}, сервер {entry.upstream or 'не определен'}")
+        self.log("="*50)
+
+        with self._journaled('rollback', entry.upstream, current_ip):
+            self._drain_and_stop()
+
+            # Текущий конфиг тоже попадает в историю - откат можно отменить
+            backup = self._backup_config(current_ip)
+            try:
+                try:
+                    with self._phase('restore'):
+                        self.backup_store.restore(entry, self.config_file_path)
+                        invalidate(self.config_file_path)
+                    self.log("Конфигурация восстановлена")
+                except Exception as e:
+                    self.log(f"ОШИБКА: Не удалось восстановить конфиг: {e}")
+                    self.start_service()
+                    raise
+
+                self._start_and_wait_ready(backup)
+            finally:
+                self.backup_store.commit()
+
+        self.log("="*50)
+        self.log(f"УСПЕШНО: Конфигурация откачена, сервер: {self.get_current_server() or 'не определен'}")
+        self.log("="*50)
+        return entry
+
+
+def is_admin():
+    """Проверить, запущена ли программа с правами администратора"""
+    try:
+        return ctypes.windll.shell32.IsUserAnAdmin()
+    except:
+        return False
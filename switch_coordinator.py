@@ -0,0 +1,324 @@
+"""
+Координация смены сервера между окнами GUI, скриптами и планировщиком: межпроцессная
+блокировка, журнал незавершенной смены и очередь запросов с объединением
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from stunnel_config import atomic_write
+
+
+class FileLock:
+    """Межпроцессная блокировка на файле (fcntl.flock / msvcrt.locking)
+
+    Внутри процесса потоки ждут друг друга на RLock, поэтому повторный захват тем же потоком
+    допускается. ОС снимает блокировку при завершении процесса, в том числе аварийном.
+    """
+
+    def __init__(self, path, poll_interval=0.02):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+
+    def _try_lock(self, fd):
+        """Захватить блокировку без ожидания (OSError, если она занята)"""
+        if sys.platform == 'win32':
+            import msvcrt
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(self, fd):
+        """Снять блокировку"""
+        if sys.platform == 'win32':
+            import msvcrt
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def acquire(self, timeout=None):
+        """Захватить блокировку; timeout=None - ждать без ограничения. Вернуть True/False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._thread_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        if self._depth:
+            self._depth += 1
+            return True
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                self._try_lock(fd)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    os.close(fd)
+                    self._thread_lock.release()
+                    return False
+                time.sleep(self.poll_interval)
+        self._fd = fd
+        self._depth = 1
+        return True
+
+    def release(self):
+        """Освободить блокировку (после последнего вложенного захвата)"""
+        self._depth -= 1
+        if not self._depth:
+            fd, self._fd = self._fd, None
+            try:
+                self._unlock(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SwitchJournal:
+    """Журнал операций со службой: state='in_progress' пишется до начала, итог - после
+
+    Если при запуске (под блокировкой) журнал в состоянии 'in_progress', процесс завершился
+    посреди смены. Там же хранится номер последнего примененного запроса очереди.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def read(self):
+        """Содержимое журнала ({} если его нет или он поврежден)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, **fields):
+        """Обновить поля журнала (вызывается под блокировкой)"""
+        data = self.read()
+        data.update(fields)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=1))
+
+    def begin(self, operation, target=None, previous=None):
+        """Отметить начало операции"""
+        self._update(state='in_progress', operation=operation, target=target, previous=previous,
+                     pid=os.getpid(), started=datetime.now().isoformat(timespec='seconds'),
+                     finished=None, backup=None)
+
+    def record(self, **fields):
+        """Дополнить запись текущей операции (например, хэшем резервной копии)"""
+        self._update(**fields)
+
+    def finish(self, outcome):
+        """Отметить завершение операции: 'ok', 'error' или 'recovered'"""
+        self._update(state=outcome, finished=datetime.now().isoformat(timespec='seconds'))
+
+    def interrupted(self):
+        """Запись прерванной операции или None"""
+        data = self.read()
+        return data if data.get('state') == 'in_progress' else None
+
+    def applied_seq(self):
+        """Номер последнего примененного запроса очереди"""
+        return self.read().get('applied_seq', 0)
+
+    def mark_applied(self, seq):
+        """Запомнить номер примененного запроса"""
+        self._update(applied_seq=seq)
+
+
+class SwitchResult:
+    """Итог запроса смены сервера"""
+
+    __slots__ = ('requested', 'applied', 'coalesced', 'switches')
+
+    def __init__(self, requested, applied, coalesced=1, switches=0):
+        self.requested = requested
+        self.applied = applied
+        self.coalesced = coalesced
+        self.switches = switches
+
+    @property
+    def superseded(self):
+        """Запрос заменен более новым (из этого или другого процесса)"""
+        return self.applied != self.requested
+
+    def to_dict(self):
+        """Представление для JSON"""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['superseded'] = self.superseded
+        return data
+
+    def __repr__(self):
+        return (f"SwitchResult({self.requested} -> {self.applied}, coalesced={self.coalesced}, "
+                f"switches={self.switches})")
+
+
+class SwitchTicket:
+    """Ожидание результата запроса"""
+
+    def __init__(self, target):
+        self.target = target
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _resolve(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        """Обработан ли запрос"""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Дождаться SwitchResult; исключение смены пробрасывается"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Смена на {self.target} не завершилась за {timeout} с")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SwitchCoordinator:
+    """Очередь запросов смены сервера с объединением
+
+    Запрос записывается в switch_request.json в AppData (последний запрос из любого процесса
+    перезаписывает предыдущий) и ставится в очередь фонового потока. Поток выжидает
+    coalesce_window, захватывает межпроцессную блокировку менеджера и применяет только
+    последний запрос: серия из N запросов дает одну смену сервера, а не N.
+    """
+
+    def __init__(self, manager, coalesce_window=0.05):
+        self.manager = manager
+        self.coalesce_window = coalesce_window
+        self.request_path = manager.config_dir / "switch_request.json"
+        # Короткая блокировка записи запроса: номера растут при любом порядке часов процессов
+        self._request_lock = FileLock(manager.config_dir / "switch_request.lock")
+        self.requests = 0
+        self.switches = 0
+        self._tickets = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def submit(self, ip, strategy=None):
+        """Поставить запрос в очередь; вернуть SwitchTicket"""
+        ticket = SwitchTicket(ip)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Очередь смены сервера остановлена")
+            self.requests += 1
+            with self._request_lock:
+                last = self._read_request() or {}
+                request = {'target': ip, 'strategy': strategy, 'pid': os.getpid(),
+                           'seq': max(time.time_ns(), last.get('seq', 0) + 1)}
+                atomic_write(self.request_path, json.dumps(request))
+            self._tickets.append(ticket)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="SwitchCoordinator",
+                                                daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return ticket
+
+    def request(self, ip, strategy=None, timeout=None):
+        """Запросить смену сервера и дождаться результата"""
+        return self.submit(ip, strategy).wait(timeout)
+
+    def _read_request(self):
+        """Последний записанный запрос или None"""
+        try:
+            with open(self.request_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        """Фоновый поток: пачки запросов -> применение последнего"""
+        while True:
+            self._wakeup.wait()
+            if self._closed:
+                break
+            # Серия быстрых запросов собирается в одну пачку
+            time.sleep(self.coalesce_window)
+            with self._lock:
+                self._wakeup.clear()
+                tickets, self._tickets = self._tickets, []
+            if tickets:
+                self._process(tickets)
+
+    def _process(self, tickets):
+        """Под блокировкой применять новые запросы, пока они есть; разрешить ожидания"""
+        manager = self.manager
+        switches = 0
+        error = None
+        # Исключения примененных запросов по серверу: смена может упасть уже после записи
+        # конфига (например, туннель не готов), и текущий сервер совпадет с целью
+        failed = {}
+        try:
+            with manager.switch_lock, manager.process_lock:
+                while True:
+                    request = self._read_request()
+                    if request is None or request['seq'] <= manager.journal.applied_seq():
+                        break
+                    target = request['target']
+                    previous = manager.get_current_server()
+                    try:
+                        manager.change_server(target, request.get('strategy'))
+                        error = None
+                        failed.pop(target, None)
+                    except Exception as e:
+                        error = failed[target] = e
+                    finally:
+                        # Неудачный запрос не повторяется - ждем следующего
+                        manager.journal.mark_applied(request['seq'])
+                    if error is None and previous != target:
+                        switches += 1
+                applied = manager.get_current_server()
+        except Exception as e:
+            error, applied = e, None
+
+        self.switches += switches
+        if switches or error:
+            manager.log(f"[Очередь] Запросов: {len(tickets)}, смен сервера: {switches}, "
+                        f"сервер: {applied}")
+        for ticket in tickets:
+            if ticket.target in failed:
+                ticket._resolve(error=failed[ticket.target])
+            elif error is not None and applied != ticket.target:
+                ticket._resolve(error=error)
+            else:
+                ticket._resolve(SwitchResult(ticket.target, applied, len(tickets), switches))
+
+    def close(self):
+        """Остановить фоновый поток после текущей пачки"""
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
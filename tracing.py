@@ -0,0 +1,395 @@
+"""
+Трассировка смены сервера: спаны фаз в JSONL, гистограммы длительностей и снимок метрик
+в текстовом формате Prometheus (для textfile collector node_exporter)
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from stunnel_config import atomic_write
+from switch_coordinator import FileLock
+
+
+# Границы корзин гистограммы длительности фаз, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Span:
+    """Замер одной операции или фазы"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'status',
+                 'attributes', '_started')
+
+    def __init__(self, name, trace_id, span_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.status = 'ok'
+        self.attributes = dict(attributes or {})
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        """Добавить атрибуты"""
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        """Запись JSONL"""
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': datetime.fromtimestamp(self.start).isoformat(timespec='milliseconds'),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+    def __repr__(self):
+        return f"Span({self.name!r}, status={self.status!r}, duration={self.duration!r})"
+
+
+class RollingHistogram:
+    """Накопительная гистограмма Prometheus и окно последних значений для квантилей"""
+
+    def __init__(self, window=200, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        """Добавить значение (секунды)"""
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def quantile(self, q):
+        """Квантиль по окну последних значений (ближайший ранг)"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def to_state(self):
+        """Состояние для сохранения между запусками"""
+        return {'counts': self.counts, 'count': self.count, 'sum': self.sum,
+                'recent': list(self.recent)}
+
+    def load_state(self, state):
+        """Восстановить состояние (если границы корзин не менялись)"""
+        if len(state.get('counts', ())) != len(self.buckets):
+            return
+        self.counts = list(state['counts'])
+        self.count = state['count']
+        self.sum = state['sum']
+        self.recent.extend(state.get('recent', ()))
+
+    def merge(self, other):
+        """Добавить значения другой гистограммы с теми же границами"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.recent.extend(other.recent)
+
+
+class Tracer:
+    """Спаны операций со службой, JSONL-журнал, гистограммы фаз и снимок метрик
+
+    Хуки add_hook(fn) получают каждый завершенный спан (в потоке, где он завершился) -
+    через них тесты и бенчмарки проверяют, что было записано.
+
+    Состояние метрик (metrics_state.json) общее для GUI и CLI: при записи оно перечитывается
+    под блокировкой metrics_state.lock и дополняется значениями этого процесса с прошлой
+    записи, поэтому счетчики одного процесса не затирают счетчики другого.
+
+    Ошибки записи метрик передаются в on_error(сообщение) (без него - в stderr): stdout
+    занят выводом CLI, в том числе JSON.
+    """
+
+    def __init__(self, directory=None, metrics_path=None, window=200, on_error=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.metrics_path = Path(metrics_path) if metrics_path is not None else None
+        self.state_path = (self.directory / "metrics_state.json"
+                           if self.directory is not None and self.metrics_path is not None
+                           else None)
+        self._state_lock = (FileLock(self.directory / "metrics_state.lock")
+                            if self.state_path is not None else None)
+        self.window = window
+        self.on_error = on_error
+        self.histograms = {}
+        self.outcomes = {}
+        self.last_timestamp = {}
+        # Значения с прошлой записи состояния - добавляются к перечитанному файлу
+        self._pending_histograms = {}
+        self._pending_outcomes = {}
+        self._hooks = []
+        self._writer = None
+        self._state_loaded = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Подписаться на завершенные спаны: hook(span)"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Отписаться от спанов"""
+        self._hooks.remove(hook)
+
+    def _stack(self):
+        """Стек открытых спанов текущего потока"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @property
+    def current(self):
+        """Текущий открытый спан потока или None"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def annotate(self, **attributes):
+        """Добавить атрибуты текущему спану (если он есть)"""
+        span = self.current
+        if span is not None:
+            span.set(**attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Замерить операцию; вложенный спан относится к той же трассе"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            # Накопленные метрики читаются до начала операции, а не во время ее фаз
+            with self._lock:
+                self._load_state()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else os.urandom(8).hex(),
+            span_id=os.urandom(4).hex(),
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes,
+        )
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.attributes.setdefault('error', str(e))
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._started
+            stack.pop()
+            self._finish(span, root=parent is None)
+
+    def _finish(self, span, root):
+        """Записать спан, обновить метрики и вызвать хуки"""
+        with self._lock:
+            # Корневой спан (switch, rollback) - длительность всей операции
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = RollingHistogram(self.window)
+            histogram.observe(span.duration)
+            if root:
+                operation = span.name
+                outcome = span.attributes.get('outcome', span.status)
+                key = (operation, outcome)
+                self.outcomes[key] = self.outcomes.get(key, 0) + 1
+                self.last_timestamp[operation] = span.start + span.duration
+            if self.state_path is not None:
+                pending = self._pending_histograms.get(span.name)
+                if pending is None:
+                    pending = self._pending_histograms[span.name] = RollingHistogram(self.window)
+                pending.observe(span.duration)
+                if root:
+                    self._pending_outcomes[key] = self._pending_outcomes.get(key, 0) + 1
+
+        if self.directory is not None:
+            self._trace_writer().write(json.dumps(span.to_dict(), ensure_ascii=False,
+                                                  default=str))
+        for hook in list(self._hooks):
+            hook(span)
+        if root:
+            self.write_metrics()
+
+    def _trace_writer(self):
+        """Фоновая запись JSONL (создается при первом спане)"""
+        if self._writer is None:
+            from log_writer import LogWriter
+
+            self._writer = LogWriter(self.directory, prefix="switch_trace", suffix=".jsonl")
+        return self._writer
+
+    def _read_state(self):
+        """Состояние метрик из файла: (гистограммы, результаты, время последних операций)"""
+        histograms, outcomes, last_timestamp = {}, {}, {}
+        if self.state_path is None or not self.state_path.exists():
+            return histograms, outcomes, last_timestamp
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return histograms, outcomes, last_timestamp
+        for name, data in state.get('histograms', {}).items():
+            histogram = histograms[name] = RollingHistogram(self.window)
+            histogram.load_state(data)
+        for item in state.get('outcomes', []):
+            outcomes[(item['operation'], item['outcome'])] = item['count']
+        last_timestamp.update(state.get('last_timestamp', {}))
+        return histograms, outcomes, last_timestamp
+
+    def _load_state(self):
+        """Загрузить накопленные метрики прошлых запусков (один раз)"""
+        if self._state_loaded:
+            return
+        self._state_loaded = True
+        histograms, outcomes, last_timestamp = self._read_state()
+        self.histograms.update(histograms)
+        self.outcomes.update(outcomes)
+        self.last_timestamp.update(last_timestamp)
+
+    def _merge_state(self):
+        """Перечитать файл состояния и добавить к нему значения процесса с прошлой записи
+
+        Вызывается под блокировкой файла состояния; вернуть состояние для записи и
+        добавленные значения (для _restore_pending, если записать не удалось).
+        """
+        histograms, outcomes, last_timestamp = self._read_state()
+        with self._lock:
+            self._state_loaded = True
+            for name, pending in self._pending_histograms.items():
+                histogram = histograms.get(name)
+                if histogram is None:
+                    histogram = histograms[name] = RollingHistogram(self.window)
+                histogram.merge(pending)
+            for key, count in self._pending_outcomes.items():
+                outcomes[key] = outcomes.get(key, 0) + count
+            for operation, timestamp in self.last_timestamp.items():
+                last_timestamp[operation] = max(timestamp, last_timestamp.get(operation, 0))
+            self.histograms = histograms
+            self.outcomes = outcomes
+            self.last_timestamp = last_timestamp
+            merged = (self._pending_histograms, self._pending_outcomes)
+            self._pending_histograms = {}
+            self._pending_outcomes = {}
+            state = {
+                'histograms': {name: h.to_state() for name, h in histograms.items()},
+                'outcomes': [{'operation': operation, 'outcome': outcome, 'count': count}
+                             for (operation, outcome), count in outcomes.items()],
+                'last_timestamp': last_timestamp,
+            }
+        return state, merged
+
+    def _restore_pending(self, merged):
+        """Вернуть в ожидающие значения, которые не удалось записать в файл состояния"""
+        histograms, outcomes = merged
+        with self._lock:
+            for name, pending in histograms.items():
+                current = self._pending_histograms.get(name)
+                if current is not None:
+                    pending.merge(current)
+                self._pending_histograms[name] = pending
+            for key, count in outcomes.items():
+                self._pending_outcomes[key] = self._pending_outcomes.get(key, 0) + count
+
+    def render_metrics(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP giis_switch_phase_seconds Длительность фаз операций со службой stunnel",
+            "# TYPE giis_switch_phase_seconds histogram",
+        ]
+        with self._lock:
+            self._load_state()
+            histograms = sorted(self.histograms.items())
+            for phase, histogram in histograms:
+                name = "giis_switch_phase_seconds"
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{phase="{phase}"}} {histogram.count}')
+
+            lines += [
+                f"# HELP giis_switch_phase_recent_seconds Квантили длительности фаз "
+                f"по последним {self.window} операциям",
+                "# TYPE giis_switch_phase_recent_seconds gauge",
+            ]
+            for phase, histogram in histograms:
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    if value is not None:
+                        labels = f'phase="{phase}",quantile="{q}"'
+                        lines.append(f'giis_switch_phase_recent_seconds{{{labels}}} {value:.6f}')
+
+            lines += [
+                "# HELP giis_switch_operations_total Операции со службой по результату",
+                "# TYPE giis_switch_operations_total counter",
+            ]
+            for (operation, outcome), count in sorted(self.outcomes.items()):
+                labels = f'operation="{operation}",outcome="{outcome}"'
+                lines.append(f'giis_switch_operations_total{{{labels}}} {count}')
+
+            lines += [
+                "# HELP giis_switch_last_timestamp_seconds Время завершения последней операции",
+                "# TYPE giis_switch_last_timestamp_seconds gauge",
+            ]
+            for operation, timestamp in sorted(self.last_timestamp.items()):
+                labels = f'operation="{operation}"'
+                lines.append(f'giis_switch_last_timestamp_seconds{{{labels}}} {timestamp:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self):
+        """Атомарно записать снимок метрик и состояние гистограмм"""
+        if self.metrics_path is None:
+            return
+        try:
+            if self._state_lock is None:
+                self._write_snapshot(self.render_metrics())
+                return
+            # Другой процесс (GUI, CLI) мог записать свои операции - читаем, дополняем, пишем
+            with self._state_lock:
+                state, merged = self._merge_state()
+                try:
+                    atomic_write(self.state_path, json.dumps(state))
+                except OSError:
+                    self._restore_pending(merged)
+                    raise
+                self._write_snapshot(self.render_metrics())
+        except OSError as e:
+            message = f"Ошибка записи метрик: {e}"
+            if self.on_error is not None:
+                self.on_error(message)
+            else:
+                print(message, file=sys.stderr)
+
+    def _write_snapshot(self, text):
+        """Записать снимок метрик для collector"""
+        self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        # Collector читает файл целиком - частично записанный снимок он не увидит
+        atomic_write(self.metrics_path, text)
+
+    def flush(self):
+        """Дождаться записи JSONL на диск"""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Записать остаток JSONL и закрыть файл"""
+        if self._writer is not None:
+            self._writer.close()